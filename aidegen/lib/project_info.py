@@ -20,6 +20,8 @@ from __future__ import absolute_import
 
 import logging
 import os
+import subprocess
+import time
 
 from aidegen import constant
 from aidegen.lib import common_util
@@ -28,8 +30,6 @@ from aidegen.lib import module_info
 from aidegen.lib import project_config
 from aidegen.lib import source_locator
 
-from atest import atest_utils
-
 _CONVERT_MK_URL = ('https://android.googlesource.com/platform/build/soong/'
                    '#convert-android_mk-files')
 _ANDROID_MK_WARN = (
@@ -44,12 +44,12 @@ _NOT_TARGET = ('Module %s\'s class setting is %s, none of which is included in '
 # content. It will impact the dependency for framework when referencing the
 # package from fake-framework in IntelliJ.
 _EXCLUDE_MODULES = ['fake-framework']
-# When we use atest_utils.build(), there is a command length limit on
-# soong_ui.bash. We reserve 5000 characters for rewriting the command line
-# in soong_ui.bash.
-_CMD_LENGTH_BUFFER = 5000
-# For each argument, it need a space to separate following argument.
-_BLANK_SIZE = 1
+# The jar or srcjar files are the inputs of a phony target in a generated ninja
+# file, which includes the ninja file of the lunch target's last build.
+_DEPS_NINJA = 'aidegen_deps.ninja'
+_DEPS_TARGET = 'aidegen_deps'
+_COMBINED_NINJA = 'combined-{}.ninja'
+_NINJA_PATH = 'prebuilts/build-tools/linux-x86/bin/ninja'
 _CORE_MODULES = [constant.FRAMEWORK_ALL, constant.CORE_ALL,
                  'org.apache.http.legacy.stubs.system']
 
@@ -460,60 +460,79 @@ class MultiProjectsInfo(ProjectInfo):
 def batch_build_dependencies(rebuild_targets):
     """Batch build the jar or srcjar files of the modules if they don't exist.
 
-    Command line has the max length limit, MAX_ARG_STRLEN, and
-    MAX_ARG_STRLEN = (PAGE_SIZE * 32).
-    If the build command is longer than MAX_ARG_STRLEN, this function will
-    separate the rebuild_targets into chunks with size less or equal to
-    MAX_ARG_STRLEN to make sure it can be built successfully.
+    All the files are built by a single build command, whatever their number,
+    and the time of the build is logged.
 
     Args:
         rebuild_targets: A set of jar or srcjar files which do not exist.
     """
     logging.info('Ready to build the jar or srcjar files. Files count = %s',
                  str(len(rebuild_targets)))
-    arg_max = os.sysconf('SC_PAGE_SIZE') * 32 - _CMD_LENGTH_BUFFER
-    rebuild_targets = list(rebuild_targets)
-    for start, end in iter(_separate_build_targets(rebuild_targets, arg_max)):
-        _build_target(rebuild_targets[start:end])
+    start_time = time.time()
+    _build_target(sorted(rebuild_targets))
+    logging.info('Built %d jar or srcjar files with a single build command in '
+                 '%.1f seconds.', len(rebuild_targets),
+                 time.time() - start_time)
 
 
 def _build_target(targets):
     """Build the jar or srcjar files.
 
-    Use -k to keep going when some targets can't be built or build failed.
-    Use -j to speed up building.
+    The command line of soong_ui.bash has a length limit, so the files are
+    the inputs of a phony target in a generated ninja file instead, which
+    includes the ninja file soong_ui.bash generated for the last build of
+    the lunch target, i.e. the one of module_bp_java_deps.json. Ninja builds
+    the phony target with one command, without running the soong analysis
+    again.
+
+    Use -k 0 to keep going when some targets can't be built or build failed.
 
     Args:
         targets: A list of jar or srcjar files which need to build.
     """
-    build_cmd = ['-k', '-j']
-    build_cmd.extend(list(targets))
-    verbose = True
-    if not atest_utils.build(build_cmd, verbose):
+    root_dir = common_util.get_android_root_dir()
+    out_dir = os.path.join(root_dir, common_util.get_android_out_dir())
+    deps_ninja = os.path.join(out_dir, _DEPS_NINJA)
+    combined_ninja = os.path.join(out_dir, _COMBINED_NINJA.format(
+        os.environ.get(constant.TARGET_PRODUCT)))
+    common_util.file_generate(
+        deps_ninja, _get_deps_ninja_content(combined_ninja, targets))
+    build_cmd = [os.path.join(root_dir, _NINJA_PATH), '-f', deps_ninja,
+                 '-k', '0', _DEPS_TARGET]
+    logging.debug('Executing command: %s', build_cmd)
+    try:
+        subprocess.check_call(build_cmd, cwd=root_dir)
+    except (subprocess.CalledProcessError, OSError) as err:
+        logging.debug('Exception raised: %s', err)
         message = ('Build failed!\n{}\nAIDEGen will proceed but dependency '
                    'correctness is not guaranteed if not all targets being '
                    'built successfully.'.format('\n'.join(targets)))
         print('\n{} {}\n'.format(common_util.COLORED_INFO('Warning:'), message))
 
 
-def _separate_build_targets(build_targets, max_length):
-    """Separate the build_targets by limit the command size to max command
-    length.
+def _get_deps_ninja_content(combined_ninja, targets):
+    """Get the content of a ninja file with a phony target of the targets.
+
+    Args:
+        combined_ninja: A string of the path of the ninja file to include.
+        targets: A list of jar or srcjar files which need to build.
+
+    Returns:
+        A string of the ninja file content.
+    """
+    build = ['build {}: phony'.format(_DEPS_TARGET)]
+    build.extend(_escape_ninja_path(target) for target in targets)
+    return 'include {}\n{}\n'.format(_escape_ninja_path(combined_ninja),
+                                      ' $\n    '.join(build))
+
+
+def _escape_ninja_path(path):
+    """Escape the characters of a path which are special to ninja.
 
     Args:
-        build_targets: A list to be separated.
-        max_length: The max number of each build command length.
+        path: A string of a file path.
 
-    Yields:
-        The start index and end index of build_targets.
+    Returns:
+        A string of the path in a ninja file.
     """
-    arg_len = 0
-    first_item_index = 0
-    for i, item in enumerate(build_targets):
-        arg_len = arg_len + len(item) + _BLANK_SIZE
-        if arg_len > max_length:
-            yield first_item_index, i
-            first_item_index = i
-            arg_len = len(item) + _BLANK_SIZE
-    if first_item_index < len(build_targets):
-        yield first_item_index, len(build_targets)
+    return path.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
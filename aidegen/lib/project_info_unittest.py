@@ -19,6 +19,7 @@
 import logging
 import os
 import shutil
+import subprocess
 import tempfile
 import unittest
 from unittest import mock
@@ -239,26 +240,6 @@ class ProjectInfoUnittests(unittest.TestCase):
         project_info_obj.locate_source()
         self.assertFalse(mock_batch.called)
 
-    def test_separate_build_target(self):
-        """Test separate_build_target."""
-        test_list = ['1', '22', '333', '4444', '55555', '1', '7777777']
-        targets = []
-        sample = [['1', '22', '333'], ['4444'], ['55555', '1'], ['7777777']]
-        for start, end in iter(
-                project_info._separate_build_targets(test_list, 9)):
-            targets.append(test_list[start:end])
-        self.assertEqual(targets, sample)
-
-    def test_separate_build_target_with_length_short(self):
-        """Test separate_build_target with length short."""
-        test_list = ['1']
-        sample = [['1']]
-        targets = []
-        for start, end in iter(
-                project_info._separate_build_targets(test_list, 9)):
-            targets.append(test_list[start:end])
-        self.assertEqual(targets, sample)
-
     @mock.patch.object(project_info.ProjectInfo, 'locate_source')
     @mock.patch('atest.module_info.ModuleInfo')
     def test_rebuild_jar_once(self, mock_module_info, mock_locate_source):
@@ -272,30 +253,38 @@ class ProjectInfoUnittests(unittest.TestCase):
         self.assertEqual(mock_locate_source.call_count, 2)
 
     @mock.patch('builtins.print')
-    @mock.patch('builtins.format')
-    @mock.patch('atest.atest_utils.build')
-    def test_build_target(self, mock_build, mock_format, mock_print):
-        """Test _build_target."""
-        build_argument = ['-k', 'j']
+    @mock.patch('subprocess.check_call')
+    @mock.patch.object(common_util, 'file_generate')
+    @mock.patch.dict('os.environ', {constant.TARGET_PRODUCT: 'aosp_x86'})
+    @mock.patch.object(common_util, 'get_android_out_dir')
+    @mock.patch.object(common_util, 'get_android_root_dir')
+    def test_build_target(self, mock_root, mock_out, mock_generate,
+                          mock_call, mock_print):
+        """Test _build_target builds the phony target of the targets."""
+        mock_root.return_value = '/aosp'
+        mock_out.return_value = 'out'
         test_targets = ['mod_1', 'mod_2']
-        build_argument.extend(test_targets)
-        mock_build.return_value = False
         project_info._build_target(test_targets)
-        self.assertTrue(mock_build.called_with((build_argument, True)))
-        self.assertTrue(mock_format.called_with('\n'.join(test_targets)))
-        self.assertTrue(mock_print.called)
-        mock_print.reset_mock()
-        mock_format.reset_mock()
-        mock_build.reset_mock()
+        mock_generate.assert_called_with(
+            '/aosp/out/aidegen_deps.ninja',
+            'include /aosp/out/combined-aosp_x86.ninja\n'
+            'build aidegen_deps: phony $\n'
+            '    mod_1 $\n'
+            '    mod_2\n')
+        mock_call.assert_called_with(
+            ['/aosp/prebuilts/build-tools/linux-x86/bin/ninja', '-f',
+             '/aosp/out/aidegen_deps.ninja', '-k', '0', 'aidegen_deps'],
+            cwd='/aosp')
+        self.assertFalse(mock_print.called)
 
-        mock_build.return_value = True
+        mock_call.side_effect = subprocess.CalledProcessError(1, 'ninja')
         project_info._build_target(test_targets)
-        self.assertTrue(mock_build.called_with((build_argument, True)))
-        self.assertFalse(mock_format.called)
-        self.assertFalse(mock_print.called)
-        mock_print.reset_mock()
-        mock_format.reset_mock()
-        mock_build.reset_mock()
+        self.assertTrue(mock_print.called)
+
+    def test_escape_ninja_path(self):
+        """Test _escape_ninja_path escapes the special characters."""
+        self.assertEqual('out/a$ b$:c$$d.jar',
+                         project_info._escape_ninja_path('out/a b:c$d.jar'))
 
     @mock.patch('builtins.print')
     @mock.patch.object(project_info.ProjectInfo, '_search_android_make_files')
@@ -316,16 +305,17 @@ class ProjectInfoUnittests(unittest.TestCase):
         proj_info._display_convert_make_files_message()
         self.assertTrue(mock_print.called)
 
-    @mock.patch.object(project_info, '_build_target')
-    @mock.patch.object(project_info, '_separate_build_targets')
     @mock.patch.object(logging, 'info')
-    def test_batch_build_dependencies(self, mock_log, mock_sep, mock_build):
-        """Test batch_build_dependencies."""
-        mock_sep.return_value = [(0, 1)]
-        project_info.batch_build_dependencies({'m1', 'm2'})
-        self.assertTrue(mock_log.called)
-        self.assertTrue(mock_sep.called)
-        self.assertEqual(mock_build.call_count, 1)
+    @mock.patch('time.time')
+    @mock.patch.object(project_info, '_build_target')
+    def test_batch_build_dependencies(self, mock_build, mock_time, mock_log):
+        """Test batch_build_dependencies builds all targets at once."""
+        targets = {'out/target/common/obj/%05d/classes.jar' % i
+                   for i in range(10000)}
+        mock_time.side_effect = [0, 80]
+        project_info.batch_build_dependencies(targets)
+        mock_build.assert_called_once_with(sorted(targets))
+        self.assertEqual((10000, 80), mock_log.call_args[0][1:])
 
 
 class MultiProjectsInfoUnittests(unittest.TestCase):
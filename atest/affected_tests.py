@@ -0,0 +1,173 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Select the tests affected by the modified files from the module dependencies.
+"""
+
+import collections
+import json
+import logging
+import os
+
+import atest_utils
+import constants
+
+# The dependencies of java modules collected by soong when
+# SOONG_COLLECT_JAVA_DEPS is enabled, see constants.ATEST_BUILD_ENV.
+_BP_JAVA_DEPS_FILE = 'module_bp_java_deps.json'
+_KEY_DEPENDENCIES = 'dependencies'
+
+# A test selected by the modified files, where chain is a list of module
+# names from the test to the changed module it depends on, and files is a list
+# of the modified files in the changed module.
+AffectedTest = collections.namedtuple(
+    'AffectedTest', ['name', 'chain', 'files'])
+
+
+def get_bp_java_deps_path():
+    """Get the path of module_bp_java_deps.json.
+
+    Returns:
+        A string of the path of module_bp_java_deps.json.
+    """
+    root_dir = os.environ.get(constants.ANDROID_BUILD_TOP, os.sep)
+    out_dir = os.environ.get(constants.ANDROID_OUT_DIR, 'out')
+    return os.path.join(root_dir, out_dir, 'soong', _BP_JAVA_DEPS_FILE)
+
+
+class AffectedTestsFinder:
+    """Find the test modules transitively depending on modified files."""
+
+    def __init__(self, mod_info, bp_java_deps_file=None):
+        """AffectedTestsFinder constructor
+
+        Args:
+            mod_info: ModuleInfo class that has cached module-info.json.
+            bp_java_deps_file: String of path to module_bp_java_deps.json.
+                Default is the one in the soong out dir.
+        """
+        self.mod_info = mod_info
+        self.root_dir = os.environ.get(constants.ANDROID_BUILD_TOP, os.sep)
+        self._bp_java_deps_file = bp_java_deps_file or get_bp_java_deps_path()
+        self._reverse_deps = None
+
+    def _load_bp_java_deps(self):
+        """Load the java module dependencies collected by soong.
+
+        Returns:
+            A dict of module name to module info, empty if it can't be loaded.
+        """
+        try:
+            with open(self._bp_java_deps_file) as json_file:
+                return json.load(json_file)
+        except (IOError, ValueError) as err:
+            logging.debug('Exception raised: %s', err)
+            return {}
+
+    def _get_reverse_deps(self):
+        """Get the reverse dependency graph of all modules.
+
+        The dependencies in module-info.json and module_bp_java_deps.json are
+        merged.
+
+        Returns:
+            A dict of module name to a set of names of the modules depending
+            on it.
+        """
+        if self._reverse_deps is None:
+            self._reverse_deps = {}
+            for infos in (self.mod_info.name_to_module_info,
+                          self._load_bp_java_deps()):
+                for name, info in infos.items():
+                    # Merge the variants of multi-arch modules.
+                    name = info.get(constants.MODULE_NAME, name)
+                    for dep in info.get(_KEY_DEPENDENCIES, []):
+                        if dep != name:
+                            self._reverse_deps.setdefault(dep, set()).add(name)
+        return self._reverse_deps
+
+    def get_owning_modules(self, modified_files):
+        """Map the modified files to the modules owning them.
+
+        A file is owned by the modules in the nearest directory containing it.
+
+        Args:
+            modified_files: An iterable of absolute paths of modified files.
+
+        Returns:
+            A dict of module name to a sorted list of modified files relative
+            to the root dir.
+        """
+        owning_modules = {}
+        for modified_file in modified_files:
+            rel_path = os.path.relpath(modified_file, self.root_dir)
+            if rel_path.startswith(os.pardir):
+                continue
+            path = os.path.dirname(rel_path)
+            while path not in self.mod_info.path_to_module_info and path:
+                path = os.path.dirname(path)
+            for info in self.mod_info.path_to_module_info.get(path, []):
+                owning_modules.setdefault(
+                    info[constants.MODULE_NAME], []).append(rel_path)
+        return {name: sorted(files) for name, files in owning_modules.items()}
+
+    def find(self, modified_files):
+        """Find the tests affected by the modified files.
+
+        The reverse dependency graph is walked breadth first from the modules
+        owning the modified files, so the chain of each test is one of the
+        shortest.
+
+        Args:
+            modified_files: An iterable of absolute paths of modified files.
+
+        Returns:
+            A list of AffectedTest sorted by name.
+        """
+        owning_modules = self.get_owning_modules(modified_files)
+        reverse_deps = self._get_reverse_deps()
+        # Module name to the module it's reached from.
+        parents = dict.fromkeys(owning_modules)
+        queue = collections.deque(sorted(owning_modules))
+        affected_tests = []
+        while queue:
+            name = queue.popleft()
+            if self.mod_info.is_testable_module(
+                    self.mod_info.name_to_module_info.get(name)):
+                chain = [name]
+                while parents[chain[-1]]:
+                    chain.append(parents[chain[-1]])
+                affected_tests.append(AffectedTest(
+                    name, chain, owning_modules[chain[-1]]))
+            for dependent in sorted(reverse_deps.get(name, [])):
+                if dependent not in parents:
+                    parents[dependent] = name
+                    queue.append(dependent)
+        return sorted(affected_tests)
+
+
+def print_rationale(affected_tests):
+    """Print why each affected test is selected.
+
+    Args:
+        affected_tests: A list of AffectedTest.
+    """
+    atest_utils.colorful_print(
+        '\nTests affected by the modified files:', constants.CYAN)
+    for affected_test in affected_tests:
+        print('%s: %s (changed: %s)' % (
+            atest_utils.colorize(affected_test.name, constants.GREEN),
+            ' -> '.join(affected_test.chain),
+            ', '.join(affected_test.files)))
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for affected_tests."""
+
+# pylint: disable=protected-access
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest import mock
+
+import affected_tests
+import constants
+import module_info
+
+_ROOT = '/src'
+_MODULE_INFOS = {
+    'libfoo': {constants.MODULE_NAME: 'libfoo',
+               constants.MODULE_PATH: ['frameworks/foo']},
+    'libbar': {constants.MODULE_NAME: 'libbar',
+               constants.MODULE_PATH: ['frameworks/bar'],
+               'dependencies': ['libfoo']},
+    'FooTests': {constants.MODULE_NAME: 'FooTests',
+                 constants.MODULE_PATH: ['frameworks/foo/tests'],
+                 'dependencies': ['libfoo']},
+    'BarTests': {constants.MODULE_NAME: 'BarTests',
+                 constants.MODULE_PATH: ['frameworks/bar/tests']},
+    'BazTests': {constants.MODULE_NAME: 'BazTests',
+                 constants.MODULE_PATH: ['frameworks/baz/tests'],
+                 'dependencies': ['libbaz']},
+}
+# BarTests depends on libbar only in the java dependencies.
+_BP_JAVA_DEPS = {'BarTests': {'dependencies': ['libbar', 'junit']}}
+_TESTS = {'FooTests', 'BarTests', 'BazTests'}
+
+
+class AffectedTestsFinderUnittests(unittest.TestCase):
+    """Unit tests for AffectedTestsFinder in affected_tests.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        bp_java_deps_file = os.path.join(self.tmp_dir, 'bp_java_deps.json')
+        with open(bp_java_deps_file, 'w') as json_file:
+            json.dump(_BP_JAVA_DEPS, json_file)
+        mod_info = mock.Mock(spec=module_info.ModuleInfo)
+        mod_info.name_to_module_info = _MODULE_INFOS
+        mod_info.path_to_module_info = (
+            module_info.ModuleInfo._get_path_to_module_info(_MODULE_INFOS))
+        mod_info.is_testable_module.side_effect = (
+            lambda info: bool(info) and info[constants.MODULE_NAME] in _TESTS)
+        with mock.patch.dict('os.environ',
+                             {constants.ANDROID_BUILD_TOP: _ROOT}):
+            self.finder = affected_tests.AffectedTestsFinder(
+                mod_info, bp_java_deps_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_owning_modules(self):
+        """Test get_owning_modules method."""
+        self.assertEqual(
+            {'libfoo': ['frameworks/foo/Foo.java', 'frameworks/foo/a/B.java'],
+             'FooTests': ['frameworks/foo/tests/FooTest.java']},
+            self.finder.get_owning_modules(
+                ['/src/frameworks/foo/a/B.java', '/src/frameworks/foo/Foo.java',
+                 '/src/frameworks/foo/tests/FooTest.java', '/src/README',
+                 '/other/Foo.java']))
+
+    def test_find(self):
+        """Test find method."""
+        self.assertEqual(
+            [affected_tests.AffectedTest(
+                'BarTests', ['BarTests', 'libbar', 'libfoo'],
+                ['frameworks/foo/Foo.java']),
+             affected_tests.AffectedTest(
+                 'FooTests', ['FooTests', 'libfoo'],
+                 ['frameworks/foo/Foo.java'])],
+            self.finder.find(['/src/frameworks/foo/Foo.java']))
+        self.assertEqual(
+            [affected_tests.AffectedTest(
+                'BarTests', ['BarTests'],
+                ['frameworks/bar/tests/BarTest.java'])],
+            self.finder.find(['/src/frameworks/bar/tests/BarTest.java']))
+        self.assertEqual([], self.finder.find(['/src/frameworks/baz/Baz.java']))
+
+    def test_find_without_bp_java_deps(self):
+        """Test find method without module_bp_java_deps.json."""
+        self.finder._bp_java_deps_file = os.path.join(self.tmp_dir, 'none')
+        self.assertEqual(
+            ['FooTests'],
+            [test.name for test in self.finder.find(
+                ['/src/frameworks/foo/Foo.java'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,6 +28,7 @@ atest is designed to support any test types that can be ran by TradeFederation.
 from __future__ import print_function
 
 import collections
+import itertools
 import logging
 import os
 import sys
@@ -41,10 +42,15 @@ import atest_arg_parser
 import atest_error
 import atest_execution_info
 import atest_utils
+import benchmark_store
 import bug_detector
+import build_pipeline
 import cli_translator
 import constants
+import duration_profiler
+import failed_tests
 import module_info
+import phase_tracer
 import result_reporter
 import test_runner_handler
 
@@ -52,6 +58,7 @@ from metrics import metrics
 from metrics import metrics_base
 from metrics import metrics_utils
 from test_runners import regression_test_runner
+from test_runners import robolectric_test_runner
 from tools import atest_tools
 
 EXPECTED_VARS = frozenset([
@@ -76,7 +83,19 @@ EXTRA_TASKS = {
 }
 
 
-def _run_extra_tasks(join=False):
+def _warm_test_mapping_cache(translator):
+    """Pre-resolve tests in TEST_MAPPING files of frequently used directories.
+
+    Args:
+        translator: A CLITranslator instance.
+    """
+    # Finding tests prints messages which would mess up the build output.
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        translator.warm_test_mapping_cache()
+
+
+def _run_extra_tasks(join=False, translator=None):
     """Execute EXTRA_TASKS with multiprocessing.
 
     Args:
@@ -84,10 +103,16 @@ def _run_extra_tasks(join=False):
         the main process ends or keep itself alive. True indicates the
         main process will wait for all subprocesses finish while False represents
         killing all subprocesses when the main process exits.
+        translator: Optional. A CLITranslator instance. If given, tests in
+        TEST_MAPPING files of frequently used directories are pre-resolved
+        into the test info cache along with the other tasks.
     """
     _running_procs = []
-    for task in EXTRA_TASKS.values():
-        proc = Process(target=task)
+    tasks = [(task, ()) for task in EXTRA_TASKS.values()]
+    if translator:
+        tasks.append((_warm_test_mapping_cache, (translator,)))
+    for task, task_args in tasks:
+        proc = Process(target=task, args=task_args)
         proc.daemon = not join
         proc.start()
         _running_procs.append(proc)
@@ -183,19 +208,23 @@ def get_extra_args(args):
     # if args.aaaa:
     #     extra_args[constants.AAAA] = args.aaaa
     arg_maps = {'all_abi': constants.ALL_ABI,
+                'all_devices': constants.ALL_DEVICES,
                 'collect_tests_only': constants.COLLECT_TESTS_ONLY,
                 'custom_args': constants.CUSTOM_ARGS,
                 'disable_teardown': constants.DISABLE_TEARDOWN,
                 'dry_run': constants.DRY_RUN,
+                'fail_fast': constants.FAIL_FAST,
                 'generate_baseline': constants.PRE_PATCH_ITERATIONS,
                 'generate_new_metrics': constants.POST_PATCH_ITERATIONS,
                 'host': constants.HOST,
+                'host_shards': constants.HOST_SHARDS,
                 'instant': constants.INSTANT,
                 'iterations': constants.ITERATIONS,
                 'rerun_until_failure': constants.RERUN_UNTIL_FAILURE,
                 'retry_any_failure': constants.RETRY_ANY_FAILURE,
                 'serial': constants.SERIAL,
                 'sharding': constants.SHARDING,
+                'tf_daemon': constants.TF_DAEMON,
                 'tf_debug': constants.TF_DEBUG,
                 'tf_template': constants.TF_TEMPLATE,
                 'user_type': constants.USER_TYPE}
@@ -286,6 +315,50 @@ def _validate_tm_tests_exec_mode(args, test_infos):
         _validate_exec_mode(args, host_test_infos, host_tests=True)
 
 
+def _can_pipeline(args, steps, test_infos):
+    """Check if the tests can run as soon as their targets are built.
+
+    The Robolectric tests run through soong_ui, which can't run while the
+    next stage is being built since both hold the lock of the out folder.
+
+    Args:
+        args: parsed args object.
+        steps: A list of the steps to run.
+        test_infos: A set of TestInfos.
+
+    Returns:
+        True if the build and the tests can be pipelined, False otherwise.
+    """
+    return (args.pipeline and constants.TEST_STEP in steps
+            and not args.detect_regression
+            and not is_from_test_mapping(test_infos)
+            and not any(test.test_runner ==
+                        robolectric_test_runner.RobolectricTestRunner.NAME
+                        for test in test_infos))
+
+
+def _create_build_pipeline(test_infos, build_targets, verbose,
+                           log_path=None):
+    """Create the pipeline building the tests in stages.
+
+    Args:
+        test_infos: A set of TestInfos.
+        build_targets: A set of all the build targets.
+        verbose: True to stream the output of the first stage.
+        log_path: A string of the file to append the build output to.
+
+    Returns:
+        A BuildPipeline.
+    """
+    common_targets = build_targets - set().union(
+        *(info.build_targets for info in test_infos))
+    stages = build_pipeline.plan_stages(test_infos, common_targets)
+    logging.debug('Build stages: %s', [len(x.targets) for x in stages])
+    return build_pipeline.BuildPipeline(
+        stages, lambda targets, quiet: atest_utils.build(
+            targets, verbose=verbose, quiet=quiet, log_path=log_path))
+
+
 def _will_run_tests(args):
     """Determine if there are tests to run.
 
@@ -356,7 +429,7 @@ def _has_valid_test_mapping_args(args):
         True if args are valid
     """
     is_test_mapping = atest_utils.is_test_mapping(args)
-    if not is_test_mapping:
+    if not is_test_mapping or args.affected or args.rerun_failed:
         return True
     options_to_validate = [
         (args.generate_baseline, '--generate-baseline'),
@@ -470,13 +543,17 @@ def _split_test_mapping_tests(test_infos):
 
 
 # pylint: disable=too-many-locals
-def _run_test_mapping_tests(results_dir, test_infos, extra_args):
+def _run_test_mapping_tests(results_dir, test_infos, extra_args,
+                            concurrency=1):
     """Run all tests in TEST_MAPPING files.
 
     Args:
         results_dir: String directory to store atest results.
         test_infos: A set of TestInfos.
         extra_args: Dict of extra args to add to test run.
+        concurrency: An integer of the maximum number of test runner groups to
+            run at the same time. Host and device tests run concurrently if
+            it's more than 1.
 
     Returns:
         Exit code.
@@ -493,40 +570,105 @@ def _run_test_mapping_tests(results_dir, test_infos, extra_args):
     else:
         test_runs.append((device_test_infos, extra_args, DEVICE_TESTS))
 
+    test_runs = [test_run for test_run in test_runs if test_run[0]]
     test_results = []
-    for tests, args, test_type in test_runs:
-        if not tests:
-            continue
-        header = RUN_HEADER_FMT % {TEST_COUNT: len(tests), TEST_TYPE: test_type}
-        atest_utils.colorful_print(header, constants.MAGENTA)
-        logging.debug('\n'.join([str(info) for info in tests]))
-        tests_exit_code, reporter = test_runner_handler.run_all_tests(
-            results_dir, tests, args, delay_print_summary=True)
+    if concurrency > 1 and len(test_runs) > 1:
+        for tests, _, test_type in test_runs:
+            header = RUN_HEADER_FMT % {TEST_COUNT: len(tests),
+                                       TEST_TYPE: test_type}
+            atest_utils.colorful_print(header, constants.MAGENTA)
+            logging.debug('\n'.join([str(info) for info in tests]))
+        batch_results = test_runner_handler.run_test_batches(
+            results_dir, [(tests, args) for tests, args, _ in test_runs],
+            concurrency)
+        for (tests_exit_code, reporter), (_, _, test_type) in zip(
+                batch_results, test_runs):
+            test_results.append((tests_exit_code, reporter, test_type))
+    else:
+        for tests, args, test_type in test_runs:
+            header = RUN_HEADER_FMT % {TEST_COUNT: len(tests),
+                                       TEST_TYPE: test_type}
+            atest_utils.colorful_print(header, constants.MAGENTA)
+            logging.debug('\n'.join([str(info) for info in tests]))
+            test_results.append(test_runner_handler.run_all_tests(
+                results_dir, tests, args, delay_print_summary=True,
+                concurrency=concurrency) + (test_type,))
+    for _, reporter, _ in test_results:
         atest_execution_info.AtestExecutionInfo.result_reporters.append(reporter)
-        test_results.append((tests_exit_code, reporter, test_type))
 
     all_tests_exit_code = constants.EXIT_CODE_SUCCESS
-    failed_tests = []
+    failed_test_types = []
     for tests_exit_code, reporter, test_type in test_results:
         atest_utils.colorful_print(
             RESULT_HEADER_FMT % {TEST_TYPE: test_type}, constants.MAGENTA)
         result = tests_exit_code | reporter.print_summary()
         if result:
-            failed_tests.append(test_type)
+            failed_test_types.append(test_type)
         all_tests_exit_code |= result
 
     # List failed tests at the end as a reminder.
-    if failed_tests:
+    if failed_test_types:
         atest_utils.colorful_print(
             atest_utils.delimiter('=', 30, prenl=1), constants.YELLOW)
         atest_utils.colorful_print(
             '\nFollowing tests failed:', constants.MAGENTA)
-        for failure in failed_tests:
+        for failure in failed_test_types:
             atest_utils.colorful_print(failure, constants.RED)
 
     return all_tests_exit_code
 
 
+def _process_benchmarks(args, results_dir):
+    """Store the benchmark results of the run and compare them to a baseline.
+
+    Args:
+        args: An argspace.Namespace class instance holding parsed args.
+        results_dir: String directory to store atest results.
+
+    Returns:
+        EXIT_CODE_TEST_FAILURE if a benchmark regressed, EXIT_CODE_SUCCESS
+        otherwise.
+    """
+    perf_info = []
+    for reporter in atest_execution_info.AtestExecutionInfo.result_reporters:
+        perf_info.extend(reporter.run_stats.perf_info.perf_info)
+    return benchmark_store.process_run(
+        results_dir, perf_info, serial=args.serial,
+        save_baseline=args.benchmark_baseline,
+        compare_to=args.benchmark_compare)
+
+
+def _rerun_failed_tests(results_dir, test_infos, extra_args, reporter,
+                        concurrency=1):
+    """Rerun the failed tests of a test run once.
+
+    Args:
+        results_dir: String directory to store atest results.
+        test_infos: A list of TestInfos of the test run.
+        extra_args: Dict of extra args for test runners to use.
+        reporter: The ResultReporter of the test run.
+        concurrency: An integer of the maximum number of test runners to run
+            at the same time.
+
+    Returns:
+        Exit code of the rerun, None if there's no failed test to rerun.
+    """
+    test_results = reporter.all_test_results
+    if reporter.result_log:
+        test_results = itertools.chain(
+            reporter.result_log.read_test_results(), test_results)
+    failures = failed_tests.FailedTests.from_test_results(test_results)
+    failed_infos = failures.filter_test_infos(test_infos)
+    if not failed_infos:
+        return None
+    failures.print_rerun_info()
+    tests_exit_code, rerun_reporter = test_runner_handler.run_all_tests(
+        results_dir, failed_infos, extra_args, concurrency=concurrency)
+    atest_execution_info.AtestExecutionInfo.result_reporters.append(
+        rerun_reporter)
+    return tests_exit_code
+
+
 def _dry_run(results_dir, extra_args, test_infos):
     """Only print the commands of the target tests rather than running them in actual.
 
@@ -599,6 +741,14 @@ def _non_action_validator(args):
         atest_execution_info.print_test_result_by_path(
             constants.LATEST_RESULT_FILE)
         sys.exit(constants.EXIT_CODE_SUCCESS)
+    if args.slowest_tests:
+        duration_profiler.print_report(constants.ATEST_RESULT_ROOT,
+                                       args.slowest_tests)
+        sys.exit(constants.EXIT_CODE_SUCCESS)
+    if args.test_history:
+        atest_execution_info.print_test_history(constants.ATEST_RESULT_ROOT,
+                                                args.test_history)
+        sys.exit(constants.EXIT_CODE_SUCCESS)
     # TODO(b/131879842): remove below statement after they are fully removed.
     if any((args.detect_regression,
             args.generate_baseline,
@@ -664,7 +814,9 @@ def main(argv, results_dir, args):
         cwd=os.getcwd(),
         os=os_pyver)
     _non_action_validator(args)
-    mod_info = module_info.ModuleInfo(force_build=args.rebuild_module_info)
+    with phase_tracer.span('module_info_load'):
+        mod_info = module_info.ModuleInfo(
+            force_build=args.rebuild_module_info)
     if args.rebuild_module_info:
         _run_extra_tasks(join=True)
     translator = cli_translator.CLITranslator(module_info=mod_info,
@@ -678,7 +830,8 @@ def main(argv, results_dir, args):
     build_targets = set()
     test_infos = set()
     if _will_run_tests(args):
-        build_targets, test_infos = translator.translate(args)
+        with phase_tracer.span('find_tests'):
+            build_targets, test_infos = translator.translate(args)
         if not test_infos:
             return constants.EXIT_CODE_TEST_NOT_FOUND
         if not is_from_test_mapping(test_infos):
@@ -697,22 +850,31 @@ def main(argv, results_dir, args):
                           .get_test_runner_build_reqs())
     # args.steps will be None if none of -bit set, else list of params set.
     steps = args.steps if args.steps else constants.ALL_STEPS
+    pipeline = None
     if build_targets and constants.BUILD_STEP in steps:
         if constants.TEST_STEP in steps and not args.rebuild_module_info:
             # Run extra tasks along with build step concurrently. Note that
             # Atest won't index targets when only "-b" is given(without -t).
-            _run_extra_tasks(join=False)
+            _run_extra_tasks(join=False, translator=translator)
         # Add module-info.json target to the list of build targets to keep the
         # file up to date.
         build_targets.add(mod_info.module_info_target)
-        build_start = time.time()
-        success = atest_utils.build(build_targets, verbose=args.verbose)
-        metrics.BuildFinishEvent(
-            duration=metrics_utils.convert_duration(time.time() - build_start),
-            success=success,
-            targets=build_targets)
-        if not success:
-            return constants.EXIT_CODE_BUILD_FAILURE
+        build_log_path = os.path.join(results_dir, atest_utils.BUILD_LOG_NAME)
+        if _can_pipeline(args, steps, test_infos):
+            # The tests run as soon as their targets are built.
+            pipeline = _create_build_pipeline(test_infos, build_targets,
+                                              args.verbose, build_log_path)
+        else:
+            build_start = time.time()
+            success = atest_utils.build(build_targets, verbose=args.verbose,
+                                        log_path=build_log_path)
+            metrics.BuildFinishEvent(
+                duration=metrics_utils.convert_duration(
+                    time.time() - build_start),
+                success=success,
+                targets=build_targets)
+            if not success:
+                return constants.EXIT_CODE_BUILD_FAILURE
     elif constants.TEST_STEP not in steps:
         logging.warning('Install step without test step currently not '
                         'supported, installing AND testing instead.')
@@ -720,21 +882,45 @@ def main(argv, results_dir, args):
     tests_exit_code = constants.EXIT_CODE_SUCCESS
     test_start = time.time()
     if constants.TEST_STEP in steps:
-        if not is_from_test_mapping(test_infos):
-            tests_exit_code, reporter = test_runner_handler.run_all_tests(
-                results_dir, test_infos, extra_args)
+        if pipeline:
+            tests_exit_code, reporter = test_runner_handler.run_pipelined_tests(
+                results_dir, pipeline, extra_args,
+                concurrency=args.runner_concurrency)
             atest_execution_info.AtestExecutionInfo.result_reporters.append(reporter)
+            metrics.BuildFinishEvent(
+                duration=metrics_utils.convert_duration(pipeline.build_secs),
+                success=pipeline.success,
+                targets=build_targets)
+            if not pipeline.success:
+                return constants.EXIT_CODE_BUILD_FAILURE
+        if not is_from_test_mapping(test_infos):
+            if not pipeline:
+                tests_exit_code, reporter = test_runner_handler.run_all_tests(
+                    results_dir, test_infos, extra_args,
+                    concurrency=args.runner_concurrency)
+                atest_execution_info.AtestExecutionInfo.result_reporters.append(reporter)
+            # Without tests, the failed tests of the latest run are rerun.
+            if (args.rerun_failed and args.tests
+                    and tests_exit_code != constants.EXIT_CODE_SUCCESS):
+                rerun_exit_code = _rerun_failed_tests(
+                    results_dir, test_infos, extra_args, reporter,
+                    concurrency=args.runner_concurrency)
+                if rerun_exit_code is not None:
+                    tests_exit_code = rerun_exit_code
         else:
             tests_exit_code = _run_test_mapping_tests(
-                results_dir, test_infos, extra_args)
+                results_dir, test_infos, extra_args, args.runner_concurrency)
+        tests_exit_code |= _process_benchmarks(args, results_dir)
     if args.detect_regression:
         regression_args = _get_regression_detection_args(args, results_dir)
         # TODO(b/110485713): Should not call run_tests here.
-        reporter = result_reporter.ResultReporter()
+        reporter = result_reporter.ResultReporter(
+            result_log=atest_execution_info.AtestExecutionInfo.result_log)
         atest_execution_info.AtestExecutionInfo.result_reporters.append(reporter)
         tests_exit_code |= regression_test_runner.RegressionTestRunner(
             '').run_tests(
                 None, regression_args, reporter)
+    phase_tracer.add_span('run_tests', test_start, time.time())
     metrics.RunTestsFinishEvent(
         duration=metrics_utils.convert_duration(time.time() - test_start))
     preparation_time = atest_execution_info.preparation_time(test_start)
@@ -749,9 +935,30 @@ def main(argv, results_dir, args):
         tests_exit_code = constants.EXIT_CODE_TEST_FAILURE
     return tests_exit_code
 
+def _save_trace(results_dir, argv):
+    """Save the trace of the phases of the run to the result folder.
+
+    Args:
+        results_dir: A string of the test result folder.
+        argv: A list of arguments.
+    """
+    metadata = {'command_line': ' '.join(argv)}
+    if os.path.isfile(constants.VERSION_FILE):
+        with open(constants.VERSION_FILE) as version_file:
+            metadata['version'] = version_file.read().strip()
+    trace_path = os.path.join(results_dir, phase_tracer.TRACE_NAME)
+    if phase_tracer.save(trace_path, metadata):
+        print('Trace of the run saved to %s, open it in chrome://tracing.'
+              % atest_utils.colorize(trace_path, constants.CYAN))
+
+
 if __name__ == '__main__':
+    PARSE_START = time.time()
     RESULTS_DIR = make_test_run_dir()
     ARGS = _parse_args(sys.argv[1:])
+    if ARGS.trace:
+        phase_tracer.enable()
+        phase_tracer.add_span('parse_args', PARSE_START, time.time())
     with atest_execution_info.AtestExecutionInfo(sys.argv[1:],
                                                  RESULTS_DIR,
                                                  ARGS) as result_file:
@@ -763,7 +970,13 @@ if __name__ == '__main__':
             else:
                 metrics_base.MetricsBase.tool_name = USER_FROM_TOOL
 
-        EXIT_CODE = main(sys.argv[1:], RESULTS_DIR, ARGS)
+        try:
+            with phase_tracer.span('main'):
+                EXIT_CODE = main(sys.argv[1:], RESULTS_DIR, ARGS)
+        finally:
+            # The trace of a failed run is saved too.
+            if ARGS.trace:
+                _save_trace(RESULTS_DIR, sys.argv[1:])
         DETECTOR = bug_detector.BugDetector(sys.argv[1:], EXIT_CODE)
         metrics.LocalDetectEvent(
             detect_type=constants.DETECT_TYPE_BUG_DETECTED,
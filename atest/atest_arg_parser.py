@@ -32,7 +32,19 @@ HELP_DESC = ('A command line tool that allows users to build, install, and run '
              ' options.')
 
 # Constants used for arg help message(sorted in alphabetic)
+AFFECTED = ('Run the tests depending on the modified files of the git project '
+            'in the current directory, along with the given tests.')
 ALL_ABI = 'Set to run tests for all abis.'
+ALL_DEVICES = ('Distribute the test modules across all the connected devices, '
+               'balanced by their durations in previous runs, and run the '
+               'modules of each device in one TradeFed invocation.')
+BENCHMARK_BASELINE = ('Save the benchmark results of the run as the baseline '
+                      'of the lunch target and the device.')
+BENCHMARK_COMPARE = ('Compare the benchmark results of the run against the '
+                     'saved baseline of the lunch target and the device, or '
+                     'against the given benchmark.json or result folder, and '
+                     'fail on the significant regressions. Run the benchmarks '
+                     'with at least 4 repetitions to detect the regressions.')
 BUILD = 'Run a build.'
 CLEAR_CACHE = 'Wipe out the test_infos cache of the test.'
 COLLECT_TESTS_ONLY = ('Collect a list test cases of the instrumentation tests '
@@ -40,11 +52,19 @@ COLLECT_TESTS_ONLY = ('Collect a list test cases of the instrumentation tests '
 DISABLE_TEARDOWN = 'Disable test teardown and cleanup.'
 DRY_RUN = 'Dry run atest without building, installing and running tests in real.'
 ENABLE_FILE_PATTERNS = 'Enable FILE_PATTERNS in TEST_MAPPING.'
+FAIL_FAST = ('Run the tests likely to fail first, as ordered by their failures '
+             'and durations in previous runs, and stop starting new tests '
+             'after the first failure. The tests already started in a '
+             'TradeFed invocation, e.g. on a single device or in host shards, '
+             'run to the end.')
 HISTORY = ('Show test results in chronological order(with specified number or '
            'all by default).')
 HOST = ('Run the test completely on the host without a device. '
         '(Note: running a host test that requires a device without '
         '--host will fail.)')
+HOST_SHARDS = ('Split the host tests into the given number of shards balanced '
+               'by their durations in previous runs, and run the shards '
+               'in parallel. Only applies with --host.')
 INCLUDE_SUBDIRS = 'Search TEST_MAPPING files in subdirs as well.'
 INFO = 'Show module information.'
 INSTALL = 'Install an APK.'
@@ -55,22 +75,42 @@ ITERATION = 'Loop-run tests until the max iteration is reached. (10 by default)'
 LATEST_RESULT = 'Print latest test result.'
 LIST_MODULES = 'List testable modules for the given suite.'
 NO_METRICS = 'Do not send metrics.'
+PIPELINE = ('Build the tests in a few stages and run the tests of each stage '
+            'while the next stages are being built, instead of running the '
+            'tests after building all of them.')
 REBUILD_MODULE_INFO = ('Forces a rebuild of the module-info.json file. '
                        'This may be necessary following a repo sync or '
                        'when writing a new test.')
+RERUN_FAILED = ('Rerun only the failed tests of the latest test run if no test is '
+                'given, otherwise rerun the failed tests once after the run.')
 RERUN_UNTIL_FAILURE = ('Rerun all tests until a failure occurs or the max '
                        'iteration is reached. (10 by default)')
+RUNNER_CONCURRENCY = ('Run up to the given number of test runners at the same '
+                      'time, e.g. host and device tests. (1 by default)')
 RETRY_ANY_FAILURE = ('Rerun failed tests until passed or the max iteration '
                      'is reached. (10 by default)')
 SERIAL = 'The device to run the test on.'
+SLOWEST_TESTS = ('Show the given number of the slowest modules, classes, tests and '
+                 'module setups in the latest test results, along with the '
+                 'trend of their durations. (10 by default)')
 TEST = ('Run the tests. WARNING: Many test configs force cleanup of device '
         'after test run. In this case, "-d" must be used in previous test run to '
         'disable cleanup for "-t" to work. Otherwise, device will need to be '
         'setup again with "-i".')
+TEST_HISTORY = ('Show the pass rate of the given module, class or test, e.g. '
+                'com.android.Test#test, in the test results, along with its '
+                'last failure.')
 TEST_MAPPING = 'Run tests defined in TEST_MAPPING files.'
 TF_TEMPLATE = ('Add extra tradefed template for ATest suite, '
                'e.g. atest <test> --tf-template <template_key>=<template_path>')
+TF_DAEMON = ('Run the TradeFed tests in a TradeFed console kept running between '
+             'atest runs, which saves the startup of TradeFed. The console '
+             'exits after being idle for 30 minutes or once TradeFed is '
+             'rebuilt.')
 TF_DEBUG = 'Enable tradefed debug mode with a specify port. Default value is 10888.'
+TRACE = ('Record the spans of the phases of the run, e.g. the module-info '
+         'load, the test finders and the build, to trace.json in the '
+         'result folder in the Chrome trace event format.')
 SHARDING = 'Option to specify sharding count. The default value is 2'
 UPDATE_CMD_MAPPING = ('Update the test command of input tests. Warning: result '
                       'will be saved under tools/tradefederation/core/atest/test_data.')
@@ -113,22 +153,36 @@ class AtestArgParser(argparse.ArgumentParser):
         self.add_argument('tests', nargs='*', help='Tests to build and/or run.')
         # Options that to do with testing.
         self.add_argument('-a', '--all-abi', action='store_true', help=ALL_ABI)
+        self.add_argument('--affected', action='store_true', help=AFFECTED)
+        self.add_argument('--all-devices', action='store_true',
+                          help=ALL_DEVICES)
         self.add_argument('-b', '--build', action='append_const', dest='steps',
                           const=constants.BUILD_STEP, help=BUILD)
         self.add_argument('-d', '--disable-teardown', action='store_true',
                           help=DISABLE_TEARDOWN)
+        self.add_argument('--benchmark-baseline', action='store_true',
+                          help=BENCHMARK_BASELINE)
+        self.add_argument('--benchmark-compare', nargs='?', const='',
+                          metavar='BASELINE', help=BENCHMARK_COMPARE)
+        self.add_argument('--fail-fast', action='store_true', help=FAIL_FAST)
         self.add_argument('--host', action='store_true', help=HOST)
+        self.add_argument('--host-shards', type=_positive_int,
+                          help=HOST_SHARDS)
         self.add_argument('-i', '--install', action='append_const',
                           dest='steps', const=constants.INSTALL_STEP,
                           help=INSTALL)
         self.add_argument('-m', constants.REBUILD_MODULE_INFO_FLAG,
                           action='store_true', help=REBUILD_MODULE_INFO)
+        self.add_argument('--pipeline', action='store_true', help=PIPELINE)
+        self.add_argument('--runner-concurrency', type=_positive_int,
+                          default=1, help=RUNNER_CONCURRENCY)
         self.add_argument('-s', '--serial', help=SERIAL)
         self.add_argument('--sharding', nargs='?', const=2,
                           type=_positive_int, default=0,
                           help=SHARDING)
         self.add_argument('-t', '--test', action='append_const', dest='steps',
                           const=constants.TEST_STEP, help=TEST)
+        self.add_argument('--trace', action='store_true', help=TRACE)
         self.add_argument('-w', '--wait-for-debugger', action='store_true',
                           help=WAIT_FOR_DEBUGGER)
 
@@ -186,10 +240,13 @@ class AtestArgParser(argparse.ArgumentParser):
         self.add_argument('-D', '--tf-debug', nargs='?', const=10888,
                           type=_positive_int, default=0,
                           help=TF_DEBUG)
+        self.add_argument('--tf-daemon', action='store_true', help=TF_DAEMON)
         # Options for Tradefed customization related.
         self.add_argument('--tf-template', action='append',
                           help=TF_TEMPLATE)
 
+        self.add_argument('--rerun-failed', action='store_true',
+                          help=RERUN_FAILED)
         # A group of options for rerun strategy. They are mutually exclusive
         # in a command line.
         group = self.add_mutually_exclusive_group()
@@ -212,6 +269,11 @@ class AtestArgParser(argparse.ArgumentParser):
                                    help=LATEST_RESULT)
         history_group.add_argument('--history', nargs='?', const='99999',
                                    help=HISTORY)
+        history_group.add_argument('--slowest-tests', nargs='?',
+                                   type=_positive_int, const=10, default=0,
+                                   metavar='TOP_N', help=SLOWEST_TESTS)
+        history_group.add_argument('--test-history', metavar='TEST',
+                                   help=TEST_HISTORY)
 
         # Options for disabling collecting data for metrics.
         self.add_argument(constants.NO_METRICS_ARG, action='store_true',
@@ -244,16 +306,22 @@ def print_epilog_text():
     Returns:
         STDOUT from pydoc.pager().
     """
-    epilog_text = EPILOG_TEMPLATE.format(ALL_ABI=ALL_ABI,
+    epilog_text = EPILOG_TEMPLATE.format(AFFECTED=AFFECTED,
+                                         ALL_ABI=ALL_ABI,
+                                         ALL_DEVICES=ALL_DEVICES,
+                                         BENCHMARK_BASELINE=BENCHMARK_BASELINE,
+                                         BENCHMARK_COMPARE=BENCHMARK_COMPARE,
                                          BUILD=BUILD,
                                          CLEAR_CACHE=CLEAR_CACHE,
                                          COLLECT_TESTS_ONLY=COLLECT_TESTS_ONLY,
                                          DISABLE_TEARDOWN=DISABLE_TEARDOWN,
                                          DRY_RUN=DRY_RUN,
                                          ENABLE_FILE_PATTERNS=ENABLE_FILE_PATTERNS,
+                                         FAIL_FAST=FAIL_FAST,
                                          HELP_DESC=HELP_DESC,
                                          HISTORY=HISTORY,
                                          HOST=HOST,
+                                         HOST_SHARDS=HOST_SHARDS,
                                          INCLUDE_SUBDIRS=INCLUDE_SUBDIRS,
                                          INFO=INFO,
                                          INSTALL=INSTALL,
@@ -262,15 +330,22 @@ def print_epilog_text():
                                          LATEST_RESULT=LATEST_RESULT,
                                          LIST_MODULES=LIST_MODULES,
                                          NO_METRICS=NO_METRICS,
+                                         PIPELINE=PIPELINE,
                                          REBUILD_MODULE_INFO=REBUILD_MODULE_INFO,
+                                         RERUN_FAILED=RERUN_FAILED,
                                          RERUN_UNTIL_FAILURE=RERUN_UNTIL_FAILURE,
                                          RETRY_ANY_FAILURE=RETRY_ANY_FAILURE,
+                                         RUNNER_CONCURRENCY=RUNNER_CONCURRENCY,
                                          SERIAL=SERIAL,
                                          SHARDING=SHARDING,
+                                         SLOWEST_TESTS=SLOWEST_TESTS,
                                          TEST=TEST,
+                                         TEST_HISTORY=TEST_HISTORY,
                                          TEST_MAPPING=TEST_MAPPING,
+                                         TF_DAEMON=TF_DAEMON,
                                          TF_DEBUG=TF_DEBUG,
                                          TF_TEMPLATE=TF_TEMPLATE,
+                                         TRACE=TRACE,
                                          USER_TYPE=USER_TYPE,
                                          UPDATE_CMD_MAPPING=UPDATE_CMD_MAPPING,
                                          VERBOSE=VERBOSE,
@@ -297,6 +372,18 @@ OPTIONS
         -a, --all-abi
             {ALL_ABI}
 
+        --affected
+            {AFFECTED}
+
+        --all-devices
+            {ALL_DEVICES}
+
+        --benchmark-baseline
+            {BENCHMARK_BASELINE}
+
+        --benchmark-compare
+            {BENCHMARK_COMPARE}
+
         -b, --build:
             {BUILD} (default)
 
@@ -306,18 +393,30 @@ OPTIONS
         -D --tf-debug
             {TF_DEBUG}
 
+        --fail-fast
+            {FAIL_FAST}
+
         --history
             {HISTORY}
 
         --host
             {HOST}
 
+        --host-shards
+            {HOST_SHARDS}
+
         -i, --install
             {INSTALL} (default)
 
         -m, --rebuild-module-info
             {REBUILD_MODULE_INFO} (default)
 
+        --pipeline
+            {PIPELINE}
+
+        --runner-concurrency
+            {RUNNER_CONCURRENCY}
+
         -s, --serial
             {SERIAL}
 
@@ -327,9 +426,15 @@ OPTIONS
         -t, --test
             {TEST} (default)
 
+        --tf-daemon
+            {TF_DAEMON}
+
         --tf-template
             {TF_TEMPLATE}
 
+        --trace
+            {TRACE}
+
         -w, --wait-for-debugger
             {WAIT_FOR_DEBUGGER}
 
@@ -358,6 +463,12 @@ OPTIONS
         --latest-result
             {LATEST_RESULT}
 
+        --slowest-tests
+            {SLOWEST_TESTS}
+
+        --test-history
+            {TEST_HISTORY}
+
         -v, --verbose
             {VERBOSE}
 
@@ -391,6 +502,9 @@ OPTIONS
         --iterations
             {ITERATION}
 
+        --rerun-failed
+            {RERUN_FAILED}
+
         --rerun-until-failure
             {RERUN_UNTIL_FAILURE}
 
@@ -602,6 +716,20 @@ EXAMPLES
         - stop when passed or reached the 20th run.
         atest <test> --retry-any-failure 20
 
+    To rerun only the failed tests rather than the whole modules, pass --rerun-failed argument.
+
+    Example:
+        - rerun the failed tests of the latest test run.
+        atest --rerun-failed
+        - run <test> and then rerun its failed tests once.
+        atest <test> --rerun-failed
+
+    To get the first failure as early as possible, pass --fail-fast argument. The tests failed often and quickly in previous runs run first, and no new test is started once a test fails.
+
+    Example:
+        atest <test> <test> --fail-fast
+        atest <test> --fail-fast --all-devices
+
 
     - - - - - - - - - - - - - - - -
     REGRESSION DETECTION (obsolute)
@@ -18,14 +18,22 @@
 
 from __future__ import print_function
 
+import collections
 import glob
 import logging
 import json
 import os
+import re
+import sqlite3
 import sys
 
 import atest_utils as au
+import benchmark_store
+import build_profiler
 import constants
+import history_index
+import result_archive
+import result_reporter
 
 from metrics import metrics_utils
 
@@ -33,25 +41,50 @@ _ARGS_KEY = 'args'
 _STATUS_PASSED_KEY = 'PASSED'
 _STATUS_FAILED_KEY = 'FAILED'
 _STATUS_IGNORED_KEY = 'IGNORED'
+_STATUS_ERROR_KEY = 'ERROR'
+_FAILED_STATUSES = (_STATUS_FAILED_KEY, _STATUS_ERROR_KEY)
 _SUMMARY_KEY = 'summary'
 _TOTAL_SUMMARY_KEY = 'total_summary'
 _TEST_RUNNER_KEY = 'test_runner'
 _TEST_NAME_KEY = 'test_name'
 _TEST_TIME_KEY = 'test_time'
 _TEST_DETAILS_KEY = 'details'
+_MODULE_TIME_KEY = 'module_time'
+_DURATION_KEY = 'duration'
+_OVERHEAD_KEY = 'overhead'
+_BUILD_PROFILE_KEY = 'build_profile'
 _TEST_RESULT_NAME = 'test_result'
+# The test results streamed during the run, which test_result is made from.
+_TEST_RESULT_LOG_NAME = 'test_result.jsonl'
 _EXIT_CODE_ATTR = 'EXIT_CODE'
 _MAIN_MODULE_KEY = '__main__'
 _UUID_LEN = 30
 _RESULT_LEN = 35
 _COMMAND_LEN = 50
-_LOGCAT_FMT = '{}/log/invocation_*/{}*logcat-on-failure*'
+# Invocations of host test shards log to log/shard_<index>/invocation_*.
+_LOGCAT_FMT = '{}/log/**/invocation_*/{}*logcat-on-failure*'
+# The number of the last lines of the logcat on failure to print.
+_LOG_TAIL_LINES = 20
+# The number of latest test results to estimate the test durations from.
+_DURATION_HISTORY_SIZE = 5
+# test_time formatted by EventHandler, e.g. (5ms), (1.234s), (2m3.456s) or
+# (1h2m3.456s).
+_TEST_TIME_RE = re.compile(r'^\((?:(?P<hours>\d+)h)?(?:(?P<minutes>\d+)m(?=\d))?'
+                           r'(?:(?P<seconds>[\d.]+)s|(?P<millis>\d+)ms)\)$')
+
+# The history of a test, where duration is the average duration in
+# milliseconds, None if unknown, runs is the number of test results having the
+# test and failed_runs is the number of them where the test failed.
+TestHistory = collections.namedtuple(
+    'TestHistory', ['duration', 'runs', 'failed_runs'])
 
 _SUMMARY_MAP_TEMPLATE = {_STATUS_PASSED_KEY : 0,
                          _STATUS_FAILED_KEY : 0,
                          _STATUS_IGNORED_KEY : 0,}
 
 PREPARE_END_TIME = None
+# The time the first event is received from TradeFed.
+FIRST_EVENT_TIME = None
 
 
 def preparation_time(start_time):
@@ -93,34 +126,88 @@ def print_test_result(root, history_arg):
                             'test_result')
         print_test_result_by_path(path)
         return
-    target = '%s/20*_*_*' % root
-    paths = glob.glob(target)
-    paths.sort(reverse=True)
     print('{:-^{uuid_len}} {:-^{result_len}} {:-^{command_len}}'
           .format('uuid', 'result', 'command',
                   uuid_len=_UUID_LEN,
                   result_len=_RESULT_LEN,
                   command_len=_COMMAND_LEN))
+    try:
+        with history_index.HistoryIndex(root) as index:
+            index.sync()
+            runs = index.get_runs(int(history_arg) + 1)
+        for run in runs:
+            _print_run_summary(run.run_name, run.summary, run.args)
+        return
+    except sqlite3.Error as err:
+        logging.debug('Exception raised: %s', err)
+    target = '%s/20*_*_*' % root
+    paths = glob.glob(target)
+    paths.sort(reverse=True)
     for path in paths[0: int(history_arg)+1]:
         result_path = os.path.join(path, 'test_result')
         if os.path.isfile(result_path):
             try:
                 with open(result_path) as json_file:
                     result = json.load(json_file)
-                    total_summary = result.get(_TOTAL_SUMMARY_KEY, {})
-                    summary_str = ', '.join([k+':'+str(v)
-                                             for k, v in total_summary.items()])
-                    print('{:<{uuid_len}} {:<{result_len}} atest {:<{command_len}}'
-                          .format(os.path.basename(path),
-                                  summary_str,
-                                  result.get(_ARGS_KEY, ''),
-                                  uuid_len=_UUID_LEN,
-                                  result_len=_RESULT_LEN,
-                                  command_len=_COMMAND_LEN))
+                    _print_run_summary(os.path.basename(path),
+                                       result.get(_TOTAL_SUMMARY_KEY, {}),
+                                       result.get(_ARGS_KEY, ''))
             except ValueError:
                 pass
 
 
+def _print_run_summary(run_name, total_summary, args):
+    """Print a line of the summary of a test result.
+
+    Args:
+        run_name: A string of the name of the test result folder.
+        total_summary: A dict of status to the number of tests.
+        args: A string of the atest arguments of the run.
+    """
+    summary_str = ', '.join([k+':'+str(v) for k, v in total_summary.items()])
+    print('{:<{uuid_len}} {:<{result_len}} atest {:<{command_len}}'
+          .format(run_name,
+                  summary_str,
+                  args,
+                  uuid_len=_UUID_LEN,
+                  result_len=_RESULT_LEN,
+                  command_len=_COMMAND_LEN))
+
+
+def print_test_history(root, test_name):
+    """Print the pass rate and the last failure of a test.
+
+    Args:
+        root: A string of the test result root path.
+        test_name: A string of a module name, a class name or a test name,
+            e.g. com.android.Test#test.
+    """
+    try:
+        with history_index.HistoryIndex(root) as index:
+            index.sync()
+            stats = index.get_test_stats(test_name)
+    except sqlite3.Error as err:
+        logging.debug('Exception raised: %s', err)
+        print('Failed to read the test history in %s.' % root)
+        return
+    if not stats.runs:
+        print('No test history of %s found in %s.' % (test_name, root))
+        return
+    pass_rate = (stats.runs - stats.failed_runs) / stats.runs
+    print('%s passed in %d of %d runs (%s).' % (
+        test_name, stats.runs - stats.failed_runs, stats.runs,
+        au.colorize('{:.0%}'.format(pass_rate),
+                    constants.GREEN if not stats.failed_runs
+                    else constants.RED)))
+    if stats.last_failure:
+        failure = stats.last_failure
+        print('Last failure: %s in %s' % (
+            au.colorize(failure.test_name, constants.RED),
+            os.path.join(root, failure.run_name)))
+        if failure.details:
+            print(failure.details)
+
+
 def print_test_result_by_path(path):
     """Print latest test result.
 
@@ -151,17 +238,207 @@ def print_test_result_by_path(path):
                                 fail.get(_TEST_NAME_KEY)), constants.RED))
                             failure_files = glob.glob(_LOGCAT_FMT.format(
                                 os.path.dirname(path), fail.get(_TEST_NAME_KEY)
-                                ))
+                                ), recursive=True)
                             if failure_files:
                                 print('{} {}'.format(
                                     au.colorize('LOGCAT-ON-FAILURES:',
                                                 constants.CYAN),
                                     failure_files[0]))
+                                _print_log_tail(failure_files[0])
                             print('{} {}'.format(
                                 au.colorize('STACKTRACE:\n', constants.CYAN),
                                 fail.get(_TEST_DETAILS_KEY)))
 
 
+def _print_log_tail(path, lines=_LOG_TAIL_LINES):
+    """Print the last lines of a log, whether it's compressed or not.
+
+    Args:
+        path: A string of the log path.
+        lines: An integer of the number of the lines to print.
+    """
+    try:
+        with result_archive.open_log(path) as log_file:
+            tail = collections.deque(log_file, maxlen=lines)
+    except (IOError, OSError, EOFError) as err:
+        logging.debug('Exception raised: %s', err)
+        return
+    print(''.join(tail).rstrip('\n'))
+
+
+def parse_test_time(test_time):
+    """Parse the test time of a test result.
+
+    Args:
+        test_time: A string of the test time, e.g. (2m3.456s).
+
+    Returns:
+        An integer of the test time in milliseconds, None if it can't be
+        parsed.
+    """
+    match = _TEST_TIME_RE.match(test_time or '')
+    if not match:
+        return None
+    duration = (int(match.group('hours') or 0) * 3600
+                + int(match.group('minutes') or 0) * 60
+                + float(match.group('seconds') or 0)) * 1000
+    return int(duration + int(match.group('millis') or 0))
+
+
+def get_module_name(group_name):
+    """Get the module name of a test group.
+
+    Args:
+        group_name: A string of the group name, e.g. "x86_64 hello_world_test".
+
+    Returns:
+        A string of the module name without the abi, e.g. "hello_world_test".
+    """
+    return group_name.split()[-1] if group_name else ''
+
+
+def load_test_results(root, max_results):
+    """Load the latest test results.
+
+    Args:
+        root: A string of the test result root path.
+        max_results: An integer of the number of latest test results to read.
+
+    Returns:
+        A list of tuples of the name of the result folder and the dict of the
+        test result, from the latest to the oldest.
+    """
+    paths = sorted(glob.glob(os.path.join(root, '20*_*_*', _TEST_RESULT_NAME)),
+                   reverse=True)
+    results = []
+    for path in paths[:max_results]:
+        try:
+            with open(path) as json_file:
+                results.append((os.path.basename(os.path.dirname(path)),
+                                json.load(json_file)))
+        except (IOError, ValueError) as err:
+            logging.debug('Exception raised: %s', err)
+    return results
+
+
+def iter_test_times(result):
+    """Iterate over the tests of a test result.
+
+    Args:
+        result: A dict of a test result.
+
+    Yields:
+        A tuple of the module name, the test name, the status and the test
+        time in milliseconds, where the test time is None if unknown.
+    """
+    for groups in result.get(_TEST_RUNNER_KEY, {}).values():
+        for group_name, group in groups.items():
+            module_name = get_module_name(group_name)
+            if not module_name:
+                continue
+            for status, tests in group.items():
+                if status == _SUMMARY_KEY:
+                    continue
+                for test in tests:
+                    yield (module_name, test.get(_TEST_NAME_KEY) or '', status,
+                           parse_test_time(test.get(_TEST_TIME_KEY)))
+
+
+def get_module_times(result):
+    """Get the wall time and the setup overhead of the modules.
+
+    Args:
+        result: A dict of a test result.
+
+    Returns:
+        A dict of module name to a tuple of the wall time and the overhead,
+        i.e. the wall time not spent in its tests, in milliseconds.
+    """
+    module_times = {}
+    for group_name, times in result.get(_MODULE_TIME_KEY, {}).items():
+        module_name = get_module_name(group_name)
+        if module_name:
+            duration, overhead = module_times.get(module_name, (0, 0))
+            module_times[module_name] = (duration + times[_DURATION_KEY],
+                                         overhead + times[_OVERHEAD_KEY])
+    return module_times
+
+
+def _get_run_durations(result):
+    """Get the durations and failures of the tests in a test result.
+
+    Args:
+        result: A dict of the test result.
+
+    Returns:
+        A tuple of a dict of test name to the duration in milliseconds, None
+        if it's unknown, and a set of the names of the failed tests.
+    """
+    durations = {}
+    failed = set()
+    for module_name, test_name, status, test_time in iter_test_times(result):
+        names = (module_name, '%s:%s' % (module_name, test_name.split('#')[0]))
+        for name in names:
+            durations.setdefault(name, None)
+            if test_time is not None:
+                durations[name] = (durations[name] or 0) + test_time
+        if status in _FAILED_STATUSES:
+            failed.update(names)
+    for module_name, (_, overhead) in get_module_times(result).items():
+        if module_name in durations:
+            durations[module_name] = (durations[module_name] or 0) + overhead
+    return durations, failed
+
+
+def get_test_history(root, max_results=_DURATION_HISTORY_SIZE):
+    """Get the durations and failures of the tests in the latest test results.
+
+    The duration of a class is the sum of its test times, and the duration of
+    a module also counts its setup overhead if it's recorded.
+
+    Args:
+        root: A string of the test result root path.
+        max_results: An integer of the number of latest test results to read.
+
+    Returns:
+        A dict of test name to TestHistory, where the test name is a module
+        name or module_name:class_name.
+    """
+    total_durations = collections.defaultdict(list)
+    runs = collections.Counter()
+    failed_runs = collections.Counter()
+    for _, result in load_test_results(root, max_results):
+        durations, failed = _get_run_durations(result)
+        runs.update(durations.keys())
+        failed_runs.update(failed)
+        for name, duration in durations.items():
+            if duration is not None:
+                total_durations[name].append(duration)
+    history = {}
+    for name, count in runs.items():
+        durations = total_durations.get(name)
+        history[name] = TestHistory(
+            sum(durations) // len(durations) if durations else None,
+            count, failed_runs[name])
+    return history
+
+
+def get_test_durations(root, max_results=_DURATION_HISTORY_SIZE):
+    """Get the average durations of the tests in the latest test results.
+
+    Args:
+        root: A string of the test result root path.
+        max_results: An integer of the number of latest test results to read.
+
+    Returns:
+        A dict of test name to the average duration in milliseconds, where
+        the test name is a module name or module_name:class_name.
+    """
+    return {name: history.duration
+            for name, history in get_test_history(root, max_results).items()
+            if history.duration is not None}
+
+
 def has_non_test_options(args):
     """
     check whether non-test option in the args.
@@ -179,7 +456,9 @@ def has_non_test_options(args):
             or args.history
             or args.info
             or args.version
-            or args.latest_result)
+            or args.latest_result
+            or args.slowest_tests
+            or args.test_history)
 
 
 class AtestExecutionInfo:
@@ -219,7 +498,9 @@ class AtestExecutionInfo:
     }
     """
 
+    # The reporters whose results aren't streamed to result_log.
     result_reporters = []
+    result_log = None
 
     def __init__(self, args, work_dir, args_ns):
         """Initialise an AtestExecutionInfo instance.
@@ -242,18 +523,27 @@ class AtestExecutionInfo:
         full_file_name = os.path.join(self.work_dir, _TEST_RESULT_NAME)
         try:
             self.result_file = open(full_file_name, 'w')
+            AtestExecutionInfo.result_log = result_reporter.ResultLog(
+                os.path.join(self.work_dir, _TEST_RESULT_LOG_NAME))
         except IOError:
             logging.error('Cannot open file %s', full_file_name)
         return self.result_file
 
     def __exit__(self, exit_type, value, traceback):
         """Write execution information and close information file."""
+        info_dict = None
         if self.result_file:
-            self.result_file.write(AtestExecutionInfo.
-                                   _generate_execution_detail(self.args))
+            info_dict = AtestExecutionInfo._generate_execution_info(self.args)
+            if info_dict is not None:
+                self.result_file.write(json.dumps(info_dict))
             self.result_file.close()
+        if AtestExecutionInfo.result_log:
+            AtestExecutionInfo.result_log.close()
+            AtestExecutionInfo.result_log = None
+        if self.result_file:
             if not has_non_test_options(self.args_ns):
                 symlink_latest_result(self.work_dir)
+                self._archive_test_result(info_dict)
         main_module = sys.modules.get(_MAIN_MODULE_KEY)
         main_exit_code = getattr(main_module, _EXIT_CODE_ATTR,
                                  constants.EXIT_CODE_ERROR)
@@ -262,27 +552,71 @@ class AtestExecutionInfo:
         else:
             metrics_utils.handle_exc_and_send_exit_event(main_exit_code)
 
+    def _archive_test_result(self, info_dict):
+        """Index the test result, compress the logs and evict the oldest ones.
+
+        The logs of this run are compressed by the next run, so the run isn't
+        delayed by its own logs.
+
+        Args:
+            info_dict: A dict of the test result, None if it's not generated.
+        """
+        root = os.path.dirname(os.path.abspath(self.work_dir))
+        # Only the test results under the result root are managed.
+        if root != os.path.abspath(constants.ATEST_RESULT_ROOT):
+            return
+        run_name = os.path.basename(self.work_dir)
+        try:
+            with history_index.HistoryIndex(root) as index:
+                if info_dict is not None:
+                    index.add_run(run_name, info_dict,
+                                  result_archive.get_dir_size(self.work_dir))
+                index.sync()
+                original_size, compressed_size = index.compress_logs(
+                    keep=(run_name,))
+                evicted, reclaimed = index.evict(
+                    history_index.MAX_RESULT_RUNS,
+                    history_index.MAX_RESULT_BYTES, keep=(run_name,),
+                    reserved_dirs=(benchmark_store.BASELINE_ROOT,))
+        except sqlite3.Error as err:
+            logging.debug('Exception raised: %s', err)
+            return
+        if original_size:
+            print('Compressed the logs of the previous runs from %s to %s.' % (
+                result_archive.format_size(original_size),
+                result_archive.format_size(compressed_size)))
+        if evicted:
+            print('Removed the %d oldest test results in %s, reclaimed %s.' % (
+                len(evicted), root, result_archive.format_size(reclaimed)))
+
     @staticmethod
-    def _generate_execution_detail(args):
-        """Generate execution detail.
+    def _generate_execution_info(args):
+        """Generate execution info.
 
         Args:
             args: Command line parameters that you want to save.
 
         Returns:
-            A json format string.
+            A dict of the execution info, None if it fails to be generated.
         """
         info_dict = {_ARGS_KEY: ' '.join(args)}
+        if build_profiler.PROFILES:
+            info_dict[_BUILD_PROFILE_KEY] = [
+                build_profiler.to_dict(build_profile)
+                for build_profile in build_profiler.PROFILES]
+        result_log = AtestExecutionInfo.result_log
         try:
             AtestExecutionInfo._arrange_test_result(
                 info_dict,
-                AtestExecutionInfo.result_reporters)
-            return json.dumps(info_dict)
+                AtestExecutionInfo.result_reporters,
+                result_log.read() if result_log else ())
+            return info_dict
         except ValueError as err:
             logging.warning('Parsing test result failed due to : %s', err)
+        return None
 
     @staticmethod
-    def _arrange_test_result(info_dict, reporters):
+    def _arrange_test_result(info_dict, reporters, log_records=()):
         """Append test result information in given dict.
 
         Arrange test information to below
@@ -297,35 +631,60 @@ class AtestExecutionInfo:
                 "summary": {"FAILED": 0, "PASSED": 0, "IGNORED": 0}
                 },
             },
-        "total_summary": {"FAILED": 0, "PASSED": 0, "IGNORED": 0}
+        "total_summary": {"FAILED": 0, "PASSED": 0, "IGNORED": 0},
+        "module_time": {
+            "module name": {"duration": 0, "overhead": 0}
+            }
+
+        The summaries are counted as the records are read, so the records
+        streamed to the result log aren't loaded at once.
 
         Args:
             info_dict: A dict you want to add result information in.
-            reporters: A list of result_reporter.
+            reporters: A list of result_reporter whose results aren't
+                streamed to the result log.
+            log_records: An iterable of the dicts of the records in the
+                result log.
 
         Returns:
             A dict contains test result information data.
         """
-        info_dict[_TEST_RUNNER_KEY] = {}
+        test_runner = info_dict[_TEST_RUNNER_KEY] = {}
+        total_summary = info_dict[_TOTAL_SUMMARY_KEY] = _SUMMARY_MAP_TEMPLATE.copy()
+        module_time = info_dict[_MODULE_TIME_KEY] = {}
+
+        def _add_test_result(runner_name, group_name, status, result_dict):
+            """Add the result of a test and count it in the summaries."""
+            group = test_runner.setdefault(runner_name, {}).setdefault(
+                group_name, {_SUMMARY_KEY: _SUMMARY_MAP_TEMPLATE.copy()})
+            group.setdefault(status, []).append(result_dict)
+            if status in _SUMMARY_MAP_TEMPLATE:
+                group[_SUMMARY_KEY][status] += 1
+                total_summary[status] += 1
+
+        def _add_module_time(group_name, duration, test_time):
+            """Add the wall time and the overhead of a module."""
+            times = module_time.setdefault(
+                group_name, {_DURATION_KEY: 0, _OVERHEAD_KEY: 0})
+            times[_DURATION_KEY] += duration
+            times[_OVERHEAD_KEY] += max(duration - test_time, 0)
+
+        for record in log_records:
+            if record.get('type') == result_reporter.ResultLog.TEST_RESULT:
+                _add_test_result(record['runner_name'], record['group_name'],
+                                 record['status'],
+                                 {_TEST_NAME_KEY : record['test_name'],
+                                  _TEST_TIME_KEY : record['test_time'],
+                                  _TEST_DETAILS_KEY : record['details']})
+            elif record.get('type') == result_reporter.ResultLog.MODULE_TIME:
+                _add_module_time(record['group_name'], record['duration'],
+                                 record['test_time'])
         for reporter in reporters:
             for test in reporter.all_test_results:
-                runner = info_dict[_TEST_RUNNER_KEY].setdefault(
-                    test.runner_name, {})
-                group = runner.setdefault(test.group_name, {})
-                result_dict = {_TEST_NAME_KEY : test.test_name,
-                               _TEST_TIME_KEY : test.test_time,
-                               _TEST_DETAILS_KEY : test.details}
-                group.setdefault(test.status, []).append(result_dict)
-
-        total_test_group_summary = _SUMMARY_MAP_TEMPLATE.copy()
-        for runner in info_dict[_TEST_RUNNER_KEY]:
-            for group in info_dict[_TEST_RUNNER_KEY][runner]:
-                group_summary = _SUMMARY_MAP_TEMPLATE.copy()
-                for status in info_dict[_TEST_RUNNER_KEY][runner][group]:
-                    count = len(info_dict[_TEST_RUNNER_KEY][runner][group][status])
-                    if status in _SUMMARY_MAP_TEMPLATE:
-                        group_summary[status] = count
-                        total_test_group_summary[status] += count
-                info_dict[_TEST_RUNNER_KEY][runner][group][_SUMMARY_KEY] = group_summary
-        info_dict[_TOTAL_SUMMARY_KEY] = total_test_group_summary
+                _add_test_result(test.runner_name, test.group_name, test.status,
+                                 {_TEST_NAME_KEY : test.test_name,
+                                  _TEST_TIME_KEY : test.test_time,
+                                  _TEST_DETAILS_KEY : test.details})
+            for group_name, (duration, test_time) in reporter.module_times.items():
+                _add_module_time(group_name, duration, test_time)
         return info_dict
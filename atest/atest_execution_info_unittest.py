@@ -18,10 +18,21 @@
 
 # pylint: disable=line-too-long
 
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
 import time
 import unittest
 
+from io import StringIO
+from unittest import mock
+
 import atest_execution_info as aei
+import history_index
+import result_archive
 import result_reporter
 
 from test_runners import test_runner_base
@@ -158,6 +169,231 @@ class AtestRunInfoUnittests(unittest.TestCase):
                                 aei._STATUS_PASSED_KEY : 3}
         self.assertEqual(expect_total_summary, info_dict[aei._TOTAL_SUMMARY_KEY])
 
+    def test_parse_test_time(self):
+        """Test parse_test_time method."""
+        self.assertEqual(10, aei.parse_test_time('(10ms)'))
+        self.assertEqual(1234, aei.parse_test_time('(1.234s)'))
+        self.assertEqual(123456, aei.parse_test_time('(2m3.456s)'))
+        self.assertEqual(3723456, aei.parse_test_time('(1h2m3.456s)'))
+        self.assertIsNone(aei.parse_test_time(''))
+        self.assertIsNone(aei.parse_test_time(None))
+
+    def test_get_test_durations(self):
+        """Test get_test_durations method."""
+        root = tempfile.mkdtemp()
+        try:
+            for run, test_time in (('2020-01-01_10:00:00_1', '(10ms)'),
+                                   ('2020-01-02_10:00:00_1', '(30ms)'),
+                                   ('2019-01-01_10:00:00_1', '(1m0.000s)')):
+                os.mkdir(os.path.join(root, run))
+                result = {aei._TEST_RUNNER_KEY: {'someRunner': {
+                    'x86_64 someModule': {
+                        aei._STATUS_PASSED_KEY: [
+                            {aei._TEST_NAME_KEY: 'someClass#a',
+                             aei._TEST_TIME_KEY: test_time},
+                            {aei._TEST_NAME_KEY: 'otherClass#b',
+                             aei._TEST_TIME_KEY: '(5ms)'}],
+                        aei._SUMMARY_KEY: {aei._STATUS_PASSED_KEY: 2}}}}}
+                with open(os.path.join(root, run, 'test_result'), 'w') as f:
+                    json.dump(result, f)
+            # The oldest result is out of the history.
+            self.assertEqual({'someModule': 25,
+                              'someModule:someClass': 20,
+                              'someModule:otherClass': 5},
+                             aei.get_test_durations(root, 2))
+        finally:
+            shutil.rmtree(root)
+
+    def test_get_test_history(self):
+        """Test get_test_history method."""
+        root = tempfile.mkdtemp()
+        try:
+            for run, status in (('2020-01-01_10:00:00_1', aei._STATUS_PASSED_KEY),
+                                ('2020-01-02_10:00:00_1', aei._STATUS_FAILED_KEY)):
+                os.mkdir(os.path.join(root, run))
+                result = {aei._TEST_RUNNER_KEY: {'someRunner': {
+                    'someModule': {
+                        status: [{aei._TEST_NAME_KEY: 'someClass#a',
+                                  aei._TEST_TIME_KEY: '(10ms)'}],
+                        aei._STATUS_IGNORED_KEY: [
+                            {aei._TEST_NAME_KEY: 'otherClass#b',
+                             aei._TEST_TIME_KEY: ''}]}}}}
+                with open(os.path.join(root, run, 'test_result'), 'w') as f:
+                    json.dump(result, f)
+            self.assertEqual(
+                {'someModule': aei.TestHistory(10, 2, 1),
+                 'someModule:someClass': aei.TestHistory(10, 2, 1),
+                 'someModule:otherClass': aei.TestHistory(None, 2, 0)},
+                aei.get_test_history(root))
+        finally:
+            shutil.rmtree(root)
+
+    def test_arrange_test_result_module_time(self):
+        """Test _arrange_test_result method with the module times."""
+        reporter_1 = result_reporter.ResultReporter()
+        reporter_1.process_module_time('someModule', 100, 30)
+        reporter_2 = result_reporter.ResultReporter()
+        reporter_2.process_module_time('someModule', 50, 10)
+        reporter_2.process_module_time('otherModule', 5, 10)
+        info_dict = {}
+        aei.AtestExecutionInfo._arrange_test_result(info_dict,
+                                                    [reporter_1, reporter_2])
+        self.assertEqual(
+            {'someModule': {aei._DURATION_KEY: 150, aei._OVERHEAD_KEY: 110},
+             'otherModule': {aei._DURATION_KEY: 5, aei._OVERHEAD_KEY: 0}},
+            info_dict[aei._MODULE_TIME_KEY])
+
+    def test_arrange_test_result_log_records(self):
+        """Test _arrange_test_result method with the result log."""
+        root = tempfile.mkdtemp()
+        try:
+            result_log = result_reporter.ResultLog(
+                os.path.join(root, 'test_result.jsonl'))
+            result_log.write_test_result(self._create_test_result(
+                status=test_runner_base.PASSED_STATUS))
+            result_log.write_test_result(self._create_test_result(
+                status=test_runner_base.FAILED_STATUS, details='trace'))
+            result_log.write_module_time('someModule', 100, 30)
+            result_log.close()
+            # The results of the reporter aren't streamed.
+            reporter = result_reporter.ResultReporter()
+            reporter.all_test_results.append(self._create_test_result(
+                group_name='otherModule'))
+            info_dict = {}
+            aei.AtestExecutionInfo._arrange_test_result(
+                info_dict, [reporter], result_log.read())
+        finally:
+            shutil.rmtree(root)
+        group = info_dict[aei._TEST_RUNNER_KEY]['someRunner']['someModule']
+        self.assertEqual(
+            [{aei._TEST_NAME_KEY: 'someClassName#sostName',
+              aei._TEST_TIME_KEY: '(10ms)',
+              aei._TEST_DETAILS_KEY: 'trace'}],
+            group[aei._STATUS_FAILED_KEY])
+        self.assertEqual({aei._STATUS_IGNORED_KEY : 0,
+                          aei._STATUS_FAILED_KEY : 1,
+                          aei._STATUS_PASSED_KEY : 1},
+                         group[aei._SUMMARY_KEY])
+        self.assertEqual({aei._STATUS_IGNORED_KEY : 0,
+                          aei._STATUS_FAILED_KEY : 1,
+                          aei._STATUS_PASSED_KEY : 2},
+                         info_dict[aei._TOTAL_SUMMARY_KEY])
+        self.assertEqual(
+            {'someModule': {aei._DURATION_KEY: 100, aei._OVERHEAD_KEY: 70}},
+            info_dict[aei._MODULE_TIME_KEY])
+
+    @mock.patch('metrics.metrics_utils.handle_exc_and_send_exit_event')
+    def test_execution_info_result_log(self, _send_exit):
+        """Test test_result is made from the results streamed in the run."""
+        work_dir = tempfile.mkdtemp()
+        try:
+            with aei.AtestExecutionInfo(['someTest'], work_dir, mock.Mock()):
+                reporter = result_reporter.ResultReporter(
+                    result_log=aei.AtestExecutionInfo.result_log)
+                reporter.process_test_result(self._create_test_result())
+                # The result is on disk before the run ends.
+                with open(os.path.join(work_dir, 'test_result.jsonl')) as f:
+                    self.assertEqual(1, len(f.readlines()))
+            self.assertIsNone(aei.AtestExecutionInfo.result_log)
+            with open(os.path.join(work_dir, 'test_result')) as f:
+                result = json.load(f)
+        finally:
+            shutil.rmtree(work_dir)
+        self.assertEqual('someTest', result[aei._ARGS_KEY])
+        self.assertEqual(1, result[aei._TOTAL_SUMMARY_KEY][aei._STATUS_PASSED_KEY])
+
+    @mock.patch('metrics.metrics_utils.handle_exc_and_send_exit_event')
+    def test_execution_info_history_index(self, _send_exit):
+        """Test the run is indexed and the oldest runs are removed."""
+        root = tempfile.mkdtemp()
+        try:
+            old_dir = os.path.join(root, '2020-01-01_10:00:00_1')
+            os.mkdir(old_dir)
+            with open(os.path.join(old_dir, 'test_result'), 'w') as f:
+                json.dump({aei._ARGS_KEY: 'otherTest'}, f)
+            work_dir = os.path.join(root, '2020-01-02_10:00:00_1')
+            os.mkdir(work_dir)
+            args_ns = mock.Mock(collect_tests_only=False, dry_run=False,
+                                help=False, history=None, info=False,
+                                version=False, latest_result=False,
+                                slowest_tests=0, test_history=None)
+            with mock.patch('constants.ATEST_RESULT_ROOT', root), \
+                 mock.patch('history_index.MAX_RESULT_RUNS', 1):
+                with aei.AtestExecutionInfo(['someTest'], work_dir, args_ns):
+                    reporter = result_reporter.ResultReporter(
+                        result_log=aei.AtestExecutionInfo.result_log)
+                    reporter.process_test_result(self._create_test_result(
+                        status=test_runner_base.FAILED_STATUS,
+                        details='trace'))
+            self.assertFalse(os.path.exists(old_dir))
+            # The logs of the run are left for the next run to compress.
+            self.assertFalse(os.path.exists(
+                os.path.join(work_dir, result_archive._COMPRESSED_MARK_NAME)))
+            with history_index.HistoryIndex(root) as index:
+                runs = index.get_runs(5)
+                stats = index.get_test_stats('someClassName#sostName')
+        finally:
+            shutil.rmtree(root)
+        self.assertEqual(['2020-01-02_10:00:00_1'],
+                         [run.run_name for run in runs])
+        self.assertEqual(history_index.TestStats(
+            1, 1, history_index.Failure('2020-01-02_10:00:00_1',
+                                        'someClassName#sostName', 'trace')),
+                         stats)
+
+    def test_print_test_result_by_path_compressed_logcat(self):
+        """Test print_test_result_by_path reads the compressed logcat."""
+        root = tempfile.mkdtemp()
+        try:
+            log_dir = os.path.join(root, 'log', 'invocation_1')
+            os.makedirs(log_dir)
+            with gzip.open(os.path.join(
+                    log_dir, 'someClass#a-logcat-on-failure.txt.gz'),
+                           'wt') as f:
+                f.write(''.join('line %d\n' % i for i in range(100)))
+            result = {aei._ARGS_KEY: 'someTest',
+                      aei._TOTAL_SUMMARY_KEY: {aei._STATUS_FAILED_KEY: 1},
+                      aei._TEST_RUNNER_KEY: {'someRunner': {'someModule': {
+                          aei._STATUS_FAILED_KEY: [
+                              {aei._TEST_NAME_KEY: 'someClass#a',
+                               aei._TEST_DETAILS_KEY: 'trace'}]}}}}
+            with open(os.path.join(root, 'test_result'), 'w') as f:
+                json.dump(result, f)
+            capture_output = StringIO()
+            sys.stdout = capture_output
+            try:
+                aei.print_test_result_by_path(os.path.join(root,
+                                                           'test_result'))
+            finally:
+                sys.stdout = sys.__stdout__
+        finally:
+            shutil.rmtree(root)
+        output = capture_output.getvalue()
+        self.assertIn('logcat-on-failure.txt.gz', output)
+        self.assertIn('line 99', output)
+        self.assertNotIn('line 79\n', output)
+
+    def test_get_test_history_module_time(self):
+        """Test get_test_history method counts the module overhead."""
+        root = tempfile.mkdtemp()
+        try:
+            run = '2020-01-01_10:00:00_1'
+            os.mkdir(os.path.join(root, run))
+            result = {aei._TEST_RUNNER_KEY: {'someRunner': {
+                'x86_64 someModule': {
+                    aei._STATUS_PASSED_KEY: [
+                        {aei._TEST_NAME_KEY: 'someClass#a',
+                         aei._TEST_TIME_KEY: '(10ms)'}]}}},
+                      aei._MODULE_TIME_KEY: {
+                          'x86_64 someModule': {aei._DURATION_KEY: 50,
+                                                aei._OVERHEAD_KEY: 40}}}
+            with open(os.path.join(root, run, 'test_result'), 'w') as f:
+                json.dump(result, f)
+            self.assertEqual({'someModule': 50, 'someModule:someClass': 10},
+                             aei.get_test_durations(root))
+        finally:
+            shutil.rmtree(root)
+
     def _create_test_result(self, **kwargs):
         """A Helper to create TestResult"""
         test_info = test_runner_base.TestResult(**RESULT_TEST_TEMPLATE._asdict())
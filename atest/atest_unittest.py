@@ -28,12 +28,20 @@ from importlib import reload
 from io import StringIO
 from unittest import mock
 
-import atest
+import atest_execution_info
 import constants
 import module_info
+import result_reporter
+import test_runner_handler
+import unittest_constants as uc
 
 from metrics import metrics_utils
 from test_finders import test_info
+from test_runners import test_runner_base
+
+# The atest package shares the name of the module under test, so the module
+# is imported last to keep the first party imports after the others.
+import atest
 
 #pylint: disable=protected-access
 class AtestUnittests(unittest.TestCase):
@@ -292,6 +300,59 @@ class AtestUnittests(unittest.TestCase):
         reload(constants)
         self.assertTrue(date_time)
 
+    @mock.patch.object(atest_execution_info.AtestExecutionInfo,
+                       'result_reporters', [])
+    @mock.patch.object(test_runner_handler, 'run_all_tests')
+    def test_rerun_failed_tests(self, mock_run_all_tests):
+        """Test _rerun_failed_tests method."""
+        reporter = result_reporter.ResultReporter(silent=True)
+        rerun_reporter = result_reporter.ResultReporter(silent=True)
+        mock_run_all_tests.return_value = (constants.EXIT_CODE_SUCCESS,
+                                           rerun_reporter)
+        test_name = '%s#%s' % (uc.FULL_CLASS_NAME, uc.METHOD_NAME)
+        reporter.all_test_results = [test_runner_base.TestResult(
+            runner_name=uc.MODULE_INFO.test_runner,
+            group_name=uc.MODULE_NAME, test_name=test_name,
+            status=test_runner_base.FAILED_STATUS, details=None,
+            test_count=1, test_time='(1ms)', runner_total=None,
+            group_total=None, additional_info={}, test_run_name='')]
+        self.assertEqual(constants.EXIT_CODE_SUCCESS,
+                         atest._rerun_failed_tests('/tmp', [uc.MODULE_INFO],
+                                                   {}, reporter))
+        failed_infos = mock_run_all_tests.call_args[0][1]
+        self.assertEqual({test_name},
+                         next(iter(failed_infos[0].data[constants.TI_FILTER]))
+                         .to_set_of_tf_strings())
+        self.assertEqual(
+            [rerun_reporter],
+            atest_execution_info.AtestExecutionInfo.result_reporters)
+        # Nothing to rerun without failed tests.
+        self.assertIsNone(atest._rerun_failed_tests(
+            '/tmp', [uc.MODULE_INFO], {}, rerun_reporter))
+        self.assertEqual(1, mock_run_all_tests.call_count)
+
+    @mock.patch('atest_utils.build', return_value=True)
+    def test_create_build_pipeline(self, mock_build):
+        """Test _create_build_pipeline method."""
+        info = test_info.TestInfo(uc.MODULE_NAME, uc.MODULE_INFO.test_runner,
+                                  {'module_target'})
+        pipeline = atest._create_build_pipeline(
+            [info], {'module_target', 'runner_target'}, False)
+        self.assertEqual([[info]], list(pipeline))
+        mock_build.assert_called_once_with(
+            {'module_target', 'runner_target'}, verbose=False, quiet=False,
+            log_path=None)
+
+    def test_can_pipeline(self):
+        """Test _can_pipeline method."""
+        args = mock.Mock(pipeline=True, detect_regression=False)
+        steps = [constants.BUILD_STEP, constants.TEST_STEP]
+        self.assertTrue(atest._can_pipeline(args, steps, [uc.MODULE_INFO]))
+        robo_info = test_info.TestInfo(uc.MODULE_NAME,
+                                       'RobolectricTestRunner', set())
+        self.assertFalse(atest._can_pipeline(args, steps, [uc.MODULE_INFO,
+                                                           robo_info]))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -21,6 +21,7 @@ Utility functions for atest.
 
 from __future__ import print_function
 
+import collections
 import hashlib
 import itertools
 import json
@@ -31,15 +32,19 @@ import re
 import shutil
 import subprocess
 import sys
+import time
 
 import atest_decorator
 import atest_error
 import constants
+import phase_tracer
 
 # b/147562331 only occurs when running atest in source code. We don't encourge
 # the users to manually "pip3 install protobuf", therefore when the exception
 # occurs, we don't collect data and the tab completion is for args is silence.
 try:
+    # build_profiler imports the metrics too.
+    import build_profiler
     from metrics import metrics_base
     from metrics import metrics_utils
 except ModuleNotFoundError:
@@ -57,8 +62,14 @@ _BASH_RESET_CODE = '\033[0m\n'
 _FAILED_OUTPUT_LINE_LIMIT = 100
 # Regular expression to match the start of a ninja compile:
 # ex: [ 99% 39710/39711]
-_BUILD_COMPILE_STATUS = re.compile(r'\[\s*(\d{1,3}%\s+)?\d+/\d+\]')
+_BUILD_COMPILE_STATUS = re.compile(
+    r'\[\s*(\d{1,3}%\s+)?(?P<done>\d+)/(?P<total>\d+)\]')
 _BUILD_FAILURE = 'FAILED: '
+# The full output of the builds in the test result folder, which is
+# compressed with the other logs once atest exits.
+BUILD_LOG_NAME = os.path.join('log', 'build.log')
+# Seconds of the ninja progress the build throughput is measured over.
+_BUILD_RATE_WINDOW_SECS = 30
 CMD_RESULT_PATH = os.path.join(os.environ.get(constants.ANDROID_BUILD_TOP,
                                               os.getcwd()),
                                'tools/tradefederation/core/atest/test_data',
@@ -67,6 +78,10 @@ BUILD_TOP_HASH = hashlib.md5(os.environ.get(constants.ANDROID_BUILD_TOP, '').
                              encode()).hexdigest()
 TEST_INFO_CACHE_ROOT = os.path.join(os.path.expanduser('~'), '.atest',
                                     'info_cache', BUILD_TOP_HASH[:8])
+# File under the test info cache root counting the directories atest ran the
+# tests in TEST_MAPPING files from.
+_TEST_MAPPING_DIRS_FILE = 'test_mapping_dirs.json'
+_TEST_MAPPING_DIRS_LIMIT = 100
 _DEFAULT_TERMINAL_WIDTH = 80
 _DEFAULT_TERMINAL_HEIGHT = 25
 _BUILD_CMD = 'build/soong/soong_ui.bash'
@@ -94,33 +109,224 @@ def get_build_cmd():
     return [make_cmd, '--make-mode']
 
 
+class _BuildProgress:
+    """Estimate the throughput and the remaining time of a ninja build.
+
+    The throughput is measured over the latest _BUILD_RATE_WINDOW_SECS, as
+    the edges built early, e.g. the code generation, are much faster than the
+    compilation and linking later on.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._samples = collections.deque()
+        self.done = 0
+        self.total = 0
+
+    def update(self, line):
+        """Update the progress with a line of the build output.
+
+        Args:
+            line: A string of a line of the build output.
+
+        Returns:
+            True if the line is a ninja status, e.g. [ 45% 123/270] ...
+        """
+        match = _BUILD_COMPILE_STATUS.match(line)
+        if not match:
+            return False
+        self.done = int(match.group('done'))
+        self.total = int(match.group('total'))
+        now = self._clock()
+        self._samples.append((now, self.done))
+        while now - self._samples[0][0] > _BUILD_RATE_WINDOW_SECS:
+            self._samples.popleft()
+        return True
+
+    @property
+    def rate(self):
+        """The number of the edges built per second, None if unknown."""
+        if len(self._samples) < 2:
+            return None
+        start, start_done = self._samples[0]
+        end, end_done = self._samples[-1]
+        if end <= start or end_done <= start_done:
+            return None
+        return (end_done - start_done) / (end - start)
+
+    @property
+    def eta(self):
+        """The estimated seconds to finish the build, None if unknown."""
+        rate = self.rate
+        if not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def format_status(self):
+        """Format the throughput and the ETA, e.g. 12.3/s ETA 4:56."""
+        eta = self.eta
+        if eta is None:
+            return ''
+        minutes, seconds = divmod(int(eta), 60)
+        hours, minutes = divmod(minutes, 60)
+        eta_str = ('%d:%02d:%02d' % (hours, minutes, seconds) if hours
+                   else '%d:%02d' % (minutes, seconds))
+        return '%.1f/s ETA %s' % (self.rate, eta_str)
+
+
+class _BuildOutput:
+    """Collect the output of a build within bounded memory.
+
+    Only the latest lines and the first failure section are kept for the
+    error report. The failure section starts at a line of _BUILD_FAILURE and
+    ends at the next ninja status. Every line is spooled to the build log if
+    given.
+    """
+
+    _WAITING, _CAPTURING, _CAPTURED = range(3)
+
+    def __init__(self, log_path=None):
+        self._tail = collections.deque(maxlen=_FAILED_OUTPUT_LINE_LIMIT)
+        self._fail_section = collections.deque(
+            maxlen=_FAILED_OUTPUT_LINE_LIMIT)
+        self._state = self._WAITING
+        self.progress = _BuildProgress()
+        self._log = None
+        if log_path:
+            try:
+                os.makedirs(os.path.dirname(log_path), exist_ok=True)
+                self._log = open(log_path, 'a')
+            except OSError as err:
+                logging.debug('Exception raised: %s', err)
+
+    def add(self, line):
+        """Add a line of the build output.
+
+        Args:
+            line: A string of a line of the build output.
+        """
+        if self._log:
+            self._log.write(line)
+        self._tail.append(line)
+        is_status = self.progress.update(line)
+        if self._state == self._CAPTURING and is_status:
+            self._state = self._CAPTURED
+        elif self._state == self._WAITING and line.startswith(_BUILD_FAILURE):
+            self._state = self._CAPTURING
+        if self._state == self._CAPTURING:
+            self._fail_section.append(line)
+
+    @property
+    def fail_section(self):
+        """A list of the lines of the first failure section."""
+        return list(self._fail_section)
+
+    def get_failure_output(self):
+        """Get the output to print of a failed build.
+
+        Returns:
+            A string of the build errors, or the last lines of the output if
+            the errors can't be found.
+        """
+        output = self._fail_section or self._tail
+        return 'Output (may be trimmed):\n%s' % ''.join(output)
+
+    def close(self):
+        """Close the build log."""
+        if self._log:
+            self._log.close()
+            self._log = None
+
+
 def _capture_fail_section(full_log):
     """Return the error message from the build output.
 
     Args:
-        full_log: List of strings representing full output of build.
+        full_log: An iterable of strings representing full output of build.
 
     Returns:
-        capture_output: List of strings that are build errors.
+        capture_output: List of strings that are build errors, up to the
+            last _FAILED_OUTPUT_LINE_LIMIT lines of them.
     """
-    am_capturing = False
-    capture_output = []
+    output = _BuildOutput()
     for line in full_log:
-        if am_capturing and _BUILD_COMPILE_STATUS.match(line):
-            break
-        if am_capturing or line.startswith(_BUILD_FAILURE):
-            capture_output.append(line)
-            am_capturing = True
-            continue
-    return capture_output
+        output.add(line)
+    return output.fail_section
+
+
+def _get_build_failure_output(full_output):
+    """Get the output to print of a failed build.
+
+    Args:
+        full_output: An iterable of strings representing full output of build.
+
+    Returns:
+        A string of the build errors, or the last lines of the output if the
+        errors can't be found.
+    """
+    output = _BuildOutput()
+    for line in full_output:
+        output.add(line)
+    return output.get_failure_output()
+
+
+def _read_output(proc, output, on_line=None):
+    """Read the output of a build process until it exits.
+
+    The lines are read blocking until the process closes its output, so no
+    time is spent polling it.
+
+    Args:
+        proc: A subprocess.Popen instance with the output piped.
+        output: A _BuildOutput instance collecting the lines.
+        on_line: A function called with each line, e.g. to print it.
+    """
+    try:
+        for raw_line in proc.stdout:
+            line = raw_line.decode('utf-8', errors='replace')
+            output.add(line)
+            if on_line:
+                on_line(line)
+    finally:
+        output.close()
+        # Wait for the Popen to finish completely before checking the
+        # returncode.
+        proc.wait()
+
+
+def _run_quiet_output(cmd, env_vars=None, log_path=None):
+    """Runs a given command without printing its output.
 
+    Args:
+        cmd: A list of strings representing the command to run.
+        env_vars: Optional arg. Dict of env vars to set during build.
+        log_path: Optional arg. A string of the file to append the full
+            output to.
+
+    Raises:
+        subprocess.CalledProcessError: When the command exits with a non-0
+            exitcode.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, env=env_vars)
+    output = _BuildOutput(log_path)
+    _read_output(proc, output)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            proc.returncode, cmd, output.get_failure_output())
 
-def _run_limited_output(cmd, env_vars=None):
+
+def _run_limited_output(cmd, env_vars=None, log_path=None):
     """Runs a given command and streams the output on a single line in stdout.
 
+    The line is prefixed by the throughput and the ETA of the build once
+    they're known from the ninja status.
+
     Args:
         cmd: A list of strings representing the command to run.
         env_vars: Optional arg. Dict of env vars to set during build.
+        log_path: Optional arg. A string of the file to append the full
+            output to.
 
     Raises:
         subprocess.CalledProcessError: When the command exits with a non-0
@@ -130,41 +336,32 @@ def _run_limited_output(cmd, env_vars=None):
     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                             stderr=subprocess.STDOUT, env=env_vars)
     sys.stdout.write('\n')
-    term_width, _ = get_terminal_size()
-    white_space = " " * int(term_width)
-    full_output = []
-    while proc.poll() is None:
-        line = proc.stdout.readline().decode('utf-8')
-        # Readline will often return empty strings.
-        if not line:
-            continue
-        full_output.append(line)
-        # Trim the line to the width of the terminal.
-        # Note: Does not handle terminal resizing, which is probably not worth
-        #       checking the width every loop.
-        if len(line) >= term_width:
-            line = line[:term_width - 1]
-        # Clear the last line we outputted.
-        sys.stdout.write('\r%s\r' % white_space)
-        sys.stdout.write('%s' % line.strip())
+    output = _BuildOutput(log_path)
+
+    def _print_line(line):
+        """Replace the last line printed with the line."""
+        # The width is read for every line to follow the terminal resizing.
+        term_width, _ = get_terminal_size()
+        status = output.progress.format_status()
+        line = '%s %s' % (status, line.strip()) if status else line.strip()
+        # Clear the last line we outputted and trim the line to the width
+        # of the terminal.
+        sys.stdout.write('\r%s\r' % (' ' * term_width))
+        sys.stdout.write(line[:term_width - 1])
         sys.stdout.flush()
+
+    _read_output(proc, output, _print_line)
     # Reset stdout (on bash) to remove any custom formatting and newline.
     sys.stdout.write(_BASH_RESET_CODE)
     sys.stdout.flush()
-    # Wait for the Popen to finish completely before checking the returncode.
-    proc.wait()
     if proc.returncode != 0:
         # Parse out the build error to output.
-        output = _capture_fail_section(full_output)
-        if not output:
-            output = full_output
-        if len(output) >= _FAILED_OUTPUT_LINE_LIMIT:
-            output = output[-_FAILED_OUTPUT_LINE_LIMIT:]
-        output = 'Output (may be trimmed):\n%s' % ''.join(output)
-        raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+        raise subprocess.CalledProcessError(
+            proc.returncode, cmd, output.get_failure_output())
 
 
-def build(build_targets, verbose=False, env_vars=None):
+def build(build_targets, verbose=False, env_vars=None, quiet=False,
+          log_path=None):
     """Shell out and make build_targets.
 
     Args:
@@ -172,6 +369,10 @@ def build(build_targets, verbose=False, env_vars=None):
         verbose: Optional arg. If True output is streamed to the console.
                  If False, only the last line of the build output is outputted.
         env_vars: Optional arg. Dict of env vars to set during build.
+        quiet: Optional arg. If True, nothing is outputted unless the build
+               fails, e.g. while tests are running. Overrides verbose.
+        log_path: Optional arg. A string of the file to append the full build
+                  output to, unless the output is streamed to the console.
 
     Returns:
         Boolean of whether build command was successful, True if nothing to
@@ -183,18 +384,23 @@ def build(build_targets, verbose=False, env_vars=None):
     full_env_vars = os.environ.copy()
     if env_vars:
         full_env_vars.update(env_vars)
-    print('\n%s\n%s' % (colorize("Building Dependencies...", constants.CYAN),
-                        ', '.join(build_targets)))
+    if not quiet:
+        print('\n%s\n%s' % (colorize("Building Dependencies...",
+                                     constants.CYAN),
+                            ', '.join(build_targets)))
     logging.debug('Building Dependencies: %s', ' '.join(build_targets))
     cmd = get_build_cmd() + list(build_targets)
     logging.debug('Executing command: %s', cmd)
+    snapshot = build_profiler.NinjaLogSnapshot()
     try:
-        if verbose:
+        if quiet:
+            _run_quiet_output(cmd, env_vars=full_env_vars, log_path=log_path)
+        elif verbose:
             subprocess.check_call(cmd, stderr=subprocess.STDOUT,
                                   env=full_env_vars)
         else:
-            # TODO: Save output to a log file.
-            _run_limited_output(cmd, env_vars=full_env_vars)
+            _run_limited_output(cmd, env_vars=full_env_vars,
+                                log_path=log_path)
         logging.info('Build successful')
         return True
     except subprocess.CalledProcessError as err:
@@ -202,6 +408,11 @@ def build(build_targets, verbose=False, env_vars=None):
         if err.output:
             logging.error(err.output)
         return False
+    finally:
+        phase_tracer.add_span('build', snapshot.start_time, time.time(),
+                              targets=len(build_targets))
+        build_profiler.finish(snapshot, build_targets,
+                              time.time() - snapshot.start_time, quiet=quiet)
 
 
 def _can_upload_to_result_server():
@@ -513,6 +724,7 @@ def get_test_info_cache_path(test_reference, cache_root=TEST_INFO_CACHE_ROOT):
     return os.path.join(cache_root,
                         _get_hashed_file_name(test_reference))
 
+@phase_tracer.traced('cache_store')
 def update_test_info_cache(test_reference, test_infos,
                            cache_root=TEST_INFO_CACHE_ROOT):
     """Update cache content which stores a set of test_info objects through
@@ -539,6 +751,7 @@ def update_test_info_cache(test_reference, test_infos,
             constants.ACCESS_CACHE_FAILURE)
 
 
+@phase_tracer.traced('cache_load')
 def load_test_info_cache(test_reference, cache_root=TEST_INFO_CACHE_ROOT):
     """Load cache by test_reference to a set of test_infos object.
 
@@ -568,6 +781,19 @@ def load_test_info_cache(test_reference, cache_root=TEST_INFO_CACHE_ROOT):
                 constants.ACCESS_CACHE_FAILURE)
     return None
 
+def load_find_index(index_path):
+    """Load an index of the find command, e.g. constants.CLASS_INDEX.
+
+    Args:
+        index_path: A string of the path of the pickled index.
+
+    Returns:
+        A dict of a name to the set of paths found by the name.
+    """
+    with phase_tracer.span('index_read', index=index_path):
+        with open(index_path, 'rb') as index:
+            return pickle.load(index, encoding='utf-8')
+
 def clean_test_info_caches(tests, cache_root=TEST_INFO_CACHE_ROOT):
     """Clean caches of input tests.
 
@@ -586,6 +812,60 @@ def clean_test_info_caches(tests, cache_root=TEST_INFO_CACHE_ROOT):
                 metrics_utils.handle_exc_and_send_exit_event(
                     constants.ACCESS_CACHE_FAILURE)
 
+def _load_test_mapping_dirs(dirs_file):
+    """Load the counts of the directories running tests in TEST_MAPPING.
+
+    Args:
+        dirs_file: Path of the file storing the counts.
+
+    Returns:
+        A dict of directory path to the number of runs.
+    """
+    if not os.path.isfile(dirs_file):
+        return {}
+    try:
+        with open(dirs_file) as json_file:
+            return json.load(json_file)
+    except (ValueError, IOError) as err:
+        logging.debug('Exception raised: %s', err)
+    return {}
+
+def record_test_mapping_dir(path, cache_root=TEST_INFO_CACHE_ROOT):
+    """Count a run of the tests in TEST_MAPPING files of the given directory.
+
+    Args:
+        path: A string of the directory searching TEST_MAPPING files from.
+        cache_root: Folder path for saving caches.
+    """
+    dirs_file = os.path.join(cache_root, _TEST_MAPPING_DIRS_FILE)
+    dir_counts = _load_test_mapping_dirs(dirs_file)
+    dir_counts[path] = dir_counts.get(path, 0) + 1
+    # Only keep the most used directories to bound the file size.
+    dirs = sorted(dir_counts, key=dir_counts.get, reverse=True)
+    dir_counts = {d: dir_counts[d] for d in dirs[:_TEST_MAPPING_DIRS_LIMIT]}
+    try:
+        if not os.path.isdir(cache_root):
+            os.makedirs(cache_root)
+        with open(dirs_file, 'w') as json_file:
+            json.dump(dir_counts, json_file)
+    except IOError as err:
+        logging.debug('Exception raised: %s', err)
+
+def get_frequent_test_mapping_dirs(limit=5, cache_root=TEST_INFO_CACHE_ROOT):
+    """Get the directories that most often run tests in TEST_MAPPING files.
+
+    Args:
+        limit: An integer of the max number of directories to return.
+        cache_root: Folder path for finding caches.
+
+    Returns:
+        A list of existing directories, the most frequently used first.
+    """
+    dir_counts = _load_test_mapping_dirs(
+        os.path.join(cache_root, _TEST_MAPPING_DIRS_FILE))
+    dirs = sorted(dir_counts, key=dir_counts.get, reverse=True)
+    return [d for d in dirs if os.path.isdir(d)][:limit]
+
 def get_modified_files(root_dir):
     """Get the git modified files. The git path here is git top level of
     the root_dir. It's inevitable to utilise different commands to fulfill
@@ -20,6 +20,8 @@
 
 import hashlib
 import os
+import pickle
+import shutil
 import subprocess
 import sys
 import tempfile
@@ -71,6 +73,76 @@ class AtestUtilsUnittests(unittest.TestCase):
         self.assertEqual(want_list,
                          atest_utils._capture_fail_section(test_list))
 
+    def test_run_quiet_output(self):
+        """Test _run_quiet_output prints nothing and raises the errors."""
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            atest_utils._run_quiet_output(['echo', 'built'])
+            with self.assertRaises(subprocess.CalledProcessError) as context:
+                atest_utils._run_quiet_output(
+                    ['sh', '-c', 'echo "[ 1% 1/2] A"; echo "FAILED: B"; '
+                                 'echo "error"; exit 1'])
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertEqual('', capture_output.getvalue())
+        self.assertEqual('Output (may be trimmed):\nFAILED: B\nerror\n',
+                         context.exception.output)
+
+    def test_capture_fail_section_bounded(self):
+        """Test capture_fail_section keeps the last lines of a long section."""
+        test_list = (['FAILED: Error1\n'] +
+                     ['line %d\n' % i for i in range(500)] +
+                     ['[ 6% 191/2997] BBBBBB\n', 'FAILED: Error2\n'])
+        fail_section = atest_utils._capture_fail_section(test_list)
+        self.assertEqual(atest_utils._FAILED_OUTPUT_LINE_LIMIT,
+                         len(fail_section))
+        self.assertEqual('line 499\n', fail_section[-1])
+
+    def test_run_limited_output(self):
+        """Test _run_limited_output spools the output to the build log."""
+        log_dir = tempfile.mkdtemp()
+        log_path = os.path.join(log_dir, 'log', 'build.log')
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            atest_utils._run_limited_output(
+                ['sh', '-c', 'echo "[ 50% 1/2] A"; echo "[100% 2/2] B"'],
+                log_path=log_path)
+            with self.assertRaises(subprocess.CalledProcessError) as context:
+                atest_utils._run_limited_output(
+                    ['sh', '-c', 'echo "FAILED: C"; exit 1'],
+                    log_path=log_path)
+            with open(log_path) as log_file:
+                log = log_file.read()
+        finally:
+            sys.stdout = sys.__stdout__
+            shutil.rmtree(log_dir)
+        self.assertIn('[100% 2/2] B', capture_output.getvalue())
+        self.assertEqual('[ 50% 1/2] A\n[100% 2/2] B\nFAILED: C\n', log)
+        self.assertEqual('Output (may be trimmed):\nFAILED: C\n',
+                         context.exception.output)
+
+    def test_build_progress(self):
+        """Test _BuildProgress estimates the throughput and the ETA."""
+        now = [100]
+        progress = atest_utils._BuildProgress(clock=lambda: now[0])
+        self.assertFalse(progress.update('FAILED: A'))
+        self.assertTrue(progress.update('[  1% 10/1000] A'))
+        self.assertIsNone(progress.eta)
+        self.assertEqual('', progress.format_status())
+        now[0] = 110
+        progress.update('[  6% 60/1010] B')
+        self.assertEqual(5, progress.rate)
+        self.assertEqual(190, progress.eta)
+        self.assertEqual('5.0/s ETA 3:10', progress.format_status())
+        # The throughput is measured over the latest samples only.
+        now[0] = 190
+        progress.update('[ 85% 860/1010] C')
+        now[0] = 200
+        progress.update('[ 95% 960/1010] D')
+        self.assertEqual(10, progress.rate)
+
     def test_is_test_mapping(self):
         """Test method is_test_mapping."""
         tm_option_attributes = [
@@ -380,6 +452,37 @@ class AtestUtilsUnittests(unittest.TestCase):
             self, set([TEST_INFO_A]),
             atest_utils.load_test_info_cache(test_reference, test_cache_dir))
 
+    @mock.patch('phase_tracer.span')
+    def test_load_find_index(self, mock_span):
+        """Test method load_find_index."""
+        index_dir = tempfile.mkdtemp()
+        index_path = os.path.join(index_dir, 'classes.idx')
+        index = {'Foo': {'/path/to/Foo.java', '/path2/to/Foo.kt'}}
+        with open(index_path, 'wb') as index_file:
+            pickle.dump(index, index_file, protocol=2)
+        self.assertEqual(index, atest_utils.load_find_index(index_path))
+        mock_span.assert_called_once_with('index_read', index=index_path)
+        shutil.rmtree(index_dir)
+
+    def test_get_frequent_test_mapping_dirs(self):
+        """Test method record_test_mapping_dir and its getter."""
+        test_cache_dir = tempfile.mkdtemp()
+        dir_a = tempfile.mkdtemp()
+        dir_b = tempfile.mkdtemp()
+        self.assertEqual(
+            [], atest_utils.get_frequent_test_mapping_dirs(
+                cache_root=test_cache_dir))
+        atest_utils.record_test_mapping_dir(dir_a, test_cache_dir)
+        atest_utils.record_test_mapping_dir(dir_b, test_cache_dir)
+        atest_utils.record_test_mapping_dir(dir_b, test_cache_dir)
+        atest_utils.record_test_mapping_dir('/not/exist', test_cache_dir)
+        self.assertEqual(
+            [dir_b, dir_a], atest_utils.get_frequent_test_mapping_dirs(
+                cache_root=test_cache_dir))
+        self.assertEqual(
+            [dir_b], atest_utils.get_frequent_test_mapping_dirs(
+                limit=1, cache_root=test_cache_dir))
+
     @mock.patch('os.getcwd')
     def test_get_build_cmd(self, mock_cwd):
         """Test method get_build_cmd."""
@@ -0,0 +1,314 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Store the benchmark results of the runs and detect the regressions locally.
+
+The repetitions of each gbenchmark reported in PerfInfo are saved in the
+result folder of the run, along with the lunch target and the device they ran
+on. A run can be saved as the baseline of its lunch target and device, and
+the later runs compared against it with a Mann-Whitney U test, so a
+benchmark is flagged only if it's significantly slower than the baseline.
+"""
+
+from __future__ import print_function
+
+import collections
+import json
+import logging
+import math
+import os
+
+import atest_utils
+import constants
+import result_reporter
+
+BENCHMARK_RESULT_NAME = 'benchmark.json'
+BENCHMARK_DIFF_NAME = 'benchmark_diff.json'
+BASELINE_ROOT = os.path.join(constants.ATEST_RESULT_ROOT, 'benchmark_baseline')
+# The p-value below which a change is significant.
+SIGNIFICANCE_LEVEL = 0.05
+# The smallest change worth flagging, i.e. 5% slower than the baseline.
+MIN_CHANGE = 0.05
+# The fewest repetitions per run which can make a change significant.
+MIN_REPETITIONS = 4
+METRICS = ('real_time', 'cpu_time')
+_ITERATION_RUN_TYPE = 'iteration'
+_UNKNOWN = 'unknown'
+_NS_PER_UNIT = {'ns': 1, 'us': 1000, 'ms': 1000000, 's': 1000000000}
+_TARGET_PRODUCT_ENV = 'TARGET_PRODUCT'
+_TARGET_BUILD_VARIANT_ENV = 'TARGET_BUILD_VARIANT'
+_ENVIRONMENT_KEY = 'environment'
+_BENCHMARKS_KEY = 'benchmarks'
+_TARGET_KEY = 'target'
+_DEVICE_KEY = 'device'
+
+# The comparison of a metric of a benchmark, where baseline and current are
+# the medians in nanoseconds, change is relative to the baseline, p_value is
+# None if either run has fewer than MIN_REPETITIONS repetitions and regressed
+# is True if the benchmark is significantly slower.
+BenchmarkDiff = collections.namedtuple(
+    'BenchmarkDiff', ['name', 'metric', 'baseline', 'current', 'change',
+                      'p_value', 'regressed'])
+
+
+def get_samples(perf_info):
+    """Get the repetitions of the benchmarks.
+
+    Args:
+        perf_info: A list of benchmark_info of PerfInfo.
+
+    Returns:
+        A dict of module_name:benchmark_name to a dict of metric to a list of
+        the times of its repetitions in nanoseconds, as reported rather than
+        truncated for the summary. The aggregates, e.g. the mean of the
+        repetitions, are excluded.
+    """
+    samples = collections.OrderedDict()
+    for info in perf_info:
+        if info.get('run_type') != _ITERATION_RUN_TYPE:
+            continue
+        name = '%s:%s' % (info['test_name'].split('#')[0], info['run_name'])
+        ns_per_unit = _NS_PER_UNIT.get(info.get('time_unit'), 1)
+        metrics = samples.setdefault(name, {metric: [] for metric in METRICS})
+        raw_times = info.get(result_reporter.RAW_TIMES_KEY, info)
+        for metric in METRICS:
+            try:
+                metrics[metric].append(float(raw_times[metric]) * ns_per_unit)
+            except (KeyError, ValueError) as err:
+                logging.debug('Exception raised: %s', err)
+    return samples
+
+
+def get_environment(serial=None):
+    """Get the lunch target and the device the benchmarks ran on.
+
+    Args:
+        serial: A string of the serial of the device, None if not given.
+
+    Returns:
+        A dict of the target and the device.
+    """
+    target = '-'.join(filter(None, (os.environ.get(_TARGET_PRODUCT_ENV),
+                                    os.environ.get(_TARGET_BUILD_VARIANT_ENV))))
+    device = serial or os.environ.get(constants.ANDROID_SERIAL)
+    return {_TARGET_KEY: target or _UNKNOWN, _DEVICE_KEY: device or _UNKNOWN}
+
+
+def get_baseline_path(environment):
+    """Get the path of the baseline of a lunch target and a device."""
+    return os.path.join(BASELINE_ROOT, environment[_TARGET_KEY],
+                        '%s.json' % environment[_DEVICE_KEY])
+
+
+def save(path, samples, environment):
+    """Save the benchmark results of a run.
+
+    Args:
+        path: A string of the file path.
+        samples: A dict of the repetitions, see get_samples.
+        environment: A dict of the lunch target and the device.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as result_file:
+        json.dump({_ENVIRONMENT_KEY: environment, _BENCHMARKS_KEY: samples},
+                  result_file, indent=1)
+
+
+def load(path):
+    """Load the benchmark results of a run.
+
+    Args:
+        path: A string of the file path or the result folder of a run.
+
+    Returns:
+        A dict of the environment and the benchmarks, None if not found.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, BENCHMARK_RESULT_NAME)
+    try:
+        with open(path) as result_file:
+            return json.load(result_file)
+    except (IOError, ValueError) as err:
+        logging.debug('Exception raised: %s', err)
+    return None
+
+
+def mann_whitney_u(samples_a, samples_b):
+    """Test whether two samples are from the same distribution.
+
+    Uses the normal approximation of the U statistic with the tie and the
+    continuity corrections, which is close to the exact test already for 4
+    repetitions per sample.
+
+    Args:
+        samples_a: A list of numbers.
+        samples_b: A list of numbers.
+
+    Returns:
+        The two-sided p-value.
+    """
+    n_a, n_b = len(samples_a), len(samples_b)
+    ranked = sorted([(value, 0) for value in samples_a] +
+                    [(value, 1) for value in samples_b])
+    rank_sum_a = 0
+    tie_term = 0
+    start = 0
+    while start < len(ranked):
+        end = start
+        while end < len(ranked) and ranked[end][0] == ranked[start][0]:
+            end += 1
+        # The tied values share the average of their ranks.
+        rank = (start + end + 1) / 2
+        rank_sum_a += rank * sum(1 for _, group in ranked[start:end]
+                                 if group == 0)
+        ties = end - start
+        tie_term += ties ** 3 - ties
+        start = end
+    u_a = rank_sum_a - n_a * (n_a + 1) / 2
+    total = n_a + n_b
+    variance = n_a * n_b / 12 * (
+        total + 1 - tie_term / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0
+    z = max(abs(u_a - n_a * n_b / 2) - 0.5, 0) / math.sqrt(variance)
+    return math.erfc(z / math.sqrt(2))
+
+
+def _median(values):
+    """Get the median of a list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def compare(baseline, current):
+    """Compare the benchmarks of a run against the baseline.
+
+    Args:
+        baseline: A dict of the repetitions of the baseline.
+        current: A dict of the repetitions of the run.
+
+    Returns:
+        A list of BenchmarkDiff of the benchmarks in both runs.
+    """
+    diffs = []
+    for name, metrics in current.items():
+        for metric in METRICS:
+            base_samples = baseline.get(name, {}).get(metric)
+            samples = metrics.get(metric)
+            if not base_samples or not samples:
+                continue
+            base_median = _median(base_samples)
+            median = _median(samples)
+            change = (median - base_median) / base_median if base_median else 0
+            p_value = None
+            if min(len(base_samples), len(samples)) >= MIN_REPETITIONS:
+                p_value = mann_whitney_u(base_samples, samples)
+            regressed = (p_value is not None and p_value < SIGNIFICANCE_LEVEL
+                         and change > MIN_CHANGE)
+            diffs.append(BenchmarkDiff(name, metric, base_median, median,
+                                       change, p_value, regressed))
+    return diffs
+
+
+def print_diffs(diffs):
+    """Print the comparison, highlighting the regressions."""
+    header = 'Benchmark comparison (baseline, current, change, p-value)'
+    print(atest_utils.delimiter('-', len(header), prenl=1))
+    print(header)
+    print(atest_utils.delimiter('-', len(header)))
+    for diff in diffs:
+        change = '%+.1f%%' % (diff.change * 100)
+        if diff.regressed:
+            change = atest_utils.colorize(change, constants.RED)
+        print('{:>14.0f}ns {:>14.0f}ns {:>8} {:>7} {} ({})'.format(
+            diff.baseline, diff.current, change,
+            '-' if diff.p_value is None else '%.3f' % diff.p_value,
+            diff.name, diff.metric))
+    regressions = sum(1 for diff in diffs if diff.regressed)
+    if regressions:
+        atest_utils.colorful_print(
+            '%d benchmark regression(s) found.' % regressions, constants.RED)
+    if any(diff.p_value is None for diff in diffs):
+        print('Run the benchmarks with at least %d repetitions to detect the '
+              'regressions.' % MIN_REPETITIONS)
+
+
+def save_diffs(path, diffs, baseline_environment, environment):
+    """Save the comparison as JSON.
+
+    Args:
+        path: A string of the file path.
+        diffs: A list of BenchmarkDiff.
+        baseline_environment: A dict of the environment of the baseline.
+        environment: A dict of the environment of the run.
+    """
+    with open(path, 'w') as diff_file:
+        json.dump({'baseline': baseline_environment,
+                   'current': environment,
+                   _BENCHMARKS_KEY: [diff._asdict() for diff in diffs]},
+                  diff_file, indent=1)
+
+
+def process_run(results_dir, perf_info, serial=None, save_baseline=False,
+                compare_to=None):
+    """Store the benchmarks of a run and compare them against a baseline.
+
+    Args:
+        results_dir: A string of the result folder of the run.
+        perf_info: A list of benchmark_info of PerfInfo.
+        serial: A string of the serial of the device, None if not given.
+        save_baseline: True to save the run as the baseline of its lunch
+            target and device.
+        compare_to: A string of the path of the benchmark results or the
+            result folder to compare against, '' for the saved baseline of
+            the lunch target and device, None not to compare.
+
+    Returns:
+        EXIT_CODE_TEST_FAILURE if a benchmark regressed, EXIT_CODE_SUCCESS
+        otherwise.
+    """
+    samples = get_samples(perf_info)
+    if not samples:
+        if save_baseline or compare_to is not None:
+            print('No benchmark result found in the run.')
+        return constants.EXIT_CODE_SUCCESS
+    environment = get_environment(serial)
+    save(os.path.join(results_dir, BENCHMARK_RESULT_NAME), samples,
+         environment)
+    exit_code = constants.EXIT_CODE_SUCCESS
+    if compare_to is not None:
+        baseline_path = compare_to or get_baseline_path(environment)
+        baseline = load(baseline_path)
+        if baseline is None:
+            atest_utils.colorful_print(
+                'No benchmark baseline found in %s.' % baseline_path,
+                constants.YELLOW)
+        else:
+            diffs = compare(baseline.get(_BENCHMARKS_KEY, {}), samples)
+            print_diffs(diffs)
+            diff_path = os.path.join(results_dir, BENCHMARK_DIFF_NAME)
+            save_diffs(diff_path, diffs, baseline.get(_ENVIRONMENT_KEY),
+                       environment)
+            print('Benchmark diff: %s' % diff_path)
+            if any(diff.regressed for diff in diffs):
+                exit_code = constants.EXIT_CODE_TEST_FAILURE
+    if save_baseline:
+        baseline_path = get_baseline_path(environment)
+        save(baseline_path, samples, environment)
+        print('Saved the benchmark baseline to %s.' % baseline_path)
+    return exit_code
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for benchmark_store."""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from io import StringIO
+from unittest import mock
+
+import benchmark_store
+import constants
+
+
+def _create_perf_info(real_times, run_name='BM_a', time_unit='ns'):
+    """Create the benchmark_info of the repetitions of a benchmark."""
+    perf_info = [{'test_name': 'someModule#%s' % run_name,
+                  'name': run_name, 'run_name': run_name,
+                  'run_type': 'iteration', 'time_unit': time_unit,
+                  'real_time': str(real_time), 'cpu_time': str(real_time),
+                  'iterations': '1000', 'repetition_index': str(index)}
+                 for index, real_time in enumerate(real_times)]
+    # The aggregates of the repetitions are excluded.
+    perf_info.append(dict(perf_info[0], name=run_name + '_mean',
+                          run_type='aggregate'))
+    return perf_info
+
+
+class BenchmarkStoreUnittests(unittest.TestCase):
+    """Unit tests for benchmark_store.py"""
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_get_samples(self):
+        """Test get_samples method."""
+        self.assertEqual(
+            {'someModule:BM_a': {'real_time': [1000, 2000],
+                                 'cpu_time': [1000, 2000]}},
+            benchmark_store.get_samples(
+                _create_perf_info([1, 2], time_unit='us')))
+        perf_info = _create_perf_info([1, 2], time_unit='us')
+        for info, raw_time in zip(perf_info, ['1.25', '1.5']):
+            info['raw_times'] = {'real_time': raw_time, 'cpu_time': raw_time}
+        self.assertEqual(
+            {'someModule:BM_a': {'real_time': [1250, 1500],
+                                 'cpu_time': [1250, 1500]}},
+            benchmark_store.get_samples(perf_info))
+
+    @mock.patch.dict('os.environ', {'TARGET_PRODUCT': 'aosp_x86',
+                                    'TARGET_BUILD_VARIANT': 'eng'},
+                     clear=True)
+    def test_get_environment(self):
+        """Test get_environment method."""
+        self.assertEqual({'target': 'aosp_x86-eng', 'device': 'serial1'},
+                         benchmark_store.get_environment('serial1'))
+        self.assertEqual('unknown',
+                         benchmark_store.get_environment()['device'])
+
+    def test_mann_whitney_u(self):
+        """Test mann_whitney_u method."""
+        self.assertLess(benchmark_store.mann_whitney_u([1, 2, 3, 4],
+                                                       [5, 6, 7, 8]), 0.05)
+        self.assertGreater(benchmark_store.mann_whitney_u([1, 3, 5, 7],
+                                                          [2, 4, 6, 8]), 0.5)
+        # Three repetitions can't make a significant difference.
+        self.assertGreater(benchmark_store.mann_whitney_u([1, 2, 3],
+                                                          [4, 5, 6]), 0.05)
+        self.assertEqual(1.0, benchmark_store.mann_whitney_u([1, 1], [1, 1]))
+
+    def test_compare(self):
+        """Test compare method flags the significant slowdowns only."""
+        baseline = {'A': {'real_time': [100, 101, 102, 103]},
+                    'B': {'real_time': [100, 101, 102, 103]},
+                    'C': {'real_time': [100]},
+                    'E': {'real_time': [100, 101, 102]}}
+        current = {'A': {'real_time': [120, 121, 122, 123]},
+                   'B': {'real_time': [90, 91, 92, 93]},
+                   'C': {'real_time': [200]},
+                   'D': {'real_time': [100]},
+                   'E': {'real_time': [200, 201, 202]}}
+        diffs = {diff.name: diff for diff in
+                 benchmark_store.compare(baseline, current)}
+        self.assertEqual(['A', 'B', 'C', 'E'], sorted(diffs))
+        self.assertTrue(diffs['A'].regressed)
+        self.assertEqual(20 / 101.5, diffs['A'].change)
+        self.assertFalse(diffs['B'].regressed)
+        self.assertIsNone(diffs['C'].p_value)
+        self.assertFalse(diffs['C'].regressed)
+        # Fewer than MIN_REPETITIONS repetitions can't be significant.
+        self.assertIsNone(diffs['E'].p_value)
+
+    @mock.patch.dict('os.environ', {'TARGET_PRODUCT': 'aosp_x86'}, clear=True)
+    def test_process_run(self):
+        """Test process_run method saves the run, the baseline and the diff."""
+        baseline_root = os.path.join(self.results_dir, 'baseline')
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            with mock.patch('benchmark_store.BASELINE_ROOT', baseline_root):
+                self.assertEqual(constants.EXIT_CODE_SUCCESS,
+                                 benchmark_store.process_run(
+                                     self.results_dir,
+                                     _create_perf_info([10, 11, 12, 13]),
+                                     save_baseline=True))
+                self.assertTrue(os.path.isfile(os.path.join(
+                    baseline_root, 'aosp_x86', 'unknown.json')))
+                self.assertEqual(constants.EXIT_CODE_TEST_FAILURE,
+                                 benchmark_store.process_run(
+                                     self.results_dir,
+                                     _create_perf_info([20, 21, 22, 23]),
+                                     compare_to=''))
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertIn('2 benchmark regression', capture_output.getvalue())
+        self.assertEqual(
+            [20, 21, 22, 23],
+            benchmark_store.load(self.results_dir)['benchmarks'][
+                'someModule:BM_a']['real_time'])
+        with open(os.path.join(self.results_dir, 'benchmark_diff.json')) as f:
+            diff = json.load(f)
+        self.assertEqual({'target': 'aosp_x86', 'device': 'unknown'},
+                         diff['baseline'])
+        self.assertEqual([True, True], [benchmark['regressed'] for benchmark
+                                        in diff['benchmarks']])
+
+
+if __name__ == '__main__':
+    unittest.main()
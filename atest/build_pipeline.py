@@ -0,0 +1,141 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Build the tests in stages and run the tests of each stage once it's built.
+
+The build targets are grouped per TestInfo into stages, which are built one
+after another in a background thread, since the builds of an out directory
+can't run at the same time. The tests of a stage run while the next stages
+are being built.
+"""
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+# Each stage is a build invocation paying the startup of the build system,
+# so the tests left are merged into the last stage.
+MAX_STAGES = 4
+
+# The build targets of a stage and the TestInfos which can run once they're
+# built.
+BuildStage = collections.namedtuple('BuildStage', ['targets', 'test_infos'])
+
+
+def plan_stages(test_infos, common_targets, max_stages=MAX_STAGES):
+    """Group the build targets per TestInfo into stages.
+
+    The first stage builds the targets needed by all tests, e.g. the test
+    runners. The TestInfos needing the fewest targets not built yet come
+    first, so the first tests start as early as possible, and the TestInfos
+    whose targets are built by then run in the same stage.
+
+    Args:
+        test_infos: A list of TestInfos.
+        common_targets: A set of strings of the targets needed by all tests.
+        max_stages: An integer of the maximum number of stages.
+
+    Returns:
+        A list of BuildStage.
+    """
+    stages = []
+    planned = set(common_targets)
+    pending = sorted(test_infos, key=lambda x: x.test_name)
+    while pending:
+        if len(stages) == max_stages - 1:
+            ready = pending
+        else:
+            first = min(pending,
+                        key=lambda x: len(x.build_targets - planned))
+            available = planned | first.build_targets
+            ready = [x for x in pending if x.build_targets <= available]
+        targets = set() if stages else set(common_targets)
+        for info in ready:
+            targets |= info.build_targets - planned
+        planned |= targets
+        stages.append(BuildStage(targets, ready))
+        pending = [x for x in pending if x not in ready]
+    if not stages:
+        stages.append(BuildStage(set(common_targets), []))
+    return stages
+
+
+class BuildPipeline:
+    """Iterate over the TestInfos of the stages as soon as they're built.
+
+    The stages are built in a background thread, which stops building once a
+    stage fails to build or the iteration stops, e.g. after a test failure.
+    """
+
+    def __init__(self, stages, build_func):
+        """BuildPipeline constructor
+
+        Args:
+            stages: A list of BuildStage.
+            build_func: A function of a set of build targets and whether to
+                build quietly, i.e. while tests are running, which returns
+                True if the build succeeds.
+        """
+        self.stages = stages
+        self._build_func = build_func
+        self._stopped = threading.Event()
+        self.success = True
+        self.build_secs = 0
+
+    def _build(self, built):
+        """Build the stages and put the index of each stage built to the queue.
+
+        Args:
+            built: A Queue of the indexes, where None marks the end.
+        """
+        try:
+            for index, stage in enumerate(self.stages):
+                if self._stopped.is_set():
+                    return
+                start = time.time()
+                success = self._build_func(stage.targets, index > 0)
+                self.build_secs += time.time() - start
+                if not success:
+                    self.success = False
+                    return
+                built.put(index)
+        # The error of the build is reported as a failed build by the thread
+        # running the tests, so nothing raised here is lost.
+        except Exception:  # pylint: disable=broad-except
+            logging.debug('Caught exception:', exc_info=1)
+            self.success = False
+        finally:
+            built.put(None)
+
+    def __iter__(self):
+        """Yield the TestInfos of each stage once its targets are built."""
+        built = queue.Queue()
+        builder = threading.Thread(target=self._build, args=(built,),
+                                   daemon=True)
+        builder.start()
+        try:
+            while True:
+                index = built.get()
+                if index is None:
+                    return
+                logging.debug('Built stage %d of %d.', index + 1,
+                              len(self.stages))
+                yield self.stages[index].test_infos
+        finally:
+            self._stopped.set()
+            # Wait for the stage being built so no build outlives atest.
+            builder.join()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for build_pipeline."""
+
+# pylint: disable=protected-access
+
+import threading
+import unittest
+
+import build_pipeline
+
+from test_finders import test_info
+
+RUNNER_NAME = 'AtestTradefedTestRunner'
+INFO_A = test_info.TestInfo('A', RUNNER_NAME, {'a', 'shared'})
+INFO_B = test_info.TestInfo('B', RUNNER_NAME, {'b1', 'b2', 'b3'})
+INFO_C = test_info.TestInfo('C', RUNNER_NAME, {'shared'})
+INFO_D = test_info.TestInfo('D', RUNNER_NAME, {'d1', 'd2'})
+
+
+class PlanStagesUnittests(unittest.TestCase):
+    """Unit tests for plan_stages in build_pipeline.py"""
+
+    def test_plan_stages(self):
+        """Test the tests needing the fewest targets are built first."""
+        stages = build_pipeline.plan_stages(
+            [INFO_D, INFO_B, INFO_A, INFO_C], {'runner'})
+        self.assertEqual(
+            [({'runner', 'shared'}, ['C']), ({'a'}, ['A']),
+             ({'d1', 'd2'}, ['D']), ({'b1', 'b2', 'b3'}, ['B'])],
+            [(stage.targets, [x.test_name for x in stage.test_infos])
+             for stage in stages])
+
+    def test_plan_stages_max_stages(self):
+        """Test the tests left are merged into the last stage."""
+        stages = build_pipeline.plan_stages(
+            [INFO_D, INFO_B, INFO_A, INFO_C], {'runner'}, max_stages=2)
+        self.assertEqual(
+            [({'runner', 'shared'}, ['C']),
+             ({'a', 'b1', 'b2', 'b3', 'd1', 'd2'}, ['A', 'B', 'D'])],
+            [(stage.targets, [x.test_name for x in stage.test_infos])
+             for stage in stages])
+
+    def test_plan_stages_without_tests(self):
+        """Test the common targets are built without tests."""
+        self.assertEqual([build_pipeline.BuildStage({'runner'}, [])],
+                         build_pipeline.plan_stages([], {'runner'}))
+
+
+class BuildPipelineUnittests(unittest.TestCase):
+    """Unit tests for BuildPipeline in build_pipeline.py"""
+
+    def setUp(self):
+        self.stages = build_pipeline.plan_stages([INFO_A, INFO_B, INFO_D],
+                                                 {'runner'})
+        self.builds = []
+
+    def _build_func(self, targets, quiet):
+        """Record the build."""
+        self.builds.append((targets, quiet))
+        return 'd1' not in targets
+
+    def test_iter(self):
+        """Test the tests of each stage are yielded once it's built."""
+        stages = [self.stages[0], self.stages[2]]
+        pipeline = build_pipeline.BuildPipeline(stages, self._build_func)
+        for index, test_infos in enumerate(pipeline):
+            self.assertEqual(stages[index].test_infos, test_infos)
+            # The stage is built before its tests run.
+            self.assertEqual(stages[index].targets, self.builds[index][0])
+        self.assertEqual([False, True], [quiet for _, quiet in self.builds])
+        self.assertTrue(pipeline.success)
+        self.assertGreaterEqual(pipeline.build_secs, 0)
+
+    def test_iter_build_failure(self):
+        """Test no more stage is yielded once a stage fails to build."""
+        pipeline = build_pipeline.BuildPipeline(self.stages,
+                                                self._build_func)
+        self.assertEqual([[INFO_A]], list(pipeline))
+        self.assertEqual(2, len(self.builds))
+        self.assertFalse(pipeline.success)
+
+    def test_iter_build_exception(self):
+        """Test the pipeline fails if the build raises an exception."""
+        def _build_func(_targets, _quiet):
+            raise OSError('build not found')
+
+        pipeline = build_pipeline.BuildPipeline(self.stages, _build_func)
+        self.assertEqual([], list(pipeline))
+        self.assertFalse(pipeline.success)
+
+    def test_iter_stop(self):
+        """Test no more stage is built once the iteration stops."""
+        building = threading.Event()
+        pipeline = None
+
+        def _build_func(targets, quiet):
+            self.builds.append(targets)
+            if quiet:
+                building.set()
+                # Keep building until the iteration stops.
+                pipeline._stopped.wait(5)
+            return True
+
+        pipeline = build_pipeline.BuildPipeline(self.stages, _build_func)
+        stages = iter(pipeline)
+        self.assertEqual([INFO_A], next(stages))
+        building.wait(5)
+        stages.close()
+        # The stage being built when the iteration stops is finished.
+        self.assertEqual(2, len(self.builds))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Attribute the time of a build to its edges from the ninja log.
+
+Ninja appends an entry to $OUT_DIR/.ninja_log for each edge it runs:
+    <start ms>\t<end ms>\t<output mtime>\t<output path>\t<command hash>
+where the times are relative to the start of ninja. The entries appended
+during a build are read from the size of the log before the build, or from
+the mtimes of the outputs if ninja recompacted the log, and reported as the
+slowest edges and the critical path of the build.
+"""
+
+from __future__ import print_function
+
+import bisect
+import collections
+import logging
+import os
+import time
+
+import constants
+
+from metrics import metrics
+
+NINJA_LOG_NAME = '.ninja_log'
+# The builds shorter than this are not worth reporting.
+REPORT_THRESHOLD_SECS = 60
+TOP_N = 5
+_DEFAULT_OUT_DIR = 'out'
+# Output mtimes above this are in nanoseconds, in seconds otherwise.
+_NS_MTIME_THRESHOLD = 10 ** 12
+_NINJA_LOG_FIELDS = 5
+
+# The profiles of the builds of this atest run, see AtestExecutionInfo.
+PROFILES = []
+
+# An edge of the build, where start and end are in milliseconds since ninja
+# started and outputs is a list of the output paths.
+Edge = collections.namedtuple('Edge', ['start', 'end', 'outputs'])
+# The profile of a build, where wall_time and edge_time, i.e. the sum of the
+# durations of the edges, are in milliseconds, and top_edges and
+# critical_path are lists of Edge, from the slowest and in build order.
+BuildProfile = collections.namedtuple(
+    'BuildProfile', ['targets', 'wall_time', 'edge_time', 'edge_count',
+                     'top_edges', 'critical_path'])
+
+
+def get_ninja_log_path():
+    """Get the path of the ninja log of the build."""
+    out_dir = os.environ.get(constants.ANDROID_OUT_DIR, _DEFAULT_OUT_DIR)
+    if not os.path.isabs(out_dir):
+        out_dir = os.path.join(os.environ.get(constants.ANDROID_BUILD_TOP,
+                                              os.getcwd()), out_dir)
+    return os.path.join(out_dir, NINJA_LOG_NAME)
+
+
+def _duration(edge):
+    """Get the duration of an edge in milliseconds."""
+    return edge.end - edge.start
+
+
+class NinjaLogSnapshot:
+    """The state of the ninja log before a build, to read its new entries."""
+
+    def __init__(self, path=None):
+        """NinjaLogSnapshot constructor
+
+        Args:
+            path: A string of the ninja log path, the one of the build if
+                None.
+        """
+        self.path = path or get_ninja_log_path()
+        self.start_time = time.time()
+        try:
+            stat = os.stat(self.path)
+            self._inode, self._offset = stat.st_ino, stat.st_size
+        except OSError:
+            self._inode, self._offset = None, 0
+
+    def _read_lines(self):
+        """Read the lines of the ninja log written since the snapshot."""
+        try:
+            stat = os.stat(self.path)
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+            return [], False
+        # Ninja rewrites the log to a new file when it recompacts it.
+        recompacted = (stat.st_ino != self._inode
+                       or stat.st_size < self._offset)
+        with open(self.path, errors='replace') as log_file:
+            if not recompacted:
+                log_file.seek(self._offset)
+            return log_file.readlines(), recompacted
+
+    def read_edges(self):
+        """Read the edges run since the snapshot.
+
+        Returns:
+            A list of Edge, where the outputs of an edge are merged.
+        """
+        lines, recompacted = self._read_lines()
+        edges = collections.OrderedDict()
+        for line in lines:
+            fields = line.rstrip('\n').split('\t')
+            if line.startswith('#') or len(fields) != _NINJA_LOG_FIELDS:
+                continue
+            try:
+                start, end, mtime = (int(field) for field in fields[:3])
+            except ValueError:
+                continue
+            if recompacted and not self._is_built_since(mtime):
+                continue
+            # An edge of multiple outputs has an entry per output.
+            edge = edges.setdefault((start, end, fields[4]),
+                                    Edge(start, end, []))
+            edge.outputs.append(fields[3])
+        return list(edges.values())
+
+    def _is_built_since(self, mtime):
+        """Check whether an output mtime is after the snapshot."""
+        if mtime > _NS_MTIME_THRESHOLD:
+            mtime /= 10 ** 9
+        return mtime >= int(self.start_time)
+
+
+def get_critical_path(edges):
+    """Estimate the critical path of a build from the timings of its edges.
+
+    The ninja log doesn't have the dependencies, so the path is walked back
+    from the last edge, taking as the dependency of an edge the one that
+    finished last before it started.
+
+    Args:
+        edges: A list of Edge.
+
+    Returns:
+        A list of Edge in build order.
+    """
+    if not edges:
+        return []
+    by_end = sorted(edges, key=lambda edge: edge.end)
+    ends = [edge.end for edge in by_end]
+    path = [by_end[-1]]
+    # The number of the edges which finished before the last edge started,
+    # the edges of the path excluded.
+    candidates = bisect.bisect_right(ends, path[-1].start, 0, len(by_end) - 1)
+    while candidates:
+        path.append(by_end[candidates - 1])
+        candidates = bisect.bisect_right(ends, path[-1].start, 0,
+                                         candidates - 1)
+    return path[::-1]
+
+
+def profile(snapshot, targets=(), top_n=TOP_N):
+    """Profile the build run since the snapshot.
+
+    Args:
+        snapshot: A NinjaLogSnapshot taken before the build.
+        targets: A list of the build targets.
+        top_n: An integer of the number of the slowest edges to keep.
+
+    Returns:
+        A BuildProfile, None if no edge ran.
+    """
+    edges = snapshot.read_edges()
+    if not edges:
+        return None
+    return BuildProfile(
+        targets=list(targets),
+        wall_time=max(e.end for e in edges) - min(e.start for e in edges),
+        edge_time=sum(_duration(edge) for edge in edges),
+        edge_count=len(edges),
+        top_edges=sorted(edges, key=_duration, reverse=True)[:top_n],
+        critical_path=get_critical_path(edges))
+
+
+def to_dict(build_profile):
+    """Convert a BuildProfile to a dict to save in the test result."""
+    def _edge_dict(edge):
+        return {'duration': _duration(edge), 'outputs': edge.outputs}
+    return {'targets': build_profile.targets,
+            'wall_time': build_profile.wall_time,
+            'edge_time': build_profile.edge_time,
+            'edge_count': build_profile.edge_count,
+            'top_edges': [_edge_dict(edge) for edge in build_profile.top_edges],
+            'critical_path_time': sum(_duration(edge) for edge
+                                      in build_profile.critical_path),
+            'critical_path': [_edge_dict(edge) for edge
+                              in build_profile.critical_path]}
+
+
+def _format_edge(edge):
+    """Format the duration and the output of an edge."""
+    outputs = edge.outputs[0]
+    if len(edge.outputs) > 1:
+        outputs += ' (+%d)' % (len(edge.outputs) - 1)
+    return '{:>9.1f}s  {}'.format(_duration(edge) / 1000, outputs)
+
+
+def print_report(build_profile, top_n=TOP_N):
+    """Print the slowest edges and the critical path of a build.
+
+    Args:
+        build_profile: A BuildProfile.
+        top_n: An integer of the number of the edges to print per section.
+    """
+    path_time = sum(_duration(edge) for edge in build_profile.critical_path)
+    print('\nBuild time attribution (%s):' % NINJA_LOG_NAME)
+    print('  %d edges, %.1fs of edge time in %.1fs, parallelism %.1f' % (
+        build_profile.edge_count, build_profile.edge_time / 1000,
+        build_profile.wall_time / 1000,
+        build_profile.edge_time / max(build_profile.wall_time, 1)))
+    print('  Slowest edges:')
+    for edge in build_profile.top_edges[:top_n]:
+        print('  ' + _format_edge(edge))
+    print('  Critical path: %.1fs over %d edges, the slowest of them:' % (
+        path_time / 1000, len(build_profile.critical_path)))
+    for edge in sorted(build_profile.critical_path, key=_duration,
+                       reverse=True)[:top_n]:
+        print('  ' + _format_edge(edge))
+
+
+def finish(snapshot, targets, elapsed_secs, quiet=False):
+    """Profile a finished build, record it and report it if it's slow.
+
+    Args:
+        snapshot: A NinjaLogSnapshot taken before the build.
+        targets: A list of the build targets.
+        elapsed_secs: A float of the wall time of the build in seconds.
+        quiet: True not to print the report.
+
+    Returns:
+        A BuildProfile, None if no edge ran.
+    """
+    try:
+        build_profile = profile(snapshot, targets)
+    except (IOError, OSError) as err:
+        logging.debug('Exception raised: %s', err)
+        return None
+    if not build_profile:
+        return None
+    PROFILES.append(build_profile)
+    metrics.LocalDetectEvent(
+        detect_type=constants.DETECT_TYPE_BUILD_CRITICAL_PATH_MS,
+        result=sum(_duration(edge) for edge in build_profile.critical_path))
+    metrics.LocalDetectEvent(
+        detect_type=constants.DETECT_TYPE_BUILD_EDGE_TIME_MS,
+        result=build_profile.edge_time)
+    if not quiet and elapsed_secs >= REPORT_THRESHOLD_SECS:
+        print_report(build_profile)
+    return build_profile
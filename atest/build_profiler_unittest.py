@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for build_profiler."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from io import StringIO
+from unittest import mock
+
+import build_profiler
+import constants
+
+from build_profiler import Edge
+
+OLD_LOG = '# ninja log v5\n0\t50\t1\tout/old\taaa\n'
+# a and b run in parallel, c depends on a, and d has two outputs.
+NEW_ENTRIES = ('0\t100\t%(mtime)d\tout/a\th1\n'
+               '0\t30\t%(mtime)d\tout/b\th2\n'
+               '100\t400\t%(mtime)d\tout/c\th3\n'
+               '400\t450\t%(mtime)d\tout/d1\th4\n'
+               '400\t450\t%(mtime)d\tout/d2\th4\n')
+
+
+class BuildProfilerUnittests(unittest.TestCase):
+    """Unit tests for build_profiler.py"""
+
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.out_dir, '.ninja_log')
+        with open(self.log_path, 'w') as log_file:
+            log_file.write(OLD_LOG)
+        build_profiler.PROFILES[:] = []
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+        build_profiler.PROFILES[:] = []
+
+    def _append_entries(self):
+        """Append the entries of a build to the ninja log."""
+        with open(self.log_path, 'a') as log_file:
+            log_file.write(NEW_ENTRIES % {'mtime': time.time() * 10 ** 9})
+
+    def test_get_ninja_log_path(self):
+        """Test get_ninja_log_path method."""
+        with mock.patch.dict('os.environ', {'OUT_DIR': self.out_dir}):
+            self.assertEqual(self.log_path,
+                             build_profiler.get_ninja_log_path())
+        with mock.patch.dict('os.environ', {'ANDROID_BUILD_TOP': '/top'}):
+            os.environ.pop('OUT_DIR', None)
+            self.assertEqual('/top/out/.ninja_log',
+                             build_profiler.get_ninja_log_path())
+
+    def test_read_edges(self):
+        """Test read_edges method reads the new entries only."""
+        snapshot = build_profiler.NinjaLogSnapshot(self.log_path)
+        self._append_entries()
+        edges = snapshot.read_edges()
+        self.assertEqual(4, len(edges))
+        self.assertEqual(Edge(400, 450, ['out/d1', 'out/d2']), edges[-1])
+
+    def test_read_edges_recompacted(self):
+        """Test the new outputs are read once the ninja log is recompacted."""
+        snapshot = build_profiler.NinjaLogSnapshot(self.log_path)
+        os.remove(self.log_path)
+        with open(self.log_path, 'w') as log_file:
+            log_file.write(OLD_LOG)
+        self._append_entries()
+        self.assertEqual(['out/a', 'out/b', 'out/c', 'out/d1'],
+                         [edge.outputs[0] for edge in snapshot.read_edges()])
+
+    def test_get_critical_path(self):
+        """Test get_critical_path method."""
+        edges = [Edge(0, 100, ['a']), Edge(0, 30, ['b']),
+                 Edge(100, 400, ['c']), Edge(400, 450, ['d'])]
+        self.assertEqual(['a', 'c', 'd'],
+                         [edge.outputs[0] for edge in
+                          build_profiler.get_critical_path(edges)])
+        self.assertEqual([], build_profiler.get_critical_path([]))
+
+    def test_profile(self):
+        """Test profile method."""
+        snapshot = build_profiler.NinjaLogSnapshot(self.log_path)
+        self.assertIsNone(build_profiler.profile(snapshot))
+        self._append_entries()
+        build_profile = build_profiler.profile(snapshot, ['target'], top_n=2)
+        self.assertEqual(450, build_profile.wall_time)
+        self.assertEqual(480, build_profile.edge_time)
+        self.assertEqual([['out/c'], ['out/a']],
+                         [edge.outputs for edge in build_profile.top_edges])
+        result = build_profiler.to_dict(build_profile)
+        self.assertEqual(450, result['critical_path_time'])
+        self.assertEqual(['target'], result['targets'])
+
+    @mock.patch('metrics.metrics.LocalDetectEvent')
+    def test_finish(self, mock_detect_event):
+        """Test finish method records the profile and reports slow builds."""
+        snapshot = build_profiler.NinjaLogSnapshot(self.log_path)
+        self._append_entries()
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            build_profiler.finish(snapshot, ['target'], 1)
+            self.assertEqual('', capture_output.getvalue())
+            build_profiler.finish(snapshot, ['target'], 600)
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertEqual(2, len(build_profiler.PROFILES))
+        mock_detect_event.assert_any_call(
+            detect_type=constants.DETECT_TYPE_BUILD_CRITICAL_PATH_MS,
+            result=450)
+        output = capture_output.getvalue()
+        self.assertIn('Critical path: 0.5s over 3 edges', output)
+        self.assertIn('out/d1 (+1)', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
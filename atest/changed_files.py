@@ -0,0 +1,214 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Provider of the files changed in the git projects of the source tree.
+"""
+
+import logging
+import os
+import subprocess
+import threading
+
+from concurrent import futures
+
+# Maximum number of git projects queried at the same time.
+_MAX_WORKERS = 8
+# Marker of a remote branch pointing to another one, e.g.
+# 'm/master -> aosp/master'.
+_REMOTE_ALIAS = '->'
+
+
+class Git:
+    """Run git commands to find the changed files of a git project.
+
+    Tests can substitute any object providing get_toplevel and
+    get_changed_files to fake a source tree.
+    """
+
+    @staticmethod
+    def _run(git_root, args):
+        """Run a git command in the given project.
+
+        Args:
+            git_root: A string of the top level path of the git project.
+            args: A list of arguments of the git command.
+
+        Returns:
+            A list of the lines of the command output.
+        """
+        return subprocess.check_output(
+            ['git', '-C', git_root] + args,
+            stderr=subprocess.DEVNULL).decode().splitlines()
+
+    @staticmethod
+    def get_toplevel(path):
+        """Get the top level path of the git project containing the path.
+
+        Args:
+            path: A string of a directory path.
+
+        Returns:
+            A string of the top level path, None if the path isn't in a git
+            project.
+        """
+        path = os.path.realpath(path)
+        while True:
+            # .git is a file instead of a directory in worktrees.
+            if os.path.exists(os.path.join(path, '.git')):
+                return path
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    def _get_upstream_distance(self, git_root):
+        """Get the number of local commits not merged into the remote branch.
+
+        Args:
+            git_root: A string of the top level path of the git project.
+
+        Returns:
+            A string of the number of commits ahead of the remote branch. '1'
+            if there's no remote branch to compare with, i.e. only the last
+            commit is considered.
+        """
+        remote_branch = ''
+        for line in self._run(git_root, ['branch', '-r']):
+            if _REMOTE_ALIAS in line:
+                remote_branch = line.split()[0]
+                break
+        if not remote_branch:
+            return '1'
+        counts = self._run(git_root, ['rev-list', '--left-right', '--count',
+                                      'HEAD...%s' % remote_branch])
+        return counts[0].split()[0] if counts else '1'
+
+    def get_changed_files(self, git_root):
+        """Get the files changed in the git project.
+
+        It includes unstaged and staged files, and files in local commits
+        which are not merged into the remote branch yet.
+
+        Each git command failing, e.g. git diff in a project with a single
+        commit, is skipped so the files found by the others are kept.
+
+        Args:
+            git_root: A string of the top level path of the git project.
+
+        Returns:
+            A set of paths of the changed files relative to the git_root.
+        """
+        changed_files = set()
+        try:
+            for line in self._run(git_root, ['status', '--short']):
+                if line.strip():
+                    changed_files.add(line.split()[-1])
+        except (OSError, subprocess.CalledProcessError) as err:
+            logging.debug('Exception raised: %s', err)
+        try:
+            ahead = self._get_upstream_distance(git_root)
+            changed_files.update(self._run(
+                git_root, ['diff', 'HEAD~%s' % ahead, '--name-only']))
+        except (OSError, subprocess.CalledProcessError) as err:
+            logging.debug('Exception raised: %s', err)
+        return changed_files
+
+
+class ChangedFilesProvider:
+    """Memoize the changed files of every git project in an invocation.
+
+    The git projects of a source tree are queried at most once, and the ones
+    requested together are queried concurrently.
+    """
+
+    def __init__(self, git=None, max_workers=_MAX_WORKERS):
+        """ChangedFilesProvider constructor
+
+        Args:
+            git: An object to query git projects. Default is a Git object.
+            max_workers: An integer of the maximum number of git projects
+                queried at the same time.
+        """
+        self._git = git or Git()
+        self._max_workers = max_workers
+        self._git_roots = {}
+        self._changed_files = {}
+        self._lock = threading.Lock()
+
+    def get_git_root(self, path):
+        """Get the top level path of the git project containing the path.
+
+        Args:
+            path: A string of a directory path.
+
+        Returns:
+            A string of the top level path, None if the path isn't in a git
+            project.
+        """
+        if path not in self._git_roots:
+            self._git_roots[path] = self._git.get_toplevel(path)
+        return self._git_roots[path]
+
+    def _query(self, git_root):
+        """Query the absolute paths of the changed files of a git project.
+
+        Args:
+            git_root: A string of the top level path of the git project.
+
+        Returns:
+            A frozenset of the absolute paths of the changed files.
+        """
+        try:
+            return frozenset(
+                os.path.normpath(os.path.join(git_root, changed_file))
+                for changed_file in self._git.get_changed_files(git_root))
+        except (OSError, subprocess.CalledProcessError) as err:
+            logging.debug('Exception raised: %s', err)
+            return frozenset()
+
+    def prefetch(self, paths):
+        """Query the changed files of the git projects of all given paths.
+
+        Args:
+            paths: An iterable of directory paths.
+        """
+        git_roots = {self.get_git_root(path) for path in paths}
+        git_roots.discard(None)
+        with self._lock:
+            git_roots.difference_update(self._changed_files)
+            if not git_roots:
+                return
+            git_roots = sorted(git_roots)
+            if len(git_roots) == 1:
+                self._changed_files[git_roots[0]] = self._query(git_roots[0])
+                return
+            with futures.ThreadPoolExecutor(self._max_workers) as executor:
+                self._changed_files.update(
+                    zip(git_roots, executor.map(self._query, git_roots)))
+
+    def get_changed_files(self, path):
+        """Get the changed files of the git project containing the path.
+
+        Args:
+            path: A string of a directory path.
+
+        Returns:
+            A frozenset of the absolute paths of the changed files.
+        """
+        git_root = self.get_git_root(path)
+        if git_root is None:
+            return frozenset()
+        self.prefetch([path])
+        return self._changed_files[git_root]
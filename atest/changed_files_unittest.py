@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for changed_files."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from unittest import mock
+
+import changed_files
+
+
+class FakeGit:
+    """Fake source tree of git projects with changed files."""
+
+    def __init__(self, projects):
+        """FakeGit constructor
+
+        Args:
+            projects: A dict of git project top level path to a list of its
+                changed files.
+        """
+        self.projects = projects
+        self.queried = []
+
+    def get_toplevel(self, path):
+        """Get the project containing the path."""
+        for project in self.projects:
+            if path == project or path.startswith(project + os.sep):
+                return project
+        return None
+
+    def get_changed_files(self, git_root):
+        """Get the changed files of the project."""
+        self.queried.append(git_root)
+        changed = self.projects[git_root]
+        if isinstance(changed, Exception):
+            raise changed
+        return changed
+
+
+class ChangedFilesProviderUnittests(unittest.TestCase):
+    """Unit tests for ChangedFilesProvider in changed_files.py"""
+
+    def setUp(self):
+        self.git = FakeGit({'/src/a': ['x.java', 'b/y.java'],
+                            '/src/c': ['z.cc'],
+                            '/src/d': subprocess.CalledProcessError(1, 'git')})
+        self.provider = changed_files.ChangedFilesProvider(self.git)
+
+    def test_get_changed_files(self):
+        """Test get_changed_files method."""
+        self.assertEqual({'/src/a/x.java', '/src/a/b/y.java'},
+                         self.provider.get_changed_files('/src/a/b'))
+        self.assertEqual({'/src/a/x.java', '/src/a/b/y.java'},
+                         self.provider.get_changed_files('/src/a'))
+        self.assertEqual(set(), self.provider.get_changed_files('/src/d'))
+        self.assertEqual(set(), self.provider.get_changed_files('/other'))
+        self.assertEqual(['/src/a', '/src/d'], self.git.queried)
+
+    def test_prefetch(self):
+        """Test prefetch method queries each project once."""
+        self.provider.prefetch(['/src/a', '/src/a/b', '/src/c', '/other'])
+        self.assertEqual(['/src/a', '/src/c'], sorted(self.git.queried))
+        self.assertEqual({'/src/c/z.cc'},
+                         self.provider.get_changed_files('/src/c'))
+        self.provider.prefetch(['/src/a/b', '/src/c'])
+        self.assertEqual(2, len(self.git.queried))
+
+
+class GitUnittests(unittest.TestCase):
+    """Unit tests for Git in changed_files.py"""
+
+    def setUp(self):
+        self.tmp_dir = os.path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_toplevel(self):
+        """Test get_toplevel method."""
+        sub_dir = os.path.join(self.tmp_dir, 'a', 'b')
+        os.makedirs(sub_dir)
+        os.mkdir(os.path.join(self.tmp_dir, 'a', '.git'))
+        self.assertEqual(os.path.join(self.tmp_dir, 'a'),
+                         changed_files.Git.get_toplevel(sub_dir))
+
+    @mock.patch('subprocess.check_output')
+    def test_get_changed_files(self, mock_co):
+        """Test get_changed_files method."""
+        mock_co.side_effect = [
+            x.encode('utf-8') for x in [' M a/x.java\n?? y.java\n',
+                                        '  m/master -> aosp/master\n'
+                                        '  aosp/master\n',
+                                        '2\t0\n',
+                                        'c/z.java\n']]
+        self.assertEqual({'a/x.java', 'y.java', 'c/z.java'},
+                         changed_files.Git().get_changed_files('/src'))
+        mock_co.assert_called_with(
+            ['git', '-C', '/src', 'diff', 'HEAD~2', '--name-only'],
+            stderr=subprocess.DEVNULL)
+
+    @mock.patch('subprocess.check_output')
+    def test_get_changed_files_partial(self, mock_co):
+        """Test the files of the git commands not failing are kept."""
+        mock_co.side_effect = [b' M a/x.java\n', b'',
+                               subprocess.CalledProcessError(128, 'git')]
+        self.assertEqual({'a/x.java'},
+                         changed_files.Git().get_changed_files('/src'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,17 +19,19 @@
 
 from __future__ import print_function
 
-import fnmatch
-import json
+import copy
 import logging
 import os
-import re
 import sys
 import time
 
+import affected_tests
 import atest_error
 import atest_utils
+import changed_files
 import constants
+import failed_tests
+import phase_tracer
 import test_finder_handler
 import test_mapping
 
@@ -40,9 +42,6 @@ from test_finders import module_finder
 FUZZY_FINDER = 'FUZZY'
 CACHE_FINDER = 'CACHE'
 
-# Pattern used to identify comments start with '//' or '#' in TEST_MAPPING.
-_COMMENTS_RE = re.compile(r'(?m)[\s\t]*(#|//).*|(\".*?\")')
-_COMMENTS = frozenset(['//', '#'])
 
 #pylint: disable=no-self-use
 class CLITranslator:
@@ -71,6 +70,8 @@ class CLITranslator:
         """
         self.mod_info = module_info
         self.enable_file_patterns = False
+        self._tm_catalogs = {}
+        self._changed_files = changed_files.ChangedFilesProvider()
         self.msg = ''
         if print_cache_msg:
             self.msg = ('(Test info has been cached for speeding up the next '
@@ -101,21 +102,27 @@ class CLITranslator:
             # test name, so the details can be set after test_info object
             # is created.
             try:
-                found_test_infos = finder.find_method(
-                    finder.test_finder_instance, test)
+                with phase_tracer.span('finder:%s' % finder.finder_info,
+                                       test=test):
+                    found_test_infos = finder.find_method(
+                        finder.test_finder_instance, test)
             except atest_error.TestDiscoveryException as e:
                 find_test_err_msg = e
             if found_test_infos:
                 finder_info = finder.finder_info
                 for test_info in found_test_infos:
-                    if tm_test_detail:
-                        test_info.data[constants.TI_MODULE_ARG] = (
-                            tm_test_detail.options)
-                        test_info.from_test_mapping = True
-                        test_info.host = tm_test_detail.host
                     if finder_info != CACHE_FINDER:
                         test_info.test_finder = finder_info
                     test_infos.add(test_info)
+                if tm_test_detail:
+                    # Cache the resolution before the TEST_MAPPING options
+                    # are applied so the cached TestInfos stay option-free
+                    # and can be shared by any run referencing this test.
+                    if finder_info != CACHE_FINDER:
+                        atest_utils.update_test_info_cache(
+                            test, copy.deepcopy(test_infos))
+                    self._apply_test_mapping_detail(test_infos,
+                                                    tm_test_detail)
                 test_found = True
                 print("Found '%s' as %s" % (
                     atest_utils.colorize(test, constants.GREEN),
@@ -126,7 +133,9 @@ class CLITranslator:
                 test_info_str = ','.join([str(x) for x in found_test_infos])
                 break
         if not test_found:
-            f_results = self._fuzzy_search_and_msg(test, find_test_err_msg)
+            with phase_tracer.span('fuzzy_search', test=test):
+                f_results = self._fuzzy_search_and_msg(test,
+                                                       find_test_err_msg)
             if f_results:
                 test_infos.update(f_results)
                 test_found = True
@@ -140,12 +149,27 @@ class CLITranslator:
             test_info=test_info_str)
         # Cache test_infos by default except running with TEST_MAPPING which may
         # include customized flags and they are likely to mess up other
-        # non-test_mapping tests.
+        # non-test_mapping tests. The option-free part of TEST_MAPPING tests
+        # has been cached above.
         if test_infos and not tm_test_detail:
             atest_utils.update_test_info_cache(test, test_infos)
             print(self.msg)
         return test_infos
 
+    @staticmethod
+    def _apply_test_mapping_detail(test_infos, tm_test_detail):
+        """Apply the options configured in TEST_MAPPING to the TestInfos.
+
+        Args:
+            test_infos: A collection of TestInfos of the test.
+            tm_test_detail: The TestDetail of test configured in TEST_MAPPING
+                files.
+        """
+        for test_info in test_infos:
+            test_info.data[constants.TI_MODULE_ARG] = tm_test_detail.options
+            test_info.from_test_mapping = True
+            test_info.host = tm_test_detail.host
+
     def _fuzzy_search_and_msg(self, test, find_test_err_msg):
         """ Fuzzy search and print message.
 
@@ -239,115 +263,129 @@ class CLITranslator:
         Returns:
             Valid json string without comments.
         """
-        def _replace(match):
-            """Replace comments if found matching the defined regular
-            expression.
-
-            Args:
-                match: The matched regex pattern
-
-            Returns:
-                "" if it matches _COMMENTS, otherwise original string.
-            """
-            line = match.group(0).strip()
-            return "" if any(map(line.startswith, _COMMENTS)) else line
-        with open(test_mapping_file) as json_file:
-            return re.sub(_COMMENTS_RE, _replace, json_file.read())
-
-    def _read_tests_in_test_mapping(self, test_mapping_file):
-        """Read tests from a TEST_MAPPING file.
+        return test_mapping.filter_comments(test_mapping_file)
+
+    def _get_test_mapping_catalog(self, file_name=constants.TEST_MAPPING):
+        """Get the catalog of TEST_MAPPING files with the given name.
+
+        Only the catalog of real TEST_MAPPING files is persisted.
 
         Args:
-            test_mapping_file: Path to a TEST_MAPPING file.
+            file_name: Name of TEST_MAPPING file. Default is set to
+                `TEST_MAPPING`. The argument is added for testing purpose.
 
         Returns:
-            A tuple of (all_tests, imports), where
-            all_tests is a dictionary of all tests in the TEST_MAPPING file,
-                grouped by test group.
-            imports is a list of test_mapping.Import to include other test
-                mapping files.
+            A test_mapping.TestMappingCatalog object.
         """
-        all_tests = {}
-        imports = []
-        test_mapping_dict = json.loads(self.filter_comments(test_mapping_file))
-        for test_group_name, test_list in test_mapping_dict.items():
-            if test_group_name == constants.TEST_MAPPING_IMPORTS:
-                for import_detail in test_list:
-                    imports.append(
-                        test_mapping.Import(test_mapping_file, import_detail))
-            else:
-                grouped_tests = all_tests.setdefault(test_group_name, set())
-                tests = []
+        catalog = self._tm_catalogs.get(file_name)
+        if not catalog:
+            catalog_file = (constants.TEST_MAPPING_CATALOG
+                            if file_name == constants.TEST_MAPPING else None)
+            catalog = test_mapping.TestMappingCatalog(catalog_file, file_name)
+            self._tm_catalogs[file_name] = catalog
+        return catalog
+
+    def _match_file_patterns(self, test_mapping_files, catalog):
+        """Match the file_patterns in TEST_MAPPING files with modified files.
+
+        Args:
+            test_mapping_files: A list of path of TEST_MAPPING files.
+            catalog: A test_mapping.TestMappingCatalog object.
+
+        Returns:
+            A test_mapping.FilePatternsMatcher object.
+        """
+        matcher = test_mapping.FilePatternsMatcher()
+        for test_mapping_file in test_mapping_files:
+            for test_list in catalog.get_groups(test_mapping_file).values():
                 for test in test_list:
-                    if (self.enable_file_patterns and
-                            not test_mapping.is_match_file_patterns(
-                                test_mapping_file, test)):
-                        continue
-                    test_mod_info = self.mod_info.name_to_module_info.get(
-                        test['name'])
-                    if not test_mod_info:
-                        print('WARNING: %s is not a valid build target and '
-                              'may not be discoverable by TreeHugger. If you '
-                              'want to specify a class or test-package, '
-                              'please set \'name\' to the test module and use '
-                              '\'options\' to specify the right tests via '
-                              '\'include-filter\'.\nNote: this can also occur '
-                              'if the test module is not built for your '
-                              'current lunch target.\n' %
-                              atest_utils.colorize(test['name'], constants.RED))
-                    elif not any(x in test_mod_info['compatibility_suites'] for
-                                 x in constants.TEST_MAPPING_SUITES):
-                        print('WARNING: Please add %s to either suite: %s for '
-                              'this TEST_MAPPING file to work with TreeHugger.' %
-                              (atest_utils.colorize(test['name'],
-                                                    constants.RED),
-                               atest_utils.colorize(constants.TEST_MAPPING_SUITES,
-                                                    constants.GREEN)))
-                    tests.append(test_mapping.TestDetail(test))
-                grouped_tests.update(tests)
-        return all_tests, imports
-
-    def _find_files(self, path, file_name=constants.TEST_MAPPING):
-        """Find all files with given name under the given path.
+                    matcher.add(test_mapping_file, test)
+        test_mapping_dirs = matcher.get_dirs()
+        # Query the git projects of all TEST_MAPPING files at once.
+        self._changed_files.prefetch(test_mapping_dirs)
+        modified_files = set()
+        for test_mapping_dir in test_mapping_dirs:
+            modified_files.update(
+                self._changed_files.get_changed_files(test_mapping_dir))
+        matcher.match(modified_files)
+        for test_mapping_file in sorted(test_mapping_files):
+            for pattern, files in sorted(
+                    matcher.get_matched_patterns(test_mapping_file).items()):
+                logging.debug('file_patterns %s in %s matches %s', pattern,
+                              test_mapping_file, files)
+        return matcher
+
+    def _read_tests_in_test_mapping(self, test_mapping_file, catalog,
+                                    matcher=None):
+        """Read tests from a TEST_MAPPING file.
 
         Args:
-            path: A string of path in source.
+            test_mapping_file: Path to a TEST_MAPPING file.
+            catalog: A test_mapping.TestMappingCatalog object.
+            matcher: A test_mapping.FilePatternsMatcher object to filter the
+                tests by file_patterns. No tests are filtered if it's None.
 
         Returns:
-            A list of paths of the files with the matching name under the given
-            path.
+            A dictionary of all tests in the TEST_MAPPING file, grouped by test
+            group.
         """
-        test_mapping_files = []
-        for root, _, filenames in os.walk(path):
-            for filename in fnmatch.filter(filenames, file_name):
-                test_mapping_files.append(os.path.join(root, filename))
-        return test_mapping_files
+        all_tests = {}
+        for test_group_name, test_list in catalog.get_groups(
+                test_mapping_file).items():
+            grouped_tests = all_tests.setdefault(test_group_name, set())
+            tests = []
+            for test in test_list:
+                if matcher and not matcher.is_match(test_mapping_file, test):
+                    continue
+                test_mod_info = self.mod_info.name_to_module_info.get(
+                    test['name'])
+                if not test_mod_info:
+                    print('WARNING: %s is not a valid build target and '
+                          'may not be discoverable by TreeHugger. If you '
+                          'want to specify a class or test-package, '
+                          'please set \'name\' to the test module and use '
+                          '\'options\' to specify the right tests via '
+                          '\'include-filter\'.\nNote: this can also occur '
+                          'if the test module is not built for your '
+                          'current lunch target.\n' %
+                          atest_utils.colorize(test['name'], constants.RED))
+                elif not any(x in test_mod_info['compatibility_suites'] for
+                             x in constants.TEST_MAPPING_SUITES):
+                    print('WARNING: Please add %s to either suite: %s for '
+                          'this TEST_MAPPING file to work with TreeHugger.' %
+                          (atest_utils.colorize(test['name'],
+                                                constants.RED),
+                           atest_utils.colorize(constants.TEST_MAPPING_SUITES,
+                                                constants.GREEN)))
+                tests.append(test_mapping.TestDetail(test))
+            grouped_tests.update(tests)
+        return all_tests
 
     def _get_tests_from_test_mapping_files(
-            self, test_group, test_mapping_files):
+            self, test_group, test_mapping_files, catalog):
         """Get tests in the given test mapping files with the match group.
 
         Args:
             test_group: Group of tests to run. Default is set to `presubmit`.
             test_mapping_files: A list of path of TEST_MAPPING files.
+            catalog: A test_mapping.TestMappingCatalog object.
 
         Returns:
-            A tuple of (tests, all_tests, imports), where,
+            A tuple of (tests, all_tests), where,
             tests is a set of tests (test_mapping.TestDetail) defined in
             TEST_MAPPING file of the given path, and its parent directories,
             with matching test_group.
             all_tests is a dictionary of all tests in TEST_MAPPING files,
             grouped by test group.
-            imports is a list of test_mapping.Import objects that contains the
-            details of where to import a TEST_MAPPING file.
         """
-        all_imports = []
+        matcher = None
+        if self.enable_file_patterns:
+            matcher = self._match_file_patterns(test_mapping_files, catalog)
         # Read and merge the tests in all TEST_MAPPING files.
         merged_all_tests = {}
-        for test_mapping_file in test_mapping_files:
-            all_tests, imports = self._read_tests_in_test_mapping(
-                test_mapping_file)
-            all_imports.extend(imports)
+        for test_mapping_file in sorted(test_mapping_files):
+            all_tests = self._read_tests_in_test_mapping(
+                test_mapping_file, catalog, matcher)
             for test_group_name, test_list in all_tests.items():
                 grouped_tests = merged_all_tests.setdefault(
                     test_group_name, set())
@@ -357,16 +395,20 @@ class CLITranslator:
         if test_group == constants.TEST_GROUP_ALL:
             for grouped_tests in merged_all_tests.values():
                 tests.update(grouped_tests)
-        return tests, merged_all_tests, all_imports
+        return tests, merged_all_tests
 
     # pylint: disable=too-many-arguments
-    # pylint: disable=too-many-locals
     def _find_tests_by_test_mapping(
             self, path='', test_group=constants.TEST_GROUP_PRESUBMIT,
             file_name=constants.TEST_MAPPING, include_subdirs=False,
             checked_files=None):
         """Find tests defined in TEST_MAPPING in the given path.
 
+        TEST_MAPPING files are looked up in the given path, its parent
+        directories and, recursively, the imported directories through the
+        persisted TestMappingCatalog, so unchanged files aren't parsed again
+        and unchanged directories aren't listed again.
+
         Args:
             path: A string of path in source. Default is set to '', i.e., CWD.
             test_group: Group of tests to run. Default is set to `presubmit`.
@@ -384,56 +426,88 @@ class CLITranslator:
             all_tests is a dictionary of all tests in TEST_MAPPING files,
             grouped by test group.
         """
-        path = os.path.realpath(path)
-        test_mapping_files = set()
-        all_tests = {}
-        test_mapping_file = os.path.join(path, file_name)
-        if os.path.exists(test_mapping_file):
-            test_mapping_files.add(test_mapping_file)
-        # Include all TEST_MAPPING files in sub-directories if `include_subdirs`
-        # is set to True.
-        if include_subdirs:
-            test_mapping_files.update(self._find_files(path, file_name))
-        # Include all possible TEST_MAPPING files in parent directories.
-        root_dir = os.environ.get(constants.ANDROID_BUILD_TOP, os.sep)
-        while path not in (root_dir, os.sep):
-            path = os.path.dirname(path)
-            test_mapping_file = os.path.join(path, file_name)
-            if os.path.exists(test_mapping_file):
-                test_mapping_files.add(test_mapping_file)
-
-        if checked_files is None:
-            checked_files = set()
-        test_mapping_files.difference_update(checked_files)
-        checked_files.update(test_mapping_files)
-        if not test_mapping_files:
-            return test_mapping_files, all_tests
-
-        tests, all_tests, imports = self._get_tests_from_test_mapping_files(
-            test_group, test_mapping_files)
-
-        # Load TEST_MAPPING files from imports recursively.
-        if imports:
-            for import_detail in imports:
-                path = import_detail.get_path()
-                # (b/110166535 #19) Import path might not exist if a project is
-                # located in different directory in different branches.
-                if path is None:
-                    logging.warning(
-                        'Failed to import TEST_MAPPING at %s', import_detail)
-                    continue
-                # Search for tests based on the imported search path.
-                import_tests, import_all_tests = (
-                    self._find_tests_by_test_mapping(
-                        path, test_group, file_name, include_subdirs,
-                        checked_files))
-                # Merge the collections
-                tests.update(import_tests)
-                for group, grouped_tests in import_all_tests.items():
-                    all_tests.setdefault(group, set()).update(grouped_tests)
-
+        catalog = self._get_test_mapping_catalog(file_name)
+        test_mapping_files = catalog.find_files_with_imports(
+            path, include_subdirs, checked_files)
+        tests, all_tests = self._get_tests_from_test_mapping_files(
+            test_group, test_mapping_files, catalog)
+        catalog.save()
         return tests, all_tests
 
+    def warm_test_mapping_cache(self, paths=None):
+        """Pre-resolve the tests in TEST_MAPPING files into test info cache.
+
+        All tests configured in TEST_MAPPING files of the given directories,
+        their sub directories, parent directories and imports are resolved
+        without the TEST_MAPPING options, so that following runs can load
+        them through CacheFinder instead of searching them again.
+
+        Args:
+            paths: A list of directories to search TEST_MAPPING files from.
+                   Default is the most frequently used directories.
+
+        Returns:
+            A set of names of tests newly resolved into the cache.
+        """
+        if paths is None:
+            paths = atest_utils.get_frequent_test_mapping_dirs()
+        tests = set()
+        checked_files = set()
+        for path in paths:
+            test_details, _ = self._find_tests_by_test_mapping(
+                path=path, test_group=constants.TEST_GROUP_ALL,
+                include_subdirs=True, checked_files=checked_files)
+            tests.update(detail.name for detail in test_details)
+        cached_tests = set()
+        for test in sorted(tests):
+            if os.path.isfile(atest_utils.get_test_info_cache_path(test)):
+                continue
+            test_infos = self._resolve_test_without_cache(test)
+            if test_infos:
+                atest_utils.update_test_info_cache(test, test_infos)
+                cached_tests.add(test)
+        logging.debug('Pre-resolved tests in TEST_MAPPING: %s', cached_tests)
+        return cached_tests
+
+    def _resolve_test_without_cache(self, test):
+        """Find the TestInfos of a test without looking up the cache.
+
+        Args:
+            test: A string representing test references.
+
+        Returns:
+            A list of TestInfos if found, otherwise None.
+        """
+        for finder in test_finder_handler.get_find_methods_for_test(
+                self.mod_info, test):
+            if finder.finder_info == CACHE_FINDER:
+                continue
+            try:
+                found_test_infos = finder.find_method(
+                    finder.test_finder_instance, test)
+            except atest_error.TestDiscoveryException as e:
+                logging.debug('Exception raised: %s', e)
+                continue
+            if found_test_infos:
+                for test_info in found_test_infos:
+                    test_info.test_finder = finder.finder_info
+                return found_test_infos
+        return None
+
+    def _get_affected_tests(self):
+        """Find the tests depending on the modified files.
+
+        Returns:
+            A list of names of the affected test modules.
+        """
+        modified_files = self._changed_files.get_changed_files(os.getcwd())
+        logging.debug('Modified files: %s', sorted(modified_files))
+        finder = affected_tests.AffectedTestsFinder(self.mod_info)
+        found_tests = finder.find(modified_files)
+        if found_tests:
+            affected_tests.print_rationale(found_tests)
+        return [test.name for test in found_tests]
+
     def _gather_build_targets(self, test_infos):
         targets = set()
         for test_info in test_infos:
@@ -464,6 +538,7 @@ class CLITranslator:
         test_details, all_test_details = self._find_tests_by_test_mapping(
             path=src_path, test_group=test_group,
             include_subdirs=args.include_subdirs, checked_files=set())
+        atest_utils.record_test_mapping_dir(os.path.realpath(src_path))
         test_details_list = list(test_details)
         if not test_details_list:
             logging.warning(
@@ -502,7 +577,27 @@ class CLITranslator:
         tests = args.tests
         # Test details from TEST_MAPPING files
         test_details_list = None
-        if atest_utils.is_test_mapping(args):
+        latest_failures = None
+        if args.rerun_failed and not tests:
+            latest_failures = failed_tests.FailedTests.from_result_file(
+                constants.LATEST_RESULT_FILE)
+            if not latest_failures:
+                atest_utils.colorful_print(
+                    'No failed tests in the latest test run.',
+                    constants.YELLOW)
+                return set(), []
+            tests = latest_failures.get_module_names()
+        elif args.affected:
+            # The tests given with --affected run along with the affected ones.
+            tests = list(tests or [])
+            tests.extend(test for test in self._get_affected_tests()
+                         if test not in tests)
+            if not tests:
+                atest_utils.colorful_print(
+                    'No tests are affected by the modified files.',
+                    constants.YELLOW)
+                return set(), []
+        elif atest_utils.is_test_mapping(args):
             if args.enable_file_patterns:
                 self.enable_file_patterns = True
             tests, test_details_list = self._get_test_mapping_tests(args)
@@ -511,6 +606,9 @@ class CLITranslator:
         start = time.time()
         test_infos = self._get_test_infos(tests, test_details_list)
         logging.debug('Found tests in %ss', time.time() - start)
+        if latest_failures:
+            latest_failures.print_rerun_info()
+            test_infos = set(latest_failures.filter_test_infos(test_infos))
         for test_info in test_infos:
             logging.debug('%s\n', test_info)
         build_targets = self._gather_build_targets(test_infos)
@@ -18,6 +18,7 @@
 
 # pylint: disable=line-too-long
 
+import copy
 import unittest
 import json
 import os
@@ -30,6 +31,7 @@ from unittest import mock
 
 import cli_translator as cli_t
 import constants
+import failed_tests
 import test_finder_handler
 import test_mapping
 import unittest_constants as uc
@@ -38,6 +40,7 @@ import unittest_utils
 from metrics import metrics
 from test_finders import module_finder
 from test_finders import test_finder_base
+from test_finders import test_info
 
 
 # TEST_MAPPING related consts
@@ -85,6 +88,8 @@ class CLITranslatorUnittests(unittest.TestCase):
         self.args.test_mapping = False
         self.args.include_subdirs = False
         self.args.enable_file_patterns = False
+        self.args.affected = False
+        self.args.rerun_failed = False
         # Cache finder related args
         self.args.clear_cache = False
         self.ctr.mod_info = mock.Mock
@@ -214,6 +219,63 @@ class CLITranslatorUnittests(unittest.TestCase):
                     test_detail2.options,
                     test_info.data[constants.TI_MODULE_ARG])
 
+    @mock.patch('atest_utils.update_test_info_cache')
+    @mock.patch.object(metrics, 'FindTestFinishEvent')
+    @mock.patch.object(test_finder_handler, 'get_find_methods_for_test')
+    def test_get_test_infos_cache_test_mapping(self, mock_getfindmethods,
+                                               _metrics, mock_update_cache):
+        """Test _get_test_infos caches TEST_MAPPING tests without options."""
+        ctr = cli_t.CLITranslator()
+        test_info = copy.deepcopy(uc.MODULE_INFO)
+        mock_getfindmethods.return_value = [
+            test_finder_base.Finder(None, lambda x, y: [test_info], 'MODULE')]
+        test_detail = test_mapping.TestDetail(uc.TEST_MAPPING_TEST_WITH_OPTION)
+        test_infos = ctr._get_test_infos([uc.MODULE_NAME], [test_detail])
+        self.assertEqual(test_detail.options,
+                         list(test_infos)[0].data[constants.TI_MODULE_ARG])
+        self.assertTrue(list(test_infos)[0].from_test_mapping)
+        mock_update_cache.assert_called_once()
+        cached_info = list(mock_update_cache.call_args[0][1])[0]
+        self.assertNotIn(constants.TI_MODULE_ARG, cached_info.data)
+        self.assertFalse(cached_info.from_test_mapping)
+        # Tests found from the cache are not cached again.
+        mock_update_cache.reset_mock()
+        mock_getfindmethods.return_value = [
+            test_finder_base.Finder(None, lambda x, y: [cached_info],
+                                    cli_t.CACHE_FINDER)]
+        test_infos = ctr._get_test_infos([uc.MODULE_NAME], [test_detail])
+        self.assertTrue(list(test_infos)[0].from_test_mapping)
+        mock_update_cache.assert_not_called()
+
+    @mock.patch('os.path.isfile')
+    @mock.patch('atest_utils.update_test_info_cache')
+    @mock.patch.object(test_finder_handler, 'get_find_methods_for_test')
+    @mock.patch.object(cli_t.CLITranslator, '_find_tests_by_test_mapping')
+    def test_warm_test_mapping_cache(self, mock_testmapping,
+                                     mock_getfindmethods, mock_update_cache,
+                                     mock_isfile):
+        """Test warm_test_mapping_cache method."""
+        mock_testmapping.return_value = (set([TEST_1, TEST_2]), {})
+        mock_isfile.side_effect = lambda path: False
+        find_from_cache = mock.Mock(return_value=[uc.CLASS_INFO])
+        mock_getfindmethods.return_value = [
+            test_finder_base.Finder(None, find_from_cache, cli_t.CACHE_FINDER),
+            test_finder_base.Finder(
+                None, lambda x, test: [copy.deepcopy(uc.MODULE_INFO)]
+                if test == 'test1' else None, 'MODULE')]
+        self.assertEqual({'test1'},
+                         self.ctr.warm_test_mapping_cache(['/a', '/b']))
+        find_from_cache.assert_not_called()
+        mock_update_cache.assert_called_once_with('test1', mock.ANY)
+        self.assertEqual(
+            'MODULE', mock_update_cache.call_args[0][1][0].test_finder)
+        self.assertEqual(2, mock_testmapping.call_count)
+        # Tests already in the cache are skipped.
+        mock_update_cache.reset_mock()
+        mock_isfile.side_effect = lambda path: True
+        self.assertEqual(set(), self.ctr.warm_test_mapping_cache(['/a']))
+        mock_update_cache.assert_not_called()
+
     @mock.patch.object(cli_t.CLITranslator, '_get_test_infos',
                        side_effect=gettestinfos_side_effect)
     def test_translate_class(self, _info):
@@ -237,6 +299,46 @@ class CLITranslatorUnittests(unittest.TestCase):
         unittest_utils.assert_strict_equal(self, test_infos, {uc.MODULE_INFO,
                                                               uc.CLASS_INFO})
 
+    @mock.patch.object(cli_t.CLITranslator, '_get_affected_tests')
+    @mock.patch.object(cli_t.CLITranslator, '_get_test_infos',
+                       side_effect=gettestinfos_side_effect)
+    def test_translate_affected(self, _info, mock_affected):
+        """Test translate method for tests affected by modified files."""
+        args = mock.Mock(tests=[], affected=True, rerun_failed=False)
+        mock_affected.return_value = [uc.MODULE_NAME]
+        targets, test_infos = self.ctr.translate(args)
+        unittest_utils.assert_strict_equal(
+            self, targets, uc.MODULE_BUILD_TARGETS)
+        unittest_utils.assert_strict_equal(self, test_infos, {uc.MODULE_INFO})
+        mock_affected.return_value = []
+        self.assertEqual((set(), []), self.ctr.translate(args))
+        args.tests = [uc.CLASS_NAME]
+        mock_affected.return_value = [uc.MODULE_NAME, uc.CLASS_NAME]
+        self.ctr.translate(args)
+        self.assertEqual([uc.CLASS_NAME, uc.MODULE_NAME], _info.call_args[0][0])
+
+    @mock.patch.object(failed_tests.FailedTests, 'from_result_file')
+    @mock.patch.object(cli_t.CLITranslator, '_get_test_infos',
+                       side_effect=gettestinfos_side_effect)
+    def test_translate_rerun_failed(self, _info, mock_from_result):
+        """Test translate method for the failed tests of the latest run."""
+        args = mock.Mock(tests=[], affected=False, rerun_failed=True)
+        failures = failed_tests.FailedTests()
+        failures.add_result(uc.MODULE_INFO.test_runner, uc.MODULE_NAME,
+                            '%s#%s' % (uc.FULL_CLASS_NAME, uc.METHOD_NAME),
+                            'FAILED', '(1ms)')
+        mock_from_result.return_value = failures
+        targets, test_infos = self.ctr.translate(args)
+        mock_from_result.assert_called_once_with(constants.LATEST_RESULT_FILE)
+        unittest_utils.assert_strict_equal(
+            self, targets, uc.MODULE_BUILD_TARGETS)
+        self.assertEqual(
+            [frozenset([test_info.TestFilter(uc.FULL_CLASS_NAME,
+                                             frozenset([uc.METHOD_NAME]))])],
+            [info.data[constants.TI_FILTER] for info in test_infos])
+        mock_from_result.return_value = failed_tests.FailedTests()
+        self.assertEqual((set(), []), self.ctr.translate(args))
+
     @mock.patch.object(cli_t.CLITranslator, '_find_tests_by_test_mapping')
     @mock.patch.object(cli_t.CLITranslator, '_get_test_infos',
                        side_effect=gettestinfos_side_effect)
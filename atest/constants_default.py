@@ -44,7 +44,9 @@ POST_PATCH_FOLDER = 'POST_PATCH_FOLDER'
 SERIAL = 'SERIAL'
 SHARDING = 'SHARDING'
 ALL_ABI = 'ALL_ABI'
+ALL_DEVICES = 'ALL_DEVICES'
 HOST = 'HOST'
+HOST_SHARDS = 'HOST_SHARDS'
 CUSTOM_ARGS = 'CUSTOM_ARGS'
 DRY_RUN = 'DRY_RUN'
 ANDROID_SERIAL = 'ANDROID_SERIAL'
@@ -56,6 +58,8 @@ RETRY_ANY_FAILURE = 'RETRY_ANY_FAILURE'
 TF_DEBUG = 'TF_DEBUG'
 COLLECT_TESTS_ONLY = 'COLLECT_TESTS_ONLY'
 TF_TEMPLATE = 'TF_TEMPLATE'
+FAIL_FAST = 'FAIL_FAST'
+TF_DAEMON = 'TF_DAEMON'
 
 # Application exit codes.
 EXIT_CODE_SUCCESS = 0
@@ -171,8 +175,11 @@ USER_FROM_TOOL = 'USER_FROM_TOOL'
 TF_PREPARATION = 'tf-preparation'
 
 # Detect type for local_detect_event.
-# Next expansion : DETECT_TYPE_XXX = 1
+# Next expansion : DETECT_TYPE_XXX = 3
 DETECT_TYPE_BUG_DETECTED = 0
+# The critical path and the sum of the edge times of a build in milliseconds.
+DETECT_TYPE_BUILD_CRITICAL_PATH_MS = 1
+DETECT_TYPE_BUILD_EDGE_TIME_MS = 2
 # Considering a trade-off between speed and size, we set UPPER_LIMIT to 100000
 # to make maximum file space 10M(100000(records)*100(byte/record)) at most.
 # Therefore, to update history file will spend 1 sec at most in each run.
@@ -213,6 +220,8 @@ CC_CLASS_INDEX = os.path.join(INDEX_DIR, 'cc_classes.idx')
 PACKAGE_INDEX = os.path.join(INDEX_DIR, 'packages.idx')
 QCLASS_INDEX = os.path.join(INDEX_DIR, 'fqcn.idx')
 MODULE_INDEX = os.path.join(INDEX_DIR, 'modules.idx')
+# Catalog of TEST_MAPPING files, shared with other tools such as the IDE plugin.
+TEST_MAPPING_CATALOG = os.path.join(INDEX_DIR, 'test_mapping.json')
 VERSION_FILE = os.path.join(os.path.dirname(__file__), 'VERSION')
 
 # Regeular Expressions
@@ -233,6 +242,8 @@ PACKAGE_OUTPUT_RE = re.compile(r'(?P<java_dir>/.*/).*[.](java|kt)[:]\s*package\s
 
 ATEST_RESULT_ROOT = '/tmp/atest_result'
 LATEST_RESULT_FILE = os.path.join(ATEST_RESULT_ROOT, 'LATEST', 'test_result')
+# The metrics not sent yet, e.g. while offline, sent by the next run.
+METRICS_SPOOL_DIR = os.path.join(ATEST_RESULT_ROOT, 'metrics_spool')
 
 # Tests list which need vts_kernel_tests as test dependency
 REQUIRED_KERNEL_TEST_MODULES = [
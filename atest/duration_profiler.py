@@ -0,0 +1,158 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Aggregate the durations of the tests across the latest test results.
+
+The durations of each test, class and module, and the setup overhead of each
+module, i.e. its wall time not spent in its tests, are read from the test
+results under ATEST_RESULT_ROOT, and reported as the slowest ones along with
+the trend of their latest duration.
+"""
+
+import collections
+
+import atest_execution_info
+import atest_utils
+import constants
+
+# The number of latest test results to profile.
+PROFILE_HISTORY_SIZE = 20
+# The number of the slowest ones to report per level.
+TOP_N = 10
+# The trend worth highlighting, i.e. 10% slower than before.
+_TREND_THRESHOLD = 0.1
+
+MODULE = 'module'
+CLASS = 'class'
+TEST = 'test'
+OVERHEAD = 'overhead'
+LEVELS = (MODULE, CLASS, TEST, OVERHEAD)
+_LEVEL_TITLES = ((MODULE, 'Slowest modules'),
+                 (CLASS, 'Slowest classes'),
+                 (TEST, 'Slowest tests'),
+                 (OVERHEAD, 'Slowest module setup and teardown'))
+
+# The durations of a test in milliseconds, where trend is the change of the
+# latest duration relative to the average of the previous ones, None if it
+# only ran once.
+DurationStats = collections.namedtuple(
+    'DurationStats', ['name', 'average', 'latest', 'runs', 'trend'])
+
+
+def get_run_durations(result):
+    """Get the durations of the tests of a test result.
+
+    Args:
+        result: A dict of a test result.
+
+    Returns:
+        A dict of level to a dict of name to duration in milliseconds, where
+        the name of a class is module_name:class_name and the name of a test
+        is module_name:class_name#test_name. The duration of a module is its
+        wall time if it's recorded, the sum of its test times otherwise.
+    """
+    durations = {level: {} for level in LEVELS}
+    for module_name, test_name, _, test_time in (
+            atest_execution_info.iter_test_times(result)):
+        if test_time is None:
+            continue
+        for level, name in (
+                (MODULE, module_name),
+                (CLASS, '%s:%s' % (module_name, test_name.split('#')[0])),
+                (TEST, '%s:%s' % (module_name, test_name))):
+            durations[level][name] = durations[level].get(name, 0) + test_time
+    for module_name, (duration, overhead) in (
+            atest_execution_info.get_module_times(result).items()):
+        durations[MODULE][module_name] = duration
+        durations[OVERHEAD][module_name] = overhead
+    return durations
+
+
+def _get_stats(name, durations):
+    """Get the stats of the durations of a test.
+
+    Args:
+        name: A string of the name of the test.
+        durations: A list of the durations from the oldest to the latest.
+
+    Returns:
+        A DurationStats.
+    """
+    trend = None
+    previous = durations[:-1]
+    if previous and sum(previous):
+        baseline = sum(previous) / len(previous)
+        trend = (durations[-1] - baseline) / baseline
+    return DurationStats(name, sum(durations) // len(durations),
+                         durations[-1], len(durations), trend)
+
+
+def profile(root, max_results=PROFILE_HISTORY_SIZE):
+    """Aggregate the durations of the tests in the latest test results.
+
+    Args:
+        root: A string of the test result root path.
+        max_results: An integer of the number of latest test results to read.
+
+    Returns:
+        A dict of level to a list of DurationStats, from the slowest.
+    """
+    history = {level: collections.OrderedDict() for level in LEVELS}
+    results = atest_execution_info.load_test_results(root, max_results)
+    for _, result in reversed(results):
+        for level, durations in get_run_durations(result).items():
+            for name, duration in durations.items():
+                history[level].setdefault(name, []).append(duration)
+    return {level: sorted((_get_stats(name, durations)
+                           for name, durations in history[level].items()),
+                          key=lambda x: (-x.average, x.name))
+            for level in LEVELS}
+
+
+def _format_trend(trend):
+    """Format the trend of a test, highlighting a slowdown."""
+    if trend is None:
+        return ' ' * 6
+    text = ('%+.0f%%' % (trend * 100)).rjust(6)
+    if trend > _TREND_THRESHOLD:
+        return atest_utils.colorize(text, constants.RED)
+    if trend < -_TREND_THRESHOLD:
+        return atest_utils.colorize(text, constants.GREEN)
+    return text
+
+
+def print_report(root, top_n=TOP_N, max_results=PROFILE_HISTORY_SIZE):
+    """Print the slowest tests of the latest test results.
+
+    Args:
+        root: A string of the test result root path.
+        top_n: An integer of the number of the slowest ones per level.
+        max_results: An integer of the number of latest test results to read.
+    """
+    profiles = profile(root, max_results)
+    if not any(profiles.values()):
+        print('No test duration found in %s.' % root)
+        return
+    for level, title in _LEVEL_TITLES:
+        if not profiles[level]:
+            continue
+        header = '%s (average, latest, trend, runs)' % title
+        print(atest_utils.delimiter('-', len(header), prenl=1))
+        print(header)
+        print(atest_utils.delimiter('-', len(header)))
+        for stats in profiles[level][:top_n]:
+            print('{:>10.3f}s {:>10.3f}s {} {:>4}  {}'.format(
+                stats.average / 1000, stats.latest / 1000,
+                _format_trend(stats.trend), stats.runs, stats.name))
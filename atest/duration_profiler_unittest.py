@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for duration_profiler."""
+
+# pylint: disable=protected-access
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from io import StringIO
+
+import atest_execution_info as aei
+import duration_profiler as dp
+
+
+def _create_result(test_times, module_time=None):
+    """Create a test result of someModule.
+
+    Args:
+        test_times: A dict of test name to test time.
+        module_time: A tuple of the wall time and the overhead of the module.
+
+    Returns:
+        A dict of the test result.
+    """
+    result = {aei._TEST_RUNNER_KEY: {'someRunner': {'x86_64 someModule': {
+        aei._STATUS_PASSED_KEY: [
+            {aei._TEST_NAME_KEY: name, aei._TEST_TIME_KEY: test_time}
+            for name, test_time in sorted(test_times.items())],
+        aei._SUMMARY_KEY: {aei._STATUS_PASSED_KEY: len(test_times)}}}}}
+    if module_time:
+        result[aei._MODULE_TIME_KEY] = {'x86_64 someModule': {
+            aei._DURATION_KEY: module_time[0],
+            aei._OVERHEAD_KEY: module_time[1]}}
+    return result
+
+
+class DurationProfilerUnittests(unittest.TestCase):
+    """Unit tests for duration_profiler.py"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write_result(self, run, result):
+        """Write a test result under the result root."""
+        os.mkdir(os.path.join(self.root, run))
+        with open(os.path.join(self.root, run, 'test_result'), 'w') as f:
+            json.dump(result, f)
+
+    def test_get_run_durations(self):
+        """Test get_run_durations method."""
+        self.assertEqual(
+            {dp.MODULE: {'someModule': 50},
+             dp.CLASS: {'someModule:A': 20, 'someModule:B': 5},
+             dp.TEST: {'someModule:A#a': 10, 'someModule:A#b': 10,
+                       'someModule:B#a': 5},
+             dp.OVERHEAD: {'someModule': 25}},
+            dp.get_run_durations(_create_result(
+                {'A#a': '(10ms)', 'A#b': '(10ms)', 'B#a': '(5ms)',
+                 'B#b': ''}, (50, 25))))
+        # The module duration is the sum of its test times if not recorded.
+        self.assertEqual({'someModule': 10}, dp.get_run_durations(
+            _create_result({'A#a': '(10ms)'}))[dp.MODULE])
+
+    def test_profile(self):
+        """Test profile method."""
+        self._write_result('2020-01-01_10:00:00_1', _create_result(
+            {'A#a': '(10ms)', 'B#a': '(1.000s)'}))
+        self._write_result('2020-01-02_10:00:00_1', _create_result(
+            {'A#a': '(10ms)', 'B#a': '(1.000s)'}))
+        self._write_result('2020-01-03_10:00:00_1', _create_result(
+            {'A#a': '(40ms)'}, (100, 60)))
+        profiles = dp.profile(self.root)
+        self.assertEqual(
+            [dp.DurationStats('someModule:B#a', 1000, 1000, 2, 0.0),
+             dp.DurationStats('someModule:A#a', 20, 40, 3, 3.0)],
+            profiles[dp.TEST])
+        self.assertEqual(
+            [dp.DurationStats('someModule', 706, 100, 3, 100 / 1010 - 1)],
+            profiles[dp.MODULE])
+        self.assertEqual([dp.DurationStats('someModule', 60, 60, 1, None)],
+                         profiles[dp.OVERHEAD])
+        # The oldest results are out of the history.
+        self.assertEqual([dp.DurationStats('someModule:A#a', 40, 40, 1, None)],
+                         dp.profile(self.root, 1)[dp.TEST])
+
+    def test_print_report(self):
+        """Test print_report method."""
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            dp.print_report(self.root)
+            self.assertIn('No test duration found', capture_output.getvalue())
+            self._write_result('2020-01-01_10:00:00_1', _create_result(
+                {'A#a': '(10ms)', 'B#a': '(1.000s)'}))
+            dp.print_report(self.root, top_n=1)
+        finally:
+            sys.stdout = sys.__stdout__
+        output = capture_output.getvalue()
+        self.assertIn('Slowest tests', output)
+        self.assertIn('someModule:B#a', output)
+        self.assertNotIn('someModule:A#a', output)
+        self.assertNotIn('Slowest module setup', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
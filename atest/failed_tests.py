@@ -0,0 +1,217 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Collect the failed tests of a test run to rerun only them.
+"""
+
+import collections
+import copy
+import json
+import logging
+
+import atest_execution_info
+import atest_utils
+import constants
+
+from test_finders import test_info
+from test_runners import test_runner_base
+
+# The statuses of the tests to rerun.
+_FAILED_STATUSES = (test_runner_base.FAILED_STATUS,
+                    test_runner_base.ERROR_STATUS)
+# The keys of test_result, see atest_execution_info.AtestExecutionInfo.
+_TEST_RUNNER_KEY = 'test_runner'
+_TEST_NAME_KEY = 'test_name'
+_TEST_TIME_KEY = 'test_time'
+_SUMMARY_KEY = 'summary'
+
+
+class FailedTests:
+    """The failed tests of a test run grouped by runner, module and class.
+
+    A test failed once but passed in the same run, e.g. it passed when the
+    failed tests were rerun, isn't counted as failed.
+    """
+
+    def __init__(self):
+        # {(runner name, module name): {class name: {test name: methods}}}
+        self._failed = collections.OrderedDict()
+        self._passed = set()
+        # {(runner name, module name): milliseconds of the passed tests}
+        self._passed_times = collections.defaultdict(int)
+
+    @classmethod
+    def from_test_results(cls, test_results):
+        """Collect the failed tests from the results reported by runners.
+
+        Args:
+            test_results: A list of TestResult namedtuples.
+
+        Returns:
+            A FailedTests instance.
+        """
+        failed_tests = cls()
+        for result in test_results:
+            failed_tests.add_result(result.runner_name, result.group_name,
+                                    result.test_name, result.status,
+                                    result.test_time)
+        return failed_tests
+
+    @classmethod
+    def from_result_file(cls, path):
+        """Collect the failed tests from a test_result file.
+
+        Args:
+            path: A string of the path of the test_result file.
+
+        Returns:
+            A FailedTests instance, empty if the file can't be read.
+        """
+        failed_tests = cls()
+        try:
+            with open(path) as json_file:
+                test_runner = json.load(json_file).get(_TEST_RUNNER_KEY, {})
+        except (IOError, ValueError) as err:
+            logging.debug('Exception raised: %s', err)
+            return failed_tests
+        for runner_name, groups in test_runner.items():
+            for group_name, group in groups.items():
+                for status, results in group.items():
+                    if status == _SUMMARY_KEY:
+                        continue
+                    for result in results:
+                        failed_tests.add_result(
+                            runner_name, group_name,
+                            result.get(_TEST_NAME_KEY), status,
+                            result.get(_TEST_TIME_KEY))
+        return failed_tests
+
+    def add_result(self, runner_name, group_name, test_name, status,
+                   test_time):
+        """Add the result of a test.
+
+        Args:
+            runner_name: A string of the name of the test runner.
+            group_name: A string of the module name of the test, which may be
+                prefixed by the abi, e.g. "x86_64 hello_world_test".
+            test_name: A string of the test name, e.g. class_name#method.
+            status: A string of the status of the test.
+            test_time: A string of the test time, e.g. (2m3.456s).
+        """
+        module_name = group_name.split()[-1] if group_name else ''
+        if not module_name or not test_name:
+            logging.debug('Skip the result of %s in %s without the module or '
+                          'the test name.', test_name, runner_name)
+            return
+        key = (runner_name, module_name)
+        if status not in _FAILED_STATUSES:
+            self._passed.add((key, test_name))
+            self._passed_times[key] += atest_execution_info.parse_test_time(
+                test_time) or 0
+            return
+        class_name, _, method = test_name.partition('#')
+        methods = self._failed.setdefault(key, collections.OrderedDict())
+        methods.setdefault(class_name, {})[test_name] = method
+
+    def _get_failed_modules(self):
+        """Get the failed tests which never passed.
+
+        Returns:
+            An OrderedDict of (runner name, module name) to an OrderedDict of
+            class name to a set of failed methods, where an empty set means
+            the whole class failed.
+        """
+        modules = collections.OrderedDict()
+        for key, classes in self._failed.items():
+            for class_name, tests in classes.items():
+                failed = {method for test_name, method in tests.items()
+                          if (key, test_name) not in self._passed}
+                if failed:
+                    methods = set() if '' in failed else failed
+                    modules.setdefault(key, collections.OrderedDict())[
+                        class_name] = methods
+        return modules
+
+    def __bool__(self):
+        return bool(self._get_failed_modules())
+
+    def get_module_names(self):
+        """Get the names of the modules with failed tests.
+
+        Returns:
+            A list of module names.
+        """
+        names = []
+        for _, module_name in self._get_failed_modules():
+            if module_name not in names:
+                names.append(module_name)
+        return names
+
+    def get_test_count(self):
+        """Get the number of failed tests.
+
+        Returns:
+            An integer of the number of failed methods and classes.
+        """
+        return sum(len(methods) or 1
+                   for classes in self._get_failed_modules().values()
+                   for methods in classes.values())
+
+    def get_saved_time(self):
+        """Get the time of the tests skipped by rerunning only failed tests.
+
+        Returns:
+            An integer of the milliseconds spent on the passed tests of the
+            modules with failed tests in the run.
+        """
+        return sum(self._passed_times[key]
+                   for key in self._get_failed_modules())
+
+    def filter_test_infos(self, test_infos):
+        """Narrow the TestInfos down to the failed tests.
+
+        Args:
+            test_infos: A list of TestInfos of the tests run.
+
+        Returns:
+            A list of TestInfos filtered by the failed tests. The TestInfos of
+            modules without failed tests are dropped.
+        """
+        modules = self._get_failed_modules()
+        failed_infos = []
+        for info in test_infos:
+            key = (info.test_runner, info.test_name)
+            classes = modules.pop(key, None)
+            if not classes:
+                continue
+            failed_info = copy.copy(info)
+            failed_info.data = dict(info.data)
+            failed_info.data[constants.TI_FILTER] = frozenset(
+                test_info.TestFilter(class_name, frozenset(methods))
+                for class_name, methods in classes.items())
+            failed_infos.append(failed_info)
+        for runner_name, module_name in modules:
+            logging.warning('Cannot rerun the failed tests of %s run by %s.',
+                            module_name, runner_name)
+        return failed_infos
+
+    def print_rerun_info(self):
+        """Print the failed tests to rerun and the time saved."""
+        atest_utils.colorful_print(
+            '\nRerunning %d failed tests of %d modules, skipping the passed '
+            'tests saves %.3fs.' % (self.get_test_count(),
+                                    len(self._get_failed_modules()),
+                                    self.get_saved_time() / 1000),
+            constants.CYAN)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for failed_tests."""
+
+import json
+import os
+import tempfile
+import unittest
+
+import constants
+import failed_tests
+import unittest_constants as uc
+
+from test_finders import test_info
+from test_runners import test_runner_base
+
+RUNNER_NAME = uc.MODULE_INFO.test_runner
+CLASS2_NAME = 'android.jank.cts.ui.SomeOtherClass'
+
+
+def _test_result(group_name, test_name, status, test_time='(1ms)'):
+    """Create a TestResult of a test."""
+    return test_runner_base.TestResult(
+        runner_name=RUNNER_NAME, group_name=group_name, test_name=test_name,
+        status=status, details=None, test_count=1, test_time=test_time,
+        runner_total=None, group_total=None, additional_info={},
+        test_run_name='')
+
+
+TEST_RESULTS = [
+    _test_result('x86 ' + uc.MODULE_NAME,
+                 '%s#%s' % (uc.FULL_CLASS_NAME, uc.METHOD_NAME),
+                 test_runner_base.FAILED_STATUS),
+    _test_result('x86 ' + uc.MODULE_NAME,
+                 '%s#%s' % (uc.FULL_CLASS_NAME, uc.METHOD2_NAME),
+                 test_runner_base.PASSED_STATUS, '(1.500s)'),
+    _test_result('x86 ' + uc.MODULE_NAME, '%s#method3' % CLASS2_NAME,
+                 test_runner_base.FAILED_STATUS),
+    _test_result('x86 ' + uc.MODULE_NAME, '%s#method4' % CLASS2_NAME,
+                 test_runner_base.ERROR_STATUS),
+    _test_result('x86 ' + uc.MODULE_NAME, '%s#method4' % CLASS2_NAME,
+                 test_runner_base.PASSED_STATUS),
+    _test_result(uc.MODULE2_NAME, 'SomeClass#method',
+                 test_runner_base.PASSED_STATUS, '(2m0.000s)'),
+]
+
+
+class FailedTestsUnittests(unittest.TestCase):
+    """Unit tests for FailedTests in failed_tests.py"""
+
+    def setUp(self):
+        self.failures = failed_tests.FailedTests.from_test_results(
+            TEST_RESULTS)
+
+    def test_get_failed_tests(self):
+        """Test the failed tests of test results."""
+        self.assertTrue(self.failures)
+        # The test passed on retry isn't failed.
+        self.assertEqual(2, self.failures.get_test_count())
+        self.assertEqual([uc.MODULE_NAME], self.failures.get_module_names())
+        # Only the passed tests of the failed modules are skipped.
+        self.assertEqual(1501, self.failures.get_saved_time())
+        self.assertFalse(failed_tests.FailedTests.from_test_results(
+            TEST_RESULTS[1:2]))
+
+    def test_from_result_file(self):
+        """Test from_result_file method."""
+        test_runner = {}
+        for result in TEST_RESULTS:
+            group = test_runner.setdefault(result.runner_name, {}).setdefault(
+                result.group_name, {'summary': {}})
+            group.setdefault(result.status, []).append(
+                {'test_name': result.test_name, 'test_time': result.test_time,
+                 'details': None})
+        with tempfile.TemporaryDirectory() as result_dir:
+            path = os.path.join(result_dir, 'test_result')
+            with open(path, 'w') as result_file:
+                json.dump({'test_runner': test_runner}, result_file)
+            failures = failed_tests.FailedTests.from_result_file(path)
+            self.assertEqual(
+                self.failures.filter_test_infos(
+                    [uc.MODULE_INFO])[0].data[constants.TI_FILTER],
+                failures.filter_test_infos(
+                    [uc.MODULE_INFO])[0].data[constants.TI_FILTER])
+            self.assertFalse(failed_tests.FailedTests.from_result_file(
+                os.path.join(result_dir, 'missing')))
+
+    def test_filter_test_infos(self):
+        """Test filter_test_infos method."""
+        failed_infos = self.failures.filter_test_infos(
+            [uc.MODULE_INFO, uc.MODULE_INFO2])
+        self.assertEqual(1, len(failed_infos))
+        self.assertEqual(uc.MODULE_NAME, failed_infos[0].test_name)
+        self.assertEqual(
+            frozenset([test_info.TestFilter(uc.FULL_CLASS_NAME,
+                                            frozenset([uc.METHOD_NAME])),
+                       test_info.TestFilter(CLASS2_NAME,
+                                            frozenset(['method3']))]),
+            failed_infos[0].data[constants.TI_FILTER])
+        # The TestInfo of the test run is kept.
+        self.assertEqual(frozenset(), uc.MODULE_INFO.data[constants.TI_FILTER])
+
+    def test_filter_test_infos_of_failed_class(self):
+        """Test filter_test_infos method with a class level failure."""
+        failures = failed_tests.FailedTests.from_test_results(
+            [_test_result(uc.MODULE_NAME, uc.FULL_CLASS_NAME,
+                          test_runner_base.ERROR_STATUS)])
+        failed_infos = failures.filter_test_infos([uc.MODULE_INFO])
+        self.assertEqual(
+            frozenset([test_info.TestFilter(uc.FULL_CLASS_NAME, frozenset())]),
+            failed_infos[0].data[constants.TI_FILTER])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,335 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Index the test results under ATEST_RESULT_ROOT in a sqlite database.
+
+Each run is added to the index when atest exits, so the test history is
+queried without parsing the test_result file of every run. The result
+folders not indexed yet, e.g. those of older atest versions, are indexed
+the next time the index is synced, and only the latest MAX_RESULT_RUNS
+result folders within MAX_RESULT_BYTES are kept. The result folders never
+indexed, e.g. those of the crashed runs, and the reserved folders, e.g. the
+benchmark baselines, count towards the quota too, though only the former are
+removed.
+"""
+
+import collections
+import glob
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+import result_archive
+
+INDEX_NAME = 'history.db'
+# The number of the latest result folders to keep.
+MAX_RESULT_RUNS = 1000
+# The disk quota of the result folders in bytes.
+MAX_RESULT_BYTES = 5 * 1024 ** 3
+# The version of _SCHEMA, the index is rebuilt if it's changed.
+_SCHEMA_VERSION = 1
+# Seconds to wait for another atest writing to the index.
+_LOCK_TIMEOUT_SECS = 10
+# Seconds after which a result folder not indexed is taken as a crashed run
+# rather than a running one.
+_CRASHED_RUN_SECS = 24 * 60 * 60
+_RUN_DIR_PATTERN = '20*_*_*'
+_TEST_RESULT_NAME = 'test_result'
+# The keys of test_result, see atest_execution_info.AtestExecutionInfo.
+_ARGS_KEY = 'args'
+_TEST_RUNNER_KEY = 'test_runner'
+_TOTAL_SUMMARY_KEY = 'total_summary'
+_SUMMARY_KEY = 'summary'
+_TEST_NAME_KEY = 'test_name'
+_TEST_DETAILS_KEY = 'details'
+_PASSED = 'PASSED'
+_FAILED = 'FAILED'
+_IGNORED = 'IGNORED'
+_FAILED_STATUSES = (_FAILED, 'ERROR')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS runs ('
+    ' run_name TEXT PRIMARY KEY, args TEXT,'
+    ' passed INTEGER, failed INTEGER, ignored INTEGER, size INTEGER)',
+    'CREATE TABLE IF NOT EXISTS results ('
+    ' run_name TEXT, runner_name TEXT, module_name TEXT, test_name TEXT,'
+    ' status TEXT, details TEXT)',
+    'CREATE INDEX IF NOT EXISTS results_by_run ON results (run_name)',
+    'CREATE INDEX IF NOT EXISTS results_by_module ON results (module_name)',
+    'CREATE INDEX IF NOT EXISTS results_by_test ON results (test_name)')
+# Matches the results of a module, a class or a test. The tests of a class
+# are the names in [class#, class$), '$' being the character after '#', so
+# the range is an exact prefix under the BINARY collation that, unlike LIKE
+# or substr(), can be searched in results_by_test.
+_TEST_CONDITION = ('(module_name = :name OR test_name = :name OR'
+                   " (test_name >= :name || '#' AND test_name < :name || '$'))")
+_FAILED_CONDITION = 'status IN (%s)' % ', '.join(
+    "'%s'" % status for status in _FAILED_STATUSES)
+# The number of runs and failed runs of a test.
+_TEST_RUNS_QUERY = (
+    'SELECT COUNT(*), COALESCE(SUM(failed), 0) FROM ('
+    ' SELECT MAX(%s) AS failed FROM results WHERE %s'
+    ' GROUP BY run_name)' % (_FAILED_CONDITION, _TEST_CONDITION))
+# The last failure of a test.
+_LAST_FAILURE_QUERY = (
+    'SELECT run_name, test_name, details FROM results WHERE %s AND %s'
+    ' ORDER BY run_name DESC LIMIT 1' % (_TEST_CONDITION, _FAILED_CONDITION))
+
+# The summary of a run, where summary is a dict of status to test count.
+RunSummary = collections.namedtuple('RunSummary',
+                                    ['run_name', 'args', 'summary'])
+# The last failure of a test.
+Failure = collections.namedtuple('Failure',
+                                 ['run_name', 'test_name', 'details'])
+# The number of runs of a test, the number of them where the test failed and
+# the last Failure, None if it never failed.
+TestStats = collections.namedtuple('TestStats',
+                                   ['runs', 'failed_runs', 'last_failure'])
+
+
+class HistoryIndex:
+    """The index of the test results under a result root."""
+
+    def __init__(self, root):
+        """HistoryIndex constructor
+
+        Args:
+            root: A string of the test result root path.
+
+        Raises:
+            sqlite3.Error if the index can't be opened.
+        """
+        self.root = root
+        self._conn = sqlite3.connect(os.path.join(root, INDEX_NAME),
+                                     timeout=_LOCK_TIMEOUT_SECS)
+        with self._conn:
+            version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != _SCHEMA_VERSION:
+                # The index is rebuilt from the result folders when synced.
+                self._conn.execute('DROP TABLE IF EXISTS runs')
+                self._conn.execute('DROP TABLE IF EXISTS results')
+                self._conn.execute('PRAGMA user_version = %d' % _SCHEMA_VERSION)
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exit_type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the index."""
+        self._conn.close()
+
+    def add_run(self, run_name, result, size=0):
+        """Add a test result to the index, replacing the indexed one.
+
+        Args:
+            run_name: A string of the name of the result folder.
+            result: A dict of the test result.
+            size: An integer of the disk usage of the result folder in bytes.
+        """
+        summary = result.get(_TOTAL_SUMMARY_KEY, {})
+        rows = []
+        for runner_name, groups in result.get(_TEST_RUNNER_KEY, {}).items():
+            for group_name, group in groups.items():
+                # Remove the abi of the module, e.g. "x86_64 hello_world_test".
+                module_name = group_name.split()[-1] if group_name else ''
+                for status, tests in group.items():
+                    if status == _SUMMARY_KEY:
+                        continue
+                    for test in tests:
+                        # Only the details of the failures are queried.
+                        details = (test.get(_TEST_DETAILS_KEY)
+                                   if status in _FAILED_STATUSES else None)
+                        rows.append((run_name, runner_name, module_name,
+                                     test.get(_TEST_NAME_KEY), status,
+                                     details))
+        with self._conn:
+            self._conn.execute('DELETE FROM results WHERE run_name = ?',
+                               (run_name,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+                (run_name, result.get(_ARGS_KEY, ''),
+                 summary.get(_PASSED, 0), summary.get(_FAILED, 0),
+                 summary.get(_IGNORED, 0), size))
+            self._conn.executemany(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def _remove_runs(self, run_names):
+        """Remove the runs from the index."""
+        with self._conn:
+            for run_name in run_names:
+                self._conn.execute('DELETE FROM runs WHERE run_name = ?',
+                                   (run_name,))
+                self._conn.execute('DELETE FROM results WHERE run_name = ?',
+                                   (run_name,))
+
+    def _get_run_names(self):
+        """Get the names of the indexed runs from the oldest."""
+        return [row[0] for row in self._conn.execute(
+            'SELECT run_name FROM runs ORDER BY run_name')]
+
+    def sync(self):
+        """Index the result folders not indexed yet and drop the removed."""
+        indexed = set(self._get_run_names())
+        run_dirs = {os.path.basename(path): path for path in glob.glob(
+            os.path.join(self.root, _RUN_DIR_PATTERN))}
+        self._remove_runs(indexed - set(run_dirs))
+        for run_name in sorted(set(run_dirs) - indexed):
+            try:
+                with open(os.path.join(run_dirs[run_name],
+                                       _TEST_RESULT_NAME)) as json_file:
+                    result = json.load(json_file)
+            except (IOError, ValueError) as err:
+                # The run may be still running.
+                logging.debug('Exception raised: %s', err)
+                continue
+            self.add_run(run_name, result,
+                         result_archive.get_dir_size(run_dirs[run_name]))
+
+    def compress_logs(self, keep=()):
+        """Compress the logs of the indexed runs and update their sizes.
+
+        Args:
+            keep: A list of the names of the runs not to compress yet, e.g. the
+                current run.
+
+        Returns:
+            A tuple of the sizes in bytes of the compressed logs before and
+            after the compression.
+        """
+        original_size = compressed_size = 0
+        for run_name in self._get_run_names():
+            if run_name in keep:
+                continue
+            run_dir = os.path.join(self.root, run_name)
+            sizes = result_archive.compress_logs(run_dir)
+            if not sizes[0]:
+                continue
+            original_size += sizes[0]
+            compressed_size += sizes[1]
+            with self._conn:
+                self._conn.execute(
+                    'UPDATE runs SET size = ? WHERE run_name = ?',
+                    (result_archive.get_dir_size(run_dir), run_name))
+        return original_size, compressed_size
+
+    def _get_unindexed_runs(self):
+        """Get the result folders not indexed, e.g. of the crashed runs.
+
+        Returns:
+            A tuple of a list of (run_name, size) of the folders of the
+            crashed runs and the total size in bytes of the running ones.
+        """
+        indexed = set(self._get_run_names())
+        crashed = []
+        running_size = 0
+        for path in glob.glob(os.path.join(self.root, _RUN_DIR_PATTERN)):
+            run_name = os.path.basename(path)
+            if run_name in indexed or not os.path.isdir(path):
+                continue
+            size = result_archive.get_dir_size(path)
+            try:
+                is_crashed = (time.time() - os.path.getmtime(path)
+                              > _CRASHED_RUN_SECS)
+            except OSError as err:
+                logging.debug('Exception raised: %s', err)
+                continue
+            if is_crashed:
+                crashed.append((run_name, size))
+            else:
+                running_size += size
+        return crashed, running_size
+
+    def evict(self, max_runs=MAX_RESULT_RUNS, max_bytes=MAX_RESULT_BYTES,
+              keep=(), reserved_dirs=()):
+        """Remove the oldest result folders beyond the retention.
+
+        The folders of the crashed runs are removed along with the indexed
+        ones, and the running ones and the reserved folders count towards
+        max_bytes but are never removed.
+
+        Args:
+            max_runs: An integer of the number of the latest runs to keep.
+            max_bytes: An integer of the disk quota of the result folders.
+            keep: A list of the names of the runs never to remove, e.g. the
+                current run.
+            reserved_dirs: A list of the paths of the folders under the result
+                root never to remove, e.g. the benchmark baselines.
+
+        Returns:
+            A tuple of a list of the names of the runs removed and the bytes
+            reclaimed.
+        """
+        runs, running_size = self._get_unindexed_runs()
+        runs = sorted(runs + self._conn.execute(
+            'SELECT run_name, size FROM runs').fetchall())
+        run_count = len(runs)
+        total_size = running_size + sum(size for _, size in runs) + sum(
+            result_archive.get_dir_size(path) for path in reserved_dirs)
+        evicted = []
+        reclaimed = 0
+        for run_name, size in runs:
+            if run_count <= max_runs and total_size <= max_bytes:
+                break
+            if run_name in keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, run_name),
+                          ignore_errors=True)
+            evicted.append(run_name)
+            reclaimed += size
+            run_count -= 1
+            total_size -= size
+        self._remove_runs(evicted)
+        return evicted, reclaimed
+
+    def get_runs(self, limit):
+        """Get the latest runs.
+
+        Args:
+            limit: An integer of the number of runs to get.
+
+        Returns:
+            A list of RunSummary from the latest.
+        """
+        return [RunSummary(run_name, args, collections.OrderedDict(
+            ((_PASSED, passed), (_FAILED, failed), (_IGNORED, ignored))))
+                for run_name, args, passed, failed, ignored in
+                self._conn.execute(
+                    'SELECT run_name, args, passed, failed, ignored FROM runs'
+                    ' ORDER BY run_name DESC LIMIT ?', (limit,))]
+
+    def get_test_stats(self, name):
+        """Get the pass rate and the last failure of a test.
+
+        Args:
+            name: A string of a module name, a class name as reported, e.g.
+                com.android.Test, or a test name, e.g. com.android.Test#test.
+
+        Returns:
+            A TestStats.
+        """
+        params = {'name': name}
+        runs, failed_runs = self._conn.execute(
+            _TEST_RUNS_QUERY, params).fetchone()
+        last_failure = self._conn.execute(
+            _LAST_FAILURE_QUERY, params).fetchone()
+        return TestStats(runs, failed_runs,
+                         Failure(*last_failure) if last_failure else None)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for history_index."""
+
+# pylint: disable=protected-access
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import history_index
+
+
+def _create_result(status, details=None, args='someTest'):
+    """Create a test result of someModule with a test of the status."""
+    group = {'PASSED': [{'test_name': 'otherClass#b', 'test_time': '(1ms)',
+                         'details': None}]}
+    group.setdefault(status, []).append(
+        {'test_name': 'someClass#a', 'test_time': '(10ms)',
+         'details': details})
+    return {'args': args,
+            'test_runner': {'someRunner': {'x86_64 someModule': group}},
+            'total_summary': {'PASSED': 1, 'FAILED': 0, 'IGNORED': 0}}
+
+
+class HistoryIndexUnittests(unittest.TestCase):
+    """Unit tests for history_index.py"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.index = history_index.HistoryIndex(self.root)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.root)
+
+    def _write_result(self, run, result):
+        """Write a test result under the result root."""
+        os.mkdir(os.path.join(self.root, run))
+        if result is not None:
+            with open(os.path.join(self.root, run, 'test_result'), 'w') as f:
+                json.dump(result, f)
+
+    def test_add_run(self):
+        """Test add_run method replaces the indexed run."""
+        self.index.add_run('2020-01-01_10:00:00_1',
+                           _create_result('FAILED', 'trace'))
+        self.index.add_run('2020-01-01_10:00:00_1', _create_result('PASSED'))
+        self.assertEqual(
+            [history_index.RunSummary(
+                '2020-01-01_10:00:00_1', 'someTest',
+                {'PASSED': 1, 'FAILED': 0, 'IGNORED': 0})],
+            self.index.get_runs(5))
+        self.assertEqual(history_index.TestStats(1, 0, None),
+                         self.index.get_test_stats('someClass#a'))
+
+    def test_sync(self):
+        """Test sync method indexes the new runs and drops the removed."""
+        self._write_result('2020-01-01_10:00:00_1', _create_result('PASSED'))
+        self._write_result('2020-01-02_10:00:00_1', _create_result('PASSED'))
+        # A running test without test_result yet.
+        self._write_result('2020-01-03_10:00:00_1', None)
+        self.index.sync()
+        self.assertEqual(['2020-01-02_10:00:00_1', '2020-01-01_10:00:00_1'],
+                         [run.run_name for run in self.index.get_runs(5)])
+        shutil.rmtree(os.path.join(self.root, '2020-01-01_10:00:00_1'))
+        self.index.sync()
+        self.assertEqual(['2020-01-02_10:00:00_1'],
+                         [run.run_name for run in self.index.get_runs(5)])
+
+    def test_get_runs(self):
+        """Test get_runs method returns the latest runs."""
+        for day in range(1, 4):
+            self.index.add_run('2020-01-0%d_10:00:00_1' % day,
+                               _create_result('PASSED', args=str(day)))
+        self.assertEqual(['3', '2'],
+                         [run.args for run in self.index.get_runs(2)])
+
+    def test_get_test_stats(self):
+        """Test get_test_stats method by module, class and test."""
+        self.index.add_run('2020-01-01_10:00:00_1',
+                           _create_result('FAILED', 'old trace'))
+        self.index.add_run('2020-01-02_10:00:00_1',
+                           _create_result('ERROR', 'new trace'))
+        self.index.add_run('2020-01-03_10:00:00_1', _create_result('PASSED'))
+        last_failure = history_index.Failure(
+            '2020-01-02_10:00:00_1', 'someClass#a', 'new trace')
+        for name in ('someModule', 'someClass', 'someClass#a'):
+            self.assertEqual(history_index.TestStats(3, 2, last_failure),
+                             self.index.get_test_stats(name))
+        self.assertEqual(history_index.TestStats(3, 0, None),
+                         self.index.get_test_stats('otherClass#b'))
+        self.assertEqual(history_index.TestStats(0, 0, None),
+                         self.index.get_test_stats('someClass#b'))
+        # The class name is matched exactly, not as a LIKE pattern.
+        for name in ('someclass', 'some_lass', 'some%'):
+            self.assertEqual(history_index.TestStats(0, 0, None),
+                             self.index.get_test_stats(name))
+
+    def test_get_test_stats_plan(self):
+        """Test get_test_stats searches the indexes instead of a scan."""
+        for query in (history_index._TEST_RUNS_QUERY,
+                      history_index._LAST_FAILURE_QUERY):
+            plan = ' '.join(row[-1] for row in self.index._conn.execute(
+                'EXPLAIN QUERY PLAN ' + query, {'name': 'someClass'}))
+            self.assertNotRegex(plan, 'SCAN (TABLE )?results')
+            self.assertIn('results_by_module (module_name=?)', plan)
+            self.assertIn('results_by_test (test_name=?)', plan)
+            self.assertIn('results_by_test (test_name>? AND test_name<?)',
+                          plan)
+
+    def test_evict(self):
+        """Test evict method removes the oldest runs but the kept ones."""
+        for day in range(1, 5):
+            self._write_result('2020-01-0%d_10:00:00_1' % day,
+                               _create_result('PASSED'))
+        self.index.sync()
+        self.assertEqual(([], 0), self.index.evict(4))
+        evicted, reclaimed = self.index.evict(
+            2, keep=('2020-01-01_10:00:00_1',))
+        self.assertEqual(['2020-01-02_10:00:00_1', '2020-01-03_10:00:00_1'],
+                         evicted)
+        self.assertGreater(reclaimed, 0)
+        self.assertEqual(['2020-01-01_10:00:00_1', '2020-01-04_10:00:00_1'],
+                         sorted(name for name in os.listdir(self.root)
+                                if name != history_index.INDEX_NAME))
+        self.assertEqual(['2020-01-04_10:00:00_1', '2020-01-01_10:00:00_1'],
+                         [run.run_name for run in self.index.get_runs(5)])
+
+    def test_evict_quota(self):
+        """Test evict method removes the oldest runs beyond the disk quota."""
+        for day, size in ((1, 300), (2, 200), (3, 100)):
+            self.index.add_run('2020-01-0%d_10:00:00_1' % day,
+                               _create_result('PASSED'), size)
+        self.assertEqual((['2020-01-01_10:00:00_1'], 300),
+                         self.index.evict(max_bytes=300))
+        self.assertEqual(([], 0), self.index.evict(max_bytes=300))
+
+    def test_evict_unindexed(self):
+        """Test evict method counts the unindexed and the reserved folders."""
+        self.index.add_run('2020-01-02_10:00:00_1', _create_result('PASSED'),
+                           100)
+        for run in ('2020-01-01_10:00:00_1', '2020-01-03_10:00:00_1',
+                    'benchmark_baseline'):
+            os.mkdir(os.path.join(self.root, run))
+            with open(os.path.join(self.root, run, 'log'), 'w') as f:
+                f.write('x' * 100)
+        # The first run crashed a day ago, and the third is still running.
+        crashed_time = time.time() - history_index._CRASHED_RUN_SECS - 1
+        os.utime(os.path.join(self.root, '2020-01-01_10:00:00_1'),
+                 (crashed_time, crashed_time))
+        reserved_dirs = (os.path.join(self.root, 'benchmark_baseline'),)
+        self.assertEqual((['2020-01-01_10:00:00_1', '2020-01-02_10:00:00_1'],
+                          200),
+                         self.index.evict(max_bytes=200,
+                                          reserved_dirs=reserved_dirs))
+        self.assertEqual(['2020-01-03_10:00:00_1', 'benchmark_baseline'],
+                         sorted(name for name in os.listdir(self.root)
+                                if name != history_index.INDEX_NAME))
+
+    def test_compress_logs(self):
+        """Test compress_logs method updates the sizes of the runs."""
+        for day in (1, 2):
+            run = '2020-01-0%d_10:00:00_1' % day
+            self._write_result(run, _create_result('PASSED'))
+            os.mkdir(os.path.join(self.root, run, 'log'))
+            with open(os.path.join(self.root, run, 'log', 'host_log.txt'),
+                      'w') as f:
+                f.write('host log line\n' * 1000)
+        self.index.sync()
+        original_size, compressed_size = self.index.compress_logs(
+            keep=('2020-01-02_10:00:00_1',))
+        self.assertEqual(14000, original_size)
+        self.assertLess(compressed_size, 1000)
+        self.assertEqual((0, 0), self.index.compress_logs(
+            keep=('2020-01-02_10:00:00_1',)))
+        evicted, reclaimed = self.index.evict(1)
+        self.assertEqual(['2020-01-01_10:00:00_1'], evicted)
+        self.assertLess(reclaimed, 1000)
+
+    def test_rebuild_index(self):
+        """Test the index of an older schema is rebuilt."""
+        self.index.add_run('2020-01-01_10:00:00_1', _create_result('PASSED'))
+        self.index._conn.execute('PRAGMA user_version = 0')
+        self.index.close()
+        self.index = history_index.HistoryIndex(self.root)
+        self.assertEqual([], self.index.get_runs(5))
+
+if __name__ == '__main__':
+    unittest.main()
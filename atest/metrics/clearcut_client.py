@@ -21,17 +21,31 @@ This class is intended to be general-purpose, usable for any Clearcut LogSource.
     client = clearcut.Clearcut(clientanalytics_pb2.LogRequest.MY_LOGSOURCE)
     client.log(my_event)
     client.flush_events()
+
+The events are buffered in memory and sent by a single background thread,
+which serializes them to a LogRequest per batch. If a spool folder is given,
+each batch is written to it before it's sent and removed once sent, so the
+batches not sent, e.g. on an offline machine or at exit, are sent by a later
+client. A batch is claimed by renaming it before it's sent, so the clients of
+the concurrent processes never send the same batch.
 """
 
+import collections
+import errno
 import logging
+import os
+import tempfile
 import threading
 import time
+import uuid
 
 from urllib.request import urlopen
 from urllib.request import Request
 from urllib.request import HTTPError
 from urllib.request import URLError
 
+from http import HTTPStatus
+
 from proto import clientanalytics_pb2
 
 _CLEARCUT_PROD_URL = 'https://play.googleapis.com/log'
@@ -39,12 +53,22 @@ _DEFAULT_BUFFER_SIZE = 100  # Maximum number of events to be buffered.
 _DEFAULT_FLUSH_INTERVAL_SEC = 60  # 1 Minute.
 _BUFFER_FLUSH_RATIO = 0.5  # Flush buffer when we exceed this ratio.
 _CLIENT_TYPE = 6
+# The max seconds flush_events waits for the sender, so it never delays exit.
+_FLUSH_TIMEOUT_SEC = 1
+_REQUEST_TIMEOUT_SEC = 10
+_SPOOL_SUFFIX = '.pb'
+# The suffix of a batch claimed by a process, after its pid.
+_CLAIMED_SUFFIX = '.sending'
+# Seconds to wait after a 429 response without a valid Retry-After header.
+_DEFAULT_RETRY_AFTER_SEC = 60
+# The max number of the batches kept in the spool folder.
+_MAX_SPOOL_FILES = 100
 
 class Clearcut:
     """Handles logging to Clearcut."""
 
     def __init__(self, log_source, url=None, buffer_size=None,
-                 flush_interval_sec=None):
+                 flush_interval_sec=None, spool_dir=None):
         """Initializes a Clearcut client.
 
         Args:
@@ -52,38 +76,121 @@ class Clearcut:
             url: The Clearcut url to connect to.
             buffer_size: The size of the client buffer in number of events.
             flush_interval_sec: The flush interval in seconds.
+            spool_dir: The folder to keep the batches not sent yet, None not
+                       to keep them.
         """
         self._clearcut_url = url if url else _CLEARCUT_PROD_URL
         self._log_source = log_source
         self._buffer_size = buffer_size if buffer_size else _DEFAULT_BUFFER_SIZE
-        self._pending_events = []
+        # The oldest events are dropped once the buffer is full.
+        self._pending_events = collections.deque(maxlen=self._buffer_size)
         if flush_interval_sec:
             self._flush_interval_sec = flush_interval_sec
         else:
             self._flush_interval_sec = _DEFAULT_FLUSH_INTERVAL_SEC
-        self._pending_events_lock = threading.Lock()
-        self._scheduled_flush_thread = None
-        self._scheduled_flush_time = float('inf')
+        self._spool_dir = spool_dir
+        self._condition = threading.Condition()
+        # flush_events increases _flush_requests, and the sender sets
+        # _flushed_requests to it once the events logged before are handled.
+        self._flush_requests = 0
+        self._flushed_requests = 0
+        self._sender_thread = None
         self._min_next_request_time = 0
 
     def log(self, event):
         """Logs events to Clearcut.
 
-        Logging an event can potentially trigger a flush of queued events.
-        Flushing is triggered when the buffer is more than half full or
-        after the flush interval has passed.
+        Logging an event never blocks on the network. It can potentially
+        trigger a flush of queued events, which is when the buffer is more
+        than half full or after the flush interval has passed.
 
         Args:
           event: A LogEvent to send to Clearcut.
         """
-        self._append_events_to_buffer([event])
+        with self._condition:
+            self._pending_events.append(event)
+            self._start_sender()
+            self._condition.notify()
 
-    def flush_events(self):
-        """ Cancel whatever is scheduled and schedule an immediate flush."""
-        if self._scheduled_flush_thread:
-            self._scheduled_flush_thread.cancel()
-        self._min_next_request_time = 0
-        self._schedule_flush_thread(0)
+    def flush_events(self, timeout=_FLUSH_TIMEOUT_SEC):
+        """Flush the queued events, waiting for the sender up to timeout.
+
+        The events the sender doesn't take in time are spooled, and the batch
+        being sent is already spooled, so nothing is lost on exit.
+
+        Args:
+            timeout: The max seconds to wait.
+
+        Returns:
+            True if the events were handled in time, False otherwise.
+        """
+        with self._condition:
+            self._flush_requests += 1
+            flush_request = self._flush_requests
+            self._start_sender()
+            self._condition.notify()
+            flushed = self._condition.wait_for(
+                lambda: self._flushed_requests >= flush_request, timeout)
+            if flushed:
+                return True
+            events = list(self._pending_events)
+            self._pending_events.clear()
+        logging.debug('Clearcut sender timed out, spooling %d events.',
+                      len(events))
+        if events:
+            self._spool(self._serialize_events_to_proto(events))
+        return False
+
+    def _start_sender(self):
+        """Start the sender thread if it's not started."""
+        if not self._sender_thread:
+            # The sender is a daemon so an unreachable server never delays
+            # exit, whose batch is in the spool.
+            self._sender_thread = threading.Thread(target=self._send_loop,
+                                                   name='ClearcutSender',
+                                                   daemon=True)
+            self._sender_thread.start()
+
+    def _is_ready_to_send(self):
+        """Check whether a flush is requested or the buffer is half full."""
+        return (self._flush_requests > self._flushed_requests
+                or len(self._pending_events) >= int(self._buffer_size *
+                                                    _BUFFER_FLUSH_RATIO))
+
+    def _get_wait_time(self, unsent):
+        """Get the max seconds to wait for the events.
+
+        Args:
+            unsent: True if some spooled batches are not sent yet.
+
+        Returns:
+            The seconds until the throttled batches can be sent, or the flush
+            interval.
+        """
+        throttled_sec = self._min_next_request_time - time.time()
+        if unsent and throttled_sec > 0:
+            return min(throttled_sec, self._flush_interval_sec)
+        return self._flush_interval_sec
+
+    def _send_loop(self):
+        """Send the events in batches, which runs in the sender thread."""
+        self._release_orphans()
+        unsent = not self._send_spool()
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._is_ready_to_send,
+                                         self._get_wait_time(unsent))
+                events = list(self._pending_events)
+                self._pending_events.clear()
+                flush_request = self._flush_requests
+            if events:
+                unsent = not self._flush(events)
+            elif unsent:
+                # Retry the batches throttled or failed before.
+                unsent = not self._send_spool()
+            with self._condition:
+                self._flushed_requests = flush_request
+                self._condition.notify_all()
 
     def _serialize_events_to_proto(self, events):
         log_request = clientanalytics_pb2.LogRequest()
@@ -94,53 +201,157 @@ class Clearcut:
         log_request.log_event.extend(events)
         return log_request
 
-    def _append_events_to_buffer(self, events, retry=False):
-        with self._pending_events_lock:
-            self._pending_events.extend(events)
-            if len(self._pending_events) > self._buffer_size:
-                index = len(self._pending_events) - self._buffer_size
-                del self._pending_events[:index]
-            self._schedule_flush(retry)
-
-    def _schedule_flush(self, retry):
-        if (not retry
-                and len(self._pending_events) >= int(self._buffer_size *
-                                                     _BUFFER_FLUSH_RATIO)
-                and self._scheduled_flush_time > time.time()):
-            # Cancel whatever is scheduled and schedule an immediate flush.
-            if self._scheduled_flush_thread:
-                self._scheduled_flush_thread.cancel()
-            self._schedule_flush_thread(0)
-        elif self._pending_events and not self._scheduled_flush_thread:
-            # Schedule a flush to run later.
-            self._schedule_flush_thread(self._flush_interval_sec)
-
-    def _schedule_flush_thread(self, time_from_now):
-        min_wait_sec = self._min_next_request_time - time.time()
-        if min_wait_sec > time_from_now:
-            time_from_now = min_wait_sec
-        logging.debug('Scheduling thread to run in %f seconds', time_from_now)
-        self._scheduled_flush_thread = threading.Timer(
-            time_from_now, self._flush)
-        self._scheduled_flush_time = time.time() + time_from_now
-        self._scheduled_flush_thread.start()
-
-    def _flush(self):
+    def _is_throttled(self):
+        """Check whether the server asked to wait before the next request."""
+        if self._min_next_request_time > time.time():
+            logging.debug('Clearcut requests are throttled.')
+            return True
+        return False
+
+    def _flush(self, events):
         """Flush buffered events to Clearcut.
 
-        If the sent request is unsuccessful, the events will be appended to
-        buffer and rescheduled for next flush.
+        The batch is spooled and sent after the batches spooled before. If
+        it can't be sent, e.g. throttled or unsuccessful, it's left in the
+        spool to be retried, or dropped if there's no spool folder.
+
+        Args:
+            events: A list of LogEvent.
+
+        Returns:
+            True if the batch and the spooled ones are sent, False otherwise.
         """
-        with self._pending_events_lock:
-            self._scheduled_flush_time = float('inf')
-            self._scheduled_flush_thread = None
-            events = self._pending_events
-            self._pending_events = []
-        if self._min_next_request_time > time.time():
-            self._append_events_to_buffer(events, retry=True)
-            return
         log_request = self._serialize_events_to_proto(events)
-        self._send_to_clearcut(log_request.SerializeToString())
+        if self._spool_dir and self._spool(log_request):
+            return self._send_spool()
+        if self._is_throttled():
+            return False
+        return self._send_to_clearcut(log_request.SerializeToString())
+
+    def _spool(self, log_request):
+        """Write a LogRequest to the spool folder.
+
+        Args:
+            log_request: A LogRequest.
+
+        Returns:
+            A string of the spooled file path, None if not spooled.
+        """
+        if not self._spool_dir:
+            return None
+        try:
+            os.makedirs(self._spool_dir, exist_ok=True)
+            # The name starts with the time so the oldest is sent first.
+            path = os.path.join(self._spool_dir, '%020d_%s%s' % (
+                time.time_ns(), uuid.uuid4().hex, _SPOOL_SUFFIX))
+            with tempfile.NamedTemporaryFile(dir=self._spool_dir,
+                                             delete=False) as spool_file:
+                spool_file.write(log_request.SerializeToString())
+            os.replace(spool_file.name, path)
+            for old_path in self._get_spooled()[:-_MAX_SPOOL_FILES]:
+                self._remove_spool(old_path)
+            return path
+        except (IOError, OSError) as err:
+            logging.debug('Exception raised: %s', err)
+            return None
+
+    def _get_spooled(self):
+        """Get the paths of the spooled batches from the oldest."""
+        try:
+            return sorted(os.path.join(self._spool_dir, name)
+                          for name in os.listdir(self._spool_dir)
+                          if name.endswith(_SPOOL_SUFFIX))
+        except OSError:
+            return []
+
+    @staticmethod
+    def _remove_spool(path):
+        """Remove a spooled batch."""
+        if not path:
+            return
+        try:
+            os.remove(path)
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+
+    @staticmethod
+    def _claim(path):
+        """Claim a spooled batch by renaming it with the pid of the process.
+
+        Args:
+            path: A string of the spooled file path.
+
+        Returns:
+            A string of the claimed file path, None if another client claimed
+            it first.
+        """
+        claimed_path = '%s.%d%s' % (path, os.getpid(), _CLAIMED_SUFFIX)
+        try:
+            os.rename(path, claimed_path)
+            return claimed_path
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+            return None
+
+    @staticmethod
+    def _release(claimed_path):
+        """Return a claimed batch to the spool for a later attempt."""
+        try:
+            os.rename(claimed_path, claimed_path.rsplit('.', 2)[0])
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+
+    @staticmethod
+    def _is_running(pid):
+        """Check whether a process is running."""
+        try:
+            os.kill(pid, 0)
+        except OSError as err:
+            return err.errno != errno.ESRCH
+        return True
+
+    def _release_orphans(self):
+        """Release the batches claimed by the processes exited in sending."""
+        try:
+            names = os.listdir(self._spool_dir) if self._spool_dir else []
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith(_CLAIMED_SUFFIX):
+                continue
+            pid = name.rsplit('.', 2)[1]
+            if pid.isdigit() and not self._is_running(int(pid)):
+                self._release(os.path.join(self._spool_dir, name))
+
+    def _send_spool(self):
+        """Send the spooled batches from the oldest.
+
+        It stops at the first batch not sent, e.g. while offline or
+        throttled, which is left in the spool.
+
+        Returns:
+            True if all the spooled batches are sent, False otherwise.
+        """
+        if not self._spool_dir:
+            return True
+        for path in self._get_spooled():
+            if self._is_throttled():
+                return False
+            claimed_path = self._claim(path)
+            if not claimed_path:
+                continue
+            try:
+                with open(claimed_path, 'rb') as spool_file:
+                    data = spool_file.read()
+            except (IOError, OSError) as err:
+                logging.debug('Exception raised: %s', err)
+                self._release(claimed_path)
+                continue
+            if not self._send_to_clearcut(data):
+                self._release(claimed_path)
+                return False
+            self._remove_spool(claimed_path)
+        return True
 
     #pylint: disable=broad-except
     def _send_to_clearcut(self, data):
@@ -148,10 +359,13 @@ class Clearcut:
 
         Args:
             data: The serialized proto to send to Clearcut.
+
+        Returns:
+            True if the request is sent or rejected, False otherwise.
         """
         request = Request(self._clearcut_url, data=data)
         try:
-            response = urlopen(request)
+            response = urlopen(request, timeout=_REQUEST_TIMEOUT_SEC)
             msg = response.read()
             logging.debug('LogRequest successfully sent to Clearcut.')
             log_response = clientanalytics_pb2.LogResponse()
@@ -161,10 +375,20 @@ class Clearcut:
             self._min_next_request_time = (log_response.next_request_wait_millis
                                            / 1000 + time.time())
             logging.debug('LogResponse: %s', log_response)
+            return True
         except HTTPError as e:
             logging.debug('Failed to push events to Clearcut. Error code: %d',
                           e.code)
+            if e.code == HTTPStatus.TOO_MANY_REQUESTS:
+                retry_after = (e.headers or {}).get('Retry-After', '')
+                self._min_next_request_time = time.time() + (
+                    int(retry_after) if retry_after.isdigit()
+                    else _DEFAULT_RETRY_AFTER_SEC)
+                return False
+            # A request rejected by the server fails again if it's resent.
+            return e.code < 500
         except URLError:
             logging.debug('Failed to push events to Clearcut.')
         except Exception as e:
             logging.debug(e)
+        return False
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for clearcut_client."""
+
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from http import server
+
+from metrics import clearcut_client
+from proto import clientanalytics_pb2
+
+LOG_SOURCE = 934
+
+
+class _ClearcutHandler(server.BaseHTTPRequestHandler):
+    """Stand-in of the Clearcut server, which records the LogRequests."""
+
+    def do_POST(self):
+        """Record a LogRequest and respond a LogResponse."""
+        data = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.server.delay)
+        if self.server.throttled:
+            self.server.throttled -= 1
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        log_request = clientanalytics_pb2.LogRequest()
+        log_request.ParseFromString(data)
+        self.server.requests.append(log_request)
+        response = clientanalytics_pb2.LogResponse()
+        response.next_request_wait_millis = 0
+        body = response.SerializeToString()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # pylint: disable=redefined-builtin
+    def log_message(self, format, *args):
+        """Keep the test output quiet."""
+
+
+def _make_event(value):
+    """Make a LogEvent."""
+    event = clientanalytics_pb2.LogEvent()
+    event.event_time_ms = value
+    return event
+
+
+def _get_unused_url():
+    """Get the url of a port nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return 'http://127.0.0.1:%d/log' % sock.getsockname()[1]
+
+
+#pylint: disable=protected-access
+class ClearcutUnittests(unittest.TestCase):
+    """Unit tests for clearcut_client.py"""
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.server = server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                 _ClearcutHandler)
+        self.server.requests = []
+        self.server.delay = 0
+        # The number of the requests to respond 429.
+        self.server.throttled = 0
+        self.server_thread = threading.Thread(target=self.server.serve_forever,
+                                              daemon=True)
+        self.server_thread.start()
+        self.url = 'http://127.0.0.1:%d/log' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.spool_dir)
+
+    def _get_sent_events(self):
+        """Get the event_time_ms of the events received by the server."""
+        return [event.event_time_ms for request in self.server.requests
+                for event in request.log_event]
+
+    def _wait_for_requests(self, count):
+        """Wait for the server to receive the requests."""
+        for _ in range(100):
+            if len(self.server.requests) >= count:
+                break
+            time.sleep(0.1)
+
+    def test_flush_events(self):
+        """Test the events are sent in a batch by flush_events."""
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=self.url,
+                                          spool_dir=self.spool_dir)
+        for value in range(3):
+            client.log(_make_event(value))
+        self.assertTrue(client.flush_events(timeout=10))
+        self.assertEqual([0, 1, 2], self._get_sent_events())
+        self.assertEqual(LOG_SOURCE, self.server.requests[0].log_source)
+        self.assertEqual([], os.listdir(self.spool_dir))
+
+    def test_flush_half_full_buffer(self):
+        """Test the events are sent once the buffer is half full."""
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=self.url,
+                                          buffer_size=4)
+        client.log(_make_event(1))
+        client.log(_make_event(2))
+        self._wait_for_requests(1)
+        self.assertEqual([1, 2], self._get_sent_events())
+
+    def test_offline_spool(self):
+        """Test the events are spooled while offline and sent by next run."""
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=_get_unused_url(),
+                                          spool_dir=self.spool_dir)
+        client.log(_make_event(1))
+        self.assertTrue(client.flush_events(timeout=10))
+        self.assertEqual(1, len(os.listdir(self.spool_dir)))
+
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=self.url,
+                                          spool_dir=self.spool_dir)
+        client.log(_make_event(2))
+        self.assertTrue(client.flush_events(timeout=10))
+        self.assertEqual([1, 2], self._get_sent_events())
+        self.assertEqual([], os.listdir(self.spool_dir))
+
+    def test_flush_events_timeout(self):
+        """Test flush_events returns in time and spools the slow batch."""
+        self.server.delay = 3
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=self.url,
+                                          spool_dir=self.spool_dir)
+        client.log(_make_event(1))
+        start = time.time()
+        self.assertFalse(client.flush_events(timeout=0.2))
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(1, len(os.listdir(self.spool_dir)))
+
+    def test_retry_throttled(self):
+        """Test the batch responded 429 is resent by the same client."""
+        self.server.throttled = 1
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=self.url,
+                                          spool_dir=self.spool_dir)
+        client.log(_make_event(1))
+        self.assertTrue(client.flush_events(timeout=10))
+        self.assertEqual([], self.server.requests)
+        self.assertEqual(1, len(os.listdir(self.spool_dir)))
+        self._wait_for_requests(1)
+        # Wait for the sender to remove the sent batch.
+        self.assertTrue(client.flush_events(timeout=10))
+        self.assertEqual([1], self._get_sent_events())
+        self.assertEqual([], os.listdir(self.spool_dir))
+
+    def test_claimed_spool(self):
+        """Test the batches claimed by a running process aren't resent."""
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=self.url,
+                                          spool_dir=self.spool_dir)
+        running_path = client._claim(client._spool(
+            client._serialize_events_to_proto([_make_event(1)])))
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        exited_path = client._spool(
+            client._serialize_events_to_proto([_make_event(2)]))
+        os.rename(exited_path, '%s.%d%s' % (exited_path, exited.pid,
+                                            clearcut_client._CLAIMED_SUFFIX))
+        client.log(_make_event(3))
+        self.assertTrue(client.flush_events(timeout=10))
+        self.assertEqual([2, 3], self._get_sent_events())
+        self.assertEqual([os.path.basename(running_path)],
+                         os.listdir(self.spool_dir))
+
+    def test_spool_limit(self):
+        """Test the oldest batches are dropped beyond the spool limit."""
+        client = clearcut_client.Clearcut(LOG_SOURCE, url=self.url,
+                                          spool_dir=self.spool_dir)
+        for value in range(clearcut_client._MAX_SPOOL_FILES + 2):
+            client._spool(client._serialize_events_to_proto(
+                [_make_event(value)]))
+        spooled = client._get_spooled()
+        self.assertEqual(clearcut_client._MAX_SPOOL_FILES, len(spooled))
+        with open(spooled[0], 'rb') as spool_file:
+            log_request = clientanalytics_pb2.LogRequest()
+            log_request.ParseFromString(spool_file.read())
+        self.assertEqual(2, log_request.log_event[0].event_time_ms)
+
+
+if __name__ == '__main__':
+    unittest.main()
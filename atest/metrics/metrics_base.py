@@ -95,7 +95,8 @@ class MetricsBase:
         _user_key = asuite_metrics.DUMMY_UUID
     _user_type = get_user_type()
     _log_source = ATEST_LOG_SOURCE[_user_type]
-    cc = clearcut_client.Clearcut(_log_source)
+    cc = clearcut_client.Clearcut(_log_source,
+                                  spool_dir=constants.METRICS_SPOOL_DIR)
     tool_name = None
 
     def __new__(cls, **kwargs):
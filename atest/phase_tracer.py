@@ -0,0 +1,170 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Trace the phases of an atest run in the Chrome trace event format.
+
+With --trace, the spans of the phases, e.g. the module-info load, each finder
+attempt or the build, are recorded and saved to trace.json in the test result
+folder, which is opened by chrome://tracing or https://ui.perfetto.dev. The
+spans on the same thread nest by their times. Nothing is recorded unless the
+tracer is enabled.
+"""
+
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+TRACE_NAME = 'trace.json'
+_CATEGORY = 'atest'
+_US_PER_SEC = 1000000
+
+
+class _Tracer:
+    """The recorded events of the run."""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        # The names of the threads of the recorded events, keyed by their ids.
+        self.thread_names = {}
+
+    def get_tid(self):
+        """Get the id of the current thread and remember its name."""
+        thread = threading.current_thread()
+        self.thread_names.setdefault(thread.ident, thread.name)
+        return thread.ident
+
+
+_TRACER = _Tracer()
+
+
+def enable():
+    """Start recording the spans."""
+    _TRACER.enabled = True
+
+
+def is_enabled():
+    """Check whether the spans are recorded."""
+    return _TRACER.enabled
+
+
+def reset():
+    """Stop recording and drop the recorded events."""
+    _TRACER.enabled = False
+    del _TRACER.events[:]
+    _TRACER.thread_names.clear()
+
+
+def add_span(name, start, end, **args):
+    """Record a span of the given times.
+
+    Args:
+        name: A string of the span name.
+        start: A float of the start time in seconds since the epoch.
+        end: A float of the end time in seconds since the epoch.
+        **args: The details of the span shown in the trace viewer.
+    """
+    if not _TRACER.enabled:
+        return
+    _TRACER.events.append({'name': name, 'cat': _CATEGORY, 'ph': 'X',
+                           'ts': int(start * _US_PER_SEC),
+                           'dur': int((end - start) * _US_PER_SEC),
+                           'pid': os.getpid(), 'tid': _TRACER.get_tid(),
+                           'args': args})
+
+
+def instant(name, **args):
+    """Record an instant event, e.g. the first event received from TF.
+
+    Args:
+        name: A string of the event name.
+        **args: The details of the event shown in the trace viewer.
+    """
+    if not _TRACER.enabled:
+        return
+    _TRACER.events.append({'name': name, 'cat': _CATEGORY, 'ph': 'i',
+                           's': 'p', 'ts': int(time.time() * _US_PER_SEC),
+                           'pid': os.getpid(), 'tid': _TRACER.get_tid(),
+                           'args': args})
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Record a span of the enclosed code.
+
+    Usage:
+        with phase_tracer.span('module_info_load'):
+            mod_info = module_info.ModuleInfo()
+
+    Args:
+        name: A string of the span name.
+        **args: The details of the span shown in the trace viewer.
+    """
+    if not _TRACER.enabled:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_span(name, start, time.time(), **args)
+
+
+def traced(name):
+    """Decorate a function to record a span of each call.
+
+    Args:
+        name: A string of the span name.
+
+    Returns:
+        The decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def save(path, metadata=None):
+    """Save the recorded events to a Chrome trace event JSON file.
+
+    Args:
+        path: A string of the trace file path.
+        metadata: A dict of the details of the run, e.g. the atest version.
+
+    Returns:
+        True if the trace is saved, False otherwise.
+    """
+    pid = os.getpid()
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+               'args': {'name': thread_name}}
+              for tid, thread_name in _TRACER.thread_names.items()]
+    events.extend(_TRACER.events)
+    trace = {'traceEvents': events, 'displayTimeUnit': 'ms',
+             'otherData': metadata or {}}
+    try:
+        with open(path, 'w') as trace_file:
+            json.dump(trace, trace_file)
+        return True
+    except (IOError, OSError) as err:
+        logging.debug('Exception raised: %s', err)
+        return False
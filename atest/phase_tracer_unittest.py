@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for phase_tracer."""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import phase_tracer
+
+
+class PhaseTracerUnittests(unittest.TestCase):
+    """Unit tests for phase_tracer.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.trace_path = os.path.join(self.tmp_dir, phase_tracer.TRACE_NAME)
+        phase_tracer.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        phase_tracer.reset()
+
+    def _load_events(self):
+        """Save the trace and load its events."""
+        self.assertTrue(phase_tracer.save(self.trace_path, {'version': '1'}))
+        with open(self.trace_path) as trace_file:
+            trace = json.load(trace_file)
+        self.assertEqual({'version': '1'}, trace['otherData'])
+        return trace['traceEvents']
+
+    def test_disabled(self):
+        """Test nothing is recorded unless the tracer is enabled."""
+        with phase_tracer.span('module_info_load'):
+            pass
+        phase_tracer.add_span('parse_args', 1, 2)
+        phase_tracer.instant('first_event_received')
+        self.assertFalse(phase_tracer.is_enabled())
+        self.assertEqual([], self._load_events())
+
+    def test_span(self):
+        """Test the spans are recorded as nested complete events."""
+        @phase_tracer.traced('cache_load')
+        def _load_cache():
+            return 'cache'
+
+        phase_tracer.enable()
+        phase_tracer.add_span('parse_args', 1.5, 2)
+        with phase_tracer.span('find_tests', test='hello_world_test'):
+            self.assertEqual('cache', _load_cache())
+        phase_tracer.instant('first_event_received')
+        events = self._load_events()
+        self.assertEqual(
+            ['thread_name', 'parse_args', 'cache_load', 'find_tests',
+             'first_event_received'], [event['name'] for event in events])
+        self.assertEqual(threading.current_thread().name,
+                         events[0]['args']['name'])
+        parse_args = events[1]
+        self.assertEqual(('X', 1500000, 500000),
+                         (parse_args['ph'], parse_args['ts'],
+                          parse_args['dur']))
+        cache_load, find_tests = events[2], events[3]
+        self.assertEqual({'test': 'hello_world_test'}, find_tests['args'])
+        self.assertLessEqual(find_tests['ts'], cache_load['ts'])
+        self.assertGreaterEqual(find_tests['ts'] + find_tests['dur'],
+                                cache_load['ts'] + cache_load['dur'])
+        self.assertEqual('i', events[4]['ph'])
+
+    def test_span_exception(self):
+        """Test the span of the code raising an exception is recorded."""
+        phase_tracer.enable()
+        with self.assertRaises(ValueError):
+            with phase_tracer.span('build'):
+                raise ValueError('Build failed')
+        self.assertEqual('build', self._load_events()[-1]['name'])
+
+
+if __name__ == '__main__':
+    unittest.main()
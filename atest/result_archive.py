@@ -0,0 +1,149 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compress the logs of the finished runs in the test result folders.
+
+The logs of TradeFed, e.g. the host logs and the logcat on failures, make up
+most of a test result folder. The logs of the finished runs are gzipped in
+place by the next run, i.e. foo.txt becomes foo.txt.gz, so no run waits for
+its own logs to be compressed, and open_log reads either of them.
+"""
+
+import gzip
+import logging
+import os
+import shutil
+
+COMPRESSED_SUFFIX = '.gz'
+# The folder of the logs in a test result folder, see AtestTradefedTestRunner.
+LOG_FOLDER_NAME = 'log'
+# The file marking the logs of a run are compressed, so they're walked once.
+_COMPRESSED_MARK_NAME = '.logs_compressed'
+# The files not worth compressing, i.e. tiny or already compressed.
+_MIN_COMPRESS_BYTES = 4096
+_COMPRESSED_SUFFIXES = (COMPRESSED_SUFFIX, '.zip', '.jar', '.apk', '.png',
+                        '.jpg', '.webp', '.mp4')
+_COMPRESS_LEVEL = 6
+_CHUNK_SIZE = 1024 * 1024
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
+
+def get_dir_size(path):
+    """Get the disk usage of the files in a folder.
+
+    Args:
+        path: A string of the folder path.
+
+    Returns:
+        An integer of the total size of the files in bytes.
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError as err:
+                logging.debug('Exception raised: %s', err)
+    return size
+
+
+def format_size(size):
+    """Format a size in bytes, e.g. 1536 to 1.5KB."""
+    for unit in _SIZE_UNITS[:-1]:
+        if abs(size) < 1024:
+            return '%.1f%s' % (size, unit) if unit != 'B' else '%dB' % size
+        size /= 1024
+    return '%.1f%s' % (size, _SIZE_UNITS[-1])
+
+
+def _should_compress(path):
+    """Check whether a log is worth compressing."""
+    if os.path.islink(path) or path.endswith(_COMPRESSED_SUFFIXES):
+        return False
+    return os.path.getsize(path) >= _MIN_COMPRESS_BYTES
+
+
+def compress_file(path):
+    """Gzip a file in place, streaming it so it's never fully in memory.
+
+    Args:
+        path: A string of the file path.
+
+    Returns:
+        A string of the compressed file path.
+    """
+    compressed_path = path + COMPRESSED_SUFFIX
+    try:
+        with open(path, 'rb') as src, gzip.open(
+                compressed_path, 'wb', compresslevel=_COMPRESS_LEVEL) as dst:
+            shutil.copyfileobj(src, dst, _CHUNK_SIZE)
+        shutil.copystat(path, compressed_path)
+    except (IOError, OSError):
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+        raise
+    os.remove(path)
+    return compressed_path
+
+
+def compress_logs(run_dir):
+    """Compress the logs of a finished run, unless they're compressed.
+
+    Args:
+        run_dir: A string of the test result folder of the run.
+
+    Returns:
+        A tuple of the sizes in bytes of the compressed logs before and after
+        the compression.
+    """
+    original_size = compressed_size = 0
+    mark_path = os.path.join(run_dir, _COMPRESSED_MARK_NAME)
+    if os.path.exists(mark_path):
+        return original_size, compressed_size
+    for root, _, files in os.walk(os.path.join(run_dir, LOG_FOLDER_NAME)):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if not _should_compress(path):
+                    continue
+                size = os.path.getsize(path)
+                compressed_path = compress_file(path)
+            except (IOError, OSError) as err:
+                logging.debug('Exception raised: %s', err)
+                continue
+            original_size += size
+            compressed_size += os.path.getsize(compressed_path)
+    try:
+        with open(mark_path, 'w'):
+            pass
+    except (IOError, OSError) as err:
+        logging.debug('Exception raised: %s', err)
+    return original_size, compressed_size
+
+
+def open_log(path):
+    """Open a log for reading text, whether it's compressed or not.
+
+    Args:
+        path: A string of the log path, with or without the .gz suffix.
+
+    Returns:
+        A text file object.
+    """
+    if not path.endswith(COMPRESSED_SUFFIX) and not os.path.exists(path):
+        path += COMPRESSED_SUFFIX
+    if path.endswith(COMPRESSED_SUFFIX):
+        return gzip.open(path, 'rt', errors='replace')
+    return open(path, errors='replace')
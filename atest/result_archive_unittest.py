@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for result_archive."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import result_archive
+
+
+class ResultArchiveUnittests(unittest.TestCase):
+    """Unit tests for result_archive.py"""
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.run_dir, 'log', 'invocation_1')
+        os.makedirs(self.log_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def _write(self, path, content):
+        """Write a file and return its path."""
+        with open(path, 'w') as log_file:
+            log_file.write(content)
+        return path
+
+    def test_compress_logs(self):
+        """Test compress_logs method compresses the large logs only."""
+        content = 'logcat line\n' * 1000
+        log_path = self._write(os.path.join(self.log_dir, 'host_log.txt'),
+                               content)
+        small_path = self._write(os.path.join(self.log_dir, 'small.txt'), 'x')
+        zip_path = self._write(os.path.join(self.log_dir, 'logs.zip'),
+                               content)
+        result_path = self._write(os.path.join(self.run_dir, 'test_result'),
+                                  content)
+        original_size, compressed_size = result_archive.compress_logs(
+            self.run_dir)
+        self.assertEqual(len(content), original_size)
+        self.assertLess(compressed_size, original_size / 10)
+        self.assertFalse(os.path.exists(log_path))
+        for path in (small_path, zip_path, result_path):
+            self.assertTrue(os.path.exists(path))
+        with result_archive.open_log(log_path + '.gz') as log_file:
+            self.assertEqual(content, log_file.read())
+        # The original path reads the compressed log too.
+        with result_archive.open_log(log_path) as log_file:
+            self.assertEqual(content, log_file.read())
+        # The logs of a run are compressed once.
+        self._write(log_path, content)
+        self.assertEqual((0, 0), result_archive.compress_logs(self.run_dir))
+        self.assertTrue(os.path.exists(log_path))
+
+    def test_get_dir_size(self):
+        """Test get_dir_size method."""
+        self._write(os.path.join(self.log_dir, 'a.txt'), 'x' * 10)
+        self._write(os.path.join(self.run_dir, 'b.txt'), 'x' * 5)
+        self.assertEqual(15, result_archive.get_dir_size(self.run_dir))
+
+    def test_format_size(self):
+        """Test format_size method."""
+        self.assertEqual('512B', result_archive.format_size(512))
+        self.assertEqual('1.5KB', result_archive.format_size(1536))
+        self.assertEqual('2.0GB', result_archive.format_size(2 * 1024 ** 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -64,10 +64,15 @@ WmTests: Passed: 0, Failed: 0 (Completed With ERRORS)
 
 from __future__ import print_function
 
+import json
+import logging
+import threading
+
 from collections import OrderedDict
 
 import constants
 import atest_utils as au
+import phase_tracer
 
 from test_runners import test_runner_base
 
@@ -80,6 +85,8 @@ BENCHMARK_ESSENTIAL_KEYS = {'repetition_index', 'cpu_time', 'name', 'repetitions
 BENCHMARK_OPTIONAL_KEYS = {'bytes_per_second', 'label'}
 BENCHMARK_EVENT_KEYS = BENCHMARK_ESSENTIAL_KEYS.union(BENCHMARK_OPTIONAL_KEYS)
 INT_KEYS = {'cpu_time', 'real_time'}
+# The key of the times of INT_KEYS as reported, before they're truncated.
+RAW_TIMES_KEY = 'raw_times'
 
 class PerfInfo():
     """Class for storing performance test of a test run."""
@@ -105,6 +112,7 @@ class PerfInfo():
             if key in INT_KEYS:
                 data_to_int = data.split('.')[0]
                 benchmark_info[key] = data_to_int
+                benchmark_info.setdefault(RAW_TIMES_KEY, {})[key] = data
             elif key in BENCHMARK_EVENT_KEYS:
                 benchmark_info[key] = data
         if benchmark_info:
@@ -189,6 +197,111 @@ class PerfInfo():
         return classified_perf_info, max_len
 
 
+class ResultLog:
+    """Append the test results to a JSON Lines file as they're reported.
+
+    Each line is flushed once written, so the results reported before atest
+    crashes are kept, and the results don't have to be kept in memory until
+    the end of the run.
+    """
+    TEST_RESULT = 'test_result'
+    MODULE_TIME = 'module_time'
+
+    def __init__(self, path):
+        """Init ResultLog.
+
+        Args:
+            path: A string of the path of the log to append to.
+        """
+        self.path = path
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        """Append a record to the log.
+
+        Args:
+            record: A dict of the record.
+        """
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+                self._file.flush()
+
+    def write_test_result(self, test):
+        """Append the result of a test.
+
+        Args:
+            test: A TestResult namedtuple.
+        """
+        self._write({'type': self.TEST_RESULT,
+                     'runner_name': test.runner_name,
+                     'group_name': test.group_name,
+                     'test_name': test.test_name,
+                     'status': test.status,
+                     'details': test.details,
+                     'test_time': test.test_time})
+
+    def write_module_time(self, group_name, duration, test_time):
+        """Append the wall time of a module and the time of its tests.
+
+        Args:
+            group_name: A string of the name of the module.
+            duration: An integer of the wall time in milliseconds.
+            test_time: An integer of the sum of its test times in
+                milliseconds.
+        """
+        self._write({'type': self.MODULE_TIME,
+                     'group_name': group_name,
+                     'duration': duration,
+                     'test_time': test_time})
+
+    def close(self):
+        """Stop appending to the log."""
+        with self._lock:
+            self._file.close()
+
+    def read(self):
+        """Read the records in the log.
+
+        Yields:
+            A dict of each record. A line cut short by a crash is skipped.
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+        with open(self.path) as log_file:
+            for line in log_file:
+                try:
+                    yield json.loads(line)
+                except ValueError as err:
+                    logging.debug('Exception raised: %s', err)
+
+    def read_test_results(self):
+        """Read the test results in the log.
+
+        Yields:
+            A TestResult namedtuple of each test result, without the fields
+            not logged.
+        """
+        for record in self.read():
+            if record.get('type') != self.TEST_RESULT:
+                continue
+            yield test_runner_base.TestResult(
+                runner_name=record['runner_name'],
+                group_name=record['group_name'],
+                test_name=record['test_name'],
+                status=record['status'],
+                details=record['details'],
+                test_count=None,
+                test_time=record['test_time'],
+                runner_total=None,
+                group_total=None,
+                additional_info={},
+                test_run_name=None)
+
+
 class RunStat:
     """Class for storing stats of a test run."""
 
@@ -218,6 +331,19 @@ class RunStat:
         """Getter for total tests actually ran. Accessed via self.total"""
         return self.passed + self.failed
 
+    def merge(self, stats):
+        """Add the stats of another test run to this one.
+
+        Args:
+            stats: A RunStat instance.
+        """
+        self.passed += stats.passed
+        self.failed += stats.failed
+        self.ignored += stats.ignored
+        self.assumption_failed += stats.assumption_failed
+        self.perf_info.perf_info.extend(stats.perf_info.perf_info)
+        self.run_errors = self.run_errors or stats.run_errors
+
 
 class ResultReporter:
     """Result Reporter class.
@@ -260,16 +386,21 @@ class ResultReporter:
               'VtsTradefedTestRunner': {'Module1': RunStat(passed:4, failed:0)}}
     """
 
-    def __init__(self, silent=False):
+    def __init__(self, silent=False, result_log=None):
         """Init ResultReporter.
 
         Args:
             silent: A boolean of silence or not.
+            result_log: A ResultLog to stream the results to. The results
+                streamed aren't kept in all_test_results and module_times.
         """
         self.run_stats = RunStat()
         self.runners = OrderedDict()
         self.failed_tests = []
+        self.result_log = result_log
         self.all_test_results = []
+        # {group_name: [wall time, sum of test times]} in milliseconds.
+        self.module_times = OrderedDict()
         self.pre_test = None
         self.log_path = None
         self.silent = silent
@@ -284,7 +415,10 @@ class ResultReporter:
         if test.runner_name not in self.runners:
             self.runners[test.runner_name] = OrderedDict()
         assert self.runners[test.runner_name] != FAILURE_FLAG
-        self.all_test_results.append(test)
+        if self.result_log:
+            self.result_log.write_test_result(test)
+        else:
+            self.all_test_results.append(test)
         if test.group_name not in self.runners[test.runner_name]:
             self.runners[test.runner_name][test.group_name] = RunStat()
             self._print_group_title(test)
@@ -292,6 +426,23 @@ class ResultReporter:
                            self.runners[test.runner_name][test.group_name])
         self._print_result(test)
 
+    def process_module_time(self, group_name, duration, test_time):
+        """Record the wall time of a module and the time spent in its tests.
+
+        Args:
+            group_name: A string of the name of the module.
+            duration: An integer of the wall time of the module in
+                milliseconds.
+            test_time: An integer of the sum of its test times in
+                milliseconds.
+        """
+        if self.result_log:
+            self.result_log.write_module_time(group_name, duration, test_time)
+            return
+        times = self.module_times.setdefault(group_name, [0, 0])
+        times[0] += duration
+        times[1] += test_time
+
     def runner_failure(self, runner_name, failure_msg):
         """Report a runner failure.
 
@@ -329,10 +480,41 @@ class ResultReporter:
         print('This runner does not support normal results formatting. Below '
               'is the raw output of the test runner.\n\nRAW OUTPUT:')
 
+    def merge(self, reporter):
+        """Merge the results of another reporter into this one.
+
+        Test runners running concurrently report to their own reporters, which
+        are merged once they are all finished.
+
+        Args:
+            reporter: A ResultReporter instance.
+        """
+        for runner_name, groups in reporter.runners.items():
+            merged_groups = self.runners.get(runner_name)
+            if (groups in (UNSUPPORTED_FLAG, FAILURE_FLAG) or
+                    merged_groups is None):
+                self.runners[runner_name] = groups
+                continue
+            if merged_groups in (UNSUPPORTED_FLAG, FAILURE_FLAG):
+                continue
+            for group_name, stats in groups.items():
+                if group_name in merged_groups:
+                    merged_groups[group_name].merge(stats)
+                else:
+                    merged_groups[group_name] = stats
+        self.run_stats.merge(reporter.run_stats)
+        self.failed_tests.extend(reporter.failed_tests)
+        self.all_test_results.extend(reporter.all_test_results)
+        for group_name, (duration, test_time) in reporter.module_times.items():
+            self.process_module_time(group_name, duration, test_time)
+        self.log_path = self.log_path or reporter.log_path
+        self.rerun_options = self.rerun_options or reporter.rerun_options
+
     def print_starting_text(self):
         """Print starting text for running tests."""
         print(au.colorize('\nRunning Tests...', constants.CYAN))
 
+    @phase_tracer.traced('print_summary')
     def print_summary(self, is_collect_tests_only=False):
         """Print summary of all test runs.
 
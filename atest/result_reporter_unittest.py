@@ -18,7 +18,10 @@
 
 # pylint: disable=line-too-long
 
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 from io import StringIO
@@ -451,6 +454,34 @@ class ResultReporterUnittests(unittest.TestCase):
         self.rr.process_test_result(RESULT_PASSED_TEST_MODULE_2)
         self.assertNotEqual(0, self.rr.print_summary())
 
+    @mock.patch('builtins.print')
+    def test_merge(self, _print):
+        """Test merge method."""
+        self.rr.process_test_result(RESULT_PASSED_TEST)
+        other = result_reporter.ResultReporter()
+        other.process_test_result(RESULT_FAILED_TEST)
+        other.process_test_result(RESULT_PASSED_TEST_RUNNER_2_NO_MODULE)
+        other.log_path = '/log/path'
+        other.process_module_time('someTestModule', 30, 20)
+        self.rr.process_module_time('someTestModule', 10, 5)
+        crashed = result_reporter.ResultReporter()
+        crashed.runner_failure('crashedRunner', 'trace')
+        self.rr.merge(other)
+        self.rr.merge(crashed)
+        group = self.rr.runners['someTestRunner']['someTestModule']
+        self.assertEqual((1, 1), (group.passed, group.failed))
+        self.assertEqual(
+            1, self.rr.runners['someTestRunner2'][None].passed)
+        self.assertEqual(result_reporter.FAILURE_FLAG,
+                         self.rr.runners['crashedRunner'])
+        self.assertEqual((2, 1), (self.rr.run_stats.passed,
+                                  self.rr.run_stats.failed))
+        self.assertEqual(['someClassName2#sestName2'], self.rr.failed_tests)
+        self.assertEqual(3, len(self.rr.all_test_results))
+        self.assertEqual('/log/path', self.rr.log_path)
+        self.assertEqual([40, 25], self.rr.module_times['someTestModule'])
+        self.assertNotEqual(0, self.rr.print_summary())
+
     def test_update_perf_info(self):
         """Test update_perf_info method."""
         group = result_reporter.RunStat()
@@ -466,7 +497,9 @@ class ResultReporterUnittests(unittest.TestCase):
                               u'time_unit': u'ns', u'iterations': u'1001',
                               u'run_name': u'perfName01',
                               u'real_time': u'11001',
-                              'test_name': 'somePerfClass01#perfName01'}
+                              'test_name': 'somePerfClass01#perfName01',
+                              'raw_times': {u'cpu_time': u'10001.10001',
+                                            u'real_time': u'11001.11001'}}
         correct_perf_info.append(trim_perf01_test01)
         self.assertEqual(self.rr.run_stats.perf_info.perf_info,
                          correct_perf_info)
@@ -479,7 +512,9 @@ class ResultReporterUnittests(unittest.TestCase):
                               u'time_unit': u'ns', u'iterations': u'1002',
                               u'run_name': u'perfName02',
                               u'real_time': u'11002',
-                              'test_name': 'somePerfClass01#perfName02'}
+                              'test_name': 'somePerfClass01#perfName02',
+                              'raw_times': {u'cpu_time': u'10002.10002',
+                                            u'real_time': u'11002.11002'}}
         correct_perf_info.append(trim_perf01_test02)
         self.assertEqual(self.rr.run_stats.perf_info.perf_info,
                          correct_perf_info)
@@ -492,7 +527,9 @@ class ResultReporterUnittests(unittest.TestCase):
                               u'time_unit': u'ns', u'iterations': u'2001',
                               u'run_name': u'perfName11',
                               u'real_time': u'210001',
-                              'test_name': 'somePerfClass02#perfName11'}
+                              'test_name': 'somePerfClass02#perfName11',
+                              'raw_times': {u'cpu_time': u'20001.20001',
+                                            u'real_time': u'210001.21001'}}
         correct_perf_info.append(trim_perf02_test01)
         self.assertEqual(self.rr.run_stats.perf_info.perf_info,
                          correct_perf_info)
@@ -516,7 +553,9 @@ class ResultReporterUnittests(unittest.TestCase):
                               u'time_unit': u'ns', u'iterations': u'1001',
                               u'run_name': u'perfName01',
                               u'real_time': u'11001',
-                              'test_name': 'somePerfClass01#perfName01'}
+                              'test_name': 'somePerfClass01#perfName01',
+                              'raw_times': {u'cpu_time': u'10001.10001',
+                                            u'real_time': u'11001.11001'}}
         trim_perf01_test02 = {u'repetition_index': u'0', u'cpu_time': u'10002',
                               u'name': u'perfName02',
                               u'repetitions': u'0', u'run_type': u'iteration',
@@ -524,7 +563,9 @@ class ResultReporterUnittests(unittest.TestCase):
                               u'time_unit': u'ns', u'iterations': u'1002',
                               u'run_name': u'perfName02',
                               u'real_time': u'11002',
-                              'test_name': 'somePerfClass01#perfName02'}
+                              'test_name': 'somePerfClass01#perfName02',
+                              'raw_times': {u'cpu_time': u'10002.10002',
+                                            u'real_time': u'11002.11002'}}
         trim_perf02_test01 = {u'repetition_index': u'0', u'cpu_time': u'20001',
                               u'name': u'perfName11',
                               u'repetitions': u'0', u'run_type': u'iteration',
@@ -532,7 +573,9 @@ class ResultReporterUnittests(unittest.TestCase):
                               u'time_unit': u'ns', u'iterations': u'2001',
                               u'run_name': u'perfName11',
                               u'real_time': u'210001',
-                              'test_name': 'somePerfClass02#perfName11'}
+                              'test_name': 'somePerfClass02#perfName11',
+                              'raw_times': {u'cpu_time': u'20001.20001',
+                                            u'real_time': u'210001.21001'}}
         correct_classify_perf_info = {"somePerfClass01":[trim_perf01_test01,
                                                          trim_perf01_test02],
                                       "somePerfClass02":[trim_perf02_test01]}
@@ -543,5 +586,55 @@ class ResultReporterUnittests(unittest.TestCase):
         self.assertEqual(classify_perf_info, correct_classify_perf_info)
 
 
+class ResultLogUnittests(unittest.TestCase):
+    """Unit tests for ResultLog in result_reporter.py"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.log = result_reporter.ResultLog(
+            os.path.join(self.temp_dir, 'test_result.jsonl'))
+
+    def tearDown(self):
+        self.log.close()
+        shutil.rmtree(self.temp_dir)
+
+    @mock.patch('builtins.print')
+    def test_process_test_result_streamed(self, _print):
+        """Test the results of a reporter are streamed to the log."""
+        reporter = result_reporter.ResultReporter(result_log=self.log)
+        reporter.process_test_result(RESULT_PASSED_TEST)
+        reporter.process_module_time('someTestModule', 30, 10)
+        self.assertEqual([], reporter.all_test_results)
+        self.assertFalse(reporter.module_times)
+        self.assertEqual(1, reporter.run_stats.passed)
+        self.assertEqual(
+            [{'type': result_reporter.ResultLog.TEST_RESULT,
+              'runner_name': 'someTestRunner',
+              'group_name': 'someTestModule',
+              'test_name': 'someClassName#sostName',
+              'status': test_runner_base.PASSED_STATUS,
+              'details': None,
+              'test_time': '(10ms)'},
+             {'type': result_reporter.ResultLog.MODULE_TIME,
+              'group_name': 'someTestModule',
+              'duration': 30,
+              'test_time': 10}],
+            list(self.log.read()))
+
+    def test_read_test_results(self):
+        """Test the test results are read back, skipping a cut line."""
+        self.log.write_test_result(RESULT_FAILED_TEST)
+        self.log.write_module_time('someTestModule', 30, 10)
+        self.log.close()
+        with open(self.log.path, 'a') as log_file:
+            log_file.write('{"type": "test_res')
+        self.assertEqual([RESULT_FAILED_TEST._replace(
+            test_count=None, group_total=None, test_run_name=None)],
+                         list(self.log.read_test_results()))
+        # Nothing is appended once the log is closed.
+        self.log.write_test_result(RESULT_PASSED_TEST)
+        self.assertEqual(2, len(list(self.log.read())))
+
+
 if __name__ == '__main__':
     unittest.main()
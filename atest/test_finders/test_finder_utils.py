@@ -32,6 +32,7 @@ import xml.etree.ElementTree as ET
 import atest_decorator
 import atest_error
 import atest_enum
+import atest_utils
 import constants
 
 from metrics import metrics_utils
@@ -427,14 +428,13 @@ def run_find_cmd(ref_type, search_dir, target, methods=None):
     start = time.time()
     if os.path.isfile(FIND_INDEXES[ref_type]):
         _dict, out = {}, None
-        with open(FIND_INDEXES[ref_type], 'rb') as index:
-            try:
-                _dict = pickle.load(index, encoding='utf-8')
-            except (TypeError, IOError, EOFError, pickle.UnpicklingError) as err:
-                logging.debug('Exception raised: %s', err)
-                metrics_utils.handle_exc_and_send_exit_event(
-                    constants.ACCESS_CACHE_FAILURE)
-                os.remove(FIND_INDEXES[ref_type])
+        try:
+            _dict = atest_utils.load_find_index(FIND_INDEXES[ref_type])
+        except (TypeError, IOError, EOFError, pickle.UnpicklingError) as err:
+            logging.debug('Exception raised: %s', err)
+            metrics_utils.handle_exc_and_send_exit_event(
+                constants.ACCESS_CACHE_FAILURE)
+            os.remove(FIND_INDEXES[ref_type])
         if _dict.get(target):
             logging.debug('Found %s in %s', target, FIND_INDEXES[ref_type])
             out = [path for path in _dict.get(target) if search_dir in path]
@@ -17,14 +17,36 @@
 
 import copy
 import fnmatch
+import json
+import logging
 import os
 import re
+import tempfile
 
-import atest_utils
 import constants
 
 TEST_MAPPING = 'TEST_MAPPING'
 
+# Pattern used to identify comments start with '//' or '#' in TEST_MAPPING.
+_COMMENTS_RE = re.compile(r'(?m)[\s\t]*(#|//).*|(\".*?\")')
+_COMMENTS = frozenset(['//', '#'])
+# Pattern used to identify back references in file_patterns.
+_BACK_REFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=')
+
+# Keys of the persisted TestMappingCatalog.
+_CATALOG_VERSION = 3
+_VERSION_KEY = 'version'
+_FILE_NAME_KEY = 'file_name'
+_FILES_KEY = 'files'
+_DIRS_KEY = 'dirs'
+_MTIME_KEY = 'mtime'
+_GROUPS_KEY = 'groups'
+_IMPORTS_KEY = 'imports'
+_PATH_KEY = 'path'
+_RESOLVED_KEY = 'resolved'
+_SUBDIRS_KEY = 'subdirs'
+_HAS_FILE_KEY = 'has_file'
+
 
 class TestDetail:
     """Stores the test details set in a TEST_MAPPING file."""
@@ -120,39 +142,460 @@ class Import:
         return None
 
 
-def is_match_file_patterns(test_mapping_file, test_detail):
-    """Check if the changed file names match the regex pattern defined in
-    file_patterns of TEST_MAPPING files.
+class FilePatternsMatcher:
+    """Match the file_patterns of many tests against modified files at once.
+
+    The file_patterns of all tests are grouped by the directory of their
+    TEST_MAPPING file, and each group is compiled once into a combined
+    alternation used to discard the modified files matching none of them.
+    Each modified file is then only checked against the patterns of the
+    directories containing it.
+    """
+
+    def __init__(self):
+        self._patterns = {}
+        self._compiled = {}
+        self._matched = {}
+        self._forced_dirs = set()
+
+    def add(self, test_mapping_file, test_detail):
+        """Add the file_patterns of a test.
+
+        Args:
+            test_mapping_file: Path to a TEST_MAPPING file.
+            test_detail: A dict of the test detail in the TEST_MAPPING file.
+        """
+        patterns = self._patterns.setdefault(
+            os.path.dirname(test_mapping_file), [])
+        for pattern in test_detail.get('file_patterns', []):
+            if pattern not in patterns:
+                patterns.append(pattern)
+
+    def get_dirs(self):
+        """Get the directories of the TEST_MAPPING files with file_patterns.
+
+        Returns:
+            A list of directory paths.
+        """
+        return [test_mapping_dir for test_mapping_dir, patterns
+                in self._patterns.items() if patterns]
+
+    def _compile(self, test_mapping_dir):
+        """Compile the file_patterns of a directory.
+
+        Args:
+            test_mapping_dir: A string of the directory path.
+
+        Returns:
+            A tuple of (combined, compiled), where combined is the compiled
+            alternation of all patterns, None if the patterns can't be
+            combined, and compiled is a list of tuples of (pattern, compiled
+            pattern).
+        """
+        if test_mapping_dir not in self._compiled:
+            patterns = self._patterns[test_mapping_dir]
+            combined = None
+            # Back references are renumbered in the alternation.
+            if not any(_BACK_REFERENCE_RE.search(p) for p in patterns):
+                try:
+                    combined = re.compile(
+                        '|'.join('(?:%s)' % pattern for pattern in patterns))
+                except re.error:
+                    # e.g. duplicate group names or inline flags.
+                    pass
+            self._compiled[test_mapping_dir] = (
+                combined, [(p, re.compile(p)) for p in patterns])
+        return self._compiled[test_mapping_dir]
+
+    def match(self, modified_files):
+        """Match the modified files against the file_patterns.
+
+        Args:
+            modified_files: An iterable of absolute paths of modified files.
+        """
+        for modified_file in modified_files:
+            test_mapping_dir = os.path.dirname(modified_file)
+            while True:
+                if self._patterns.get(test_mapping_dir):
+                    self._match_file(test_mapping_dir, os.path.relpath(
+                        modified_file, test_mapping_dir))
+                parent_dir = os.path.dirname(test_mapping_dir)
+                if parent_dir == test_mapping_dir:
+                    break
+                test_mapping_dir = parent_dir
+
+    def _match_file(self, test_mapping_dir, modified_file):
+        """Match a modified file against the file_patterns of a directory.
+
+        Args:
+            test_mapping_dir: A string of the directory path.
+            modified_file: A string of the modified file path relative to the
+                test_mapping_dir.
+        """
+        # Force to run the tests in a TEST_MAPPING file included in the
+        # changesets.
+        if modified_file == constants.TEST_MAPPING:
+            self._forced_dirs.add(test_mapping_dir)
+            return
+        combined, compiled = self._compile(test_mapping_dir)
+        if combined and not combined.search(modified_file):
+            return
+        matched = self._matched.setdefault(test_mapping_dir, {})
+        for pattern, compiled_pattern in compiled:
+            if compiled_pattern.search(modified_file):
+                matched.setdefault(pattern, []).append(modified_file)
+
+    def is_match(self, test_mapping_file, test_detail):
+        """Check if a test should run based on its file_patterns.
+
+        Args:
+            test_mapping_file: Path to a TEST_MAPPING file.
+            test_detail: A dict of the test detail in the TEST_MAPPING file.
+
+        Returns:
+            True if the test's file_patterns setting is not set or contains a
+            pattern matches any of the modified files.
+        """
+        file_patterns = test_detail.get('file_patterns', [])
+        if not file_patterns:
+            return True
+        test_mapping_dir = os.path.dirname(test_mapping_file)
+        if test_mapping_dir in self._forced_dirs:
+            return True
+        matched = self._matched.get(test_mapping_dir, {})
+        return any(pattern in matched for pattern in file_patterns)
+
+    def get_matched_patterns(self, test_mapping_file):
+        """Get the file_patterns of a TEST_MAPPING file matching any file.
+
+        Args:
+            test_mapping_file: Path to a TEST_MAPPING file.
+
+        Returns:
+            A dict of the matched patterns to a list of the modified files they
+            match, relative to the directory of the TEST_MAPPING file.
+        """
+        return self._matched.get(os.path.dirname(test_mapping_file), {})
+
+
+def filter_comments(test_mapping_file):
+    """Remove comments in TEST_MAPPING file to valid format. Only '//' and
+    '#' are regarded as comments.
 
     Args:
         test_mapping_file: Path to a TEST_MAPPING file.
-        test_detail: A TestDetail object.
 
     Returns:
-        True if the test's file_patterns setting is not set or contains a
-        pattern matches any of the modified files.
+        Valid json string without comments.
     """
-    # Only check if the altered files are located in the same or sub directory
-    # of the TEST_MAPPING file. Extract the relative path of the modified files
-    # which match file patterns.
-    file_patterns = test_detail.get('file_patterns', [])
-    if not file_patterns:
-        return True
-    test_mapping_dir = os.path.dirname(test_mapping_file)
-    modified_files = atest_utils.get_modified_files(test_mapping_dir)
-    if not modified_files:
-        return False
-    modified_files_in_source_dir = [
-        os.path.relpath(filepath, test_mapping_dir)
-        for filepath in fnmatch.filter(modified_files,
-                                       os.path.join(test_mapping_dir, '*'))
-    ]
-    for modified_file in modified_files_in_source_dir:
-        # Force to run the test if it's in a TEST_MAPPING file included in the
-        # changesets.
-        if modified_file == constants.TEST_MAPPING:
-            return True
-        for pattern in file_patterns:
-            if re.search(pattern, modified_file):
-                return True
-    return False
+    def _replace(match):
+        """Replace comments if found matching the defined regular
+        expression.
+
+        Args:
+            match: The matched regex pattern
+
+        Returns:
+            "" if it matches _COMMENTS, otherwise original string.
+        """
+        line = match.group(0).strip()
+        return "" if any(map(line.startswith, _COMMENTS)) else line
+    with open(test_mapping_file) as json_file:
+        return re.sub(_COMMENTS_RE, _replace, json_file.read())
+
+
+def _get_mtime(path):
+    """Return the mtime of the path in nanoseconds, None if it's gone."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class TestMappingCatalog:
+    """An index of TEST_MAPPING files kept fresh by mtime.
+
+    The catalog stores every TEST_MAPPING file atest has looked at with its
+    parsed test groups and resolved imports, and the sub directories of every
+    directory it has searched. A file is only parsed again when its mtime
+    changes and a directory is only listed again when its mtime changes, i.e.
+    when an entry is added to or removed from it. The symlinks to directories
+    aren't recorded as sub directories, so a symlink loop or a link out of the
+    source tree is never searched.
+
+    The catalog is persisted in JSON so that it is shared between atest runs
+    and other tools such as the IDE plugin, e.g.
+    {
+      "version": 1,
+      "file_name": "TEST_MAPPING",
+      "files": {
+        "/src/a/TEST_MAPPING": {
+          "mtime": 1580000000000000000,
+          "groups": {"presubmit": [{"name": "test1", "host": true}]},
+          "imports": [{"path": "../b", "resolved": "/src/b"}]
+        }
+      },
+      "dirs": {
+        "/src/a": {"mtime": 1580000000000000000, "subdirs": ["c"],
+                   "has_file": true}
+      }
+    }
+    """
+
+    def __init__(self, catalog_file=None, file_name=TEST_MAPPING):
+        """TestMappingCatalog constructor
+
+        Args:
+            catalog_file: Path to the persisted catalog. The catalog is kept in
+                memory only if it's None.
+            file_name: Name of TEST_MAPPING file. Default is set to
+                `TEST_MAPPING`. The argument is added for testing purpose.
+        """
+        self.catalog_file = catalog_file
+        self.file_name = file_name
+        self._files = {}
+        self._dirs = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        """Load the persisted catalog if it matches the current format."""
+        if not self.catalog_file or not os.path.isfile(self.catalog_file):
+            return
+        try:
+            with open(self.catalog_file) as json_file:
+                catalog = json.load(json_file)
+        except (ValueError, IOError) as err:
+            logging.debug('Exception raised: %s', err)
+            return
+        if (catalog.get(_VERSION_KEY) != _CATALOG_VERSION or
+                catalog.get(_FILE_NAME_KEY) != self.file_name):
+            return
+        self._files = catalog.get(_FILES_KEY, {})
+        self._dirs = catalog.get(_DIRS_KEY, {})
+
+    def save(self):
+        """Persist the catalog if it has been changed."""
+        if not self.catalog_file or not self._dirty:
+            return
+        catalog = {_VERSION_KEY: _CATALOG_VERSION,
+                   _FILE_NAME_KEY: self.file_name,
+                   _FILES_KEY: self._files,
+                   _DIRS_KEY: self._dirs}
+        catalog_dir = os.path.dirname(self.catalog_file)
+        try:
+            if not os.path.isdir(catalog_dir):
+                os.makedirs(catalog_dir)
+            # Write to a temp file first so concurrent atest processes never
+            # read a partial catalog.
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=catalog_dir, delete=False) as temp_file:
+                json.dump(catalog, temp_file)
+            os.replace(temp_file.name, self.catalog_file)
+            self._dirty = False
+        except (IOError, OSError) as err:
+            logging.debug('Exception raised: %s', err)
+
+    def _get_file_entry(self, test_mapping_file):
+        """Return the up-to-date catalog entry of a TEST_MAPPING file.
+
+        Args:
+            test_mapping_file: Path to a TEST_MAPPING file.
+
+        Returns:
+            A dict of the entry of the file.
+        """
+        mtime = _get_mtime(test_mapping_file)
+        entry = self._files.get(test_mapping_file)
+        if entry and entry[_MTIME_KEY] == mtime:
+            return entry
+        groups = {}
+        imports = []
+        test_mapping_dict = json.loads(filter_comments(test_mapping_file))
+        for test_group_name, test_list in test_mapping_dict.items():
+            if test_group_name == constants.TEST_MAPPING_IMPORTS:
+                for import_detail in test_list:
+                    path = Import(test_mapping_file, import_detail).get_path()
+                    imports.append({_PATH_KEY: import_detail[_PATH_KEY],
+                                    _RESOLVED_KEY: path})
+            else:
+                groups[test_group_name] = test_list
+        entry = {_MTIME_KEY: mtime, _GROUPS_KEY: groups, _IMPORTS_KEY: imports}
+        self._files[test_mapping_file] = entry
+        self._dirty = True
+        return entry
+
+    def get_groups(self, test_mapping_file):
+        """Get the tests configured in a TEST_MAPPING file.
+
+        Args:
+            test_mapping_file: Path to a TEST_MAPPING file.
+
+        Returns:
+            A dict of test group name to a list of test detail dicts.
+        """
+        return self._get_file_entry(test_mapping_file)[_GROUPS_KEY]
+
+    def get_imports(self, test_mapping_file):
+        """Get the directories imported by a TEST_MAPPING file.
+
+        Args:
+            test_mapping_file: Path to a TEST_MAPPING file.
+
+        Returns:
+            A list of the real paths of the imported directories. Imports
+            which can't be located are skipped.
+        """
+        paths = []
+        for import_detail in self._get_file_entry(
+                test_mapping_file)[_IMPORTS_KEY]:
+            path = import_detail[_RESOLVED_KEY]
+            # Imports are resolved again in case the directory is moved, e.g.
+            # a project is located differently in a different branch.
+            if path is None or not os.path.exists(path):
+                path = Import(test_mapping_file, import_detail).get_path()
+            if path is None:
+                # (b/110166535 #19) Import path might not exist if a project
+                # is located in different directory in different branches.
+                logging.warning('Failed to import TEST_MAPPING at %s',
+                                Import(test_mapping_file, import_detail))
+                continue
+            paths.append(path)
+        return paths
+
+    def _get_dir_entry(self, path):
+        """Return the up-to-date catalog entry of a directory.
+
+        Args:
+            path: A string of the directory path.
+
+        Returns:
+            A dict of the entry of the directory, None if it doesn't exist.
+        """
+        mtime = _get_mtime(path)
+        if mtime is None:
+            return None
+        entry = self._dirs.get(path)
+        if entry and entry[_MTIME_KEY] == mtime:
+            return entry
+        subdirs = []
+        has_file = False
+        try:
+            with os.scandir(path) as dir_entries:
+                for dir_entry in dir_entries:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        subdirs.append(dir_entry.name)
+                    elif fnmatch.fnmatch(dir_entry.name, self.file_name):
+                        has_file = True
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+        entry = {_MTIME_KEY: mtime, _SUBDIRS_KEY: subdirs,
+                 _HAS_FILE_KEY: has_file}
+        self._dirs[path] = entry
+        self._dirty = True
+        return entry
+
+    def find_files_in_subdirs(self, path):
+        """Find all TEST_MAPPING files under the given path.
+
+        The sub directories are looked up in the catalog, so only the
+        directories changed since they were recorded are listed again.
+
+        Args:
+            path: A string of path in source.
+
+        Returns:
+            A set of paths of the TEST_MAPPING files under the given path.
+        """
+        test_mapping_files = set()
+        dirs = [path]
+        while dirs:
+            dir_path = dirs.pop()
+            entry = self._get_dir_entry(dir_path)
+            if not entry:
+                continue
+            if entry[_HAS_FILE_KEY]:
+                test_mapping_files.add(os.path.join(dir_path, self.file_name))
+            dirs.extend(os.path.join(dir_path, subdir)
+                        for subdir in entry[_SUBDIRS_KEY])
+        return test_mapping_files
+
+    def find_files(self, path, include_subdirs=False):
+        """Find TEST_MAPPING files of the given path and parent directories.
+
+        Args:
+            path: A string of path in source.
+            include_subdirs: True to include TEST_MAPPING files in sub
+                directories.
+
+        Returns:
+            A set of paths of the TEST_MAPPING files.
+        """
+        path = os.path.realpath(path)
+        test_mapping_files = set()
+        test_mapping_file = os.path.join(path, self.file_name)
+        if os.path.exists(test_mapping_file):
+            test_mapping_files.add(test_mapping_file)
+        if include_subdirs:
+            test_mapping_files.update(self.find_files_in_subdirs(path))
+        root_dir = os.environ.get(constants.ANDROID_BUILD_TOP, os.sep)
+        while path not in (root_dir, os.sep):
+            path = os.path.dirname(path)
+            test_mapping_file = os.path.join(path, self.file_name)
+            if os.path.exists(test_mapping_file):
+                test_mapping_files.add(test_mapping_file)
+        return test_mapping_files
+
+    def find_files_with_imports(self, path, include_subdirs=False,
+                                checked_files=None):
+        """Find TEST_MAPPING files of the given path and all their imports.
+
+        Imported directories are searched the same way as the given path,
+        recursively.
+
+        Args:
+            path: A string of path in source.
+            include_subdirs: True to include TEST_MAPPING files in sub
+                directories.
+            checked_files: Paths of TEST_MAPPING files that have been checked.
+
+        Returns:
+            A set of paths of the TEST_MAPPING files that haven't been checked.
+        """
+        if checked_files is None:
+            checked_files = set()
+        test_mapping_files = set()
+        paths = [path]
+        while paths:
+            files = self.find_files(paths.pop(), include_subdirs)
+            files.difference_update(checked_files)
+            checked_files.update(files)
+            test_mapping_files.update(files)
+            for test_mapping_file in sorted(files):
+                paths.extend(self.get_imports(test_mapping_file))
+        return test_mapping_files
+
+    def find_tests(self, path, test_group=constants.TEST_GROUP_PRESUBMIT,
+                   include_subdirs=False):
+        """Find the tests of a group for the given path.
+
+        Args:
+            path: A string of path in source.
+            test_group: Group of tests to find. Default is set to `presubmit`.
+            include_subdirs: True to include tests in TEST_MAPPING files in sub
+                directories.
+
+        Returns:
+            A dict of TEST_MAPPING file path to a list of test detail dicts.
+        """
+        tests = {}
+        for test_mapping_file in self.find_files_with_imports(
+                path, include_subdirs):
+            groups = self.get_groups(test_mapping_file)
+            if test_group == constants.TEST_GROUP_ALL:
+                test_list = [t for group in groups.values() for t in group]
+            else:
+                test_list = groups.get(test_group, [])
+            if test_list:
+                tests[test_mapping_file] = test_list
+        return tests
@@ -18,13 +18,22 @@
 
 # pylint: disable=line-too-long
 
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 from unittest import mock
 
+import constants
 import test_mapping
 import unittest_constants as uc
 
+TEST_MAPPING_TOP_DIR = os.path.realpath(
+    os.path.join(uc.TEST_DATA_DIR, 'test_mapping'))
+TEST_MAPPING_SAMPLE = 'test_mapping_sample'
+
 
 class TestMappingUnittests(unittest.TestCase):
     """Unit tests for test_mapping.py"""
@@ -56,30 +65,162 @@ class TestMappingUnittests(unittest.TestCase):
         self.assertEqual(
             'host can only have boolean value.', str(context.exception))
 
-    @mock.patch("atest_utils.get_modified_files")
-    def test_is_match_file_patterns(self, mock_modified_files):
-        """Test mathod is_match_file_patterns."""
-        test_mapping_file = ''
-        test_detail = {
-            "name": "Test",
-            "file_patterns": ["(/|^)test_fp1[^/]*\\.java",
-                              "(/|^)test_fp2[^/]*\\.java"]
-        }
-        mock_modified_files.return_value = {'/a/b/test_fp122.java',
-                                            '/a/b/c/d/test_fp222.java'}
-        self.assertTrue(test_mapping.is_match_file_patterns(test_mapping_file,
-                                                            test_detail))
-        mock_modified_files.return_value = {}
-        self.assertFalse(test_mapping.is_match_file_patterns(test_mapping_file,
-                                                             test_detail))
-        mock_modified_files.return_value = {'/a/b/test_fp3.java'}
-        self.assertFalse(test_mapping.is_match_file_patterns(test_mapping_file,
-                                                             test_detail))
-        test_mapping_file = '/a/b/TEST_MAPPING'
-        mock_modified_files.return_value = {'/a/b/test_fp3.java',
-                                            '/a/b/TEST_MAPPING'}
-        self.assertTrue(test_mapping.is_match_file_patterns(test_mapping_file,
-                                                            test_detail))
+    def test_file_patterns_matcher(self):
+        """Test FilePatternsMatcher class."""
+        test_1 = {"name": "Test1",
+                  "file_patterns": ["(/|^)test_fp1[^/]*\\.java",
+                                    "(/|^)test_fp2[^/]*\\.java"]}
+        test_2 = {"name": "Test2", "file_patterns": ["(/|^)test_fp3"]}
+        test_3 = {"name": "Test3"}
+        matcher = test_mapping.FilePatternsMatcher()
+        for test in (test_1, test_2, test_3):
+            matcher.add('/a/b/TEST_MAPPING', test)
+        matcher.add('/a/TEST_MAPPING', test_2)
+        matcher.add('/c/TEST_MAPPING', test_3)
+        self.assertEqual(['/a/b', '/a'], matcher.get_dirs())
+        matcher.match({'/a/b/c/test_fp222.java', '/a/test_fp3.cc',
+                       '/d/test_fp1.java'})
+        self.assertTrue(matcher.is_match('/a/b/TEST_MAPPING', test_1))
+        self.assertFalse(matcher.is_match('/a/b/TEST_MAPPING', test_2))
+        self.assertTrue(matcher.is_match('/a/b/TEST_MAPPING', test_3))
+        self.assertTrue(matcher.is_match('/a/TEST_MAPPING', test_2))
+        self.assertEqual({"(/|^)test_fp2[^/]*\\.java": ['c/test_fp222.java']},
+                         matcher.get_matched_patterns('/a/b/TEST_MAPPING'))
+        # A modified TEST_MAPPING file forces its tests to run.
+        matcher.match({'/a/b/TEST_MAPPING'})
+        self.assertTrue(matcher.is_match('/a/b/TEST_MAPPING', test_2))
+        self.assertFalse(matcher.is_match('/a/TEST_MAPPING', test_1))
+
+    def test_file_patterns_matcher_uncombinable(self):
+        """Test FilePatternsMatcher with patterns using back references."""
+        test = {"name": "Test", "file_patterns": ["(a)\\1\\.java"]}
+        matcher = test_mapping.FilePatternsMatcher()
+        matcher.add('/a/TEST_MAPPING', test)
+        matcher.add('/a/TEST_MAPPING', {"name": "Test2",
+                                        "file_patterns": ["(b)\\1"]})
+        matcher.match({'/a/aa.java', '/a/bb'})
+        self.assertTrue(matcher.is_match('/a/TEST_MAPPING', test))
+        self.assertEqual(['bb'],
+                         matcher.get_matched_patterns('/a/TEST_MAPPING')[
+                             "(b)\\1"])
+
+
+class TestMappingCatalogUnittests(unittest.TestCase):
+    """Unit tests for TestMappingCatalog in test_mapping.py"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.catalog_file = os.path.join(self.tmp_dir, 'catalog.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _sample_file(self, folder=''):
+        """Return the path of the sample TEST_MAPPING file in the folder."""
+        return os.path.join(TEST_MAPPING_TOP_DIR, folder, TEST_MAPPING_SAMPLE)
+
+    @mock.patch.dict('os.environ', {constants.ANDROID_BUILD_TOP:
+                                    os.path.realpath(uc.TEST_DATA_DIR)})
+    def test_find_files(self):
+        """Test find_files method."""
+        catalog = test_mapping.TestMappingCatalog(
+            file_name=TEST_MAPPING_SAMPLE)
+        self.assertEqual(
+            {self._sample_file('folder1'), self._sample_file()},
+            catalog.find_files(os.path.join(TEST_MAPPING_TOP_DIR, 'folder1')))
+        self.assertEqual(
+            {self._sample_file(), self._sample_file('folder1'),
+             self._sample_file('folder2'), self._sample_file('folder3'),
+             self._sample_file('folder3/folder4'),
+             self._sample_file('folder5')},
+            catalog.find_files(TEST_MAPPING_TOP_DIR, include_subdirs=True))
+
+    @mock.patch.dict('os.environ', {constants.ANDROID_BUILD_TOP:
+                                    os.path.realpath(uc.TEST_DATA_DIR)})
+    def test_find_files_with_imports(self):
+        """Test find_files_with_imports method."""
+        catalog = test_mapping.TestMappingCatalog(
+            file_name=TEST_MAPPING_SAMPLE)
+        checked_files = {self._sample_file()}
+        self.assertEqual(
+            {self._sample_file('folder1'), self._sample_file('folder2'),
+             self._sample_file('folder3'), self._sample_file('folder3/folder4'),
+             self._sample_file('folder5')},
+            catalog.find_files_with_imports(
+                os.path.join(TEST_MAPPING_TOP_DIR, 'folder1'),
+                checked_files=checked_files))
+        self.assertEqual(
+            [os.path.join(TEST_MAPPING_TOP_DIR, 'folder2')],
+            catalog.get_imports(self._sample_file('folder1')))
+        self.assertEqual(['test2'], [t['name'] for t in catalog.get_groups(
+            self._sample_file('folder1'))['presubmit']])
+
+    @mock.patch.dict('os.environ', {constants.ANDROID_BUILD_TOP: os.sep})
+    def test_refresh_by_mtime(self):
+        """Test that only changed files and directories are read again."""
+        catalog = test_mapping.TestMappingCatalog(file_name=TEST_MAPPING_SAMPLE)
+        test_mapping_file = os.path.join(self.tmp_dir, TEST_MAPPING_SAMPLE)
+        with open(test_mapping_file, 'w') as cache_file:
+            json.dump({'presubmit': [{'name': 'test1'}]}, cache_file)
+        self.assertEqual({test_mapping_file},
+                         catalog.find_files_in_subdirs(self.tmp_dir))
+        self.assertEqual([{'name': 'test1'}],
+                         catalog.get_groups(test_mapping_file)['presubmit'])
+        with mock.patch.object(test_mapping, 'filter_comments') as mock_filter:
+            catalog.get_groups(test_mapping_file)
+            self.assertFalse(mock_filter.called)
+        with mock.patch('os.scandir') as mock_scandir:
+            catalog.find_files_in_subdirs(self.tmp_dir)
+            self.assertFalse(mock_scandir.called)
+        # A new sub directory changes the mtime of the parent directory.
+        sub_dir = os.path.join(self.tmp_dir, 'sub')
+        os.mkdir(sub_dir)
+        sub_file = os.path.join(sub_dir, TEST_MAPPING_SAMPLE)
+        with open(sub_file, 'w') as cache_file:
+            json.dump({'postsubmit': [{'name': 'test2'}]}, cache_file)
+        self.assertEqual({test_mapping_file, sub_file},
+                         catalog.find_files_in_subdirs(self.tmp_dir))
+        with open(test_mapping_file, 'w') as cache_file:
+            json.dump({'presubmit': [{'name': 'test3'}]}, cache_file)
+        os.utime(test_mapping_file, ns=(0, 0))
+        self.assertEqual([{'name': 'test3'}],
+                         catalog.get_groups(test_mapping_file)['presubmit'])
+
+    def test_find_files_in_subdirs_symlink_loop(self):
+        """Test that the symlinks to directories aren't followed."""
+        catalog = test_mapping.TestMappingCatalog(file_name=TEST_MAPPING_SAMPLE)
+        sub_dir = os.path.join(self.tmp_dir, 'a', 'b')
+        os.makedirs(sub_dir)
+        os.symlink('..', os.path.join(sub_dir, 'loop'))
+        test_mapping_file = os.path.join(self.tmp_dir, 'a', TEST_MAPPING_SAMPLE)
+        with open(test_mapping_file, 'w') as cache_file:
+            json.dump({'presubmit': [{'name': 'test1'}]}, cache_file)
+        self.assertEqual({test_mapping_file},
+                         catalog.find_files_in_subdirs(self.tmp_dir))
+
+    @mock.patch.dict('os.environ', {constants.ANDROID_BUILD_TOP:
+                                    os.path.realpath(uc.TEST_DATA_DIR)})
+    def test_save_and_load(self):
+        """Test persisting the catalog and loading it back."""
+        catalog = test_mapping.TestMappingCatalog(
+            self.catalog_file, TEST_MAPPING_SAMPLE)
+        catalog.find_tests(TEST_MAPPING_TOP_DIR, include_subdirs=True)
+        catalog.save()
+        self.assertTrue(os.path.isfile(self.catalog_file))
+        loaded = test_mapping.TestMappingCatalog(
+            self.catalog_file, TEST_MAPPING_SAMPLE)
+        with mock.patch.object(test_mapping, 'filter_comments') as mock_filter:
+            tests = loaded.find_tests(TEST_MAPPING_TOP_DIR,
+                                      include_subdirs=True)
+            self.assertFalse(mock_filter.called)
+        self.assertEqual(['test2'], [
+            t['name'] for t in tests[self._sample_file('folder1')]])
+        # A catalog of a different TEST_MAPPING file name is not loaded.
+        other = test_mapping.TestMappingCatalog(self.catalog_file)
+        with mock.patch.object(test_mapping, 'filter_comments',
+                               return_value='{}') as mock_filter:
+            other.get_groups(self._sample_file())
+            self.assertTrue(mock_filter.called)
 
 
 if __name__ == '__main__':
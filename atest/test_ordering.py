@@ -0,0 +1,147 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Order the tests by their history so that failures are reported early.
+
+The tests are run in the decreasing order of their failure probability per
+millisecond of their expected duration, which minimizes the expected time to
+the first failure.
+"""
+
+import copy
+
+import atest_execution_info
+import constants
+
+
+def split_by_class(test_info):
+    """Split a TestInfo filtered by multiple classes into one per class.
+
+    Args:
+        test_info: A TestInfo.
+
+    Returns:
+        A list of TestInfos, which is the TestInfo itself unless it's
+        filtered by multiple classes.
+    """
+    filters = test_info.data.get(constants.TI_FILTER)
+    if not filters or len(filters) < 2:
+        return [test_info]
+    class_infos = []
+    for test_filter in sorted(filters):
+        class_info = copy.copy(test_info)
+        class_info.data = dict(test_info.data)
+        class_info.data[constants.TI_FILTER] = frozenset([test_filter])
+        class_infos.append(class_info)
+    return class_infos
+
+
+def get_history_name(test_info):
+    """Get the name of the test in the test history.
+
+    Args:
+        test_info: A TestInfo.
+
+    Returns:
+        A string of module_name:class_name if the TestInfo is filtered by a
+        single class, the module name otherwise.
+    """
+    filters = test_info.data.get(constants.TI_FILTER)
+    if filters and len(filters) == 1:
+        return '%s:%s' % (test_info.test_name, next(iter(filters)).class_name)
+    return test_info.test_name
+
+
+class TestOrderer:
+    """Order the tests by their failures and durations in the latest runs."""
+
+    def __init__(self, history=None):
+        """TestOrderer constructor
+
+        Args:
+            history: A dict of test name to TestHistory, see
+                atest_execution_info.get_test_history. Default is the history
+                of the latest test results.
+        """
+        if history is None:
+            history = atest_execution_info.get_test_history(
+                constants.ATEST_RESULT_ROOT)
+        self._history = history
+        durations = [x.duration for x in history.values() if x.duration]
+        self._default_duration = (sum(durations) / len(durations)
+                                  if durations else 1)
+
+    def get_failure_probability(self, name):
+        """Estimate the probability that the test fails.
+
+        Laplace smoothing keeps the tests without history in the middle, and
+        the tests which never failed yet ahead of none.
+
+        Args:
+            name: A string of the module name or module_name:class_name.
+
+        Returns:
+            A float between 0 and 1.
+        """
+        history = self._history.get(name)
+        if not history:
+            return 0.5
+        return (history.failed_runs + 1) / (history.runs + 2)
+
+    def get_duration(self, name):
+        """Get the expected duration of the test.
+
+        Args:
+            name: A string of the module name or module_name:class_name.
+
+        Returns:
+            A positive number of milliseconds, the average duration of the
+            tests if the test has no duration in the history.
+        """
+        history = self._history.get(name)
+        if history and history.duration:
+            return history.duration
+        return self._default_duration
+
+    def get_priority(self, test_info):
+        """Get the priority of the test, the higher the earlier it runs.
+
+        Args:
+            test_info: A TestInfo.
+
+        Returns:
+            A float of the failure probability per millisecond.
+        """
+        name = get_history_name(test_info)
+        return self.get_failure_probability(name) / self.get_duration(name)
+
+    def order(self, test_infos, split_classes=False):
+        """Order the tests from the highest to the lowest priority.
+
+        Args:
+            test_infos: A list of TestInfos.
+            split_classes: True to split the TestInfos filtered by multiple
+                classes by class, so that the classes are ordered as well.
+
+        Returns:
+            A list of TestInfos.
+        """
+        units = []
+        for info in test_infos:
+            units.extend(split_by_class(info) if split_classes else [info])
+        # Stable sorts keep the tests of the same priority in name order.
+        units.sort(key=lambda x: x.test_name)
+        units.sort(key=self.get_priority, reverse=True)
+        return units
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for test_ordering."""
+
+import unittest
+
+from unittest import mock
+
+import constants
+import test_ordering
+import unittest_constants as uc
+
+from atest_execution_info import TestHistory
+from test_finders import test_info
+
+CLASS2_NAME = 'android.jank.cts.ui.SomeOtherClass'
+CLASS2_FILTER = test_info.TestFilter(CLASS2_NAME, frozenset())
+TWO_CLASSES_INFO = test_info.TestInfo(
+    uc.MODULE_NAME, uc.MODULE_INFO.test_runner, set(),
+    data={constants.TI_FILTER: frozenset([uc.CLASS_FILTER, CLASS2_FILTER])})
+CLASS_HISTORY_NAME = '%s:%s' % (uc.MODULE_NAME, uc.FULL_CLASS_NAME)
+CLASS2_HISTORY_NAME = '%s:%s' % (uc.MODULE_NAME, CLASS2_NAME)
+
+
+class TestOrderingUnittests(unittest.TestCase):
+    """Unit tests for test_ordering.py"""
+
+    def test_split_by_class(self):
+        """Test split_by_class method."""
+        self.assertEqual([uc.MODULE_INFO],
+                         test_ordering.split_by_class(uc.MODULE_INFO))
+        class_infos = test_ordering.split_by_class(TWO_CLASSES_INFO)
+        self.assertEqual([frozenset([uc.CLASS_FILTER]),
+                          frozenset([CLASS2_FILTER])],
+                         [x.data[constants.TI_FILTER] for x in class_infos])
+        # The TestInfo itself is kept.
+        self.assertEqual(2, len(TWO_CLASSES_INFO.data[constants.TI_FILTER]))
+
+    def test_get_history_name(self):
+        """Test get_history_name method."""
+        self.assertEqual(uc.MODULE_NAME,
+                         test_ordering.get_history_name(uc.MODULE_INFO))
+        self.assertEqual(uc.MODULE_NAME,
+                         test_ordering.get_history_name(TWO_CLASSES_INFO))
+        self.assertEqual(CLASS_HISTORY_NAME,
+                         test_ordering.get_history_name(uc.CLASS_INFO))
+
+    def test_get_failure_probability(self):
+        """Test get_failure_probability method."""
+        orderer = test_ordering.TestOrderer({
+            'never_failed': TestHistory(10, 3, 0),
+            'always_failed': TestHistory(10, 3, 3)})
+        self.assertEqual(0.2, orderer.get_failure_probability('never_failed'))
+        self.assertEqual(0.8, orderer.get_failure_probability('always_failed'))
+        self.assertEqual(0.5, orderer.get_failure_probability('no_history'))
+
+    def test_order(self):
+        """Test order method orders by failure probability per duration."""
+        orderer = test_ordering.TestOrderer({
+            uc.MODULE_NAME: TestHistory(300, 2, 1),
+            uc.MODULE2_NAME: TestHistory(100, 2, 1),
+            CLASS_HISTORY_NAME: TestHistory(200, 2, 0),
+            CLASS2_HISTORY_NAME: TestHistory(100, 2, 1)})
+        self.assertEqual(
+            [uc.MODULE2_NAME, uc.MODULE_NAME],
+            [x.test_name for x in orderer.order([TWO_CLASSES_INFO,
+                                                 uc.MODULE_INFO2])])
+        self.assertEqual(
+            [(uc.MODULE_NAME, CLASS2_NAME), (uc.MODULE2_NAME, None),
+             (uc.MODULE_NAME, uc.FULL_CLASS_NAME)],
+            [(x.test_name, next(iter(x.data[constants.TI_FILTER])).class_name
+              if x.data.get(constants.TI_FILTER) else None)
+             for x in orderer.order([TWO_CLASSES_INFO, uc.MODULE_INFO2],
+                                    split_classes=True)])
+
+    def test_order_without_history(self):
+        """Test order method keeps the name order without history."""
+        orderer = test_ordering.TestOrderer({})
+        self.assertEqual([uc.MODULE_NAME, uc.MODULE2_NAME],
+                         [x.test_name for x in orderer.order(
+                             [uc.MODULE_INFO2, uc.MODULE_INFO])])
+
+    @mock.patch('atest_execution_info.get_test_history', return_value={})
+    def test_default_history(self, mock_history):
+        """Test the history of the latest test results is read by default."""
+        test_ordering.TestOrderer()
+        mock_history.assert_called_once_with(constants.ATEST_RESULT_ROOT)
+
+
+if __name__ == '__main__':
+    unittest.main()
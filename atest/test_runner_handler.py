@@ -19,19 +19,27 @@ Aggregates test runners, groups tests by test runners and kicks off tests.
 # pylint: disable=line-too-long
 # pylint: disable=import-outside-toplevel
 
+import collections
 import itertools
+import queue
+import sys
+import threading
 import time
 import traceback
 
 import atest_error
+import atest_execution_info
+import atest_utils
 import constants
 import result_reporter
+import test_ordering
 
 from metrics import metrics
 from metrics import metrics_utils
 from test_runners import atest_tf_test_runner
 from test_runners import robolectric_test_runner
 from test_runners import suite_plan_test_runner
+from test_runners import test_runner_base
 from test_runners import vts_tf_test_runner
 
 _TEST_RUNNERS = {
@@ -41,6 +49,108 @@ _TEST_RUNNERS = {
     vts_tf_test_runner.VtsTradefedTestRunner.NAME: vts_tf_test_runner.VtsTradefedTestRunner,
 }
 
+# A group of tests run by a test runner, where batch is the index of the batch
+# of tests the group belongs to, see run_test_batches.
+_RunnerGroup = collections.namedtuple(
+    '_RunnerGroup', ['test_runner', 'tests', 'extra_args', 'batch'])
+# The max seconds to wait for the output of the subprocesses of a group once
+# the group finishes.
+_PUMP_TIMEOUT_SECS = 5
+
+
+class _OutputRouter:
+    """Multiplex the output of test runner groups running concurrently.
+
+    The output of one group, the foreground one, goes to the terminal as usual
+    while the output of the others is buffered. A group's buffer is printed at
+    once when it finishes. When the foreground group finishes, the group
+    started earliest among the running ones is brought to the foreground.
+
+    The subprocesses printing to the terminal write to the file descriptor
+    rather than sys.stdout, so the runners give them a pipe routed by route(),
+    see test_runner_base.run.
+    """
+
+    def __init__(self, stream):
+        """Init _OutputRouter.
+
+        Args:
+            stream: The stream to print the output to, i.e. sys.stdout.
+        """
+        self.stream = stream
+        self._lock = threading.RLock()
+        self._buffers = collections.OrderedDict()
+        self._foreground = None
+        # The threads copying the subprocess pipes, keyed by the group thread.
+        self._pumps = collections.defaultdict(list)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def _write(self, ident, text):
+        """Write the text to the stream or the buffer of the group thread."""
+        with self._lock:
+            buf = self._buffers.get(ident)
+            if buf is None:
+                return self.stream.write(text)
+            buf.append(text)
+            return len(text)
+
+    def write(self, text):
+        """Write the text to the stream or the buffer of the current thread."""
+        return self._write(threading.get_ident(), text)
+
+    def _pump(self, ident, source):
+        """Copy the output of a subprocess to the group of the thread."""
+        with source:
+            for line in iter(source.readline, b''):
+                self._write(ident, line.decode(errors='replace'))
+
+    def route(self, source):
+        """Route the output of a subprocess of the group in the current thread.
+
+        Args:
+            source: A binary file object of the subprocess output, i.e. the
+                    stdout pipe of a Popen.
+        """
+        ident = threading.get_ident()
+        pump = threading.Thread(target=self._pump, args=(ident, source),
+                                daemon=True)
+        with self._lock:
+            self._pumps[ident].append(pump)
+        pump.start()
+
+    def flush(self):
+        """Flush the stream."""
+        with self._lock:
+            self.stream.flush()
+
+    def start(self):
+        """Start routing the output of the group in the current thread."""
+        with self._lock:
+            if self._foreground is None:
+                self._foreground = threading.get_ident()
+            else:
+                self._buffers[threading.get_ident()] = []
+
+    def finish(self):
+        """Print the output of the group in the current thread."""
+        ident = threading.get_ident()
+        with self._lock:
+            pumps = self._pumps.pop(ident, [])
+        # A process left behind by the subprocess, e.g. a server, may keep the
+        # pipe open, whose later output goes to the stream directly.
+        for pump in pumps:
+            pump.join(_PUMP_TIMEOUT_SECS)
+        with self._lock:
+            self.stream.write(''.join(self._buffers.pop(ident, [])))
+            if self._foreground == ident:
+                self._foreground = None
+                if self._buffers:
+                    self._foreground, buf = self._buffers.popitem(last=False)
+                    self.stream.write(''.join(buf))
+            self.stream.flush()
+
 
 def _get_test_runners():
     """Returns the test runners.
@@ -104,44 +214,311 @@ def get_test_runner_reqs(module_info, test_infos):
     return test_runner_build_req
 
 
+def _needs_device(group):
+    """Check if the tests of a runner group run on a device.
+
+    Args:
+        group: A _RunnerGroup.
+
+    Returns:
+        True if the group needs a device, False otherwise.
+    """
+    return (group.test_runner.NEEDS_DEVICE and
+            not group.extra_args.get(constants.HOST))
+
+
+def _run_group(results_dir, group, reporter):
+    """Run the tests of a runner group.
+
+    Args:
+        results_dir: String directory to store atest results.
+        group: A _RunnerGroup.
+        reporter: A ResultReporter to report the test results to.
+
+    Returns:
+        0 if tests succeed, non-zero otherwise.
+    """
+    test_runner = group.test_runner
+    test_name = ' '.join([test.test_name for test in group.tests])
+    test_start = time.time()
+    is_success = True
+    ret_code = constants.EXIT_CODE_TEST_FAILURE
+    stacktrace = ''
+    try:
+        test_runner = test_runner(results_dir)
+        ret_code = test_runner.run_tests(group.tests, group.extra_args,
+                                         reporter)
+    # pylint: disable=broad-except
+    except Exception:
+        stacktrace = traceback.format_exc()
+        reporter.runner_failure(test_runner.NAME, stacktrace)
+        is_success = False
+    metrics.RunnerFinishEvent(
+        duration=metrics_utils.convert_duration(time.time() - test_start),
+        success=is_success,
+        runner_name=test_runner.NAME,
+        test=[{'name': test_name,
+               'result': ret_code,
+               'stacktrace': stacktrace}])
+    return ret_code if is_success else constants.EXIT_CODE_TEST_FAILURE
+
+
+def _print_skipped_groups(groups):
+    """Print the tests of the runner groups skipped by --fail-fast.
+
+    Args:
+        groups: A list of _RunnerGroup.
+    """
+    if groups:
+        atest_utils.colorful_print(
+            'Skipped after the first failure: %s' % ' '.join(
+                test.test_name for group in groups for test in group.tests),
+            constants.YELLOW)
+
+
+def _get_next_group(groups, pending, running, concurrency):
+    """Get the first pending runner group which can start now.
+
+    Args:
+        groups: A list of _RunnerGroup.
+        pending: A list of indexes of the groups not started yet.
+        running: A set of indexes of the running groups.
+        concurrency: An integer of the maximum number of groups to run at the
+            same time.
+
+    Returns:
+        The index of the group, None if no group can start until a running
+        one finishes.
+    """
+    if len(running) >= concurrency:
+        return None
+    device_busy = any(_needs_device(groups[x]) for x in running)
+    for index in pending:
+        if not device_busy or not _needs_device(groups[index]):
+            return index
+    return None
+
+
+def _run_groups_concurrently(results_dir, groups, reporters, concurrency,
+                             fail_fast=False):
+    """Run the runner groups in threads.
+
+    At most `concurrency` groups run at the same time and at most one of them
+    runs on a device. Each group reports to its own ResultReporter, which is
+    merged into the reporter of its batch once all the groups are finished.
+
+    Args:
+        results_dir: String directory to store atest results.
+        groups: A list of _RunnerGroup.
+        reporters: A list of ResultReporter of each batch.
+        concurrency: An integer of the maximum number of groups to run at the
+            same time.
+        fail_fast: True to start no more group once a group fails.
+
+    Returns:
+        A list of exit codes of each group, 0 for the groups skipped.
+    """
+    router = _OutputRouter(sys.stdout)
+    group_reporters = [result_reporter.ResultReporter(
+        result_log=reporters[group.batch].result_log) for group in groups]
+    ret_codes = [constants.EXIT_CODE_TEST_FAILURE] * len(groups)
+    finished = queue.Queue()
+
+    def _run(index):
+        """Run the group of the index in the current thread."""
+        router.start()
+        try:
+            ret_codes[index] = _run_group(results_dir, groups[index],
+                                          group_reporters[index])
+        finally:
+            router.finish()
+            finished.put(index)
+
+    pending = list(range(len(groups)))
+    running = set()
+    sys.stdout = router
+    try:
+        while pending or running:
+            index = _get_next_group(groups, pending, running, concurrency)
+            while index is not None:
+                pending.remove(index)
+                running.add(index)
+                threading.Thread(target=_run, args=(index,),
+                                 daemon=True).start()
+                index = _get_next_group(groups, pending, running, concurrency)
+            index = finished.get()
+            running.remove(index)
+            if fail_fast and ret_codes[index] and pending:
+                for index in pending:
+                    ret_codes[index] = constants.EXIT_CODE_SUCCESS
+                _print_skipped_groups([groups[x] for x in pending])
+                pending = []
+    except KeyboardInterrupt:
+        test_runner_base.interrupt_subprocesses()
+        raise
+    finally:
+        sys.stdout = router.stream
+    for index, group in enumerate(groups):
+        reporters[group.batch].merge(group_reporters[index])
+    return ret_codes
+
+
+def _create_reporter():
+    """Create a ResultReporter streaming to the result log of the run."""
+    return result_reporter.ResultReporter(
+        result_log=atest_execution_info.AtestExecutionInfo.result_log)
+
+
+def _get_runner_groups(batches, fail_fast):
+    """Group the tests of each batch by test runners.
+
+    Args:
+        batches: A list of tuples of (test_infos, extra_args).
+        fail_fast: True to order the tests and the groups by their history.
+
+    Returns:
+        A list of _RunnerGroup.
+    """
+    orderer = test_ordering.TestOrderer() if fail_fast else None
+    groups = []
+    for batch, (test_infos, extra_args) in enumerate(batches):
+        if fail_fast:
+            test_infos = orderer.order(test_infos)
+        for test_runner, tests in group_tests_by_test_runners(test_infos):
+            groups.append(_RunnerGroup(test_runner, tests, extra_args, batch))
+    if fail_fast:
+        # The first test of a group has the highest priority of the group.
+        groups.sort(key=lambda x: orderer.get_priority(x.tests[0]),
+                    reverse=True)
+    return groups
+
+
+def _run_groups_serially(results_dir, groups, reporters, fail_fast=False):
+    """Run the runner groups one by one.
+
+    Args:
+        results_dir: String directory to store atest results.
+        groups: A list of _RunnerGroup.
+        reporters: A list of ResultReporter of each batch.
+        fail_fast: True to start no more group once a group fails.
+
+    Returns:
+        A list of exit codes of each group, 0 for the groups skipped.
+    """
+    ret_codes = []
+    for index, group in enumerate(groups):
+        if fail_fast and any(ret_codes):
+            ret_codes.extend([constants.EXIT_CODE_SUCCESS]
+                             * (len(groups) - index))
+            _print_skipped_groups(groups[index:])
+            break
+        ret_codes.append(_run_group(results_dir, group,
+                                    reporters[group.batch]))
+    return ret_codes
+
+
+def _run_batches(results_dir, batches, reporters, concurrency):
+    """Run batches of tests, reporting each batch to its own reporter.
+
+    Args:
+        results_dir: String directory to store atest results.
+        batches: A list of tuples of (test_infos, extra_args).
+        reporters: A list of ResultReporter of each batch.
+        concurrency: An integer of the maximum number of runner groups to run
+            at the same time.
+
+    With --fail-fast, the tests and the runner groups are ordered by their
+    history, see test_ordering, and no more group is started once a group
+    fails.
+
+    Returns:
+        A list of exit codes of each batch.
+    """
+    fail_fast = any(extra_args.get(constants.FAIL_FAST)
+                    for _, extra_args in batches)
+    groups = _get_runner_groups(batches, fail_fast)
+    if concurrency > 1 and len(groups) > 1:
+        ret_codes = _run_groups_concurrently(results_dir, groups, reporters,
+                                             concurrency, fail_fast)
+    else:
+        ret_codes = _run_groups_serially(results_dir, groups, reporters,
+                                         fail_fast)
+    batch_ret_codes = [constants.EXIT_CODE_SUCCESS] * len(batches)
+    for group, ret_code in zip(groups, ret_codes):
+        batch_ret_codes[group.batch] |= ret_code
+    return batch_ret_codes
+
+
+def run_test_batches(results_dir, batches, concurrency=1):
+    """Run batches of tests which need different extra args.
+
+    e.g. the host and device tests in TEST_MAPPING files. The runner groups of
+    all batches are scheduled together, so the batches can run concurrently.
+
+    Args:
+        results_dir: String directory to store atest results.
+        batches: A list of tuples of (test_infos, extra_args).
+        concurrency: An integer of the maximum number of runner groups to run
+            at the same time.
+
+    Returns:
+        A list of tuples of (exit code, ResultReporter) of each batch.
+    """
+    reporters = [_create_reporter() for _ in batches]
+    reporters[0].print_starting_text()
+    ret_codes = _run_batches(results_dir, batches, reporters, concurrency)
+    return list(zip(ret_codes, reporters))
+
+
 def run_all_tests(results_dir, test_infos, extra_args,
-                  delay_print_summary=False):
+                  delay_print_summary=False, concurrency=1):
     """Run the given tests.
 
     Args:
         results_dir: String directory to store atest results.
         test_infos: List of TestInfo.
         extra_args: Dict of extra args for test runners to use.
+        delay_print_summary: True to not print the summary of the results.
+        concurrency: An integer of the maximum number of runner groups to run
+            at the same time.
 
     Returns:
-        0 if tests succeed, non-zero otherwise.
+        A tuple of (exit code, ResultReporter), where the exit code is 0 if
+        tests succeed, non-zero otherwise.
     """
-    reporter = result_reporter.ResultReporter()
+    return run_pipelined_tests(results_dir, [test_infos], extra_args,
+                               delay_print_summary, concurrency)
+
+
+def run_pipelined_tests(results_dir, stages, extra_args,
+                        delay_print_summary=False, concurrency=1):
+    """Run the tests of each stage as soon as the stage is ready.
+
+    e.g. the stages of a build_pipeline.BuildPipeline, whose tests are ready
+    once their build targets are built. All stages report to one reporter.
+
+    Args:
+        results_dir: String directory to store atest results.
+        stages: An iterable of lists of TestInfos, which may block until the
+            next stage is ready.
+        extra_args: Dict of extra args for test runners to use.
+        delay_print_summary: True to not print the summary of the results.
+        concurrency: An integer of the maximum number of runner groups to run
+            at the same time.
+
+    Returns:
+        A tuple of (exit code, ResultReporter), where the exit code is 0 if
+        tests succeed, non-zero otherwise.
+    """
+    reporter = _create_reporter()
     reporter.print_starting_text()
     tests_ret_code = constants.EXIT_CODE_SUCCESS
-    for test_runner, tests in group_tests_by_test_runners(test_infos):
-        test_name = ' '.join([test.test_name for test in tests])
-        test_start = time.time()
-        is_success = True
-        ret_code = constants.EXIT_CODE_TEST_FAILURE
-        stacktrace = ''
-        try:
-            test_runner = test_runner(results_dir)
-            ret_code = test_runner.run_tests(tests, extra_args, reporter)
-            tests_ret_code |= ret_code
-        # pylint: disable=broad-except
-        except Exception:
-            stacktrace = traceback.format_exc()
-            reporter.runner_failure(test_runner.NAME, stacktrace)
-            tests_ret_code = constants.EXIT_CODE_TEST_FAILURE
-            is_success = False
-        metrics.RunnerFinishEvent(
-            duration=metrics_utils.convert_duration(time.time() - test_start),
-            success=is_success,
-            runner_name=test_runner.NAME,
-            test=[{'name': test_name,
-                   'result': ret_code,
-                   'stacktrace': stacktrace}])
+    for test_infos in stages:
+        tests_ret_code |= _run_batches(results_dir,
+                                       [(test_infos, extra_args)],
+                                       [reporter], concurrency)[0]
+        if tests_ret_code and extra_args.get(constants.FAIL_FAST):
+            break
     if delay_print_summary:
         return tests_ret_code, reporter
     return (reporter.print_summary(extra_args.get(constants.COLLECT_TESTS_ONLY))
@@ -19,19 +19,24 @@
 # pylint: disable=protected-access
 # pylint: disable=line-too-long
 
+import io
+import threading
 import unittest
 
 from unittest import mock
 
 import atest_error
+import constants
 import test_runner_handler
 
+from atest_execution_info import TestHistory
 from metrics import metrics
 from test_finders import test_info
 from test_runners import test_runner_base as tr_base
 
 FAKE_TR_NAME_A = 'FakeTestRunnerA'
 FAKE_TR_NAME_B = 'FakeTestRunnerB'
+FAKE_TR_NAME_C = 'FakeTestRunnerC'
 MISSING_TR_NAME = 'MissingTestRunner'
 FAKE_TR_A_REQS = {'fake_tr_A_req1', 'fake_tr_A_req2'}
 FAKE_TR_B_REQS = {'fake_tr_B_req1', 'fake_tr_B_req2'}
@@ -45,6 +50,7 @@ MODULE_INFO_A_AGAIN = test_info.TestInfo(MODULE_NAME_A_AGAIN, FAKE_TR_NAME_A,
 MODULE_INFO_B = test_info.TestInfo(MODULE_NAME_B, FAKE_TR_NAME_B, set())
 MODULE_INFO_B_AGAIN = test_info.TestInfo(MODULE_NAME_B_AGAIN, FAKE_TR_NAME_B,
                                          set())
+MODULE_INFO_C = test_info.TestInfo('ModuleNameC', FAKE_TR_NAME_C, set())
 BAD_TESTINFO = test_info.TestInfo('bad_name', MISSING_TR_NAME, set())
 
 class FakeTestRunnerA(tr_base.TestRunnerBase):
@@ -78,12 +84,47 @@ class FakeTestRunnerB(FakeTestRunnerA):
         return FAKE_TR_B_REQS
 
 
+class FakeTestRunnerC(FakeTestRunnerA):
+    """Fake test runner C running tests without device."""
+
+    NAME = FAKE_TR_NAME_C
+    NEEDS_DEVICE = False
+    # Set once the runner is running.
+    running = threading.Event()
+
+    def run_tests(self, test_infos, extra_args, reporter):
+        print('output of %s' % self.NAME)
+        self.running.set()
+        return 0
+
+
+class FakeDeviceTestRunner(FakeTestRunnerA):
+    """Fake test runner recording the number of runners using device."""
+
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def run_tests(self, test_infos, extra_args, reporter):
+        # Wait for the runner without device to run along.
+        FakeTestRunnerC.running.wait(5)
+        with self.lock:
+            FakeDeviceTestRunner.running += 1
+            FakeDeviceTestRunner.max_running = max(
+                self.max_running, FakeDeviceTestRunner.running)
+        print('output of %s' % self.NAME)
+        with self.lock:
+            FakeDeviceTestRunner.running -= 1
+        return int(self.NAME == FAKE_TR_NAME_B)
+
+
 class TestRunnerHandlerUnittests(unittest.TestCase):
     """Unit tests for test_runner_handler.py"""
 
     _TEST_RUNNERS = {
         FakeTestRunnerA.NAME: FakeTestRunnerA,
         FakeTestRunnerB.NAME: FakeTestRunnerB,
+        FakeTestRunnerC.NAME: FakeTestRunnerC,
     }
 
     def setUp(self):
@@ -143,5 +184,153 @@ class TestRunnerHandlerUnittests(unittest.TestCase):
             test_runner_handler.run_all_tests(
                 results_dir, test_infos, extra_args)[0])
 
+    @mock.patch.object(metrics, 'RunnerFinishEvent')
+    def test_run_all_tests_concurrently(self, _mock_runner_finish):
+        """Test run_all_tests method running runner groups concurrently."""
+        device_runner_a = type('FakeDeviceTestRunnerA',
+                               (FakeDeviceTestRunner,),
+                               {'NAME': FAKE_TR_NAME_A})
+        device_runner_b = type('FakeDeviceTestRunnerB',
+                               (FakeDeviceTestRunner,),
+                               {'NAME': FAKE_TR_NAME_B})
+        test_runners = {FAKE_TR_NAME_A: device_runner_a,
+                        FAKE_TR_NAME_B: device_runner_b,
+                        FAKE_TR_NAME_C: FakeTestRunnerC}
+        FakeTestRunnerC.running.clear()
+        with mock.patch('test_runner_handler._get_test_runners',
+                        return_value=test_runners), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            ret_code, _ = test_runner_handler.run_all_tests(
+                '', [MODULE_INFO_A, MODULE_INFO_B, MODULE_INFO_C], {},
+                delay_print_summary=True, concurrency=3)
+        self.assertEqual(1, ret_code)
+        # Runners running tests on device never run at the same time.
+        self.assertEqual(1, FakeDeviceTestRunner.max_running)
+        for name in (FAKE_TR_NAME_A, FAKE_TR_NAME_B, FAKE_TR_NAME_C):
+            self.assertIn('output of %s\n' % name, stdout.getvalue())
+
+    @mock.patch.object(metrics, 'RunnerFinishEvent')
+    def test_run_test_batches(self, _mock_runner_finish):
+        """Test run_test_batches method."""
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            results = test_runner_handler.run_test_batches(
+                '', [([MODULE_INFO_C], {constants.HOST: True}),
+                     ([MODULE_INFO_A, MODULE_INFO_B], {})], concurrency=2)
+        self.assertEqual([0, 1], [ret_code for ret_code, _ in results])
+
+    @mock.patch.object(metrics, 'RunnerFinishEvent')
+    @mock.patch('atest_execution_info.get_test_history')
+    def test_run_all_tests_fail_fast(self, mock_history, _mock_runner_finish):
+        """Test run_all_tests method stops after the first failed group."""
+        mock_history.return_value = {
+            MODULE_NAME_A: TestHistory(100, 4, 0),
+            MODULE_NAME_B: TestHistory(100, 4, 4)}
+        started = []
+
+        def _run_group(_results_dir, group, _reporter):
+            started.append(group.test_runner)
+            return int(group.test_runner is FakeTestRunnerB)
+
+        with mock.patch('test_runner_handler._run_group',
+                        side_effect=_run_group), \
+                mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            ret_code, _ = test_runner_handler.run_all_tests(
+                '', [MODULE_INFO_A, MODULE_INFO_B],
+                {constants.FAIL_FAST: True}, delay_print_summary=True)
+        self.assertEqual(1, ret_code)
+        # The group which failed more often runs first.
+        self.assertEqual([FakeTestRunnerB], started)
+        self.assertIn('Skipped after the first failure: %s' % MODULE_NAME_A,
+                      stdout.getvalue())
+
+    def test_run_pipelined_tests(self):
+        """Test run_pipelined_tests method reports all stages together."""
+        runs = []
+
+        def _run_group(_results_dir, group, reporter):
+            runs.append((group.tests, reporter))
+            return int(group.test_runner is FakeTestRunnerB)
+
+        with mock.patch('test_runner_handler._run_group',
+                        side_effect=_run_group), \
+                mock.patch('sys.stdout', new_callable=io.StringIO):
+            ret_code, reporter = test_runner_handler.run_pipelined_tests(
+                '', iter([[MODULE_INFO_B], [MODULE_INFO_A]]), {},
+                delay_print_summary=True)
+            self.assertEqual(1, ret_code)
+            self.assertEqual([([MODULE_INFO_B], reporter),
+                              ([MODULE_INFO_A], reporter)], runs)
+            # No more stage runs after a failure with --fail-fast.
+            runs.clear()
+            test_runner_handler.run_pipelined_tests(
+                '', iter([[MODULE_INFO_B], [MODULE_INFO_A]]),
+                {constants.FAIL_FAST: True}, delay_print_summary=True)
+            self.assertEqual([[MODULE_INFO_B]], [tests for tests, _ in runs])
+
+    def test_output_router(self):
+        """Test _OutputRouter class."""
+        stream = io.StringIO()
+        router = test_runner_handler._OutputRouter(stream)
+        background_started = threading.Event()
+        foreground_finished = threading.Event()
+
+        def _foreground():
+            router.start()
+            background_started.wait(5)
+            router.write('fg1\n')
+            router.finish()
+            foreground_finished.set()
+
+        def _background():
+            router.start()
+            router.write('bg1\n')
+            background_started.set()
+            foreground_finished.wait(5)
+            router.write('bg2\n')
+            router.finish()
+
+        foreground = threading.Thread(target=_foreground)
+        foreground.start()
+        # Wait until the foreground thread starts routing.
+        while router._foreground is None:
+            foreground.join(0.01)
+        background = threading.Thread(target=_background)
+        background.start()
+        foreground.join()
+        background.join()
+        router.write('main\n')
+        self.assertEqual('fg1\nbg1\nbg2\nmain\n', stream.getvalue())
+
+    def test_output_router_subprocess(self):
+        """Test _OutputRouter routes the output of the subprocesses."""
+        stream = io.StringIO()
+        router = test_runner_handler._OutputRouter(stream)
+        runner = FakeTestRunnerA('')
+        foreground_started = threading.Event()
+        background_finished = threading.Event()
+
+        def _foreground():
+            router.start()
+            foreground_started.set()
+            background_finished.wait(5)
+            router.write('fg1\n')
+            router.finish()
+
+        def _background():
+            foreground_started.wait(5)
+            router.start()
+            runner.run('echo bg1', output_to_stdout=True).wait()
+            router.finish()
+            background_finished.set()
+
+        threads = [threading.Thread(target=_foreground),
+                   threading.Thread(target=_background)]
+        with mock.patch('sys.stdout', router):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual('bg1\nfg1\n', stream.getvalue())
+
 if __name__ == '__main__':
     unittest.main()
@@ -18,42 +18,55 @@
 
 from __future__ import print_function
 
-import json
+import collections
+import heapq
 import logging
 import os
-import re
-import select
 import shutil
 import socket
+import threading
+import time
 
 from functools import partial
 
+import atest_execution_info
 import atest_utils
 import constants
+import phase_tracer
 import result_reporter
+import test_ordering
 
 from test_finders import test_info
+from test_runners import device_scheduler
+from test_runners import event_server
 from test_runners import test_runner_base
+from test_runners import tradefed_daemon
 from .event_handler import EventHandler
 
 POLL_FREQ_SECS = 10
 SOCKET_HOST = '127.0.0.1'
-SOCKET_QUEUE_MAX = 1
-SOCKET_BUFFER = 4096
+SOCKET_QUEUE_MAX = 16
 SELECT_TIMEOUT = 5
 
-# Socket Events of form FIRST_EVENT {JSON_DATA}\nSECOND_EVENT {JSON_DATA}
-# EVENT_RE has groups for the name and the data. "." does not match \n.
-EVENT_RE = re.compile(r'\n*(?P<event_name>[A-Z_]+) (?P<json_data>{.*})(?=\n|.)*')
-
 EXEC_DEPENDENCIES = ('adb', 'aapt')
 
 TRADEFED_EXIT_MSG = 'TradeFed subprocess exited early with exit code=%s.'
 
 LOG_FOLDER_NAME = 'log'
+# Folder of the logs of a host test shard in the log folder.
+HOST_SHARD_LOG_FOLDER_FMT = 'shard_%d'
+# Folder of the logs of the tests run on a device in the log folder.
+DEVICE_LOG_FOLDER_FMT = 'device_%s'
 
 _INTEGRATION_FINDERS = frozenset(['', 'INTEGRATION', 'INTEGRATION_FILE_PATH'])
 
+class _TestBatch(list):
+    """The TestInfos run in one TradeFed invocation on a device."""
+
+    def __str__(self):
+        return ', '.join(info.test_name for info in self)
+
+
 class TradeFedExitError(Exception):
     """Raised when TradeFed exists before test run has finished."""
 
@@ -90,6 +103,11 @@ class AtestTradefedTestRunner(test_runner_base.TestRunnerBase):
                              'log_args': self._LOG_ARGS.format(**log_args)}
         self.is_verbose = logging.getLogger().isEnabledFor(logging.DEBUG)
         self.root_dir = os.environ.get(constants.ANDROID_BUILD_TOP)
+        # Tests can substitute the lister to fake the connected devices.
+        self.device_lister = device_scheduler.AdbDeviceLister()
+        # Run commands are generated in run_cmd_dict, which is shared by the
+        # tests running on multiple devices.
+        self._run_cmd_lock = threading.Lock()
 
     def _try_set_gts_authentication_key(self):
         """Set GTS authentication key if it is available or exists.
@@ -168,23 +186,335 @@ class AtestTradefedTestRunner(test_runner_base.TestRunnerBase):
             0 if tests succeed, non-zero otherwise.
         """
         iterations = self._generate_iterations(extra_args)
+        host_shards = self._get_host_shards(test_infos, extra_args)
+        serials = self._get_device_serials(extra_args)
         ret_code = constants.EXIT_CODE_SUCCESS
         for _ in range(iterations):
+            if ret_code and extra_args.get(constants.FAIL_FAST):
+                break
+            if len(host_shards) > 1:
+                ret_code |= self._run_host_shards(host_shards, extra_args,
+                                                  reporter)
+                continue
+            if len(serials) > 1:
+                ret_code |= self._run_on_devices(test_infos, serials,
+                                                 extra_args, reporter)
+                continue
             server = self._start_socket_server()
             run_cmds = self.generate_run_commands(test_infos, extra_args,
                                                   server.getsockname()[1])
-            subproc = self.run(run_cmds[0], output_to_stdout=self.is_verbose,
-                               env_vars=self.generate_env_vars(extra_args))
+            tf_start = time.time()
+            subproc, log_file = self._run_tradefed(run_cmds[0], extra_args)
             self.handle_subprocess(subproc, partial(self._start_monitor,
                                                     server,
                                                     subproc,
-                                                    reporter))
+                                                    reporter),
+                                   log_files=[log_file])
             server.close()
+            self._trace_tf_startup(tf_start)
             ret_code |= self.wait_for_subprocess(subproc)
         return ret_code
 
-    # pylint: disable=too-many-branches
-    # pylint: disable=too-many-locals
+    @staticmethod
+    def _trace_tf_startup(tf_start):
+        """Trace the startup of TradeFed until its first event.
+
+        Args:
+            tf_start: A float of the time TradeFed was started.
+        """
+        first_event_time = atest_execution_info.FIRST_EVENT_TIME
+        # Only the first TradeFed of the run is traced.
+        if first_event_time and first_event_time >= tf_start:
+            phase_tracer.add_span('tf_startup', tf_start, first_event_time)
+
+    def _get_host_shards(self, test_infos, extra_args):
+        """Partition the host tests into shards if host sharding is enabled.
+
+        Args:
+            test_infos: A list of TestInfos.
+            extra_args: Dict of extra args to add to test run.
+
+        Returns:
+            A list of lists of TestInfos of the shards, empty if host sharding
+            isn't enabled.
+        """
+        shard_count = extra_args.get(constants.HOST_SHARDS, 0)
+        if not extra_args.get(constants.HOST) or shard_count < 2:
+            return []
+        return self.partition_test_infos(
+            test_infos, shard_count,
+            atest_execution_info.get_test_durations(
+                constants.ATEST_RESULT_ROOT))
+
+    def _get_test_units(self, test_infos, durations, split_classes=False):
+        """Get the units of the tests to distribute and their durations.
+
+        The units without history are assumed to take the average duration.
+
+        Args:
+            test_infos: A list of TestInfos.
+            durations: A dict of test name to duration in milliseconds, where
+                the test name is a module name or module_name:class_name.
+            split_classes: True to split the modules filtered by multiple
+                classes by class.
+
+        Returns:
+            A list of tuples of the duration in milliseconds and the TestInfo
+            of a unit, from the longest to the shortest.
+        """
+        units = []
+        for info in sorted(self._flatten_test_infos(test_infos),
+                           key=lambda x: x.test_name):
+            class_infos = test_ordering.split_by_class(info)
+            if not split_classes or len(class_infos) < 2:
+                units.append((durations.get(info.test_name), info))
+                continue
+            for class_info in class_infos:
+                units.append((durations.get(
+                    test_ordering.get_history_name(class_info)), class_info))
+        known_durations = [x for x, _ in units if x is not None]
+        default_duration = (sum(known_durations) // len(known_durations)
+                            if known_durations else 1)
+        units = [(default_duration if duration is None else duration, info)
+                 for duration, info in units]
+        # Stable sort keeps the units of the same duration in name order.
+        units.sort(key=lambda x: x[0], reverse=True)
+        return units
+
+    def partition_test_infos(self, test_infos, shard_count, durations):
+        """Partition the tests into shards with balanced durations.
+
+        Modules are the units of the shards. If there are fewer modules than
+        shards, the modules filtered by multiple classes are split by class
+        as well. The units are assigned from the longest to the shortest to
+        the shard with the least total duration.
+
+        Args:
+            test_infos: A list of TestInfos.
+            shard_count: An integer of the maximum number of shards.
+            durations: A dict of test name to duration in milliseconds, where
+                the test name is a module name or module_name:class_name.
+
+        Returns:
+            A list of non-empty lists of TestInfos of the shards.
+        """
+        split_classes = (len({x.test_name for x in test_infos})
+                         < shard_count)
+        units = self._get_test_units(test_infos, durations, split_classes)
+        shards = [[] for _ in range(min(shard_count, len(units)))]
+        loads = [(0, index) for index in range(len(shards))]
+        for duration, info in units:
+            load, index = heapq.heappop(loads)
+            shards[index].append(info)
+            heapq.heappush(loads, (load + duration, index))
+        return shards
+
+    def _run_host_shards(self, shards, extra_args, reporter):
+        """Run the shards of host tests in parallel TradeFed invocations.
+
+        Each shard reports to its own socket server and logs to its own
+        folder, and the events of all shards are aggregated to the reporter.
+
+        Args:
+            shards: A list of lists of TestInfos.
+            extra_args: Dict of extra args to add to test run.
+            reporter: An instance of result_report.ResultReporter.
+
+        Returns:
+            0 if tests succeed, non-zero otherwise.
+        """
+        invocations = []
+        # The raw output files of the shards, which are kept open until the
+        # shards end, None if the output goes to the terminal.
+        log_files = []
+        try:
+            for index, shard in enumerate(shards):
+                server = self._start_socket_server()
+                log_path = os.path.join(self.log_path,
+                                        HOST_SHARD_LOG_FOLDER_FMT % index)
+                run_cmds = self.generate_run_commands(
+                    shard, extra_args, server.getsockname()[1],
+                    log_path=log_path)
+                subproc, log_file = self._run_tradefed(run_cmds[0],
+                                                       extra_args)
+                invocations.append((server, subproc))
+                log_files.append(log_file)
+            logging.debug('Running %s host test shards.', len(invocations))
+            self.handle_subprocesses(
+                [subproc for _, subproc in invocations],
+                partial(self._monitor_invocations, invocations, reporter),
+                log_files=log_files)
+        finally:
+            for server, _ in invocations:
+                server.close()
+        ret_code = constants.EXIT_CODE_SUCCESS
+        for index, ((_, subproc), log_file) in enumerate(
+                zip(invocations, log_files)):
+            shard_ret_code = self.wait_for_subprocess(subproc)
+            if shard_ret_code and log_file:
+                self._print_shard_log(index, log_file.name)
+            ret_code |= shard_ret_code
+        return ret_code
+
+    @staticmethod
+    def _print_shard_log(index, log_path):
+        """Print the raw output of a failed host test shard.
+
+        Args:
+            index: An integer of the shard index.
+            log_path: A string of the path of the raw output file.
+        """
+        intro_msg = 'Host test shard %s failed. Raw Output:' % index
+        print(atest_utils.colorize(intro_msg, constants.RED))
+        try:
+            with open(log_path, 'r') as log_file:
+                print(log_file.read())
+        except (IOError, OSError) as err:
+            logging.debug('Exception raised: %s', err)
+
+    def _get_device_serials(self, extra_args):
+        """Get the devices to distribute the tests to.
+
+        Args:
+            extra_args: Dict of extra args to add to test run.
+
+        Returns:
+            A list of serials of the connected devices if the tests should be
+            distributed across all devices, empty otherwise.
+        """
+        if (not extra_args.get(constants.ALL_DEVICES)
+                or extra_args.get(constants.HOST)
+                or extra_args.get(constants.SERIAL)
+                or extra_args.get(constants.SHARDING)):
+            return []
+        serials = self.device_lister.list_serials()
+        logging.debug('Connected devices: %s', serials)
+        return serials
+
+    def _run_on_devices(self, test_infos, serials, extra_args, reporter):
+        """Distribute the test modules across the devices.
+
+        The modules are partitioned by their durations in previous runs into
+        one batch per device, like the host shards, and each device runs its
+        batch in one TradeFed invocation, so the TradeFed startup and the
+        device setup are paid once per device. The scheduler gives the
+        batches not started yet, e.g. if there are more batches than working
+        devices, to the idle devices.
+        With --fail-fast, each class runs in its own invocation, in the order
+        of their history, so that no more class is started once one fails.
+        This pays the TradeFed startup per class for stopping early.
+
+        Args:
+            test_infos: A list of TestInfos.
+            serials: A list of serials of the devices.
+            extra_args: Dict of extra args to add to test run.
+            reporter: An instance of result_report.ResultReporter.
+
+        Returns:
+            0 if tests succeed, non-zero otherwise.
+        """
+        fail_fast = extra_args.get(constants.FAIL_FAST)
+        if fail_fast:
+            batches = [_TestBatch([info]) for info in
+                       test_ordering.TestOrderer().order(
+                           self._flatten_test_infos(test_infos),
+                           split_classes=True)]
+        else:
+            batches = [_TestBatch(shard) for shard in
+                       self.partition_test_infos(
+                           test_infos, len(serials),
+                           atest_execution_info.get_test_durations(
+                               constants.ATEST_RESULT_ROOT))]
+        # Each batch reports to its own reporter, which are merged in the
+        # order of the batches once all batches are finished.
+        batch_reporters = collections.OrderedDict(
+            (id(batch), result_reporter.ResultReporter(
+                result_log=reporter.result_log)) for batch in batches)
+
+        def _run_test(serial, batch):
+            """Run the batch on the device."""
+            return self._run_on_device(serial, batch, extra_args,
+                                       batch_reporters[id(batch)])
+
+        scheduler = device_scheduler.DeviceScheduler(
+            serials, _run_test, stop_on_failure=fail_fast)
+        ret_code, usages, elapsed_secs = scheduler.run(batches)
+        for batch_reporter in batch_reporters.values():
+            reporter.merge(batch_reporter)
+        # The utilization counts the tests rather than the invocations.
+        device_scheduler.print_utilization(
+            [usage._replace(tests=[info for batch in usage.tests
+                                   for info in batch]) for usage in usages],
+            elapsed_secs)
+        return ret_code
+
+    def _run_on_device(self, serial, test_infos, extra_args, reporter):
+        """Run tests on a device in one TradeFed invocation.
+
+        Args:
+            serial: A string of the serial of the device.
+            test_infos: A list of TestInfos.
+            extra_args: Dict of extra args to add to test run.
+            reporter: An instance of result_report.ResultReporter.
+
+        Returns:
+            0 if tests succeed, non-zero otherwise.
+        """
+        device_args = dict(extra_args)
+        device_args[constants.SERIAL] = serial
+        server = self._start_socket_server()
+        try:
+            with self._run_cmd_lock:
+                run_cmds = self.generate_run_commands(
+                    list(test_infos), device_args, server.getsockname()[1],
+                    log_path=os.path.join(self.log_path,
+                                          DEVICE_LOG_FOLDER_FMT % serial))
+            subproc, log_file = self._run_tradefed(run_cmds[0], device_args)
+            self.handle_subprocess(subproc, partial(self._start_monitor,
+                                                    server,
+                                                    subproc,
+                                                    reporter),
+                                   log_files=[log_file])
+        finally:
+            server.close()
+        return self.wait_for_subprocess(subproc)
+
+    def _run_tradefed(self, run_cmd, extra_args):
+        """Run the TradeFed command, in the TradeFed daemon if enabled.
+
+        Args:
+            run_cmd: A string of the command generated by
+                generate_run_commands().
+            extra_args: Dict of extra args to add to test run.
+
+        Returns:
+            A tuple of the tradefed subprocess, or the DaemonInvocation of the
+            command run by the daemon, and the file of its raw output, None if
+            the output isn't kept in a file. The file is owned by the caller,
+            so the invocations running concurrently never share one.
+        """
+        env_vars = self.generate_env_vars(extra_args)
+        # The console of the daemon can't attach a debugger.
+        if (extra_args.get(constants.TF_DAEMON)
+                and not extra_args.get(constants.TF_DEBUG)
+                and run_cmd.startswith(self.EXECUTABLE)):
+            sock_path = tradefed_daemon.get_socket_path(
+                self.root_dir or '',
+                os.environ.get(constants.ANDROID_HOST_OUT, ''), env_vars)
+            if tradefed_daemon.start_daemon(sock_path, self.EXECUTABLE,
+                                            env_vars):
+                invocation = tradefed_daemon.submit(
+                    sock_path, 'run ' + run_cmd[len(self.EXECUTABLE):].strip())
+                if invocation:
+                    logging.debug('TradeFed daemon %s runs the tests, see %s.',
+                                  invocation.pid,
+                                  os.path.splitext(sock_path)[0] + '.log')
+                    return invocation, None
+            logging.debug('TradeFed daemon is unavailable, running TradeFed.')
+        log_file = None if self.is_verbose else self.create_log_file()
+        return self.run(run_cmd, output_to_stdout=self.is_verbose,
+                        env_vars=env_vars, log_file=log_file), log_file
+
     def _start_monitor(self, server, tf_subproc, reporter):
         """Polling and process event.
 
@@ -193,89 +523,53 @@ class AtestTradefedTestRunner(test_runner_base.TestRunnerBase):
             tf_subproc: The tradefed subprocess to poll.
             reporter: Result_Reporter object.
         """
-        inputs = [server]
-        event_handlers = {}
-        data_map = {}
-        inv_socket = None
-        while inputs:
-            try:
-                readable, _, _ = select.select(inputs, [], [], SELECT_TIMEOUT)
-                for socket_object in readable:
-                    if socket_object is server:
-                        conn, addr = socket_object.accept()
-                        logging.debug('Accepted connection from %s', addr)
-                        conn.setblocking(False)
-                        inputs.append(conn)
-                        data_map[conn] = ''
-                        # The First connection should be invocation
-                        # level reporter.
-                        if not inv_socket:
-                            inv_socket = conn
-                    else:
-                        # Count invocation level reporter events
-                        # without showing real-time information.
-                        if inv_socket == socket_object:
-                            reporter.silent = True
-                            event_handler = event_handlers.setdefault(
-                                socket_object, EventHandler(reporter,
-                                                            self.NAME))
-                        else:
-                            event_handler = event_handlers.setdefault(
-                                socket_object, EventHandler(
-                                    result_reporter.ResultReporter(),
-                                    self.NAME))
-                        recv_data = self._process_connection(data_map,
-                                                             socket_object,
-                                                             event_handler)
-                        if not recv_data:
-                            inputs.remove(socket_object)
-                            socket_object.close()
-            finally:
-                # Subprocess ended and all socket clients were closed.
-                if tf_subproc.poll() is not None and len(inputs) == 1:
-                    inputs.pop().close()
-                    if not data_map:
-                        raise TradeFedExitError(TRADEFED_EXIT_MSG
-                                                % tf_subproc.returncode)
+        self._monitor_invocations([(server, tf_subproc)], reporter)
 
-    def _process_connection(self, data_map, conn, event_handler):
-        """Process a socket connection betwen TF and ATest.
+    def _create_event_handler(self, reporter, index):
+        """Create the EventHandler of a connection from TradeFed.
 
-        Expect data of form EVENT_NAME {JSON_DATA}.  Multiple events will be
-        \n deliminated.  Need to buffer data in case data exceeds socket
-        buffer.
-        E.q.
-            TEST_RUN_STARTED {runName":"hello_world_test","runAttempt":0}\n
-            TEST_STARTED {"start_time":2172917, "testName":"PrintHelloWorld"}\n
         Args:
-            data_map: The data map of all connections.
-            conn: Socket connection.
-            event_handler: EventHandler object.
+            reporter: Result_Reporter object.
+            index: An integer of the index of the connection in the
+                invocation.
 
         Returns:
-            True if conn.recv() has data , False otherwise.
+            An EventHandler object.
         """
-        # Set connection into blocking mode.
-        conn.settimeout(None)
-        data = conn.recv(SOCKET_BUFFER)
-        if isinstance(data, bytes):
-            data = data.decode()
-        logging.debug('received: %s', data)
-        if data:
-            data_map[conn] += data
-            while True:
-                match = EVENT_RE.match(data_map[conn])
-                if not match:
-                    break
-                try:
-                    event_data = json.loads(match.group('json_data'))
-                except ValueError:
-                    logging.debug('Json incomplete, wait for more data')
-                    break
-                event_name = match.group('event_name')
-                event_handler.process_event(event_name, event_data)
-                data_map[conn] = data_map[conn][match.end():]
-        return bool(data)
+        # The First connection should be invocation level reporter. Count
+        # its events without showing real-time information.
+        if index == 0:
+            reporter.silent = True
+            return EventHandler(reporter, self.NAME)
+        return EventHandler(result_reporter.ResultReporter(), self.NAME)
+
+    def _monitor_invocations(self, invocations, reporter):
+        """Polling and process events of TradeFed invocations.
+
+        Args:
+            invocations: A list of tuples of a socket server object and the
+                tradefed subprocess reporting to it.
+            reporter: Result_Reporter object.
+        """
+        with event_server.EventServer() as server:
+            for sock, _ in invocations:
+                server.listen(sock, partial(self._create_event_handler,
+                                            reporter))
+            running = list(invocations)
+            while running:
+                server.poll(SELECT_TIMEOUT)
+                for invocation in list(running):
+                    sock, tf_subproc = invocation
+                    # Subprocess ended and all socket clients were closed.
+                    # Connections made right before the exit are accepted
+                    # by polling again.
+                    if (tf_subproc.poll() is None or server.poll(0)
+                            or not server.is_idle(sock)):
+                        continue
+                    running.remove(invocation)
+                    if not server.close_listener(sock):
+                        raise TradeFedExitError(TRADEFED_EXIT_MSG
+                                                % tf_subproc.returncode)
 
     def _start_socket_server(self):
         """Start a TCP server."""
@@ -427,6 +721,18 @@ class AtestTradefedTestRunner(test_runner_base.TestRunnerBase):
             if constants.TF_DEBUG == arg:
                 print("Please attach process to your IDE...")
                 continue
+            if constants.HOST_SHARDS == arg:
+                # Handled by running the shards in parallel invocations.
+                continue
+            if constants.ALL_DEVICES == arg:
+                # Handled by running the modules on each device.
+                continue
+            if constants.FAIL_FAST == arg:
+                # Handled by stopping the iterations and the devices.
+                continue
+            if constants.TF_DAEMON == arg:
+                # Handled by running the commands in the TradeFed daemon.
+                continue
             args_not_supported.append(arg)
         return args_to_append, args_not_supported
 
@@ -448,7 +754,8 @@ class AtestTradefedTestRunner(test_runner_base.TestRunnerBase):
             iterations = extra_args.pop(constants.POST_PATCH_ITERATIONS)
         return iterations
 
-    def generate_run_commands(self, test_infos, extra_args, port=None):
+    def generate_run_commands(self, test_infos, extra_args, port=None,
+                              log_path=None):
         """Generate a single run command from TestInfos.
 
         Args:
@@ -456,6 +763,8 @@ class AtestTradefedTestRunner(test_runner_base.TestRunnerBase):
             extra_args: A Dict of extra args to append.
             port: Optional. An int of the port number to send events to. If
                   None, then subprocess reporter in TF won't try to connect.
+            log_path: Optional. A string of the folder to save the logs of
+                  the invocation. Default is the log folder of the runner.
 
         Returns:
             A list that contains the string of atest tradefed run command.
@@ -497,6 +806,8 @@ class AtestTradefedTestRunner(test_runner_base.TestRunnerBase):
         for_test_mapping = test_infos and test_infos[0].from_test_mapping
         test_args.extend(atest_utils.get_result_server_args(for_test_mapping))
         self.run_cmd_dict['args'] = ' '.join(test_args)
+        self.run_cmd_dict['log_args'] = self._LOG_ARGS.format(
+            log_path=log_path or self.log_path)
         self.run_cmd_dict['tf_customize_template'] = (
             self._extract_customize_tf_templates(extra_args))
         return [self._RUN_CMD.format(**self.run_cmd_dict)]
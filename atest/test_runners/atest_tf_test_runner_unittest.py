@@ -18,7 +18,9 @@
 
 # pylint: disable=line-too-long
 
+import itertools
 import os
+import socket
 import sys
 import tempfile
 import unittest
@@ -31,8 +33,8 @@ import constants
 import unittest_constants as uc
 import unittest_utils
 
+from atest_execution_info import TestHistory
 from test_finders import test_info
-from test_runners import event_handler
 from test_runners import atest_tf_test_runner as atf_tr
 
 #pylint: disable=protected-access
@@ -172,121 +174,428 @@ EVENTS_NORMAL = [
     ('TEST_MODULE_ENDED', {'foo': 'bar'}),
 ]
 
+
+def _send_events(port, events):
+    """Report events to the socket server like a TradeFed connection."""
+    with socket.create_connection((atf_tr.SOCKET_HOST, port)) as client:
+        client.sendall(''.join('%s %s\n' % (name, json.dumps(data))
+                               for name, data in events).encode())
+
+
+def _get_events(handler):
+    """Get the events passed to a mock EventHandler."""
+    return [call[0] for call in handler.process_event.call_args_list]
+
+
 class AtestTradefedTestRunnerUnittests(unittest.TestCase):
     """Unit tests for atest_tf_test_runner.py"""
 
     @mock.patch.dict('os.environ', {constants.ANDROID_BUILD_TOP:'/'})
     def setUp(self):
         self.tr = atf_tr.AtestTradefedTestRunner(results_dir=TEST_INFO_DIR)
+        # Don't wait long for the events of the mock TradeFed subprocesses.
+        mock.patch.object(atf_tr, 'SELECT_TIMEOUT', 0.01).start()
 
     def tearDown(self):
         mock.patch.stopall()
 
-    @mock.patch.object(atf_tr.AtestTradefedTestRunner,
-                       '_start_socket_server')
-    @mock.patch.object(atf_tr.AtestTradefedTestRunner,
-                       'run')
+    def _mock_event_handlers(self):
+        """Mock EventHandler to record the handler of each connection.
+
+        Returns:
+            A list of the mock EventHandlers in the order of connections.
+        """
+        handlers = []
+        def _create_handler(reporter, name):
+            handlers.append(mock.Mock(reporter=reporter, runner=name))
+            return handlers[-1]
+        mock.patch.object(atf_tr, 'EventHandler',
+                          side_effect=_create_handler).start()
+        return handlers
+
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'run')
     @mock.patch.object(atf_tr.AtestTradefedTestRunner,
                        '_create_test_args', return_value=['some_args'])
     @mock.patch.object(atf_tr.AtestTradefedTestRunner,
-                       'generate_run_commands', return_value='some_cmd')
-    @mock.patch.object(atf_tr.AtestTradefedTestRunner,
-                       '_process_connection', return_value=None)
-    @mock.patch('select.select')
+                       'generate_run_commands')
     @mock.patch('os.killpg', return_value=None)
     @mock.patch('os.getpgid', return_value=None)
     @mock.patch('signal.signal', return_value=None)
-    def test_run_tests_pretty(self, _signal, _pgid, _killpg, mock_select,
-                              _process, _run_cmd, _test_args,
-                              mock_run, mock_start_socket_server):
+    def test_run_tests_pretty(self, _signal, _pgid, _killpg, mock_run_cmds,
+                              _test_args, mock_run):
         """Test _run_tests_pretty method."""
+        handlers = self._mock_event_handlers()
         mock_subproc = mock.Mock()
         mock_run.return_value = mock_subproc
         mock_subproc.returncode = 0
-        mock_subproc.poll.side_effect = [True, True, None]
-        mock_server = mock.Mock()
-        mock_server.getsockname.return_value = ('', '')
-        mock_start_socket_server.return_value = mock_server
+        mock_subproc.poll.return_value = 0
         mock_reporter = mock.Mock()
 
         # Test no early TF exit
-        mock_conn = mock.Mock()
-        mock_server.accept.return_value = (mock_conn, 'some_addr')
-        mock_server.close.return_value = True
-        mock_select.side_effect = [([mock_server], None, None),
-                                   ([mock_conn], None, None)]
-        self.tr.run_tests_pretty([MODULE2_INFO], {}, mock_reporter)
+        def _report_events(_test_infos, _extra_args, port):
+            _send_events(port, EVENTS_NORMAL)
+            return ['some_cmd']
+        mock_run_cmds.side_effect = _report_events
+        self.assertEqual(0, self.tr.run_tests_pretty([MODULE2_INFO], {},
+                                                     mock_reporter))
+        self.assertEqual(1, len(handlers))
+        self.assertEqual(mock_reporter, handlers[0].reporter)
+        self.assertEqual(EVENTS_NORMAL, _get_events(handlers[0]))
 
         # Test early TF exit
         tmp_file = tempfile.NamedTemporaryFile()
         with open(tmp_file.name, 'w') as f:
             f.write("tf msg")
-        self.tr.test_log_file = tmp_file
-        mock_select.side_effect = [([], None, None)]
-        mock_subproc.poll.side_effect = None
+        mock_run_cmds.side_effect = None
+        mock_run_cmds.return_value = ['some_cmd']
+        mock_subproc.poll.return_value = 1
         capture_output = StringIO()
         sys.stdout = capture_output
-        self.assertRaises(atf_tr.TradeFedExitError, self.tr.run_tests_pretty,
-                          [MODULE2_INFO], {}, mock_reporter)
+        with mock.patch.object(self.tr, 'create_log_file',
+                               return_value=tmp_file):
+            self.assertRaises(atf_tr.TradeFedExitError,
+                              self.tr.run_tests_pretty, [MODULE2_INFO], {},
+                              mock_reporter)
         sys.stdout = sys.__stdout__
         self.assertTrue('tf msg' in capture_output.getvalue())
 
-    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_process_connection')
-    @mock.patch('select.select')
-    def test_start_monitor_2_connection(self, mock_select, mock_process):
+    def test_start_monitor_2_connection(self):
         """Test _start_monitor method."""
-        mock_server = mock.Mock()
+        handlers = self._mock_event_handlers()
+        server = self.tr._start_socket_server()
+        port = server.getsockname()[1]
         mock_subproc = mock.Mock()
         mock_reporter = mock.Mock()
-        mock_conn1 = mock.Mock()
-        mock_conn2 = mock.Mock()
-        mock_server.accept.side_effect = [(mock_conn1, 'addr 1'),
-                                          (mock_conn2, 'addr 2')]
-        mock_select.side_effect = [([mock_server], None, None),
-                                   ([mock_server], None, None),
-                                   ([mock_conn1], None, None),
-                                   ([mock_conn2], None, None),
-                                   ([mock_conn1], None, None),
-                                   ([mock_conn2], None, None)]
-        mock_process.side_effect = ['abc', 'def', False, False]
-        mock_subproc.poll.side_effect = [None, None, None, None,
-                                         None, True]
-        self.tr._start_monitor(mock_server, mock_subproc, mock_reporter)
-        self.assertEqual(mock_process.call_count, 4)
-        calls = [mock.call.accept(), mock.call.close()]
-        mock_server.assert_has_calls(calls)
-        mock_conn1.assert_has_calls([mock.call.close()])
-        mock_conn2.assert_has_calls([mock.call.close()])
-
-    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_process_connection')
-    @mock.patch('select.select')
-    def test_start_monitor_tf_exit_before_2nd_connection(self,
-                                                         mock_select,
-                                                         mock_process):
+        _send_events(port, EVENTS_NORMAL[:2])
+        _send_events(port, EVENTS_NORMAL[2:])
+        mock_subproc.poll.side_effect = itertools.chain(
+            [None, None, None], itertools.repeat(0))
+        self.tr._start_monitor(server, mock_subproc, mock_reporter)
+        self.assertEqual(2, len(handlers))
+        # Only the invocation level connection reports to the reporter.
+        self.assertEqual(mock_reporter, handlers[0].reporter)
+        self.assertTrue(mock_reporter.silent)
+        self.assertNotEqual(mock_reporter, handlers[1].reporter)
+        self.assertEqual(EVENTS_NORMAL[:2], _get_events(handlers[0]))
+        self.assertEqual(EVENTS_NORMAL[2:], _get_events(handlers[1]))
+        self.assertEqual(-1, server.fileno())
+
+    def test_start_monitor_tf_exit_before_2nd_connection(self):
         """Test _start_monitor method."""
-        mock_server = mock.Mock()
+        handlers = self._mock_event_handlers()
+        server = self.tr._start_socket_server()
+        port = server.getsockname()[1]
         mock_subproc = mock.Mock()
-        mock_reporter = mock.Mock()
-        mock_conn1 = mock.Mock()
-        mock_conn2 = mock.Mock()
-        mock_server.accept.side_effect = [(mock_conn1, 'addr 1'),
-                                          (mock_conn2, 'addr 2')]
-        mock_select.side_effect = [([mock_server], None, None),
-                                   ([mock_server], None, None),
-                                   ([mock_conn1], None, None),
-                                   ([mock_conn2], None, None),
-                                   ([mock_conn1], None, None),
-                                   ([mock_conn2], None, None)]
-        mock_process.side_effect = ['abc', 'def', False, False]
+        _send_events(port, EVENTS_NORMAL[:2])
+        _send_events(port, EVENTS_NORMAL[2:])
         # TF exit early but have not processed data in socket buffer.
-        mock_subproc.poll.side_effect = [None, None, True, True,
-                                         True, True]
-        self.tr._start_monitor(mock_server, mock_subproc, mock_reporter)
-        self.assertEqual(mock_process.call_count, 4)
-        calls = [mock.call.accept(), mock.call.close()]
-        mock_server.assert_has_calls(calls)
-        mock_conn1.assert_has_calls([mock.call.close()])
-        mock_conn2.assert_has_calls([mock.call.close()])
+        mock_subproc.poll.return_value = 0
+        self.tr._start_monitor(server, mock_subproc, mock.Mock())
+        self.assertEqual(2, len(handlers))
+        self.assertEqual(EVENTS_NORMAL[:2], _get_events(handlers[0]))
+        self.assertEqual(EVENTS_NORMAL[2:], _get_events(handlers[1]))
+        self.assertEqual(-1, server.fileno())
+
+    def test_monitor_invocations_of_host_shards(self):
+        """Test _monitor_invocations method with multiple invocations."""
+        handlers = self._mock_event_handlers()
+        server1 = self.tr._start_socket_server()
+        server2 = self.tr._start_socket_server()
+        mock_subproc1 = mock.Mock()
+        mock_subproc2 = mock.Mock()
+        mock_reporter = mock.Mock()
+        _send_events(server1.getsockname()[1], EVENTS_NORMAL[:2])
+        _send_events(server2.getsockname()[1], EVENTS_NORMAL[2:])
+        mock_subproc1.poll.side_effect = itertools.chain(
+            [None], itertools.repeat(0))
+        mock_subproc2.poll.side_effect = itertools.chain(
+            [None, None], itertools.repeat(0))
+        self.tr._monitor_invocations([(server1, mock_subproc1),
+                                      (server2, mock_subproc2)],
+                                     mock_reporter)
+        # Events of both invocation level connections go to the reporter.
+        self.assertEqual([mock_reporter, mock_reporter],
+                         [handler.reporter for handler in handlers])
+        self.assertEqual(EVENTS_NORMAL,
+                         sorted(_get_events(handlers[0])
+                                + _get_events(handlers[1]),
+                                key=EVENTS_NORMAL.index))
+        self.assertEqual(-1, server1.fileno())
+        self.assertEqual(-1, server2.fileno())
+
+    def test_monitor_invocations_shard_exit_early(self):
+        """Test _monitor_invocations method when a shard exits early."""
+        self._mock_event_handlers()
+        server1 = self.tr._start_socket_server()
+        server2 = self.tr._start_socket_server()
+        mock_subproc1 = mock.Mock()
+        mock_subproc2 = mock.Mock()
+        _send_events(server1.getsockname()[1], EVENTS_NORMAL)
+        mock_subproc1.poll.return_value = None
+        mock_subproc2.poll.return_value = 1
+        self.assertRaises(atf_tr.TradeFedExitError,
+                          self.tr._monitor_invocations,
+                          [(server1, mock_subproc1),
+                           (server2, mock_subproc2)], mock.Mock())
+        self.assertEqual(-1, server1.fileno())
+
+    def test_partition_test_infos(self):
+        """Test partition_test_infos method."""
+        infos = [test_info.TestInfo(name, atf_tr.AtestTradefedTestRunner.NAME,
+                                    set()) for name in 'ABCD']
+        # D has no history and is assumed to take the average duration 70.
+        durations = {'A': 100, 'B': 60, 'C': 50}
+        shards = self.tr.partition_test_infos(infos, 2, durations)
+        self.assertEqual([['A', 'C'], ['D', 'B']],
+                         [[x.test_name for x in shard] for shard in shards])
+        shards = self.tr.partition_test_infos(infos, 8, durations)
+        self.assertEqual(4, len(shards))
+
+    def test_partition_test_infos_by_class(self):
+        """Test partition_test_infos method splits modules by class."""
+        # MODULE2 has no history and is assumed to take 150ms.
+        durations = {uc.MODULE_NAME: 300,
+                     '%s:%s' % (uc.MODULE_NAME, uc.FULL_CLASS_NAME): 100,
+                     '%s:%s' % (uc.MODULE_NAME, FULL_CLASS2_NAME): 200}
+        shards = self.tr.partition_test_infos(
+            [CLASS1_INFO, CLASS2_INFO, MODULE2_INFO], 3, durations)
+        self.assertEqual(
+            [[(uc.MODULE_NAME, frozenset([CLASS2_FILTER]))],
+             [(uc.MODULE2_NAME, frozenset())],
+             [(uc.MODULE_NAME, frozenset([uc.CLASS_FILTER]))]],
+            [[(x.test_name, x.data[constants.TI_FILTER]) for x in shard]
+             for shard in shards])
+        # The modules aren't split if there are enough modules for shards.
+        shards = self.tr.partition_test_infos(
+            [CLASS1_INFO, CLASS2_INFO, MODULE2_INFO], 2, durations)
+        self.assertEqual([[uc.MODULE_NAME], [uc.MODULE2_NAME]],
+                         [[x.test_name for x in shard] for shard in shards])
+
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_run_host_shards',
+                       return_value=0)
+    @mock.patch('atest_execution_info.get_test_durations', return_value={})
+    def test_run_tests_pretty_with_host_shards(self, _durations,
+                                               mock_run_shards):
+        """Test run_tests_pretty method runs host shards."""
+        infos = [test_info.TestInfo(name, atf_tr.AtestTradefedTestRunner.NAME,
+                                    set()) for name in 'ABC']
+        extra_args = {constants.HOST: True, constants.HOST_SHARDS: 2}
+        self.tr.run_tests_pretty(infos, extra_args, mock.Mock())
+        shards = mock_run_shards.call_args[0][0]
+        self.assertEqual(2, len(shards))
+        self.assertEqual({'A', 'B', 'C'},
+                         {x.test_name for shard in shards for x in shard})
+
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'wait_for_subprocess',
+                       return_value=0)
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_monitor_invocations')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'run')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'generate_run_commands',
+                       return_value=['some_cmd'])
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_start_socket_server')
+    @mock.patch('signal.signal', return_value=None)
+    def test_run_host_shards(self, _signal, mock_server, mock_cmds, mock_run,
+                             mock_monitor, _wait):
+        """Test _run_host_shards method."""
+        servers = [mock.Mock(), mock.Mock()]
+        for port, server in enumerate(servers):
+            server.getsockname.return_value = ('', port + 1000)
+        mock_server.side_effect = servers
+        subprocs = [mock.Mock(), mock.Mock()]
+        mock_run.side_effect = subprocs
+        shards = [[MODULE2_INFO], [CLASS1_INFO]]
+        mock_reporter = mock.Mock()
+        self.assertEqual(0, self.tr._run_host_shards(shards, {},
+                                                     mock_reporter))
+        mock_cmds.assert_has_calls([
+            mock.call([MODULE2_INFO], {}, 1000, log_path=os.path.join(
+                self.tr.log_path, 'shard_0')),
+            mock.call([CLASS1_INFO], {}, 1001, log_path=os.path.join(
+                self.tr.log_path, 'shard_1'))])
+        mock_monitor.assert_called_once_with(list(zip(servers, subprocs)),
+                                             mock_reporter)
+        for server in servers:
+            server.close.assert_called_once_with()
+
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'wait_for_subprocess',
+                       side_effect=[0, 1])
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_monitor_invocations')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'run')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'generate_run_commands',
+                       return_value=['some_cmd'])
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_start_socket_server')
+    @mock.patch('signal.signal', return_value=None)
+    def test_run_host_shards_failed(self, _signal, _server, _cmds, mock_run,
+                                    _monitor, _wait):
+        """Test _run_host_shards method prints the log of the failed shard."""
+        log_files = []
+
+        def _run(*_args, **kwargs):
+            kwargs['log_file'].write('output %d' % len(log_files))
+            kwargs['log_file'].flush()
+            log_files.append(kwargs['log_file'])
+            return mock.Mock()
+
+        mock_run.side_effect = _run
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            self.assertEqual(1, self.tr._run_host_shards(
+                [[MODULE2_INFO], [CLASS1_INFO]], {}, mock.Mock()))
+        finally:
+            sys.stdout = sys.__stdout__
+            for log_file in log_files:
+                log_file.close()
+        output = capture_output.getvalue()
+        self.assertIn('Host test shard 1 failed', output)
+        self.assertIn('output 1', output)
+        self.assertNotIn('output 0', output)
+
+
+    @mock.patch('test_runners.device_scheduler.print_utilization')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_run_on_device')
+    @mock.patch('atest_execution_info.get_test_durations',
+                return_value={uc.MODULE2_NAME: 10, uc.MODULE_NAME: 5})
+    def test_run_tests_pretty_on_all_devices(self, _durations, mock_run,
+                                             mock_print):
+        """Test run_tests_pretty method distributes modules to devices."""
+        self.tr.device_lister = mock.Mock()
+        self.tr.device_lister.list_serials.return_value = ['a', 'b']
+        reporters = {}
+
+        def _run_on_device(serial, batch, _extra_args, reporter):
+            self.assertEqual(1, len(batch))
+            reporters[batch[0].test_name] = reporter
+            reporter.all_test_results.append(serial)
+            return 0
+
+        mock_run.side_effect = _run_on_device
+        mock_reporter = mock.Mock()
+        extra_args = {constants.ALL_DEVICES: True}
+        self.assertEqual(0, self.tr.run_tests_pretty(
+            [MODULE2_INFO, CLASS1_INFO], extra_args, mock_reporter))
+        self.assertEqual({uc.MODULE_NAME, uc.MODULE2_NAME}, set(reporters))
+        # Batch reporters are merged in the order of the durations.
+        mock_reporter.merge.assert_has_calls(
+            [mock.call(reporters[uc.MODULE2_NAME]),
+             mock.call(reporters[uc.MODULE_NAME])])
+        usages = mock_print.call_args[0][0]
+        self.assertEqual(['a', 'b'], [x.serial for x in usages])
+        # An idle device may steal the batch of the other one.
+        self.assertEqual(2, sum(len(x.tests) for x in usages))
+        for usage in usages:
+            for info in usage.tests:
+                self.assertEqual([usage.serial],
+                                 reporters[info.test_name].all_test_results)
+
+    @mock.patch('test_runners.device_scheduler.print_utilization')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_run_on_device',
+                       return_value=0)
+    @mock.patch('atest_execution_info.get_test_durations',
+                return_value={uc.MODULE2_NAME: 10, uc.MODULE_NAME: 5})
+    def test_run_on_devices_batch(self, _durations, mock_run, mock_print):
+        """Test _run_on_devices method runs a device's modules at once."""
+        self.assertEqual(0, self.tr._run_on_devices(
+            [MODULE2_INFO, CLASS1_INFO], ['a'], {}, mock.Mock()))
+        self.assertEqual(1, mock_run.call_count)
+        names = [uc.MODULE2_NAME, uc.MODULE_NAME]
+        self.assertEqual(names, [info.test_name
+                                 for info in mock_run.call_args[0][1]])
+        usages = mock_print.call_args[0][0]
+        self.assertEqual(names, [info.test_name for info in usages[0].tests])
+
+    @mock.patch('test_runners.device_scheduler.print_utilization')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_run_on_device')
+    @mock.patch('atest_execution_info.get_test_history')
+    def test_run_tests_pretty_on_all_devices_fail_fast(self, mock_history,
+                                                       mock_run, _print):
+        """Test run_tests_pretty method runs the likely failed class first."""
+        class2_name = '%s:%s' % (uc.MODULE_NAME, FULL_CLASS2_NAME)
+        mock_history.return_value = {
+            uc.MODULE2_NAME: TestHistory(10, 4, 0),
+            class2_name: TestHistory(10, 4, 4)}
+        self.tr.device_lister = mock.Mock()
+        self.tr.device_lister.list_serials.return_value = ['a', 'b']
+        mock_run.return_value = constants.EXIT_CODE_TEST_FAILURE
+        extra_args = {constants.ALL_DEVICES: True, constants.FAIL_FAST: True}
+        with mock.patch('sys.stdout', new_callable=StringIO):
+            self.assertEqual(
+                constants.EXIT_CODE_TEST_FAILURE,
+                self.tr.run_tests_pretty([MODULE2_INFO, CLASS1_INFO,
+                                          CLASS2_INFO], extra_args,
+                                         mock.Mock()))
+        # Each device takes its first unit before the failure is reported.
+        run_units = [(x[0][1][0].test_name,
+                      x[0][1][0].data[constants.TI_FILTER])
+                     for x in mock_run.call_args_list]
+        for call in mock_run.call_args_list:
+            self.assertEqual(1, len(call[0][1]))
+        self.assertIn((uc.MODULE_NAME, frozenset([CLASS2_FILTER])), run_units)
+        self.assertLessEqual(len(run_units), 2)
+
+    def test_get_device_serials(self):
+        """Test _get_device_serials method."""
+        self.tr.device_lister = mock.Mock()
+        self.tr.device_lister.list_serials.return_value = ['a', 'b']
+        self.assertEqual([], self.tr._get_device_serials({}))
+        self.assertEqual(['a', 'b'], self.tr._get_device_serials(
+            {constants.ALL_DEVICES: True}))
+        for arg in (constants.HOST, constants.SERIAL, constants.SHARDING):
+            self.assertEqual([], self.tr._get_device_serials(
+                {constants.ALL_DEVICES: True, arg: 'a'}))
+
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'wait_for_subprocess',
+                       return_value=0)
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'handle_subprocess')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'run')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'generate_run_commands',
+                       return_value=['some_cmd'])
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_start_socket_server')
+    def test_run_on_device(self, mock_server, mock_cmds, mock_run,
+                           mock_handle, _wait):
+        """Test _run_on_device method."""
+        mock_server.return_value.getsockname.return_value = ('', 1000)
+        self.assertEqual(0, self.tr._run_on_device('a', [MODULE2_INFO], {},
+                                                   mock.Mock()))
+        mock_cmds.assert_called_once_with(
+            [MODULE2_INFO], {constants.SERIAL: 'a'}, 1000,
+            log_path=os.path.join(self.tr.log_path, 'device_a'))
+        mock_server.return_value.close.assert_called_once_with()
+        # The raw output of the invocation isn't shared with other devices.
+        log_file = mock_run.call_args[1]['log_file']
+        self.assertIsNotNone(log_file)
+        self.assertEqual([log_file], mock_handle.call_args[1]['log_files'])
+        self.assertIsNone(self.tr.test_log_file)
+
+    @mock.patch('test_runners.tradefed_daemon.submit')
+    @mock.patch('test_runners.tradefed_daemon.start_daemon', return_value=True)
+    @mock.patch('test_runners.tradefed_daemon.get_socket_path',
+                return_value='/tmp/a.sock')
+    @mock.patch.object(atf_tr.AtestTradefedTestRunner, 'run')
+    def test_run_tradefed(self, mock_run, _path, mock_start, mock_submit):
+        """Test _run_tradefed method."""
+        run_cmd = 'atest_tradefed.sh template/atest_local_min --port 1000'
+        # Test the command is run by the daemon.
+        self.assertEqual((mock_submit.return_value, None),
+                         self.tr._run_tradefed(run_cmd,
+                                               {constants.TF_DAEMON: True}))
+        mock_submit.assert_called_once_with(
+            '/tmp/a.sock', 'run template/atest_local_min --port 1000')
+        mock_run.assert_not_called()
+        # Test TradeFed runs without the daemon if it's unavailable.
+        mock_start.return_value = False
+        subproc, log_file = self.tr._run_tradefed(run_cmd,
+                                                  {constants.TF_DAEMON: True})
+        self.assertEqual(mock_run.return_value, subproc)
+        self.assertEqual(log_file, mock_run.call_args[1]['log_file'])
+        # Test the debug mode runs without the daemon.
+        mock_start.return_value = True
+        mock_submit.reset_mock()
+        self.tr._run_tradefed(run_cmd, {constants.TF_DAEMON: True,
+                                        constants.TF_DEBUG: 10888})
+        self.tr._run_tradefed(run_cmd, {})
+        mock_submit.assert_not_called()
+        self.assertEqual(3, mock_run.call_count)
 
 
     def test_start_socket_server(self):
@@ -316,68 +625,6 @@ class AtestTradefedTestRunnerUnittests(unittest.TestCase):
         self.tr._try_set_gts_authentication_key()
         self.assertEqual(os.environ.get('APE_API_KEY'), None)
 
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_process_connection(self, mock_pe):
-        """Test _process_connection method."""
-        mock_socket = mock.Mock()
-        for name, data in EVENTS_NORMAL:
-            data_map = {mock_socket: ''}
-            socket_data = '%s %s' % (name, json.dumps(data))
-            mock_socket.recv.return_value = socket_data
-            self.tr._process_connection(data_map, mock_socket, mock_pe)
-
-        calls = [mock.call.process_event(name, data) for name, data in EVENTS_NORMAL]
-        mock_pe.assert_has_calls(calls)
-        mock_socket.recv.return_value = ''
-        self.assertFalse(self.tr._process_connection(data_map, mock_socket, mock_pe))
-
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_process_connection_multiple_lines_in_single_recv(self, mock_pe):
-        """Test _process_connection when recv reads multiple lines in one go."""
-        mock_socket = mock.Mock()
-        squashed_events = '\n'.join(['%s %s' % (name, json.dumps(data))
-                                     for name, data in EVENTS_NORMAL])
-        socket_data = [squashed_events, '']
-        mock_socket.recv.side_effect = socket_data
-        data_map = {mock_socket: ''}
-        self.tr._process_connection(data_map, mock_socket, mock_pe)
-        calls = [mock.call.process_event(name, data) for name, data in EVENTS_NORMAL]
-        mock_pe.assert_has_calls(calls)
-
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_process_connection_with_buffering(self, mock_pe):
-        """Test _process_connection when events overflow socket buffer size."""
-        mock_socket = mock.Mock()
-        module_events = [EVENTS_NORMAL[0], EVENTS_NORMAL[-1]]
-        socket_events = ['%s %s' % (name, json.dumps(data))
-                         for name, data in module_events]
-        # test try-block code by breaking apart first event after first }
-        index = socket_events[0].index('}') + 1
-        socket_data = [socket_events[0][:index], socket_events[0][index:]]
-        # test non-try block buffering with second event
-        socket_data.extend([socket_events[1][:-4], socket_events[1][-4:], ''])
-        mock_socket.recv.side_effect = socket_data
-        data_map = {mock_socket: ''}
-        self.tr._process_connection(data_map, mock_socket, mock_pe)
-        self.tr._process_connection(data_map, mock_socket, mock_pe)
-        self.tr._process_connection(data_map, mock_socket, mock_pe)
-        self.tr._process_connection(data_map, mock_socket, mock_pe)
-        calls = [mock.call.process_event(name, data) for name, data in module_events]
-        mock_pe.assert_has_calls(calls)
-
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_process_connection_with_not_completed_event_data(self, mock_pe):
-        """Test _process_connection when event have \n prefix."""
-        mock_socket = mock.Mock()
-        mock_socket.recv.return_value = ('\n%s %s'
-                                         %(EVENTS_NORMAL[0][0],
-                                           json.dumps(EVENTS_NORMAL[0][1])))
-        data_map = {mock_socket: ''}
-        self.tr._process_connection(data_map, mock_socket, mock_pe)
-        calls = [mock.call.process_event(EVENTS_NORMAL[0][0],
-                                         EVENTS_NORMAL[0][1])]
-        mock_pe.assert_has_calls(calls)
-
     @mock.patch('os.environ.get', return_value=None)
     @mock.patch.object(atf_tr.AtestTradefedTestRunner, '_generate_metrics_folder')
     @mock.patch('atest_utils.get_result_server_args')
@@ -0,0 +1,240 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Scheduler distributing tests across the connected devices.
+"""
+
+import collections
+import logging
+import queue
+import subprocess
+import threading
+import time
+
+import atest_utils
+import constants
+
+from test_runners import test_runner_base
+
+# State of the devices ready for tests in the output of `adb devices`.
+_DEVICE_STATE = 'device'
+
+# The tests run on a device and the time it was busy running them.
+DeviceUsage = collections.namedtuple(
+    'DeviceUsage', ['serial', 'tests', 'busy_secs'])
+
+
+class AdbDeviceLister:
+    """List the serials of the devices connected to adb.
+
+    Tests can substitute any object providing list_serials to fake the
+    connected devices.
+    """
+
+    @staticmethod
+    def list_serials():
+        """List the serials of the devices ready for tests.
+
+        Returns:
+            A list of serials, empty if adb can't be run.
+        """
+        try:
+            output = subprocess.check_output(['adb', 'devices'],
+                                             stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError) as err:
+            logging.debug('Exception raised: %s', err)
+            return []
+        serials = []
+        # Skip the header "List of devices attached".
+        for line in output.decode().splitlines()[1:]:
+            fields = line.split()
+            if len(fields) == 2 and fields[1] == _DEVICE_STATE:
+                serials.append(fields[0])
+        return serials
+
+
+class WorkStealingQueue:
+    """Queues of tests of each device, where idle devices steal tests.
+
+    The tests are dealt to the devices in the given order, so the longest
+    tests should come first. A device takes the next test from the front of
+    its own queue, and once its queue is empty, it steals the last test of
+    the longest queue of the other devices.
+    """
+
+    def __init__(self, serials, tests):
+        """WorkStealingQueue constructor
+
+        Args:
+            serials: A list of serials of the devices.
+            tests: A list of tests, from the longest to the shortest.
+        """
+        self._queues = collections.OrderedDict(
+            (serial, collections.deque()) for serial in serials)
+        for index, test in enumerate(tests):
+            self._queues[serials[index % len(serials)]].append(test)
+        self._lock = threading.Lock()
+
+    def get(self, serial):
+        """Get the next test to run on the device.
+
+        Args:
+            serial: A string of the serial of the device.
+
+        Returns:
+            A test, None if there's no test left.
+        """
+        with self._lock:
+            own_queue = self._queues[serial]
+            if own_queue:
+                return own_queue.popleft()
+            victim = max(self._queues.values(), key=len)
+            if victim:
+                return victim.pop()
+            return None
+
+    def drain(self):
+        """Remove all the tests left.
+
+        Returns:
+            A list of the tests which haven't been taken.
+        """
+        with self._lock:
+            tests = []
+            for test_queue in self._queues.values():
+                tests.extend(test_queue)
+                test_queue.clear()
+            return tests
+
+
+class DeviceScheduler:
+    """Run tests on all the devices, one test at a time per device."""
+
+    def __init__(self, serials, run_func, stop_on_failure=False):
+        """DeviceScheduler constructor
+
+        Args:
+            serials: A list of serials of the devices.
+            run_func: A function of the serial of a device and a test that
+                runs the test on the device and returns its exit code.
+            stop_on_failure: True to start no more test on any device once a
+                test fails.
+        """
+        self.serials = serials
+        self._run_func = run_func
+        self._stop_on_failure = stop_on_failure
+        self._failed = threading.Event()
+
+    def _run_device(self, serial, tests, usages, ret_codes):
+        """Run tests on a device until there's no test left.
+
+        A device stops taking tests once a test fails to run on it, e.g. the
+        device is disconnected, so that the other devices steal its tests.
+
+        Args:
+            serial: A string of the serial of the device.
+            tests: A WorkStealingQueue of the tests.
+            usages: A dict of serial to DeviceUsage to update.
+            ret_codes: A list to append the exit codes of the tests to.
+        """
+        while not self._failed.is_set():
+            test = tests.get(serial)
+            if test is None:
+                return
+            start = time.time()
+            try:
+                ret_code = self._run_func(serial, test)
+                ret_codes.append(ret_code)
+                if ret_code and self._stop_on_failure:
+                    self._failed.set()
+            # The tests on the other devices go on whatever this one raises.
+            except Exception as err:  # pylint: disable=broad-except
+                logging.debug('Caught exception:', exc_info=1)
+                atest_utils.colorful_print(
+                    'Stop running tests on %s: %s' % (serial, err),
+                    constants.RED)
+                ret_codes.append(constants.EXIT_CODE_TEST_FAILURE)
+                return
+            finally:
+                usage = usages[serial]
+                usages[serial] = usage._replace(
+                    tests=usage.tests + [test],
+                    busy_secs=usage.busy_secs + time.time() - start)
+
+    def run(self, tests):
+        """Run the tests on the devices.
+
+        Args:
+            tests: A list of tests in the order to run them, e.g. from the
+                longest to the shortest.
+
+        Returns:
+            A tuple of the exit code, a list of DeviceUsage of each device and
+            the elapsed seconds.
+        """
+        self._failed.clear()
+        work_queue = WorkStealingQueue(self.serials, tests)
+        usages = {serial: DeviceUsage(serial, [], 0) for serial in self.serials}
+        ret_codes = []
+        finished = queue.Queue()
+
+        def _run(serial):
+            """Run the tests on the device in the current thread."""
+            try:
+                self._run_device(serial, work_queue, usages, ret_codes)
+            finally:
+                finished.put(serial)
+
+        start = time.time()
+        for serial in self.serials:
+            threading.Thread(target=_run, args=(serial,), daemon=True).start()
+        try:
+            for _ in self.serials:
+                finished.get()
+        except KeyboardInterrupt:
+            work_queue.drain()
+            test_runner_base.interrupt_subprocesses()
+            raise
+        ret_code = constants.EXIT_CODE_SUCCESS
+        for code in ret_codes:
+            ret_code |= code
+        not_run = work_queue.drain()
+        if not_run and self._failed.is_set():
+            atest_utils.colorful_print(
+                'Skipped after the first failure: %s' % ', '.join(
+                    map(str, not_run)), constants.YELLOW)
+        elif not_run:
+            atest_utils.colorful_print(
+                'No device left to run: %s' % ', '.join(map(str, not_run)),
+                constants.RED)
+            ret_code |= constants.EXIT_CODE_TEST_FAILURE
+        return (ret_code, [usages[serial] for serial in self.serials],
+                time.time() - start)
+
+
+def print_utilization(usages, elapsed_secs):
+    """Print the tests run on each device and how busy the devices were.
+
+    Args:
+        usages: A list of DeviceUsage.
+        elapsed_secs: A float of the seconds to run all the tests.
+    """
+    atest_utils.colorful_print('\nDevice utilization:', constants.CYAN)
+    for usage in usages:
+        utilization = (100 * usage.busy_secs / elapsed_secs
+                       if elapsed_secs else 0)
+        print('%s: %d test(s), busy %.1fs of %.1fs (%d%%)' % (
+            atest_utils.colorize(usage.serial, constants.GREEN),
+            len(usage.tests), usage.busy_secs, elapsed_secs, utilization))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for device_scheduler."""
+
+import subprocess
+import sys
+import threading
+import unittest
+
+from io import StringIO
+from unittest import mock
+
+import constants
+
+from test_runners import device_scheduler
+
+_ADB_DEVICES = ('List of devices attached\n'
+                'emulator-5554\tdevice\n'
+                '0123456789ABCDEF\tdevice\n'
+                'FEDCBA9876543210\toffline\n'
+                '192.168.0.2:5555\tunauthorized\n'
+                '\n')
+
+
+class AdbDeviceListerUnittests(unittest.TestCase):
+    """Unit tests for AdbDeviceLister in device_scheduler.py"""
+
+    @mock.patch('subprocess.check_output')
+    def test_list_serials(self, mock_co):
+        """Test list_serials method."""
+        mock_co.return_value = _ADB_DEVICES.encode()
+        self.assertEqual(['emulator-5554', '0123456789ABCDEF'],
+                         device_scheduler.AdbDeviceLister.list_serials())
+        mock_co.side_effect = OSError('adb not found')
+        self.assertEqual([], device_scheduler.AdbDeviceLister.list_serials())
+        mock_co.side_effect = subprocess.CalledProcessError(1, 'adb')
+        self.assertEqual([], device_scheduler.AdbDeviceLister.list_serials())
+
+
+class WorkStealingQueueUnittests(unittest.TestCase):
+    """Unit tests for WorkStealingQueue in device_scheduler.py"""
+
+    def test_get(self):
+        """Test get method deals tests and steals them once empty."""
+        tests = device_scheduler.WorkStealingQueue(['a', 'b'],
+                                                   [1, 2, 3, 4, 5])
+        self.assertEqual(1, tests.get('a'))
+        self.assertEqual(3, tests.get('a'))
+        self.assertEqual(5, tests.get('a'))
+        # 'a' steals the last test of 'b'.
+        self.assertEqual(4, tests.get('a'))
+        self.assertEqual(2, tests.get('b'))
+        self.assertIsNone(tests.get('a'))
+        self.assertIsNone(tests.get('b'))
+
+    def test_drain(self):
+        """Test drain method."""
+        tests = device_scheduler.WorkStealingQueue(['a', 'b'], [1, 2, 3])
+        self.assertEqual(1, tests.get('a'))
+        self.assertEqual([3, 2], tests.drain())
+        self.assertIsNone(tests.get('b'))
+
+
+class DeviceSchedulerUnittests(unittest.TestCase):
+    """Unit tests for DeviceScheduler in device_scheduler.py"""
+
+    def test_run(self):
+        """Test run method runs every test once on one of the devices."""
+        run_tests = []
+        lock = threading.Lock()
+
+        def _run_func(serial, test):
+            with lock:
+                run_tests.append((serial, test))
+            return constants.EXIT_CODE_TEST_FAILURE if test == 3 else 0
+
+        scheduler = device_scheduler.DeviceScheduler(['a', 'b'], _run_func)
+        ret_code, usages, elapsed_secs = scheduler.run([1, 2, 3, 4, 5])
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE, ret_code)
+        self.assertEqual([1, 2, 3, 4, 5], sorted(x for _, x in run_tests))
+        self.assertEqual(['a', 'b'], [x.serial for x in usages])
+        for usage in usages:
+            self.assertEqual(
+                sorted(usage.tests),
+                sorted(x for serial, x in run_tests if serial == usage.serial))
+        self.assertGreaterEqual(elapsed_secs, 0)
+
+    def test_run_device_failure(self):
+        """Test run method moves the tests of a failed device to others."""
+        run_tests = []
+
+        def _run_func(serial, test):
+            if serial == 'a':
+                raise OSError('device disconnected')
+            run_tests.append(test)
+            return 0
+
+        scheduler = device_scheduler.DeviceScheduler(['a', 'b'], _run_func)
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            ret_code, usages, _ = scheduler.run([1, 2, 3, 4])
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE, ret_code)
+        self.assertEqual(1, len(usages[0].tests))
+        self.assertEqual(3, len(run_tests))
+        self.assertIn('Stop running tests on a', capture_output.getvalue())
+
+    def test_run_no_device_left(self):
+        """Test run method reports the tests not run."""
+        def _run_func(_serial, _test):
+            raise OSError('device disconnected')
+
+        scheduler = device_scheduler.DeviceScheduler(['a'], _run_func)
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            ret_code, _, _ = scheduler.run([1, 2])
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE, ret_code)
+        self.assertIn('No device left to run: 2', capture_output.getvalue())
+
+    def test_run_stop_on_failure(self):
+        """Test run method starts no more test once a test fails."""
+        run_tests = []
+
+        def _run_func(_serial, test):
+            run_tests.append(test)
+            return constants.EXIT_CODE_TEST_FAILURE if test == 2 else 0
+
+        scheduler = device_scheduler.DeviceScheduler(['a'], _run_func,
+                                                     stop_on_failure=True)
+        capture_output = StringIO()
+        sys.stdout = capture_output
+        try:
+            ret_code, _, _ = scheduler.run([1, 2, 3, 4])
+        finally:
+            sys.stdout = sys.__stdout__
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE, ret_code)
+        self.assertEqual([1, 2], run_tests)
+        self.assertIn('Skipped after the first failure: 3, 4',
+                      capture_output.getvalue())
+        self.assertNotIn('No device left', capture_output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
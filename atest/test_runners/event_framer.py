@@ -0,0 +1,149 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Incremental parser of the events reported by test runners.
+
+Events are of form EVENT_NAME {JSON_DATA} and separated by a delimiter, e.g.
+    TEST_RUN_STARTED {"runName":"hello_world_test","runAttempt":0}\n
+    TEST_STARTED {"start_time":2172917, "testName":"PrintHelloWorld"}\n
+"""
+
+import json
+import logging
+import re
+
+# The delimiter of the events reported to the socket server of TradeFed.
+EVENT_DELIMITER = b'\n'
+
+_EVENT_NAME_RE = re.compile(r'^[A-Z_]+$')
+_JSON_END = ord('}')
+_WHITESPACE = frozenset(b' \t\r\n')
+
+
+class EventFramer:
+    """Split a stream of bytes into events.
+
+    Received data is appended to a buffer and only the data after the last
+    scanned position is searched for the delimiter, so each byte is scanned
+    once and each event is decoded once however it's split into chunks.
+    """
+
+    def __init__(self, delimiter=EVENT_DELIMITER, strict=True):
+        """EventFramer constructor
+
+        Args:
+            delimiter: Bytes separating the events.
+            strict: False to allow control characters, e.g. newlines of
+                stack traces, inside the JSON strings.
+        """
+        self._delimiter = delimiter
+        self._strict = strict
+        self._text_delimiter = delimiter.decode()
+        self._buffer = bytearray()
+        # The position to search the delimiter from.
+        self._scan_offset = 0
+
+    def __len__(self):
+        """Return the number of bytes buffered for incomplete events."""
+        return len(self._buffer)
+
+    def _parse(self, frame):
+        """Parse an event.
+
+        Args:
+            frame: A string of an event.
+
+        Returns:
+            A tuple of the event name and the event data, None if the frame
+            isn't a valid event.
+        """
+        name, _, data = frame.strip().partition(' ')
+        if not _EVENT_NAME_RE.match(name):
+            return None
+        try:
+            return name, json.loads(data, strict=self._strict)
+        except ValueError:
+            return None
+
+    def _parse_frames(self, data):
+        """Parse the events separated by the delimiter.
+
+        Args:
+            data: A string of complete events.
+
+        Returns:
+            A list of tuples of the event name and the event data.
+        """
+        events = []
+        for frame in data.split(self._text_delimiter):
+            event = self._parse(frame)
+            if event:
+                events.append(event)
+            elif frame.strip():
+                logging.debug('Skip invalid event: %s', frame)
+        return events
+
+    def _ends_with_json(self):
+        """Check whether the buffer ends with the end of a JSON object."""
+        index = len(self._buffer) - 1
+        while index >= 0 and self._buffer[index] in _WHITESPACE:
+            index -= 1
+        return index >= 0 and self._buffer[index] == _JSON_END
+
+    def feed(self, data):
+        """Add received data and parse the events completed by it.
+
+        An event at the end of the buffer without the delimiter is parsed as
+        well if it ends with a complete JSON object, as the last event may
+        not be followed by a delimiter.
+
+        Args:
+            data: Bytes or a string of the received data.
+
+        Returns:
+            A list of tuples of the event name and the event data.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        self._buffer += data
+        events = []
+        end = self._buffer.rfind(self._delimiter, self._scan_offset)
+        if end >= 0:
+            # Decode all the complete events at once.
+            events = self._parse_frames(
+                self._buffer[:end].decode(errors='replace'))
+            del self._buffer[:end + len(self._delimiter)]
+        # Don't search the partial delimiter at the end again from its
+        # beginning, but find it once the rest arrives.
+        self._scan_offset = max(
+            0, len(self._buffer) - len(self._delimiter) + 1)
+        if self._ends_with_json():
+            event = self._parse(self._buffer.decode(errors='replace'))
+            if event:
+                events.append(event)
+                self._buffer.clear()
+                self._scan_offset = 0
+        return events
+
+    def flush(self):
+        """Parse the event left in the buffer at the end of the stream.
+
+        Returns:
+            A list of tuples of the event name and the event data.
+        """
+        events = self._parse_frames(self._buffer.decode(errors='replace'))
+        self._buffer.clear()
+        self._scan_offset = 0
+        return events
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for event_framer."""
+
+import json
+import os
+import unittest
+
+import unittest_constants as uc
+
+from test_runners import event_framer
+
+STREAM_FILE = os.path.join(uc.TEST_DATA_DIR, 'event_streams',
+                           'tf_invocation.events')
+
+
+def _load_events(stream):
+    """Parse a stream line by line as the expected events."""
+    events = []
+    for line in stream.decode().splitlines():
+        name, _, data = line.partition(' ')
+        events.append((name, json.loads(data)))
+    return events
+
+
+class EventFramerUnittests(unittest.TestCase):
+    """Unit tests for EventFramer in event_framer.py"""
+
+    def setUp(self):
+        with open(STREAM_FILE, 'rb') as stream_file:
+            self.stream = stream_file.read()
+        self.expected_events = _load_events(self.stream)
+
+    def _replay(self, framer, chunk_size):
+        """Feed the stream to the framer in chunks."""
+        events = []
+        for i in range(0, len(self.stream), chunk_size):
+            events.extend(framer.feed(self.stream[i:i + chunk_size]))
+        return events + framer.flush()
+
+    def test_feed_recorded_stream(self):
+        """Test feed method with the recorded stream in any chunk size."""
+        for chunk_size in (1, 7, 100, 4096, len(self.stream)):
+            framer = event_framer.EventFramer()
+            self.assertEqual(self.expected_events,
+                             self._replay(framer, chunk_size))
+            self.assertEqual(0, len(framer))
+
+    def test_feed_without_delimiter(self):
+        """Test feed method parses the last event without the delimiter."""
+        framer = event_framer.EventFramer()
+        self.assertEqual([('TEST_RUN_ENDED', {})],
+                         framer.feed('\nTEST_RUN_ENDED {}'))
+        # A } in the JSON string doesn't end the event.
+        self.assertEqual([], framer.feed(b'TEST_FAILED {"trace": "}'))
+        self.assertEqual([('TEST_FAILED', {'trace': '}'})],
+                         framer.feed(b'"}'))
+
+    def test_feed_multibyte_delimiter(self):
+        """Test feed method with a delimiter split across chunks."""
+        framer = event_framer.EventFramer(b'\n\n')
+        self.assertEqual([], framer.feed(b'TEST_STARTED {\n"a": 1'))
+        self.assertEqual([('TEST_STARTED', {'a': 1})],
+                         framer.feed(b'}\n\nTEST_ENDED {"b": 2'))
+        self.assertEqual([('TEST_ENDED', {'b': 2})], framer.feed(b'}\n'))
+        self.assertEqual([], framer.feed(b'\nTEST_RUN_ENDED {"c"'))
+        self.assertEqual([('TEST_RUN_ENDED', {'c': 3})],
+                         framer.feed(b': 3}\n\n'))
+
+    def test_feed_invalid_events(self):
+        """Test feed method skips invalid events."""
+        framer = event_framer.EventFramer()
+        self.assertEqual([('TEST_ENDED', {})],
+                         framer.feed(b'some log\nTEST_STARTED {"a"\n'
+                                     b'TEST_ENDED {}\n'))
+
+    def test_feed_multibyte_characters(self):
+        """Test feed method with characters split across chunks."""
+        framer = event_framer.EventFramer()
+        stream = 'TEST_FAILED {"trace": "中é"}\n'.encode()
+        events = []
+        for i in range(len(stream)):
+            events.extend(framer.feed(stream[i:i + 1]))
+        self.assertEqual([('TEST_FAILED', {'trace': '中é'})], events)
+
+    def test_feed_not_strict(self):
+        """Test feed method with control characters in the JSON strings."""
+        stream = b'TEST_FAILED {"trace": "Error\n\tat Foo"}\n\n'
+        self.assertEqual([], event_framer.EventFramer(b'\n\n').feed(stream))
+        self.assertEqual([('TEST_FAILED', {'trace': 'Error\n\tat Foo'})],
+                         event_framer.EventFramer(b'\n\n', strict=False)
+                         .feed(stream))
+
+    def test_flush(self):
+        """Test flush method drops the incomplete event."""
+        framer = event_framer.EventFramer()
+        self.assertEqual([], framer.feed(b'TEST_FAILED {"trace": "'))
+        self.assertEqual([], framer.flush())
+        self.assertEqual(0, len(framer))
+
+
+if __name__ == '__main__':
+    unittest.main()
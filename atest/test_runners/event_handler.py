@@ -25,6 +25,7 @@ from collections import deque
 from datetime import timedelta
 
 import atest_execution_info
+import phase_tracer
 
 from test_runners import test_runner_base
 
@@ -68,7 +69,9 @@ CONNECTION_STATE = {
     'current_group': None,
     'current_group_total': None,
     'test_count': 0,
-    'test_start_time': None}
+    'test_start_time': None,
+    'module_start_time': None,
+    'module_test_time': 0}
 
 class EventHandleError(Exception):
     """Raised when handle event error."""
@@ -88,6 +91,8 @@ class EventHandler:
         self.state['current_group'] = event_data['moduleName']
         self.state['last_failed'] = None
         self.state['current_test'] = None
+        self.state['module_start_time'] = time.time()
+        self.state['module_test_time'] = 0
 
     def _run_started(self, event_data):
         # Technically there can be more than one run per module.
@@ -153,16 +158,26 @@ class EventHandler:
     def _run_ended(self, event_data):
         pass
 
-    def _module_ended(self, event_data):
-        pass
+    def _module_ended(self, _event_data):
+        # The events carry no module times, so the wall time of the module
+        # is measured as its events arrive.
+        if self.state['module_start_time'] is None:
+            return
+        duration = int((time.time() - self.state['module_start_time'])
+                       * ONE_SECOND)
+        self.reporter.process_module_time(self.state['current_group'],
+                                          duration,
+                                          self.state['module_test_time'])
+        self.state['module_start_time'] = None
 
     def _test_ended(self, event_data):
         name = TEST_NAME_TEMPLATE % (event_data['className'],
                                      event_data['testName'])
         test_time = ''
         if self.state['test_start_time']:
-            test_time = self._calc_duration(event_data['end_time'] -
-                                            self.state['test_start_time'])
+            duration = event_data['end_time'] - self.state['test_start_time']
+            self.state['module_test_time'] += duration
+            test_time = self._calc_duration(duration)
         if self.state['last_failed'] and name == self.state['last_failed']['name']:
             status = test_runner_base.FAILED_STATUS
             trace = self.state['last_failed']['trace']
@@ -223,6 +238,9 @@ class EventHandler:
             event_data: A dict of event data.
         """
         logging.debug('Processing %s %s', event_name, event_data)
+        if atest_execution_info.FIRST_EVENT_TIME is None:
+            atest_execution_info.FIRST_EVENT_TIME = time.time()
+            phase_tracer.instant('first_event_received', event=event_name)
         if event_name in START_EVENTS:
             self.event_stack.append(event_name)
         elif event_name in END_EVENTS:
@@ -296,6 +296,14 @@ class EventHandlerUnittests(unittest.TestCase):
         ))
         self.mock_reporter.process_test_result.assert_has_calls([call1, call2])
 
+    @mock.patch('time.time', side_effect=[10, 12.5])
+    def test_process_event_module_time(self, _time):
+        """Test process_event method reports the wall time of the module."""
+        for name, data in EVENTS_IGNORE:
+            self.fake_eh.process_event(name, data)
+        self.mock_reporter.process_module_time.assert_called_once_with(
+            'someTestModule', 2500, 72)
+
     def test_process_event_with_additional_info(self):
         """Test process_event method with perf information."""
         for name, data in EVENTS_WITH_PERF_INFO:
@@ -0,0 +1,224 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Event server receiving the events reported by test runners.
+
+Test runners report events over socket connections, e.g. TradeFed, or over
+streams such as pipes. All of them are multiplexed by a selector in the
+thread running the server, and their events are passed to EventHandlers.
+"""
+
+import logging
+import os
+import selectors
+import socket
+
+from test_runners import event_framer
+
+# Maximum bytes read from a connection at a time. Each ready connection is
+# read once per poll, so a busy connection can't starve the others, and the
+# runners are blocked by the full socket buffers once atest falls behind.
+READ_SIZE = 65536
+
+
+class _Listener:
+    """A listening socket and the connections accepted from it."""
+
+    def __init__(self, sock, on_connect):
+        self.sock = sock
+        self.on_connect = on_connect
+        self.connections = set()
+        self.accepted = 0
+
+
+class _Stream:
+    """A connection or stream reporting events."""
+
+    def __init__(self, fileobj, event_handler, framer, listener=None):
+        self.fileobj = fileobj
+        self.event_handler = event_handler
+        self.framer = framer
+        self.listener = listener
+
+
+class EventServer:
+    """Receive the events of socket connections and streams."""
+
+    def __init__(self, delimiter=event_framer.EVENT_DELIMITER):
+        """EventServer constructor
+
+        Args:
+            delimiter: Bytes separating the events of the connections.
+        """
+        self._delimiter = delimiter
+        self._selector = selectors.DefaultSelector()
+        self._listeners = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exit_type, value, traceback):
+        self.close()
+
+    def listen(self, sock, on_connect):
+        """Accept the connections to a listening socket.
+
+        Args:
+            sock: A listening socket.
+            on_connect: A function of the index of a connection accepted from
+                the socket, returning the EventHandler of the connection.
+        """
+        sock.setblocking(False)
+        listener = _Listener(sock, on_connect)
+        self._listeners[sock] = listener
+        self._selector.register(sock, selectors.EVENT_READ, listener)
+
+    def add_stream(self, fileobj, event_handler, framer=None):
+        """Receive the events of a stream, e.g. the read end of a pipe.
+
+        The stream is closed at the end of the stream.
+
+        Args:
+            fileobj: A file object or a file descriptor to read.
+            event_handler: The EventHandler of the stream.
+            framer: The EventFramer parsing the stream, an EventFramer of
+                the delimiter of the server if None.
+        """
+        os.set_blocking(_get_fd(fileobj), False)
+        if framer is None:
+            framer = event_framer.EventFramer(self._delimiter)
+        self._selector.register(fileobj, selectors.EVENT_READ,
+                                _Stream(fileobj, event_handler, framer))
+
+    def is_registered(self, fileobj):
+        """Check whether a listening socket or a stream is still served.
+
+        Args:
+            fileobj: A listening socket or a stream.
+
+        Returns:
+            True if it's not closed yet.
+        """
+        try:
+            self._selector.get_key(fileobj)
+            return True
+        except (KeyError, ValueError):
+            # ValueError is raised for the closed ones.
+            return False
+
+    def is_idle(self, sock):
+        """Check whether the connections of a listening socket are closed.
+
+        Args:
+            sock: A listening socket.
+
+        Returns:
+            True if all connections accepted from the socket are closed.
+        """
+        return not self._listeners[sock].connections
+
+    def close_listener(self, sock):
+        """Stop accepting the connections to a listening socket.
+
+        Args:
+            sock: A listening socket.
+
+        Returns:
+            An integer of the number of connections accepted from the socket.
+        """
+        listener = self._listeners.pop(sock)
+        for stream in list(listener.connections):
+            self._close(stream)
+        if self.is_registered(sock):
+            self._selector.unregister(sock)
+        sock.close()
+        return listener.accepted
+
+    def _accept(self, listener):
+        """Accept all pending connections of a listening socket."""
+        while True:
+            try:
+                conn, addr = listener.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            logging.debug('Accepted connection from %s', addr)
+            conn.setblocking(False)
+            stream = _Stream(conn, listener.on_connect(listener.accepted),
+                             event_framer.EventFramer(self._delimiter),
+                             listener)
+            listener.accepted += 1
+            listener.connections.add(stream)
+            self._selector.register(conn, selectors.EVENT_READ, stream)
+
+    def _close(self, stream):
+        """Stop receiving the events of a connection or a stream."""
+        self._selector.unregister(stream.fileobj)
+        if stream.listener:
+            stream.listener.connections.discard(stream)
+        if isinstance(stream.fileobj, int):
+            os.close(stream.fileobj)
+        else:
+            stream.fileobj.close()
+
+    def _read(self, stream):
+        """Read the data of a connection or a stream and handle its events."""
+        try:
+            if isinstance(stream.fileobj, socket.socket):
+                data = stream.fileobj.recv(READ_SIZE)
+            else:
+                data = os.read(_get_fd(stream.fileobj), READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+            data = b''
+        events = stream.framer.feed(data) if data else stream.framer.flush()
+        if not data:
+            self._close(stream)
+        for event_name, event_data in events:
+            stream.event_handler.process_event(event_name, event_data)
+
+    def poll(self, timeout=None):
+        """Wait for and handle the data of the connections and streams.
+
+        Args:
+            timeout: A number of seconds to wait for data. Wait until there's
+                data if None, and return immediately if 0.
+
+        Returns:
+            An integer of the number of the sockets and streams handled.
+        """
+        if not self._selector.get_map():
+            return 0
+        ready = self._selector.select(timeout)
+        for key, _ in ready:
+            if isinstance(key.data, _Listener):
+                self._accept(key.data)
+            else:
+                self._read(key.data)
+        return len(ready)
+
+    def close(self):
+        """Close all listening sockets, connections and streams."""
+        for sock in list(self._listeners):
+            self.close_listener(sock)
+        for key in list(self._selector.get_map().values()):
+            self._close(key.data)
+        self._selector.close()
+
+
+def _get_fd(fileobj):
+    """Get the file descriptor of a file object or a file descriptor."""
+    return fileobj if isinstance(fileobj, int) else fileobj.fileno()
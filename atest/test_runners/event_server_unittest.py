@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for event_server."""
+
+import json
+import os
+import socket
+import unittest
+
+from unittest import mock
+
+from test_runners import event_framer
+from test_runners import event_server
+
+EVENTS_NORMAL = [
+    ('TEST_MODULE_STARTED', {
+        'moduleContextFileName':'serial-util1146216{974}2772610436.ser',
+        'moduleName':'someTestModule'}),
+    ('TEST_RUN_STARTED', {'testCount': 2}),
+    ('TEST_STARTED', {'start_time':52, 'className':'someClassName',
+                      'testName':'someTestName'}),
+    ('TEST_ENDED', {'end_time':1048, 'className':'someClassName',
+                    'testName':'someTestName'}),
+    ('TEST_STARTED', {'start_time':48, 'className':'someClassName2',
+                      'testName':'someTestName2'}),
+    ('TEST_FAILED', {'className':'someClassName2', 'testName':'someTestName2',
+                     'trace': 'someTrace'}),
+    ('TEST_ENDED', {'end_time':9876450, 'className':'someClassName2',
+                    'testName':'someTestName2'}),
+    ('TEST_RUN_ENDED', {}),
+    ('TEST_MODULE_ENDED', {'foo': 'bar'}),
+]
+
+
+def _format_event(name, data):
+    """Format an event as reported by TradeFed without the delimiter."""
+    return ('%s %s' % (name, json.dumps(data))).encode()
+
+
+class EventServerUnittests(unittest.TestCase):
+    """Unit tests for EventServer in event_server.py"""
+
+    def setUp(self):
+        self.server = event_server.EventServer()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.handlers = []
+        self.server.listen(self.sock, self._on_connect)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.close()
+
+    def _on_connect(self, index):
+        """Create a fake EventHandler of the connection."""
+        self.assertEqual(len(self.handlers), index)
+        self.handlers.append(mock.Mock())
+        return self.handlers[-1]
+
+    def _connect(self):
+        """Connect a client to the server."""
+        client = socket.create_connection(self.sock.getsockname())
+        self.clients.append(client)
+        return client
+
+    def _poll_until(self, condition):
+        """Poll the server until the condition is met."""
+        for _ in range(100):
+            if condition():
+                return
+            self.server.poll(0.1)
+        self.fail('Timed out polling the server.')
+
+    def _get_events(self, index):
+        """Get the events passed to the EventHandler of the connection."""
+        return [call[0] for call in
+                self.handlers[index].process_event.call_args_list]
+
+    def test_process_events(self):
+        """Test each event sent in its own connection."""
+        for name, data in EVENTS_NORMAL:
+            client = self._connect()
+            client.sendall(_format_event(name, data))
+            client.close()
+        self._poll_until(lambda: len(self.handlers) == len(EVENTS_NORMAL)
+                         and self.server.is_idle(self.sock))
+        for index, event in enumerate(EVENTS_NORMAL):
+            self.assertEqual([event], self._get_events(index))
+        self.assertEqual(len(EVENTS_NORMAL),
+                         self.server.close_listener(self.sock))
+        self.assertFalse(self.server.is_registered(self.sock))
+
+    def test_process_multiple_lines_in_single_recv(self):
+        """Test multiple events sent in one go."""
+        client = self._connect()
+        client.sendall(b'\n'.join(_format_event(name, data)
+                                  for name, data in EVENTS_NORMAL))
+        client.close()
+        self._poll_until(lambda: self.handlers
+                         and self.server.is_idle(self.sock))
+        self.assertEqual(EVENTS_NORMAL, self._get_events(0))
+
+    def test_process_with_buffering(self):
+        """Test events split across multiple sends."""
+        client = self._connect()
+        module_events = [EVENTS_NORMAL[0], EVENTS_NORMAL[-1]]
+        socket_events = [_format_event(name, data)
+                         for name, data in module_events]
+        # Break apart the first event after the first }.
+        index = socket_events[0].index(b'}') + 1
+        for chunk in [socket_events[0][:index], socket_events[0][index:],
+                      b'\n' + socket_events[1][:-4], socket_events[1][-4:]]:
+            client.sendall(chunk)
+            self._poll_until(lambda: self.handlers)
+            self.server.poll(0.1)
+        client.close()
+        self._poll_until(lambda: self.server.is_idle(self.sock))
+        self.assertEqual(module_events, self._get_events(0))
+
+    def test_process_with_newline_prefix(self):
+        """Test an event with \\n prefix."""
+        client = self._connect()
+        client.sendall(b'\n' + _format_event(*EVENTS_NORMAL[0]))
+        self._poll_until(lambda: self.handlers and self._get_events(0))
+        self.assertEqual([EVENTS_NORMAL[0]], self._get_events(0))
+
+    def test_bounded_reads(self):
+        """Test a busy connection doesn't starve the others."""
+        busy_client = self._connect()
+        client = self._connect()
+        self._poll_until(lambda: len(self.handlers) == 2)
+        trace = 'x' * (event_server.READ_SIZE * 4)
+        busy_client.setblocking(False)
+        try:
+            busy_client.sendall(_format_event('TEST_FAILED',
+                                              {'trace': trace}) + b'\n')
+        except BlockingIOError:
+            # The server stops reading once its buffers are full.
+            pass
+        client.sendall(_format_event(*EVENTS_NORMAL[1]) + b'\n')
+        self._poll_until(lambda: self._get_events(1))
+        self.assertEqual([], self._get_events(0))
+
+    def test_add_stream(self):
+        """Test events of a pipe."""
+        handler = mock.Mock()
+        read_fd, write_fd = os.pipe()
+        self.server.add_stream(read_fd, handler,
+                               event_framer.EventFramer(b'\n\n'))
+        os.write(write_fd, b'TEST_STARTED {\n"a": 1}\n\nTEST_ENDED {}\n\n')
+        os.close(write_fd)
+        self._poll_until(lambda: not self.server.is_registered(read_fd))
+        handler.process_event.assert_has_calls(
+            [mock.call('TEST_STARTED', {'a': 1}), mock.call('TEST_ENDED', {})])
+
+    def test_poll_without_data(self):
+        """Test poll method returns nothing handled on timeout."""
+        self.assertEqual(0, self.server.poll(0))
+        self.server.close_listener(self.sock)
+        self.assertEqual(0, self.server.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
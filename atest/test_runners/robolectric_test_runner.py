@@ -21,28 +21,29 @@ robolectric tests will be invoked through AtestTFTestRunner.
 
 # pylint: disable=line-too-long
 
-import json
 import logging
 import os
-import re
 import tempfile
-import time
 
 from functools import partial
 
 import atest_utils
 import constants
 
+from test_runners import event_framer
+from test_runners import event_server
 from test_runners import test_runner_base
 from .event_handler import EventHandler
 
 POLL_FREQ_SECS = 0.1
-# A pattern to match event like below
+EVENT_FIFO_NAME = 'robolectric_events'
+# Events are separated by an empty line, and the stack traces in them may
+# contain raw newlines, e.g.
 #TEST_FAILED {'className':'SomeClass', 'testName':'SomeTestName',
 #            'trace':'{"trace":"AssertionError: <true> is equal to <false>\n
 #               at FailureStrategy.fail(FailureStrategy.java:24)\n
 #               at FailureStrategy.fail(FailureStrategy.java:20)\n"}\n\n
-EVENT_RE = re.compile(r'^(?P<event_name>[A-Z_]+) (?P<json_data>{(.\r*|\n)*})(?:\n|$)')
+EVENT_DELIMITER = b'\n\n'
 
 
 class RobolectricTestRunner(test_runner_base.TestRunnerBase):
@@ -52,6 +53,7 @@ class RobolectricTestRunner(test_runner_base.TestRunnerBase):
     # atest_utils.build to kick off the test but if we don't set it, the base
     # class will raise an exception.
     EXECUTABLE = 'make'
+    NEEDS_DEVICE = False
 
     # pylint: disable=useless-super-delegation
     def __init__(self, results_dir, **kwargs):
@@ -110,8 +112,13 @@ class RobolectricTestRunner(test_runner_base.TestRunnerBase):
         """
         ret_code = constants.EXIT_CODE_SUCCESS
         for test_info in test_infos:
-            # Create a temp communication file.
-            with tempfile.NamedTemporaryFile(dir=self.results_dir) as event_file:
+            if ret_code and extra_args.get(constants.FAIL_FAST):
+                break
+            # Create a FIFO the tests write the events to, so the events are
+            # received as soon as they're written.
+            with tempfile.TemporaryDirectory(dir=self.results_dir) as event_dir:
+                event_file = os.path.join(event_dir, EVENT_FIFO_NAME)
+                os.mkfifo(event_file)
                 # Prepare build environment parameter.
                 full_env_vars = self._get_full_build_environ(test_info,
                                                              extra_args,
@@ -137,8 +144,7 @@ class RobolectricTestRunner(test_runner_base.TestRunnerBase):
        Args:
            test_info: TestInfo object.
            extra_args: Dict of extra args to add to test run.
-           event_file: A file-like object that can be used as a temporary
-                       storage area.
+           event_file: A string of the path of the FIFO receiving the events.
        """
         full_env_vars = os.environ.copy()
         env_vars = self.generate_env_vars(test_info,
@@ -147,48 +153,37 @@ class RobolectricTestRunner(test_runner_base.TestRunnerBase):
         full_env_vars.update(env_vars)
         return full_env_vars
 
-    def _exec_with_robo_polling(self, communication_file, robo_proc,
-                                event_handler):
-        """Polling data from communication file
+    def _exec_with_robo_polling(self, event_file, robo_proc, event_handler):
+        """Process the events written to the FIFO until the build exits.
 
-        Polling data from communication file. Exit when communication file
-        is empty and subprocess ended.
+        Events are parsed as soon as they're written instead of polling a
+        file. The remaining events are drained after the build process exits.
 
         Args:
-            communication_file: A monitored communication file.
+            event_file: A string of the path of the FIFO receiving the events.
             robo_proc: The build process.
-            event_handler: A file-like object storing the events of robolectric tests.
+            event_handler: An EventHandler of the robolectric tests.
         """
-        buf = ''
-        while True:
-            # Make sure that ATest gets content from current position.
-            communication_file.seek(0, 1)
-            data = communication_file.read()
-            if isinstance(data, bytes):
-                data = data.decode()
-            buf += data
-            reg = re.compile(r'(.|\n)*}\n\n')
-            if not reg.match(buf) or data == '':
-                if robo_proc.poll() is not None:
-                    logging.debug('Build process exited early')
-                    return
-                time.sleep(POLL_FREQ_SECS)
-            else:
-                # Read all new data and handle it at one time.
-                for event in re.split(r'\n\n', buf):
-                    match = EVENT_RE.match(event)
-                    if match:
-                        try:
-                            event_data = json.loads(match.group('json_data'),
-                                                    strict=False)
-                        except ValueError:
-                            # Parse event fail, continue to parse next one.
-                            logging.debug('"%s" is not valid json format.',
-                                          match.group('json_data'))
-                            continue
-                        event_name = match.group('event_name')
-                        event_handler.process_event(event_name, event_data)
-                buf = ''
+        # Opening the read end without blocking before the tests open the
+        # write end, and holding a write end, keeps the FIFO from ending
+        # when the tests close it between events.
+        read_fd = os.open(event_file, os.O_RDONLY | os.O_NONBLOCK)
+        write_fd = os.open(event_file, os.O_WRONLY | os.O_NONBLOCK)
+        with event_server.EventServer() as server:
+            server.add_stream(read_fd, event_handler,
+                              event_framer.EventFramer(EVENT_DELIMITER,
+                                                       strict=False))
+            try:
+                while robo_proc.poll() is None:
+                    server.poll(POLL_FREQ_SECS)
+            finally:
+                os.close(write_fd)
+            logging.debug('Build process exited')
+            # Stop once the FIFO ends, or nothing is written to it anymore
+            # in case a descendant of the build still holds the write end.
+            while (server.is_registered(read_fd)
+                   and server.poll(POLL_FREQ_SECS)):
+                pass
 
     @staticmethod
     def generate_env_vars(test_info, extra_args, event_file=None):
@@ -200,8 +195,8 @@ class RobolectricTestRunner(test_runner_base.TestRunnerBase):
         Args:
             test_info: TestInfo class that holds the class filter info.
             extra_args: Dict of extra args to apply for test run.
-            event_file: A file-like object storing the events of robolectric
-            tests.
+            event_file: A string of the path of the FIFO receiving the events
+                of robolectric tests.
 
         Returns:
             Dict of env vars to pass into invocation.
@@ -219,7 +214,7 @@ class RobolectricTestRunner(test_runner_base.TestRunnerBase):
                 logging.debug('method filtering not supported for robolectric '
                               'tests yet.')
         if event_file:
-            env_var['EVENT_FILE_ROBOLECTRIC'] = event_file.name
+            env_var['EVENT_FILE_ROBOLECTRIC'] = event_file
         return env_var
 
     # pylint: disable=unnecessary-pass
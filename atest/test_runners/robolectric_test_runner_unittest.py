@@ -19,6 +19,7 @@
 # pylint: disable=line-too-long
 
 import json
+import os
 import unittest
 import subprocess
 import tempfile
@@ -29,6 +30,24 @@ from test_finders import test_info
 from test_runners import event_handler
 from test_runners import robolectric_test_runner
 
+EVENTS = [
+    ('TEST_MODULE_STARTED', {
+        'moduleContextFileName':'serial-util1146216{974}2772610436.ser',
+        'moduleName':'someTestModule'}),
+    ('TEST_RUN_STARTED', {'testCount': 2}),
+    ('TEST_STARTED', {'start_time':52, 'className':'someClassName',
+                      'testName':'someTestName'}),
+    ('TEST_ENDED', {'end_time':1048, 'className':'someClassName',
+                    'testName':'someTestName'}),
+    ('TEST_STARTED', {'start_time':48, 'className':'someClassName2',
+                      'testName':'someTestName2'}),
+    ('TEST_FAILED', {'className':'someClassName2', 'testName':'someTestName2',
+                     'trace': 'someTrace'}),
+    ('TEST_ENDED', {'end_time':9876450, 'className':'someClassName2',
+                    'testName':'someTestName2'}),
+    ('TEST_RUN_ENDED', {}),
+    ('TEST_MODULE_ENDED', {'foo': 'bar'}),]
+
 # pylint: disable=protected-access
 class RobolectricTestRunnerUnittests(unittest.TestCase):
     """Unit tests for robolectric_test_runner.py"""
@@ -61,43 +80,54 @@ class RobolectricTestRunnerUnittests(unittest.TestCase):
             0,
             self.suite_tr.run_tests_raw(test_infos, extra_args, mock_reporter))
 
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_exec_with_robo_polling_complete_information(self, mock_pe):
+    def _start_writer(self, event_file, *chunks):
+        """Start a process writing each chunk with a separate open().
+
+        Args:
+            event_file: A string of the path of the FIFO.
+            chunks: Strings written in turn.
+
+        Returns:
+            The writer process.
+        """
+        script = '; '.join('printf %%s "$%d" >> "$0"; sleep %s'
+                           % (i + 1, self.polling_time)
+                           for i in range(len(chunks)))
+        return subprocess.Popen(['sh', '-c', script, event_file] + list(chunks))
+
+    def _exec_with_robo_polling(self, *chunks):
+        """Run _exec_with_robo_polling with a writer of the chunks."""
+        mock_handler = mock.Mock()
+        with tempfile.TemporaryDirectory() as event_dir:
+            event_file = os.path.join(event_dir, 'events')
+            os.mkfifo(event_file)
+            robo_proc = self._start_writer(event_file, *chunks)
+            self.suite_tr._exec_with_robo_polling(event_file, robo_proc,
+                                                  mock_handler)
+        return mock_handler
+
+    def test_exec_with_robo_polling_complete_information(self):
         """Test _exec_with_robo_polling method."""
         event_name = 'TEST_STARTED'
         event_data = {'className':'SomeClass', 'testName':'SomeTestName'}
-
-        json_event_data = json.dumps(event_data)
-        data = '%s %s\n\n' %(event_name, json_event_data)
-        event_file = tempfile.NamedTemporaryFile(delete=True)
-        subprocess.call("echo '%s' -n >> %s" %(data, event_file.name), shell=True)
-        robo_proc = subprocess.Popen("sleep %s" %str(self.polling_time * 2), shell=True)
-        self.suite_tr. _exec_with_robo_polling(event_file, robo_proc, mock_pe)
+        data = '%s %s\n\n' %(event_name, json.dumps(event_data))
+        mock_pe = self._exec_with_robo_polling(data)
         calls = [mock.call.process_event(event_name, event_data)]
         mock_pe.assert_has_calls(calls)
 
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_exec_with_robo_polling_with_partial_info(self, mock_pe):
+    def test_exec_with_robo_polling_with_partial_info(self):
         """Test _exec_with_robo_polling method."""
         event_name = 'TEST_STARTED'
         event1 = '{"className":"SomeClass","test'
         event2 = 'Name":"SomeTestName"}\n\n'
         data1 = '%s %s'%(event_name, event1)
         data2 = event2
-        event_file = tempfile.NamedTemporaryFile(delete=True)
-        subprocess.Popen("echo -n '%s' >> %s" %(data1, event_file.name), shell=True)
-        robo_proc = subprocess.Popen("echo '%s' >> %s && sleep %s"
-                                     %(data2,
-                                       event_file.name,
-                                       str(self.polling_time*5)),
-                                     shell=True)
-        self.suite_tr. _exec_with_robo_polling(event_file, robo_proc, mock_pe)
+        mock_pe = self._exec_with_robo_polling(data1, data2)
         calls = [mock.call.process_event(event_name,
                                          json.loads(event1 + event2))]
         mock_pe.assert_has_calls(calls)
 
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_exec_with_robo_polling_with_fail_stacktrace(self, mock_pe):
+    def test_exec_with_robo_polling_with_fail_stacktrace(self):
         """Test _exec_with_robo_polling method."""
         event_name = 'TEST_FAILED'
         event_data = {'className':'SomeClass', 'testName':'SomeTestName',
@@ -105,42 +135,39 @@ class RobolectricTestRunnerUnittests(unittest.TestCase):
                               'at FailureStrategy.fail(FailureStrategy.java:24)\n'
                               'at FailureStrategy.fail(FailureStrategy.java:20)\n'}
         data = '%s %s\n\n'%(event_name, json.dumps(event_data))
-        event_file = tempfile.NamedTemporaryFile(delete=True)
-        subprocess.call("echo '%s' -n >> %s" %(data, event_file.name), shell=True)
-        robo_proc = subprocess.Popen("sleep %s" %str(self.polling_time * 2), shell=True)
-        self.suite_tr. _exec_with_robo_polling(event_file, robo_proc, mock_pe)
-        calls = [mock.call.process_event(event_name, event_data)]
+        # The trace may be written with raw newlines as well.
+        raw_data = data.replace('\\n', '\n')
+        mock_pe = self._exec_with_robo_polling(data, raw_data)
+        calls = [mock.call.process_event(event_name, event_data)] * 2
         mock_pe.assert_has_calls(calls)
 
-    @mock.patch.object(event_handler.EventHandler, 'process_event')
-    def test_exec_with_robo_polling_with_multi_event(self, mock_pe):
+    def test_exec_with_robo_polling_with_multi_event(self):
         """Test _exec_with_robo_polling method."""
-        event_file = tempfile.NamedTemporaryFile(delete=True)
-        events = [
-            ('TEST_MODULE_STARTED', {
-                'moduleContextFileName':'serial-util1146216{974}2772610436.ser',
-                'moduleName':'someTestModule'}),
-            ('TEST_RUN_STARTED', {'testCount': 2}),
-            ('TEST_STARTED', {'start_time':52, 'className':'someClassName',
-                              'testName':'someTestName'}),
-            ('TEST_ENDED', {'end_time':1048, 'className':'someClassName',
-                            'testName':'someTestName'}),
-            ('TEST_STARTED', {'start_time':48, 'className':'someClassName2',
-                              'testName':'someTestName2'}),
-            ('TEST_FAILED', {'className':'someClassName2', 'testName':'someTestName2',
-                             'trace': 'someTrace'}),
-            ('TEST_ENDED', {'end_time':9876450, 'className':'someClassName2',
-                            'testName':'someTestName2'}),
-            ('TEST_RUN_ENDED', {}),
-            ('TEST_MODULE_ENDED', {'foo': 'bar'}),]
         data = ''
-        for event in events:
+        for event in EVENTS:
             data += '%s %s\n\n'%(event[0], json.dumps(event[1]))
+        mock_pe = self._exec_with_robo_polling(data)
+        calls = [mock.call.process_event(name, data) for name, data in EVENTS]
+        mock_pe.assert_has_calls(calls)
 
-        subprocess.call("echo '%s' -n >> %s" %(data, event_file.name), shell=True)
-        robo_proc = subprocess.Popen("sleep %s" %str(self.polling_time * 2), shell=True)
-        self.suite_tr. _exec_with_robo_polling(event_file, robo_proc, mock_pe)
-        calls = [mock.call.process_event(name, data) for name, data in events]
+    @mock.patch.object(event_handler.EventHandler, 'process_event')
+    @mock.patch.object(robolectric_test_runner.RobolectricTestRunner, 'run')
+    def test_run_tests_pretty(self, mock_run, mock_pe):
+        """Test run_tests_pretty method."""
+        test_infos = [test_info.TestInfo("Robo1",
+                                         "RobolectricTestRunner",
+                                         ["RoboTest"])]
+        data = ''.join('%s %s\n\n'%(name, json.dumps(event_data))
+                       for name, event_data in EVENTS)
+        mock_run.side_effect = lambda cmd, output_to_stdout, env_vars: (
+            self._start_writer(env_vars['EVENT_FILE_ROBOLECTRIC'], data))
+        with tempfile.TemporaryDirectory() as results_dir:
+            self.suite_tr.results_dir = results_dir
+            self.assertEqual(0, self.suite_tr.run_tests_pretty(
+                test_infos, [], mock.Mock()))
+            # The FIFO is removed.
+            self.assertEqual([], os.listdir(results_dir))
+        calls = [mock.call(name, event_data) for name, event_data in EVENTS]
         mock_pe.assert_has_calls(calls)
 
 if __name__ == '__main__':
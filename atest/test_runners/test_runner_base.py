@@ -26,6 +26,8 @@ import signal
 import subprocess
 import tempfile
 import os
+import sys
+import threading
 
 from collections import namedtuple
 
@@ -47,10 +49,46 @@ PASSED_STATUS = 'PASSED'
 IGNORED_STATUS = 'IGNORED'
 ERROR_STATUS = 'ERROR'
 
+# Subprocesses of the test runners running outside the main thread, where
+# signal handlers can't be set.
+_SUBPROCS = set()
+_SUBPROCS_LOCK = threading.Lock()
+
+
+def interrupt_subprocess(subproc):
+    """Send SIGINT to the process group of the subprocess.
+
+    Subprocesses which aren't processes of their own, e.g. the commands run
+    by the TradeFed daemon, are interrupted by their interrupt().
+
+    Args:
+        subproc: A subprocess started in a new session.
+    """
+    if hasattr(subproc, 'interrupt'):
+        subproc.interrupt()
+        return
+    os.killpg(os.getpgid(subproc.pid), signal.SIGINT)
+
+
+def interrupt_subprocesses():
+    """Send SIGINT to the subprocesses of runners outside the main thread."""
+    with _SUBPROCS_LOCK:
+        subprocs = list(_SUBPROCS)
+    for subproc in subprocs:
+        try:
+            logging.debug('Killing subproc: %s', subproc.pid)
+            interrupt_subprocess(subproc)
+        except OSError:
+            logging.debug('Subproc already terminated, skipping')
+
+
 class TestRunnerBase:
     """Base Test Runner class."""
     NAME = ''
     EXECUTABLE = ''
+    # False if the runner never runs tests on a device, so that it can run
+    # along with other runners.
+    NEEDS_DEVICE = True
 
     def __init__(self, results_dir, **kwargs):
         """Init stuff for base class."""
@@ -64,7 +102,16 @@ class TestRunnerBase:
         if kwargs:
             logging.debug('ignoring the following args: %s', kwargs)
 
-    def run(self, cmd, output_to_stdout=False, env_vars=None):
+    def create_log_file(self):
+        """Create a temporary file for the raw output of a command.
+
+        Returns:
+            A NamedTemporaryFile, which is removed once it's closed.
+        """
+        return tempfile.NamedTemporaryFile(mode='w', dir=self.results_dir,
+                                           delete=True)
+
+    def run(self, cmd, output_to_stdout=False, env_vars=None, log_file=None):
         """Shell out and execute command.
 
         Args:
@@ -78,46 +125,83 @@ class TestRunnerBase:
                               Set to True to see the output of the cmd. This
                               would be appropriate for verbose runs.
             env_vars: Environment variables passed to the subprocess.
+            log_file: A file object for the raw output if output_to_stdout is
+                      False. If None, a new file is created and kept in
+                      self.test_log_file. The runners running commands
+                      concurrently pass their own file per command.
+
+        If sys.stdout routes the output of the runners running concurrently,
+        see test_runner_handler, the output is piped to it instead of being
+        written to the terminal directly.
         """
+        route = getattr(sys.stdout, 'route', None) if output_to_stdout else None
+        stdout = subprocess.PIPE if route else None
         if not output_to_stdout:
-            self.test_log_file = tempfile.NamedTemporaryFile(
-                mode='w', dir=self.results_dir, delete=True)
+            if log_file is None:
+                self.test_log_file = self.create_log_file()
+                log_file = self.test_log_file
+            stdout = log_file
         logging.debug('Executing command: %s', cmd)
-        return subprocess.Popen(cmd, start_new_session=True, shell=True,
+        proc = subprocess.Popen(cmd, start_new_session=True, shell=True,
                                 stderr=subprocess.STDOUT,
-                                stdout=self.test_log_file, env=env_vars)
+                                stdout=stdout, env=env_vars)
+        if route:
+            route(proc.stdout)
+        return proc
 
-    # pylint: disable=broad-except
-    def handle_subprocess(self, subproc, func):
+    def handle_subprocess(self, subproc, func, log_files=None):
         """Execute the function. Interrupt the subproc when exception occurs.
 
         Args:
             subproc: A subprocess to be terminated.
             func: A function to be run.
+            log_files: A list of the raw output files to print if the function
+                       raises, [self.test_log_file] if None.
         """
+        self.handle_subprocesses([subproc], func, log_files)
+
+    # pylint: disable=broad-except
+    def handle_subprocesses(self, subprocs, func, log_files=None):
+        """Execute the function. Interrupt the subprocs when exception occurs.
+
+        Args:
+            subprocs: A list of subprocesses to be terminated.
+            func: A function to be run.
+            log_files: A list of the raw output files to print if the function
+                       raises, where None is skipped, [self.test_log_file] if
+                       None.
+        """
+        if log_files is None:
+            log_files = [self.test_log_file]
         try:
-            signal.signal(signal.SIGINT, self._signal_passer(subproc))
+            self._watch_subprocess(*subprocs)
             func()
         except Exception as error:
             # exc_info=1 tells logging to log the stacktrace
             logging.debug('Caught exception:', exc_info=1)
-            # If atest crashes, try to kill subproc group as well.
+            # If atest crashes, try to kill subproc groups as well.
             try:
-                logging.debug('Killing subproc: %s', subproc.pid)
-                os.killpg(os.getpgid(subproc.pid), signal.SIGINT)
-            except OSError:
-                # this wipes our previous stack context, which is why
-                # we have to save it above.
-                logging.debug('Subproc already terminated, skipping')
+                for subproc in subprocs:
+                    try:
+                        logging.debug('Killing subproc: %s', subproc.pid)
+                        interrupt_subprocess(subproc)
+                    except OSError:
+                        # this wipes our previous stack context, which is why
+                        # we have to save it above.
+                        logging.debug('Subproc already terminated, skipping')
             finally:
-                if self.test_log_file:
-                    with open(self.test_log_file.name, 'r') as f:
+                for log_file in log_files:
+                    if not log_file:
+                        continue
+                    with open(log_file.name, 'r') as f:
                         intro_msg = "Unexpected Issue. Raw Output:"
                         print(atest_utils.colorize(intro_msg, constants.RED))
                         print(f.read())
                 # Ignore socket.recv() raising due to ctrl-c
                 if not error.args or error.args[0] != errno.EINTR:
                     raise error
+        finally:
+            self._unwatch_subprocess(*subprocs)
 
     def wait_for_subprocess(self, proc):
         """Check the process status. Interrupt the TF subporcess if user
@@ -132,25 +216,53 @@ class TestRunnerBase:
         try:
             logging.debug('Runner Name: %s, Process ID: %s',
                           self.NAME, proc.pid)
-            signal.signal(signal.SIGINT, self._signal_passer(proc))
+            self._watch_subprocess(proc)
             proc.wait()
             return proc.returncode
         except:
             # If atest crashes, kill TF subproc group as well.
-            os.killpg(os.getpgid(proc.pid), signal.SIGINT)
+            interrupt_subprocess(proc)
             raise
+        finally:
+            self._unwatch_subprocess(proc)
+
+    def _watch_subprocess(self, *procs):
+        """Pass the SIGINT atest receives to the subprocesses.
 
-    def _signal_passer(self, proc):
-        """Return the signal_handler func bound to proc.
+        Signal handlers can only be set in the main thread. Subprocesses of
+        runners in other threads are interrupted by interrupt_subprocesses()
+        instead.
 
         Args:
-            proc: The tradefed subprocess.
+            procs: The tradefed subprocesses.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self._signal_passer(*procs))
+            return
+        with _SUBPROCS_LOCK:
+            _SUBPROCS.update(procs)
+
+    @staticmethod
+    def _unwatch_subprocess(*procs):
+        """Stop passing SIGINT to the finished subprocesses.
+
+        Args:
+            procs: The tradefed subprocesses.
+        """
+        with _SUBPROCS_LOCK:
+            _SUBPROCS.difference_update(procs)
+
+    def _signal_passer(self, *procs):
+        """Return the signal_handler func bound to procs.
+
+        Args:
+            procs: The tradefed subprocesses.
 
         Returns:
             signal_handler function.
         """
         def signal_handler(_signal_number, _frame):
-            """Pass SIGINT to proc.
+            """Pass SIGINT to procs.
 
             If user hits ctrl-c during atest run, the TradeFed subprocess
             won't stop unless we also send it a SIGINT. The TradeFed process
@@ -158,7 +270,11 @@ class TestRunnerBase:
             kill all the child processes TradeFed spawns as well.
             """
             logging.info('Ctrl-C received. Killing subprocess group')
-            os.killpg(os.getpgid(proc.pid), signal.SIGINT)
+            for proc in procs:
+                try:
+                    interrupt_subprocess(proc)
+                except OSError:
+                    logging.debug('Subproc already terminated, skipping')
         return signal_handler
 
     def run_tests(self, test_infos, extra_args, reporter):
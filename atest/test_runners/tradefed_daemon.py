@@ -0,0 +1,651 @@
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keep a TradeFed console running between atest invocations.
+
+Starting TradeFed pays for the JVM startup, class loading and device
+discovery, which often take longer than the tests. With --tf-daemon, a
+daemon process starts the TradeFed console once and runs the commands of the
+following atest invocations in it, until it's idle for IDLE_TIMEOUT_SECS.
+
+The daemon is keyed by the build top and the mtime of tradefed.jar, so a new
+daemon replaces the old one once TradeFed is rebuilt. The console keeps the
+working directory and the environment it's started with, so the daemon is
+keyed by them as well, i.e. by _KEY_ENV_VARS selecting the device and the
+build. atest submits a command over the unix socket of the daemon, and the
+daemon relays the events TradeFed reports to the event socket of atest, so
+the results are processed as usual.
+
+The messages on the unix socket are JSON objects, one per line:
+    {"op": "ping"} -> {"status": "ok", "pid": <pid of the daemon>}
+    {"op": "run", "command": <console command>} -> {"status": "started"},
+        then {"status": "finished", "exit_code": <int>, "error": <str>}
+    {"op": "shutdown"}
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from functools import partial
+
+import constants
+
+DAEMON_DIR = os.path.join(os.path.expanduser('~'), '.atest', 'tf_daemon')
+# Seconds the daemon keeps running without any command.
+IDLE_TIMEOUT_SECS = 1800
+# Seconds to wait for TradeFed to report the invocation of a command, which
+# may wait for a device in use. A command the console rejects fails at once.
+INVOCATION_START_TIMEOUT_SECS = 300
+# Seconds to wait for a new daemon to answer or for an answer to a request.
+CONNECT_TIMEOUT_SECS = 10
+# Seconds between the checks of the daemon for timeouts.
+_SELECT_TIMEOUT = 1
+_READ_SIZE = 65536
+_SHUTDOWN_TIMEOUT_SECS = 10
+_TRADEFED_JAR = os.path.join('framework', 'tradefed.jar')
+_REPORT_PORT_RE = re.compile(r'--subprocess-report-port\s+(\d+)')
+# The console output of a command it doesn't run.
+_REJECTED_RE = re.compile(rb'Failed to run command|Unable to handle command')
+# The event TradeFed reports when the invocation fails, which exits TradeFed
+# with a non-zero code when it runs outside the console.
+_INVOCATION_FAILED = b'INVOCATION_FAILED'
+_LOCALHOST = '127.0.0.1'
+# The environment variables whose change starts a new console, e.g. the
+# device to run the tests on or the lunch target.
+_KEY_ENV_VARS = ('ANDROID_SERIAL', 'APE_API_KEY', 'ANDROID_PRODUCT_OUT',
+                 'TARGET_PRODUCT', 'TARGET_BUILD_VARIANT', 'OUT_DIR')
+
+
+def _hash(text):
+    """Get a short hash of the text for the socket name."""
+    return hashlib.md5(text.encode()).hexdigest()[:8]
+
+
+def get_socket_path(build_top, host_out, env=None):
+    """Get the path of the unix socket of the daemon of the build.
+
+    Args:
+        build_top: A string of the build top.
+        host_out: A string of the host output directory having tradefed.jar.
+        env: A dict of the environment variables of the console, None for
+             os.environ.
+
+    Returns:
+        A string of the path keyed by the build top, the working directory,
+        the environment variables of _KEY_ENV_VARS and the mtime of the jar.
+    """
+    env = os.environ if env is None else env
+    jar_path = os.path.join(host_out, _TRADEFED_JAR)
+    mtime = int(os.path.getmtime(jar_path)) if os.path.exists(jar_path) else 0
+    config = json.dumps([os.getcwd()] + [env.get(x) for x in _KEY_ENV_VARS])
+    return os.path.join(DAEMON_DIR, '%s_%s_%d.sock' % (
+        _hash(build_top), _hash(config), mtime))
+
+
+def _send(sock, message):
+    """Send a message to the other end of the unix socket."""
+    sock.sendall(json.dumps(message).encode() + b'\n')
+
+
+class _Command:
+    """A command run by the console and the relays of its events."""
+
+    def __init__(self, client, listener, client_port, deadline):
+        self.client = client
+        self.listener = listener
+        self.client_port = client_port
+        self.deadline = deadline
+        self.accepted = 0
+        # The open connections from TradeFed and to atest of each relay.
+        self.relays = []
+        self.failed = False
+        # The end of the events relayed, in case an event is split.
+        self.tail = b''
+
+
+class TradefedDaemon:
+    """Run the commands of atest in a TradeFed console.
+
+    The console runs the commands concurrently, and a command finishes once
+    all the connections TradeFed opened to report its events are closed.
+    The console can't cancel a single command, so once atest stops waiting
+    for a command, e.g. on Ctrl-C, its events are dropped while it runs to
+    the end, or the daemon exits if no other command is running.
+    """
+
+    def __init__(self, sock_path, console_cmd, env=None, log_file=None,
+                 idle_timeout=IDLE_TIMEOUT_SECS,
+                 start_timeout=INVOCATION_START_TIMEOUT_SECS):
+        """TradefedDaemon constructor
+
+        Args:
+            sock_path: A string of the path of the unix socket to listen to.
+            console_cmd: A string of the command starting the console.
+            env: A dict of the environment variables of the console.
+            log_file: A file to write the output of the console to.
+            idle_timeout: Seconds to keep running without any command.
+            start_timeout: Seconds to wait for the invocation of a command.
+        """
+        self.sock_path = sock_path
+        self._console_cmd = console_cmd
+        self._env = env
+        self._log_file = log_file
+        self._idle_timeout = idle_timeout
+        self._start_timeout = start_timeout
+        self._selector = selectors.DefaultSelector()
+        self._console = None
+        # {client socket: _Command or None}
+        self._clients = {}
+        self._buffers = {}
+        # The commands written to the console, whose invocations haven't
+        # been reported yet, in the order they're written.
+        self._pending = collections.deque()
+        self._console_buffer = b''
+        self._stopped = False
+        self._last_active = time.time()
+
+    def serve(self):
+        """Run the console and the commands until the daemon stops."""
+        self._console = subprocess.Popen(
+            self._console_cmd, shell=True, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=self._env,
+            start_new_session=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.sock_path)
+        listener.listen(socket.SOMAXCONN)
+        self._selector.register(listener, selectors.EVENT_READ,
+                                self._accept_client)
+        self._selector.register(self._console.stdout, selectors.EVENT_READ,
+                                self._read_console)
+        logging.debug('TradeFed daemon %s serving %s', os.getpid(),
+                      self.sock_path)
+        try:
+            while not self._stopped:
+                for key, _ in self._selector.select(_SELECT_TIMEOUT):
+                    key.data(key.fileobj)
+                self._check_health()
+        finally:
+            self._shutdown(listener)
+
+    def _check_health(self):
+        """Stop the daemon if the console exited or it's been idle."""
+        now = time.time()
+        for command in list(self._clients.values()):
+            if command and not command.accepted and now > command.deadline:
+                self._finish(command, constants.EXIT_CODE_TEST_FAILURE,
+                             "TradeFed didn't report the invocation.")
+        if self._console.poll() is not None:
+            logging.debug('TradeFed console exited with %s.',
+                          self._console.returncode)
+            for command in list(self._clients.values()):
+                if command:
+                    self._finish(command, constants.EXIT_CODE_TEST_FAILURE,
+                                 'TradeFed console exited.')
+            self._stopped = True
+        elif (not any(self._clients.values())
+              and now - self._last_active > self._idle_timeout):
+            logging.debug('TradeFed daemon is idle, exiting.')
+            self._stopped = True
+
+    def _read_console(self, output):
+        """Log the output of the console and fail the commands it rejects."""
+        data = os.read(output.fileno(), _READ_SIZE)
+        if not data:
+            self._selector.unregister(output)
+            return
+        if self._log_file:
+            self._log_file.write(data)
+            self._log_file.flush()
+        self._console_buffer += data
+        *lines, self._console_buffer = self._console_buffer.split(b'\n')
+        for line in lines:
+            # The console handles the commands in the order they're written.
+            if _REJECTED_RE.search(line) and self._pending:
+                self._finish(self._pending[0], constants.EXIT_CODE_TEST_FAILURE,
+                             'TradeFed rejected the command: %s' %
+                             line.decode(errors='replace').strip())
+
+    def _accept_client(self, listener):
+        """Accept a connection from atest."""
+        client, _ = listener.accept()
+        self._clients[client] = None
+        self._buffers[client] = b''
+        self._selector.register(client, selectors.EVENT_READ,
+                                self._read_client)
+        self._last_active = time.time()
+
+    def _close_client(self, client):
+        """Close the connection from atest."""
+        self._selector.unregister(client)
+        client.close()
+        self._clients.pop(client, None)
+        self._buffers.pop(client, None)
+
+    def _read_client(self, client):
+        """Read and handle the requests of atest."""
+        try:
+            data = client.recv(_READ_SIZE)
+        except OSError:
+            data = b''
+        if not data:
+            if self._clients.get(client):
+                self._cancel(self._clients[client])
+            self._close_client(client)
+            return
+        self._buffers[client] += data
+        *lines, self._buffers[client] = self._buffers[client].split(b'\n')
+        for line in lines:
+            try:
+                self._handle_request(client, json.loads(line.decode()))
+            except (ValueError, OSError) as err:
+                logging.debug('Exception raised: %s', err)
+
+    def _handle_request(self, client, request):
+        """Handle a request of atest.
+
+        Args:
+            client: The socket of the connection from atest.
+            request: A dict of the request.
+        """
+        op = request.get('op')
+        if op == 'ping':
+            _send(client, {'status': 'ok', 'pid': os.getpid()})
+        elif op == 'shutdown':
+            self._stopped = True
+        elif op == 'run' and not self._clients.get(client):
+            self._run_command(client, request.get('command', ''))
+        else:
+            _send(client, {'status': 'error',
+                           'error': 'Invalid request: %s' % op})
+
+    def _run_command(self, client, command):
+        """Write the command to the console, reporting to a relay port.
+
+        Args:
+            client: The socket of the connection from atest.
+            command: A string of the console command, which reports to the
+                event socket of atest.
+        """
+        match = _REPORT_PORT_RE.search(command)
+        if not match:
+            _send(client, {'status': 'finished',
+                           'exit_code': constants.EXIT_CODE_ERROR,
+                           'error': 'No --subprocess-report-port.'})
+            return
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind((_LOCALHOST, 0))
+        listener.listen(socket.SOMAXCONN)
+        command_info = _Command(client, listener, int(match.group(1)),
+                                time.time() + self._start_timeout)
+        self._clients[client] = command_info
+        self._pending.append(command_info)
+        self._selector.register(listener, selectors.EVENT_READ,
+                                partial(self._accept_relay, command_info))
+        command = '%s%d%s' % (command[:match.start(1)],
+                              listener.getsockname()[1],
+                              command[match.end(1):])
+        logging.debug('Running command: %s', command)
+        self._console.stdin.write(command.encode() + b'\n')
+        self._console.stdin.flush()
+        _send(client, {'status': 'started'})
+
+    def _accept_relay(self, command, listener):
+        """Relay a connection from TradeFed to the event socket of atest."""
+        conn, _ = listener.accept()
+        try:
+            upstream = socket.create_connection(
+                (_LOCALHOST, command.client_port), CONNECT_TIMEOUT_SECS)
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+            conn.close()
+            return
+        command.accepted += 1
+        if command in self._pending:
+            self._pending.remove(command)
+        command.relays.append((conn, upstream))
+        self._selector.register(conn, selectors.EVENT_READ,
+                                partial(self._relay, command, upstream))
+
+    def _relay(self, command, upstream, conn):
+        """Forward the events of a connection from TradeFed."""
+        try:
+            data = conn.recv(_READ_SIZE)
+            if data:
+                if _INVOCATION_FAILED in command.tail + data:
+                    command.failed = True
+                command.tail = data[-len(_INVOCATION_FAILED):]
+                upstream.sendall(data)
+                return
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+        self._close_relay(command, conn, upstream)
+        # The invocation level connection is the first to open and the last
+        # to close.
+        if not command.relays and command.client in self._clients:
+            self._finish(command, constants.EXIT_CODE_TEST_FAILURE
+                         if command.failed else constants.EXIT_CODE_SUCCESS,
+                         '')
+
+    def _close_relay(self, command, conn, upstream):
+        """Close the connections of a relay of the command."""
+        self._selector.unregister(conn)
+        conn.close()
+        upstream.close()
+        command.relays.remove((conn, upstream))
+
+    def _cancel(self, command):
+        """Drop the command atest stopped waiting for.
+
+        The daemon exits if no other command is running, which stops the
+        command and frees its devices at once. Otherwise, the command runs to
+        the end, but its events aren't relayed anymore.
+
+        Args:
+            command: The _Command to drop.
+        """
+        if not any(other and other is not command
+                   for other in self._clients.values()):
+            logging.debug('atest stopped waiting for the only command.')
+            self._stopped = True
+            return
+        logging.debug('atest stopped waiting for a command, dropping it.')
+        for conn, upstream in list(command.relays):
+            self._close_relay(command, conn, upstream)
+        self._finish(command, constants.EXIT_CODE_TEST_FAILURE,
+                     'The command is cancelled.')
+
+    def _finish(self, command, exit_code, error):
+        """Report the end of the command to atest."""
+        if command in self._pending:
+            self._pending.remove(command)
+        self._selector.unregister(command.listener)
+        command.listener.close()
+        self._clients[command.client] = None
+        self._last_active = time.time()
+        try:
+            _send(command.client, {'status': 'finished',
+                                   'exit_code': exit_code, 'error': error})
+        except OSError as err:
+            logging.debug('Exception raised: %s', err)
+
+    def _shutdown(self, listener):
+        """Stop the console and close all the connections."""
+        listener.close()
+        try:
+            os.remove(self.sock_path)
+        except OSError:
+            pass
+        for key in list(self._selector.get_map().values()):
+            key.fileobj.close()
+        self._selector.close()
+        if self._console.poll() is None:
+            try:
+                os.killpg(os.getpgid(self._console.pid), signal.SIGTERM)
+                self._console.wait(_SHUTDOWN_TIMEOUT_SECS)
+            except subprocess.TimeoutExpired:
+                os.killpg(os.getpgid(self._console.pid), signal.SIGKILL)
+            except OSError:
+                pass
+
+
+def _request(sock_path, message, timeout=CONNECT_TIMEOUT_SECS):
+    """Send a request to the daemon and read the first response.
+
+    Args:
+        sock_path: A string of the path of the unix socket of the daemon.
+        message: A dict of the request.
+        timeout: Seconds to wait for the response.
+
+    Returns:
+        A tuple of the connected socket, the dict of the response and the
+        bytes received after the response.
+
+    Raises:
+        OSError or ValueError if the daemon doesn't respond.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(sock_path)
+        _send(sock, message)
+        data = b''
+        while b'\n' not in data:
+            received = sock.recv(_READ_SIZE)
+            if not received:
+                raise ConnectionError('TradeFed daemon closed the connection.')
+            data += received
+        line, data = data.split(b'\n', 1)
+        return sock, json.loads(line.decode()), data
+    except (OSError, ValueError):
+        sock.close()
+        raise
+
+
+def ping(sock_path):
+    """Check the health of the daemon.
+
+    Args:
+        sock_path: A string of the path of the unix socket of the daemon.
+
+    Returns:
+        The pid of the daemon if it's healthy, None otherwise.
+    """
+    try:
+        sock, response, _ = _request(sock_path, {'op': 'ping'})
+    except (OSError, ValueError) as err:
+        logging.debug('TradeFed daemon %s is down: %s', sock_path, err)
+        return None
+    sock.close()
+    return response.get('pid') if response.get('status') == 'ok' else None
+
+
+def _stop_stale_daemons(sock_path):
+    """Stop the daemons of the build running an older TradeFed.
+
+    Args:
+        sock_path: A string of the path of the socket of the current daemon.
+    """
+    prefix = os.path.basename(sock_path).rsplit('_', 1)[0] + '_'
+    for name in os.listdir(os.path.dirname(sock_path)):
+        path = os.path.join(os.path.dirname(sock_path), name)
+        if not name.startswith(prefix) or not name.endswith('.sock'):
+            continue
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with sock:
+                sock.settimeout(CONNECT_TIMEOUT_SECS)
+                sock.connect(path)
+                _send(sock, {'op': 'shutdown'})
+        except OSError as err:
+            # Nothing listens to the socket of a crashed daemon.
+            logging.debug('Removing %s: %s', path, err)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _spawn(sock_path, console_cmd, env):
+    """Start the daemon in a process detached from atest.
+
+    Args:
+        sock_path: A string of the path of the unix socket to listen to.
+        console_cmd: A string of the command starting the console.
+        env: A dict of the environment variables of the console.
+    """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    # pylint: disable=broad-except
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        log_path = os.path.splitext(sock_path)[0] + '.log'
+        with open(log_path, 'ab') as log_file, \
+                open(os.devnull, 'rb') as devnull:
+            os.dup2(devnull.fileno(), 0)
+            os.dup2(log_file.fileno(), 1)
+            os.dup2(log_file.fileno(), 2)
+            for handler in logging.getLogger().handlers:
+                logging.getLogger().removeHandler(handler)
+            # The log file is binary, and stderr is redirected to it.
+            logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+            TradefedDaemon(sock_path, console_cmd, env=env,
+                           log_file=log_file).serve()
+    except Exception:
+        logging.debug('Caught exception:', exc_info=1)
+    finally:
+        os._exit(0)
+
+
+def start_daemon(sock_path, console_cmd, env):
+    """Get a healthy daemon, starting one if needed.
+
+    Args:
+        sock_path: A string of the path of the unix socket of the daemon.
+        console_cmd: A string of the command starting the console.
+        env: A dict of the environment variables of the console.
+
+    Returns:
+        True if the daemon is healthy, False otherwise.
+    """
+    if ping(sock_path):
+        return True
+    os.makedirs(os.path.dirname(sock_path), exist_ok=True)
+    _stop_stale_daemons(sock_path)
+    logging.debug('Starting TradeFed daemon: %s', sock_path)
+    _spawn(sock_path, console_cmd, env)
+    deadline = time.time() + CONNECT_TIMEOUT_SECS
+    while time.time() < deadline:
+        if os.path.exists(sock_path) and ping(sock_path):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+class DaemonInvocation:
+    """A command run by the daemon, standing for a TradeFed subprocess."""
+
+    def __init__(self, sock, pid, data=b''):
+        """DaemonInvocation constructor
+
+        Args:
+            sock: The socket of the connection to the daemon.
+            pid: The pid of the daemon.
+            data: The bytes received after the daemon started the command.
+        """
+        self._sock = sock
+        self._buffer = b''
+        self.pid = pid
+        self.returncode = None
+        self._handle_responses(data)
+
+    def _read(self, block):
+        """Read the response of the daemon to the command.
+
+        Args:
+            block: True to wait for the end of the command.
+        """
+        if self.returncode is not None:
+            return
+        self._sock.setblocking(block)
+        while self.returncode is None:
+            try:
+                data = self._sock.recv(_READ_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as err:
+                logging.debug('Exception raised: %s', err)
+                data = b''
+            if not data:
+                logging.debug('TradeFed daemon %s closed the connection.',
+                              self.pid)
+                self._set_returncode(constants.EXIT_CODE_TEST_FAILURE)
+                return
+            self._handle_responses(data)
+
+    def _handle_responses(self, data):
+        """Set the return code once the daemon reports the end.
+
+        Args:
+            data: The bytes received from the daemon.
+        """
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b'\n')
+        for line in lines:
+            response = json.loads(line.decode())
+            if response.get('status') == 'finished':
+                if response.get('error'):
+                    logging.error('TradeFed daemon: %s', response['error'])
+                self._set_returncode(response.get('exit_code'))
+                return
+
+    def _set_returncode(self, returncode):
+        """Set the return code and close the connection to the daemon."""
+        self.returncode = returncode
+        self._sock.close()
+
+    def poll(self):
+        """Get the return code, None if the command is running."""
+        self._read(False)
+        return self.returncode
+
+    def wait(self):
+        """Wait for the command to finish and get its return code."""
+        self._read(True)
+        return self.returncode
+
+    def interrupt(self):
+        """Stop waiting for the command, which the daemon drops then."""
+        if self.returncode is None:
+            self._set_returncode(constants.EXIT_CODE_TEST_FAILURE)
+
+
+def submit(sock_path, command):
+    """Submit a console command to the daemon.
+
+    Args:
+        sock_path: A string of the path of the unix socket of the daemon.
+        command: A string of the console command.
+
+    Returns:
+        A DaemonInvocation, None if the daemon doesn't accept the command.
+    """
+    pid = ping(sock_path)
+    if not pid:
+        return None
+    try:
+        sock, response, data = _request(sock_path, {'op': 'run',
+                                                    'command': command})
+    except (OSError, ValueError) as err:
+        logging.debug('Exception raised: %s', err)
+        return None
+    if response.get('status') != 'started':
+        logging.debug('TradeFed daemon rejected the command: %s', response)
+        sock.close()
+        return None
+    return DaemonInvocation(sock, pid, data)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittests for tradefed_daemon."""
+
+# pylint: disable=protected-access
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+import constants
+
+from test_runners import tradefed_daemon
+
+# A console reporting an event for each command it reads, which rejects the
+# bad commands and fails the invocations of the failing ones.
+FAKE_CONSOLE = r'''
+import re
+import socket
+import sys
+
+for line in sys.stdin:
+    if 'bad' in line:
+        print('Failed to run command: bad', flush=True)
+        continue
+    port = int(re.search(r'--subprocess-report-port (\d+)', line).group(1))
+    event = b'INVOCATION_FAILED {}' if 'failing' in line else b'TEST_RUN_STARTED {}'
+    with socket.create_connection(('127.0.0.1', port)) as conn:
+        conn.sendall(event + b'\n')
+'''
+
+
+class TradefedDaemonUnittests(unittest.TestCase):
+    """Unit tests for tradefed_daemon.py"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.sock_path = os.path.join(self.temp_dir, 'daemon.sock')
+        console_path = os.path.join(self.temp_dir, 'console.py')
+        with open(console_path, 'w') as console:
+            console.write(FAKE_CONSOLE)
+        self.console_cmd = '%s %s' % (sys.executable, console_path)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.server.settimeout(10)
+        self.command = 'run template --subprocess-report-port %d' % (
+            self.server.getsockname()[1])
+        self.daemon = None
+        self.thread = None
+
+    def tearDown(self):
+        if self.daemon:
+            self.daemon._stopped = True
+            self.thread.join(10)
+        self.server.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _start(self, **kwargs):
+        """Run a daemon in a thread."""
+        self.daemon = tradefed_daemon.TradefedDaemon(
+            self.sock_path, self.console_cmd, **kwargs)
+        self.thread = threading.Thread(target=self.daemon.serve, daemon=True)
+        self.thread.start()
+        for _ in range(100):
+            if tradefed_daemon.ping(self.sock_path):
+                return
+            threading.Event().wait(0.1)
+        self.fail('The daemon did not start.')
+
+    def test_get_socket_path(self):
+        """Test the socket is keyed by the build top and the jar mtime."""
+        jar_path = os.path.join(self.temp_dir, 'framework', 'tradefed.jar')
+        os.makedirs(os.path.dirname(jar_path))
+        with open(jar_path, 'w'):
+            pass
+        os.utime(jar_path, (100, 100))
+        path = tradefed_daemon.get_socket_path('/top', self.temp_dir)
+        self.assertTrue(path.endswith('_100.sock'))
+        self.assertEqual(path, tradefed_daemon.get_socket_path(
+            '/top', self.temp_dir))
+        self.assertNotEqual(path, tradefed_daemon.get_socket_path(
+            '/other_top', self.temp_dir))
+        self.assertNotEqual(path, tradefed_daemon.get_socket_path(
+            '/top', self.temp_dir, {'ANDROID_SERIAL': 'serial'}))
+        with mock.patch('os.getcwd', return_value='/other_dir'):
+            self.assertNotEqual(path, tradefed_daemon.get_socket_path(
+                '/top', self.temp_dir))
+        os.utime(jar_path, (200, 200))
+        self.assertNotEqual(path, tradefed_daemon.get_socket_path(
+            '/top', self.temp_dir))
+
+    def test_submit(self):
+        """Test the events of a command are relayed to the event socket."""
+        self._start()
+        self.assertEqual(os.getpid(), tradefed_daemon.ping(self.sock_path))
+        for _ in range(2):
+            invocation = tradefed_daemon.submit(self.sock_path, self.command)
+            conn, _ = self.server.accept()
+            with conn:
+                self.assertEqual(b'TEST_RUN_STARTED {}\n',
+                                 conn.makefile('rb').readline())
+            self.assertEqual(constants.EXIT_CODE_SUCCESS, invocation.wait())
+            self.assertEqual(constants.EXIT_CODE_SUCCESS, invocation.poll())
+
+    def test_submit_invocation_failed(self):
+        """Test a command fails if its invocation fails."""
+        self._start()
+        invocation = tradefed_daemon.submit(
+            self.sock_path, self.command.replace('template', 'failing'))
+        conn, _ = self.server.accept()
+        with conn:
+            self.assertEqual(b'INVOCATION_FAILED {}\n',
+                             conn.makefile('rb').readline())
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE, invocation.wait())
+
+    def test_submit_rejected(self):
+        """Test a command the console rejects fails without waiting."""
+        self._start()
+        invocation = tradefed_daemon.submit(
+            self.sock_path, self.command.replace('template', 'bad'))
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE, invocation.wait())
+        self.assertTrue(tradefed_daemon.ping(self.sock_path))
+
+    def test_submit_without_port(self):
+        """Test a command not reporting to atest is rejected."""
+        self._start()
+        self.assertIsNone(tradefed_daemon.submit(self.sock_path,
+                                                 'run template'))
+
+    def test_submit_without_daemon(self):
+        """Test no command is submitted without a running daemon."""
+        self.assertIsNone(tradefed_daemon.submit(self.sock_path,
+                                                 self.command))
+        self.assertIsNone(tradefed_daemon.ping(self.sock_path))
+
+    def test_invocation_start_timeout(self):
+        """Test a command fails if TradeFed doesn't report its invocation."""
+        self.console_cmd = 'cat > /dev/null'
+        self._start(start_timeout=0)
+        invocation = tradefed_daemon.submit(self.sock_path, self.command)
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE, invocation.wait())
+
+    def test_interrupt(self):
+        """Test the daemon stops once atest stops waiting for a command."""
+        self.console_cmd = 'cat > /dev/null'
+        self._start()
+        invocation = tradefed_daemon.submit(self.sock_path, self.command)
+        invocation.interrupt()
+        self.assertEqual(constants.EXIT_CODE_TEST_FAILURE,
+                         invocation.returncode)
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.sock_path))
+
+    def test_interrupt_shared(self):
+        """Test the daemon keeps the commands of other atest invocations."""
+        self.console_cmd = 'cat > /dev/null'
+        self._start()
+        invocations = [tradefed_daemon.submit(self.sock_path, self.command)
+                       for _ in range(2)]
+        invocations[0].interrupt()
+        self.thread.join(2)
+        self.assertTrue(self.thread.is_alive())
+        self.assertTrue(tradefed_daemon.ping(self.sock_path))
+        self.assertIsNone(invocations[1].poll())
+        invocations[1].interrupt()
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_idle_timeout(self):
+        """Test the daemon stops after being idle."""
+        self._start(idle_timeout=1)
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.sock_path))
+
+    def test_stop_stale_daemons(self):
+        """Test the daemons of an older TradeFed of the build are stopped."""
+        self.sock_path = os.path.join(self.temp_dir, 'top_100.sock')
+        self._start()
+        crashed_path = os.path.join(self.temp_dir, 'top_50.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.bind(crashed_path)
+        other_path = os.path.join(self.temp_dir, 'other_100.sock')
+        with open(other_path, 'w'):
+            pass
+        tradefed_daemon._stop_stale_daemons(
+            os.path.join(self.temp_dir, 'top_200.sock'))
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(crashed_path))
+        self.assertTrue(os.path.exists(other_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Micro-benchmark of parsing the event streams reported by TradeFed.
+
+Recorded event streams are replayed in chunks of the size read from the
+sockets through the EventFramer and through the previous parser, which
+matched a regex from the start of the buffer and tried to load the JSON of
+partial events.
+
+Usage, in the atest directory:
+    python3 -m tools.event_stream_benchmark [stream ...] [--repeat N]
+        [--trace-kb N] [--chunk-size N] [--rounds N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import glob
+import json
+import os
+import re
+import timeit
+
+from test_runners import event_framer
+from test_runners import event_server
+
+_STREAM_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.realpath(__file__))), 'unittest_data', 'event_streams')
+_LEGACY_EVENT_RE = re.compile(
+    r'\n*(?P<event_name>[A-Z_]+) (?P<json_data>{.*})(?=\n|.)*')
+
+
+def parse_legacy(chunks):
+    """Parse the chunks of a stream like the previous parser.
+
+    Args:
+        chunks: A list of bytes received from the socket.
+
+    Returns:
+        An integer of the number of events.
+    """
+    buf = ''
+    count = 0
+    for chunk in chunks:
+        buf += chunk.decode()
+        while True:
+            match = _LEGACY_EVENT_RE.match(buf)
+            if not match:
+                break
+            try:
+                json.loads(match.group('json_data'))
+            except ValueError:
+                break
+            count += 1
+            buf = buf[match.end():]
+    return count
+
+
+def parse_framed(chunks):
+    """Parse the chunks of a stream with an EventFramer.
+
+    Args:
+        chunks: A list of bytes received from the socket.
+
+    Returns:
+        An integer of the number of events.
+    """
+    framer = event_framer.EventFramer()
+    count = 0
+    for chunk in chunks:
+        count += len(framer.feed(chunk))
+    return count + len(framer.flush())
+
+
+def load_stream(path, repeat=1, trace_kb=0):
+    """Load a recorded event stream.
+
+    Args:
+        path: A string of the path of the recorded stream.
+        repeat: An integer of the times to repeat the stream.
+        trace_kb: An integer of the size in KB of the stack trace of an extra
+            TEST_FAILED event, 0 for no extra event.
+
+    Returns:
+        Bytes of the stream.
+    """
+    with open(path, 'rb') as stream_file:
+        stream = stream_file.read() * repeat
+    if trace_kb:
+        trace = ('\tat com.android.Foo.bar(Foo.java:1)\n'
+                 * (trace_kb * 1024 // 36 + 1))[:trace_kb * 1024]
+        stream += ('TEST_FAILED %s\n' % json.dumps(
+            {'className': 'Foo', 'testName': 'bar', 'trace': trace})).encode()
+    return stream
+
+
+def split_chunks(stream, chunk_size):
+    """Split a stream into the chunks received from the socket.
+
+    Args:
+        stream: Bytes of the stream.
+        chunk_size: An integer of the size of chunks.
+
+    Returns:
+        A list of bytes.
+    """
+    return [stream[i:i + chunk_size]
+            for i in range(0, len(stream), chunk_size)]
+
+
+def _parse_args():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('streams', nargs='*',
+                        default=sorted(glob.glob(
+                            os.path.join(_STREAM_DIR, '*.events'))),
+                        help='Recorded event streams to replay.')
+    parser.add_argument('--repeat', type=int, default=100,
+                        help='Times to repeat each stream.')
+    parser.add_argument('--trace-kb', type=int, default=0,
+                        help='Append an event with a stack trace of the size.')
+    parser.add_argument('--chunk-size', type=int,
+                        default=event_server.READ_SIZE,
+                        help='Bytes received from the socket at a time.')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='Rounds to replay, the fastest one is reported.')
+    return parser.parse_args()
+
+
+def main():
+    """Replay the streams through both parsers and print the throughput."""
+    args = _parse_args()
+    for path in args.streams:
+        stream = load_stream(path, args.repeat, args.trace_kb)
+        chunks = split_chunks(stream, args.chunk_size)
+        print('%s: %d bytes in %d chunks' % (
+            os.path.basename(path), len(stream), len(chunks)))
+        for name, parse in (('legacy', parse_legacy),
+                            ('framed', parse_framed)):
+            events = parse(chunks)
+            secs = min(timeit.repeat(functools.partial(parse, chunks),
+                                     number=1, repeat=args.rounds))
+            print('  %-7s %7d events %9.2f ms %9.2f MB/s' % (
+                name, events, secs * 1000, len(stream) / secs / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# Copyright 2020, The Android Open Source Project
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the ingestion lag of the events of robolectric tests.
+
+A writer thread appends timestamped events to the event file like the
+robolectric tests do, and the lag between writing and handling each event is
+measured for the FIFO read by RobolectricTestRunner and for the previous
+loop, which re-read a regular file and slept between the reads.
+
+Usage, in the atest directory:
+    python3 -m tools.robolectric_ingestion_benchmark [--events N]
+        [--interval-ms N] [--trace-kb N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from test_runners import robolectric_test_runner
+
+_LEGACY_EVENT_RE = re.compile(
+    r'^(?P<event_name>[A-Z_]+) (?P<json_data>{(.\r*|\n)*})(?:\n|$)')
+
+
+class _LagRecorder:
+    """An EventHandler recording the lag of the events."""
+
+    def __init__(self):
+        self.lags = []
+
+    def process_event(self, _event_name, event_data):
+        """Record the lag of an event."""
+        self.lags.append(time.monotonic() - event_data['sent'])
+
+
+class _Writer(threading.Thread):
+    """Write the events like the robolectric tests."""
+
+    def __init__(self, path, events, interval, trace):
+        super().__init__()
+        self.path = path
+        self.events = events
+        self.interval = interval
+        self.trace = trace
+
+    def poll(self):
+        """Return None while writing like a running build process."""
+        return None if self.is_alive() else 0
+
+    def run(self):
+        with open(self.path, 'a') as event_file:
+            for i in range(self.events):
+                event_file.write('TEST_FAILED %s\n\n' % json.dumps(
+                    {'testName': 'test%d' % i, 'trace': self.trace,
+                     'sent': time.monotonic()}))
+                event_file.flush()
+                time.sleep(self.interval)
+
+
+def poll_legacy(path, writer, event_handler):
+    """Poll the event file like the previous loop.
+
+    Args:
+        path: A string of the path of the event file.
+        writer: The _Writer of the file.
+        event_handler: The _LagRecorder.
+    """
+    with open(path) as communication_file:
+        buf = ''
+        while True:
+            communication_file.seek(0, 1)
+            data = communication_file.read()
+            buf += data
+            reg = re.compile(r'(.|\n)*}\n\n')
+            if not reg.match(buf) or data == '':
+                if writer.poll() is not None:
+                    return
+                time.sleep(robolectric_test_runner.POLL_FREQ_SECS)
+            else:
+                for event in re.split(r'\n\n', buf):
+                    match = _LEGACY_EVENT_RE.match(event)
+                    if match:
+                        event_handler.process_event(
+                            match.group('event_name'),
+                            json.loads(match.group('json_data'),
+                                       strict=False))
+                buf = ''
+
+
+def measure(mode, args):
+    """Measure the lags of the events of a mode.
+
+    Args:
+        mode: 'legacy' or 'fifo'.
+        args: The parsed command line arguments.
+
+    Returns:
+        A tuple of the _LagRecorder and the CPU seconds of the process.
+    """
+    trace = 'x' * (args.trace_kb * 1024)
+    recorder = _LagRecorder()
+    with tempfile.TemporaryDirectory() as event_dir:
+        path = os.path.join(event_dir, 'events')
+        writer = _Writer(path, args.events, args.interval_ms / 1000, trace)
+        cpu_start = time.process_time()
+        if mode == 'fifo':
+            os.mkfifo(path)
+            runner = robolectric_test_runner.RobolectricTestRunner(
+                results_dir=event_dir)
+            # The writer is blocked opening the FIFO until it's read.
+            writer.start()
+            # The benchmark drives the runner's polling loop directly.
+            # pylint: disable=protected-access
+            runner._exec_with_robo_polling(path, writer, recorder)
+        else:
+            open(path, 'w').close()
+            writer.start()
+            poll_legacy(path, writer, recorder)
+        writer.join()
+        return recorder, time.process_time() - cpu_start
+
+
+def _parse_args():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--events', type=int, default=200,
+                        help='Number of events to write.')
+    parser.add_argument('--interval-ms', type=float, default=5,
+                        help='Milliseconds between the events.')
+    parser.add_argument('--trace-kb', type=int, default=1,
+                        help='Size in KB of the stack trace of each event.')
+    return parser.parse_args()
+
+
+def main():
+    """Measure and print the ingestion lags."""
+    args = _parse_args()
+    for mode in ('legacy', 'fifo'):
+        recorder, cpu_secs = measure(mode, args)
+        lags = sorted(recorder.lags)
+        print('%-7s %5d events  lag p50 %7.2f ms  p99 %7.2f ms  '
+              'max %7.2f ms  cpu %7.2f ms' % (
+                  mode, len(lags), lags[len(lags) // 2] * 1000,
+                  lags[int(len(lags) * 0.99)] * 1000, lags[-1] * 1000,
+                  cpu_secs * 1000))
+
+
+if __name__ == '__main__':
+    main()